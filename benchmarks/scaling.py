@@ -0,0 +1,457 @@
+#!/usr/bin/env python3
+"""Scaling benchmarks of MPET simulations.
+
+  run      simulate benchmark cases over sweeps of Nvol_c, Npart_c and the cathode
+           particle discretization, and append the results to the history file
+  compare  compare two entries of the history file, and report the phases and
+           scaling exponents that became slower
+  list     list the entries of the history file
+
+Every case (a system config file, or a test from tests/ref_outputs) is simulated once
+for every value of each swept parameter, with the other parameters at their values in
+the config. Each simulation runs in a fresh process, with the phase profiler
+(mpet.profiler) enabled. For every simulation, the time of each phase, the peak
+memory, the solver statistics (mpet.solver_stats) and the number of variables of the
+DAE system (mpet.cost) are recorded. The scaling exponent of the run time, of each
+phase and of the peak memory with respect to each swept parameter is the slope of a
+log-log fit. For the discretization, the exponents are with respect to
+1/discretization, i.e. the number of points per particle length.
+"""
+import argparse
+import concurrent.futures
+import configparser
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+
+#: cases that are run if none are given
+DEFAULT_CASES = [os.path.join(ROOT_DIR, "configs", "params_system.cfg"), "test001"]
+
+#: default values of the swept system parameters
+DEFAULT_GRID = {"Nvol_c": [5, 10, 20], "Npart_c": [1, 2, 4]}
+
+#: default factors of the discretization of a case that are swept
+DISCRETIZATION_FACTORS = [2., 1., 0.5]
+
+#: system parameters that would change the timings of a benchmark
+SYSTEM_OVERRIDES = {"resultCache": "", "icCache": "false", "checkpointWallTime": "0",
+                    "checkpointSimTime": "0"}
+
+#: solver statistics that are summed over the run
+SOLVER_COUNTERS = ["steps", "residual_evals", "jacobian_evals", "linear_setups",
+                   "newton_iters", "error_test_fails", "convergence_fails"]
+
+#: phases that are always compared, even if they are fast
+MAIN_PHASES = ["Config", "ModCell", "Initialize", "SolveInitial", "Run", "WriteDataToFile"]
+
+
+def case_file(case):
+    """System config file of a case: a test in tests/ref_outputs or a path."""
+    testfile = os.path.join(ROOT_DIR, "tests", "ref_outputs", case, "params_system.cfg")
+    if os.path.isfile(testfile):
+        return testfile
+    if os.path.isfile(case):
+        return os.path.abspath(case)
+    raise FileNotFoundError(f"Unknown benchmark case {case}")
+
+
+def case_name(case):
+    """Short name of a case for the results."""
+    if os.path.isfile(os.path.join(ROOT_DIR, "tests", "ref_outputs", case, "params_system.cfg")):
+        return case
+    return os.path.relpath(os.path.abspath(case), ROOT_DIR)
+
+
+def read_cfg(fname):
+    parser = configparser.ConfigParser(strict=False)
+    parser.optionxform = str
+    parser.read(fname)
+    return parser
+
+
+def schema_section(config_type, key):
+    """Section of a parameter in the config schema."""
+    from mpet.config import schemas
+    for section, section_schema in getattr(schemas, config_type).items():
+        for schema_key in section_schema.schema:
+            if getattr(schema_key, "schema", schema_key) == key:
+                return section
+    raise KeyError(f"Unknown {config_type} parameter {key}")
+
+
+def set_value(parser, config_type, key, value):
+    """Set a parameter in the section where it is defined, or in its schema section."""
+    for section in parser.sections():
+        if key in parser[section]:
+            parser[section][key] = str(value)
+            return
+    section = schema_section(config_type, key)
+    if not parser.has_section(section):
+        parser.add_section(section)
+    parser[section][key] = str(value)
+
+
+def absolute_paths(parser, keys, path):
+    """Make relative file parameters absolute, relative to path."""
+    for section in parser.sections():
+        for key in keys:
+            value = parser[section].get(key)
+            if value and value.lower() != "false" and not os.path.isabs(value):
+                parser[section][key] = os.path.normpath(os.path.join(path, value))
+
+
+def write_case(paramfile, folder, system=None, cathode=None):
+    """Write a copy of the config files of a case to folder, with changed system and
+    cathode parameters.
+
+    :return: path of the new system config file
+    """
+    path = os.path.dirname(paramfile)
+    parser = read_cfg(paramfile)
+    for key, value in {**SYSTEM_OVERRIDES, **(system or {})}.items():
+        set_value(parser, "system", key, value)
+    # the new files are in another folder, file names are relative to the original
+    absolute_paths(parser, ["anode", "SMset_filename", "prevDir"], path)
+    for section in parser.sections():
+        if "cathode" in parser[section]:
+            cathodefile = parser[section]["cathode"]
+            if not os.path.isabs(cathodefile):
+                cathodefile = os.path.join(path, cathodefile)
+            trode_parser = read_cfg(cathodefile)
+            for key, value in (cathode or {}).items():
+                set_value(trode_parser, "electrode", key, value)
+            absolute_paths(trode_parser, ["rxnType_filename", "muRfunc_filename",
+                                          "Dfunc_filename"], path)
+            newfile = os.path.join(folder, "params_cathode.cfg")
+            with open(newfile, "w") as fo:
+                trode_parser.write(fo)
+            parser[section]["cathode"] = newfile
+    # electrode files may refer to files relative to the system config
+    for section in parser.sections():
+        if "anode" in parser[section] and os.path.isfile(parser[section]["anode"]):
+            trode_parser = read_cfg(parser[section]["anode"])
+            absolute_paths(trode_parser, ["rxnType_filename", "muRfunc_filename",
+                                          "Dfunc_filename"], path)
+            newfile = os.path.join(folder, "params_anode.cfg")
+            with open(newfile, "w") as fo:
+                trode_parser.write(fo)
+            parser[section]["anode"] = newfile
+    newfile = os.path.join(folder, "params_system.cfg")
+    with open(newfile, "w") as fo:
+        parser.write(fo)
+    return newfile
+
+
+def sweep_points(paramfile, grid, discretization):
+    """The benchmark points of a case: (parameter, value, system, cathode overrides)."""
+    points = []
+    for param, values in grid.items():
+        for value in values:
+            points.append((param, value, {param: value}, {}))
+    if discretization is not None:
+        parser = read_cfg(paramfile)
+        cathodefile = None
+        for section in parser.sections():
+            if "cathode" in parser[section]:
+                cathodefile = os.path.join(os.path.dirname(paramfile),
+                                           parser[section]["cathode"])
+        base = float(read_cfg(cathodefile)["Particles"]["discretization"])
+        for factor in discretization:
+            value = base*factor
+            points.append(("discretization", value, {}, {"discretization": value}))
+    return points
+
+
+def run_point(paramfile, system, cathode):
+    """Simulate a single benchmark point, in a fresh process.
+
+    :return: dict with the results of the point
+    """
+    result = {"status": "done", "error": ""}
+    with tempfile.TemporaryDirectory() as folder:
+        try:
+            casefile = write_case(paramfile, folder, system, cathode)
+            import mpet.cost as cost
+            import mpet.main as main
+            import mpet.profiler as profiler
+            import mpet.solver_stats as solver_stats
+            from mpet.config import Config
+            result["nvar"] = cost.dae_size(Config(casefile))["total"]
+            outdir = os.path.join(folder, "output")
+            profiler.enable()
+            timeStart = time.time()
+            main.main(casefile, outdir=outdir)
+            result["run_time"] = time.time() - timeStart
+            result["peak_memory"] = main.get_peak_memory()
+            with open(os.path.join(outdir, "profile.json")) as fi:
+                profile = json.load(fi)
+            result["phases"] = {phase.pop("name"): phase for phase in profile["phases"]}
+            stats = solver_stats.read_solver_stats(outdir)
+            if stats is not None:
+                result["solver"] = {column: float(np.nansum(stats[column]))
+                                    for column in SOLVER_COUNTERS}
+        except (Exception, SystemExit) as e:
+            result["status"] = "failed"
+            result["error"] = f"{type(e).__name__}: {e}"
+    return result
+
+
+def run_isolated(paramfile, system, cathode):
+    """Run a benchmark point in a new process, so that the peak memory and the global
+    state of daetools are those of that point alone."""
+    ctx = multiprocessing.get_context("spawn")
+    with concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=ctx) as pool:
+        try:
+            return pool.submit(run_point, paramfile, system, cathode).result()
+        except Exception as e:
+            # the process died, e.g. in a crash of the solver
+            return {"status": "failed", "error": f"{type(e).__name__}: {e}"}
+
+
+def fit_exponent(x, y):
+    """Slope of log(y) against log(x), None if there are too few valid points."""
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    valid = (x > 0) & (y > 0) & np.isfinite(y)
+    if len(np.unique(x[valid])) < 2:
+        return None
+    return float(np.polyfit(np.log(x[valid]), np.log(y[valid]), 1)[0])
+
+
+def scaling_exponents(results):
+    """Scaling exponents of each case and swept parameter.
+
+    :return: dict case -> parameter -> quantity -> exponent, where the quantities are
+        run_time, peak_memory, nvar and the self time of each phase
+    """
+    exponents = {}
+    for case in sorted(set(r["case"] for r in results)):
+        for param in sorted(set(r["param"] for r in results if r["case"] == case)):
+            points = [r for r in results
+                      if r["case"] == case and r["param"] == param and r["status"] == "done"]
+            x = [r["value"] for r in points]
+            if param == "discretization":
+                x = [1/value for value in x]
+            fits = {}
+            for quantity in ["run_time", "peak_memory", "nvar"]:
+                fits[quantity] = fit_exponent(x, [r.get(quantity, np.nan) for r in points])
+            phases = sorted(set(name for r in points for name in r.get("phases", {})))
+            for name in phases:
+                fits[name] = fit_exponent(
+                    x, [r["phases"].get(name, {}).get("self", np.nan) for r in points])
+            exponents.setdefault(case, {})[param] = fits
+    return exponents
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def read_history(filename):
+    if not os.path.isfile(filename):
+        return []
+    with open(filename) as fi:
+        return json.load(fi)
+
+
+def write_history(filename, history):
+    tmpname = filename + ".tmp"
+    with open(tmpname, "w") as fo:
+        json.dump(history, fo, indent=1)
+    os.replace(tmpname, filename)
+
+
+def run_benchmarks(args):
+    import mpet
+    grid = {"Nvol_c": args.Nvol_c, "Npart_c": args.Npart_c}
+    grid = {param: values for param, values in grid.items() if values}
+    discretization = None if args.no_discretization else DISCRETIZATION_FACTORS
+    if args.discretization:
+        discretization = args.discretization
+    results = []
+    for case in args.cases:
+        paramfile = case_file(case)
+        for param, value, system, cathode in sweep_points(paramfile, grid, discretization):
+            print(f"\n{case_name(case)}: {param} = {value}")
+            result = run_isolated(paramfile, system, cathode)
+            result.update({"case": case_name(case), "param": param, "value": value})
+            if result["status"] == "failed":
+                print("Failed:", result["error"])
+            results.append(result)
+
+    entry = {"date": datetime.datetime.now().isoformat(timespec="seconds"),
+             "label": args.label, "version": mpet.__version__, "commit": git_commit(),
+             "host": platform.node(), "python": platform.python_version(),
+             "results": results, "exponents": scaling_exponents(results)}
+    history = read_history(args.history)
+    history.append(entry)
+    write_history(args.history, history)
+    print_entry(entry)
+    print(f"\nResults stored as entry {len(history) - 1} in {args.history}")
+
+
+def print_entry(entry):
+    print("\n{:<36} {:<16} {:>10} {:>8} {:>10} {:>10} {:>10} {:>8}".format(
+        "case", "parameter", "value", "nvar", "time [s]", "Run [s]", "memory [MB]", "steps"))
+    for r in entry["results"]:
+        if r["status"] != "done":
+            print("{:<36} {:<16} {:>10.4g}  failed: {}".format(
+                r["case"], r["param"], r["value"], r["error"]))
+            continue
+        print("{:<36} {:<16} {:>10.4g} {:>8d} {:>10.2f} {:>10.2f} {:>10.1f} {:>8.0f}".format(
+            r["case"], r["param"], r["value"], r["nvar"], r["run_time"],
+            r["phases"].get("Run", {}).get("total", np.nan),
+            (r["peak_memory"] or np.nan)/1e6, r.get("solver", {}).get("steps", np.nan)))
+    print("\nScaling exponents (run time, peak memory, DAE size and main phases)")
+    print("{:<36} {:<16} {:>8} {:>8} {:>8}".format("case", "parameter", "time", "memory",
+                                                   "nvar") + "".join(
+        " {:>12}".format(name) for name in MAIN_PHASES))
+    for case, params in entry["exponents"].items():
+        for param, fits in params.items():
+            values = [fits.get(name) for name in ["run_time", "peak_memory", "nvar"]]
+            line = "{:<36} {:<16}".format(case, param) + "".join(
+                " {:>8}".format(fmt(value)) for value in values)
+            line += "".join(" {:>12}".format(fmt(fits.get(name))) for name in MAIN_PHASES)
+            print(line)
+
+
+def fmt(value):
+    return "-" if value is None else "{:.2f}".format(value)
+
+
+def compare_entries(base, new, tol, min_time):
+    """Phases and exponents of new that are slower than in base.
+
+    :return: list of (case, parameter, value, quantity, base, new) of the regressions
+    """
+    regressions = []
+    base_results = {(r["case"], r["param"], r["value"]): r for r in base["results"]
+                    if r["status"] == "done"}
+    for r in new["results"]:
+        key = (r["case"], r["param"], r["value"])
+        if key not in base_results:
+            continue
+        if r["status"] != "done":
+            regressions.append(key + ("status", "done", "failed"))
+            continue
+        b = base_results[key]
+        if r["run_time"] > tol*b["run_time"] and r["run_time"] - b["run_time"] > min_time:
+            regressions.append(key + ("run_time", b["run_time"], r["run_time"]))
+        # attribute the slowdown to the phases, by their self time
+        for name, phase in r["phases"].items():
+            tBase = b["phases"].get(name, {}).get("self")
+            tNew = phase["self"]
+            if tBase is not None and tNew > tol*tBase and tNew - tBase > min_time:
+                regressions.append(key + (name, tBase, tNew))
+        if r.get("peak_memory") and b.get("peak_memory") \
+                and r["peak_memory"] > tol*b["peak_memory"]:
+            regressions.append(key + ("peak_memory", b["peak_memory"], r["peak_memory"]))
+    # worse scaling, e.g. an assembly step that became quadratic in Nvol
+    for case, params in new["exponents"].items():
+        for param, fits in params.items():
+            for quantity, exponent in fits.items():
+                baseExponent = base["exponents"].get(case, {}).get(param, {}).get(quantity)
+                if exponent is not None and baseExponent is not None \
+                        and exponent - baseExponent > 0.25:
+                    regressions.append((case, param, None, f"exponent {quantity}",
+                                        baseExponent, exponent))
+    return regressions
+
+
+def compare_history(args):
+    history = read_history(args.history)
+    if len(history) < 2:
+        raise SystemExit(f"{args.history} needs at least two entries to compare")
+    base = history[args.base]
+    new = history[args.new]
+    print("Comparing {} ({} {}) with {} ({} {})".format(
+        args.new % len(history), new["commit"], new["label"],
+        args.base % len(history), base["commit"], base["label"]))
+    regressions = compare_entries(base, new, args.tolerance, args.min_time)
+    if not regressions:
+        print("No regressions found")
+        return
+    print("\n{:<36} {:<16} {:>10} {:<30} {:>12} {:>12} {:>8}".format(
+        "case", "parameter", "value", "phase", "base", "new", "ratio"))
+    for case, param, value, quantity, old, current in regressions:
+        valueStr = "-" if value is None else "{:.4g}".format(value)
+        if quantity == "status":
+            print("{:<36} {:<16} {:>10} {:<30} {:>12} {:>12}".format(
+                case, param, valueStr, quantity, old, current))
+            continue
+        ratio = current/old if old else np.inf
+        print("{:<36} {:<16} {:>10} {:<30} {:>12.4g} {:>12.4g} {:>8.2f}".format(
+            case, param, valueStr, quantity, old, current, ratio))
+    sys.exit(1)
+
+
+def list_history(args):
+    history = read_history(args.history)
+    print("{:>5} {:<20} {:<10} {:<10} {:<16} {}".format(
+        "entry", "date", "version", "commit", "host", "label"))
+    for i, entry in enumerate(history):
+        print("{:>5} {:<20} {:<10} {:<10} {:<16} {}".format(
+            i, entry["date"], entry["version"], entry["commit"], entry["host"],
+            entry["label"]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--history', default=os.path.join(BENCH_DIR, "history.json"),
+                        help='JSON file with the benchmark history (default: %(default)s)')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help='run the benchmarks')
+    run_parser.add_argument('cases', nargs='*', default=DEFAULT_CASES,
+                            help='tests from tests/ref_outputs (e.g. test001) or system '
+                            'config files (default: configs/params_system.cfg test001)')
+    run_parser.add_argument('--Nvol_c', type=int, nargs='*', default=DEFAULT_GRID["Nvol_c"],
+                            help='values of Nvol_c (default: %(default)s)')
+    run_parser.add_argument('--Npart_c', type=int, nargs='*',
+                            default=DEFAULT_GRID["Npart_c"],
+                            help='values of Npart_c (default: %(default)s)')
+    run_parser.add_argument('--discretization', type=float, nargs='+',
+                            help='factors of the cathode discretization of each case '
+                            f'(default: {DISCRETIZATION_FACTORS})')
+    run_parser.add_argument('--no_discretization', action='store_true',
+                            help='do not sweep the discretization')
+    run_parser.add_argument('--label', default='', help='description of this entry')
+    run_parser.set_defaults(func=run_benchmarks)
+
+    compare_parser = subparsers.add_parser('compare', help='compare two history entries')
+    compare_parser.add_argument('--base', type=int, default=-2,
+                                help='entry to compare with (default: the one before last)')
+    compare_parser.add_argument('--new', type=int, default=-1,
+                                help='entry to compare (default: the last)')
+    compare_parser.add_argument('--tolerance', type=float, default=1.2,
+                                help='allowed ratio of the new and base times '
+                                '(default: %(default)s)')
+    compare_parser.add_argument('--min_time', type=float, default=0.1,
+                                help='ignore differences of less than this many seconds '
+                                '(default: %(default)s)')
+    compare_parser.set_defaults(func=compare_history)
+
+    subparsers.add_parser('list', help='list the history entries').set_defaults(
+        func=list_history)
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
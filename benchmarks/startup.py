@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""Start-up time of the MPET command line tools.
+
+Every case runs an entry point in bin/ in a fresh process: the --help (and --version)
+of each script, the validation of a config (mpetrun.py --check) and the export of a
+simulation output to text (mpetplot.py -t text). The wall time of each case is the
+minimum over the repeats. Each case is also run once more to record which of the
+heavy modules (daetools, matplotlib, h5py) it imported. None of the cases needs
+daetools or matplotlib, the exit status is 1 if one of them imports it.
+
+The text export needs a simulation output. By default the output of a test in
+tests/ref_outputs is copied to a temporary directory, with its config dicts rewritten
+by the current version of mpet.
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+BIN_DIR = os.path.join(ROOT_DIR, "bin")
+
+#: heavy modules that are reported for every case
+HEAVY_MODULES = ["daetools", "matplotlib", "h5py"]
+
+#: modules that none of the cases may import
+FORBIDDEN_MODULES = ["daetools", "matplotlib"]
+
+#: test of which the output is exported to text
+DEFAULT_OUTPUT_TEST = "test024"
+
+# runs a script with the arguments after the output file, and stores the heavy modules
+# it imported in the output file
+IMPORT_CHECK = """
+import json, runpy, sys
+script, outfile = sys.argv[1:3]
+sys.argv = [script] + sys.argv[3:]
+try:
+    runpy.run_path(script, run_name="__main__")
+except SystemExit:
+    pass
+finally:
+    loaded = sorted({{name.split(".")[0] for name in sys.modules}} & set({heavy}))
+    with open(outfile, "w") as fo:
+        json.dump(loaded, fo)
+"""
+
+
+def cases(config, output):
+    """Name, script and arguments of every case."""
+    result = []
+    for script in ["mpetrun.py", "mpetplot.py", "mpetcache.py", "run_jobs.py"]:
+        name = os.path.splitext(script)[0]
+        if script in ["mpetrun.py", "mpetplot.py"]:
+            result.append((f"{name} --version", script, ["--version"]))
+        result.append((f"{name} --help", script, ["--help"]))
+    result.append(("mpetrun --check", "mpetrun.py", ["--check", config]))
+    if output is not None:
+        result.append(("mpetplot -t text", "mpetplot.py", [output, "-t", "text"]))
+    return result
+
+
+def prepare_output(test, folder):
+    """Copy the output of a test in tests/ref_outputs to folder, with the config dicts
+    of the current version of mpet. Returns the output directory."""
+    from mpet.config import Config
+    testdir = os.path.join(ROOT_DIR, "tests", "ref_outputs", test)
+    for fname in os.listdir(testdir):
+        if fname.endswith(".cfg"):
+            shutil.copy(os.path.join(testdir, fname), folder)
+    outdir = os.path.join(folder, "sim_output")
+    shutil.copytree(os.path.join(testdir, "sim_output"), outdir)
+    Config(os.path.join(folder, "params_system.cfg")).write(outdir)
+    return outdir
+
+
+def environment():
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [ROOT_DIR, env.get("PYTHONPATH")]))
+    # plots are never shown
+    env["MPLBACKEND"] = "Agg"
+    return env
+
+
+def time_case(script, args, repeat, env):
+    """Wall times of repeat runs of a script, raises an error if it fails."""
+    times = []
+    for _ in range(repeat):
+        tStart = time.perf_counter()
+        subprocess.run([sys.executable, os.path.join(BIN_DIR, script)] + args, env=env,
+                       check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        times.append(time.perf_counter() - tStart)
+    return times
+
+
+def imported_modules(script, args, env, folder):
+    """Heavy modules imported by a run of a script."""
+    outfile = os.path.join(folder, "modules.json")
+    code = IMPORT_CHECK.format(heavy=HEAVY_MODULES)
+    subprocess.run([sys.executable, "-c", code, os.path.join(BIN_DIR, script), outfile]
+                   + args, env=env, check=True, stdout=subprocess.DEVNULL,
+                   stderr=subprocess.DEVNULL)
+    with open(outfile) as fi:
+        return json.load(fi)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--config', default=os.path.join(ROOT_DIR, "configs",
+                                                         "params_system.cfg"),
+                        help='system config file of mpetrun --check (default: %(default)s)')
+    parser.add_argument('--output',
+                        help='simulation output directory to export to text (default: '
+                        f'the output of {DEFAULT_OUTPUT_TEST} in tests/ref_outputs)')
+    parser.add_argument('--no_text', action='store_true', help='skip the text export')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='number of runs of each case (default: %(default)s)')
+    parser.add_argument('--json', help='store the results in this JSON file')
+    args = parser.parse_args()
+
+    env = environment()
+    results = []
+    with tempfile.TemporaryDirectory() as folder:
+        output = None
+        if not args.no_text:
+            if args.output is None:
+                sys.path.insert(0, ROOT_DIR)
+                output = prepare_output(DEFAULT_OUTPUT_TEST, folder)
+            else:
+                # the text files are written to the output directory
+                output = os.path.join(folder, "sim_output")
+                shutil.copytree(args.output, output)
+        print("{:<22} {:>9} {:>10}  {}".format(
+            "case", "min [s]", "median [s]", "heavy modules"))
+        for name, script, script_args in cases(os.path.abspath(args.config), output):
+            times = sorted(time_case(script, script_args, args.repeat, env))
+            modules = imported_modules(script, script_args, env, folder)
+            results.append({"case": name, "min": times[0], "median": times[len(times)//2],
+                            "modules": modules})
+            print("{:<22} {:>9.3f} {:>10.3f}  {}".format(
+                name, times[0], times[len(times)//2], ", ".join(modules) or "-"))
+
+    if args.json:
+        with open(args.json, "w") as fo:
+            json.dump(results, fo, indent=1)
+    failed = [result["case"] for result in results
+              if set(result["modules"]) & set(FORBIDDEN_MODULES)]
+    if failed:
+        print("\nImported {}: {}".format(" or ".join(FORBIDDEN_MODULES), ", ".join(failed)))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""Compare the run and factorization times of the daetools linear solvers.
+
+Every selected test config (tests/ref_outputs/<test>/params_system.cfg) is simulated
+with each linear solver (see linearSolver in configs/params_system.cfg). The run time
+and the time spent in the setup (factorization) and solve calls of the linear solver
+are printed. The call times are read from the CallStats of the daetools linear solver
+(a dict of TimeAndCount objects with Count and Duration). If the daetools installation
+does not provide them, only the run time is printed.
+"""
+import argparse
+import os.path as osp
+import tempfile
+import time
+
+import mpet.main as main
+from mpet.config import Config
+
+SOLVERS = ["SuperLU", "SuperLU_MT", "Pardiso", "IntelPardiso", "Trilinos_Amesos_Klu",
+           "Trilinos_Amesos_Superlu", "Trilinos_Amesos_Umfpack", "Trilinos_Amesos_Lapack"]
+
+#: CallStats keys of the factorization and solve calls of a linear solver
+SETUP_KEY = "Setup"
+SOLVE_KEY = "Solve"
+
+
+def call_times(lasolver, solver):
+    """Total time spent in the setup and solve calls of a daetools linear solver.
+    The times that the linear solver does not report are None."""
+    stats = getattr(lasolver, "CallStats", None)
+    if stats is None:
+        print(f"Warning: the daetools linear solver {solver} does not report call "
+              "statistics (CallStats), only the run time is measured")
+        return None, None
+    stats = dict(stats)
+    missing = [key for key in [SETUP_KEY, SOLVE_KEY] if key not in stats]
+    if missing:
+        print(f"Warning: the CallStats of the daetools linear solver {solver} have no "
+              f"{', '.join(missing)} entries (available: "
+              f"{', '.join(sorted(stats)) or 'none'})")
+    return tuple(stats[key].Duration if key in stats else None
+                 for key in [SETUP_KEY, SOLVE_KEY])
+
+
+def benchmark(configfile, solver, threads):
+    config = Config(configfile)
+    config["linearSolver"] = solver
+    config["linearSolverThreads"] = threads
+    main.set_daetools_options(config)
+    with tempfile.TemporaryDirectory() as outdir:
+        timeStart = time.time()
+        completed, lasolver = main.run_simulation(config, outdir)
+        runtime = time.time() - timeStart
+    if not completed:
+        raise RuntimeError(f"The simulation of {configfile} with {solver} did not finish")
+    setup, solve = call_times(lasolver, solver)
+    return runtime, setup, solve
+
+
+def fmt(value):
+    return "-" if value is None else "{:.3f}".format(value)
+
+
+def main_bench():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--test_dir', type=str,
+                        default=osp.join(osp.dirname(osp.abspath(__file__)), "../tests"),
+                        help='where are the tests located?')
+    parser.add_argument('--solvers', nargs='+', default=SOLVERS, choices=SOLVERS,
+                        help='linear solvers to compare, default is all')
+    parser.add_argument('--threads', type=int, default=0,
+                        help='threads of the multithreaded solvers, default is the solver '
+                        'default')
+    parser.add_argument('tests', nargs='+', help='tests from ref_outputs to run, e.g. test001')
+    args = parser.parse_args()
+
+    results = []
+    for test in args.tests:
+        configfile = osp.join(args.test_dir, "ref_outputs", test, "params_system.cfg")
+        for solver in args.solvers:
+            try:
+                runtime, setup, solve = benchmark(configfile, solver, args.threads)
+            except ImportError as e:
+                # solvers that are not part of the daetools installation
+                print("Skipping:", e)
+                continue
+            results.append((test, solver, runtime, setup, solve))
+
+    print("\n{:<28} {:<24} {:>10} {:>12} {:>10}".format(
+        "test", "linearSolver", "run [s]", "setup [s]", "solve [s]"))
+    for test, solver, runtime, setup, solve in results:
+        print("{:<28} {:<24} {:>10} {:>12} {:>10}".format(
+            test, solver, fmt(runtime), fmt(setup), fmt(solve)))
+
+
+if __name__ == "__main__":
+    main_bench()
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""Manage a store of simulation results (see resultCache in configs/params_system.cfg).
+
+  list   show the stored results, most recently used first
+  prune  remove results that were not used recently, or the least recently used
+         results until the store is smaller than a maximum size
+  gc     remove incomplete results of interrupted runs and results of other mpet
+         versions, which can never be used again
+"""
+import argparse
+
+import mpet.result_cache as result_cache
+
+
+def list_store(args):
+    items = result_cache.entries(args.store)
+    print("{:<16} {:>10} {:<16} {:<16} {:<8} {}".format(
+        "hash", "size [MB]", "created", "last used", "version", "config"))
+    total = 0
+    for key, info in items:
+        total += info.get("size", 0)
+        print("{:<16} {:>10.1f} {:<16} {:<16} {:<8} {}".format(
+            key[:16], info.get("size", 0)/1e6,
+            result_cache.format_time(info.get("created", 0)),
+            result_cache.format_time(info.get("last_used", 0)),
+            info.get("version", ""), info.get("config", "")))
+    print(f"\n{len(items)} results, {total/1e6:.1f} MB")
+
+
+def prune_store(args):
+    if args.days is None and args.max_size is None:
+        raise SystemExit("prune needs --days and/or --max_size")
+    max_size = None if args.max_size is None else args.max_size*1e9
+    removed = result_cache.prune(args.store, max_age=args.days, max_size=max_size)
+    print(f"Removed {len(removed)} results")
+
+
+def gc_store(args):
+    removed = result_cache.garbage_collect(args.store)
+    print(f"Removed {len(removed)} incomplete or outdated results")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('store', help='directory of the result store')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('list', help='list the stored results').set_defaults(
+        func=list_store)
+    prune_parser = subparsers.add_parser('prune', help='remove old results')
+    prune_parser.add_argument('--days', type=float,
+                              help='remove results that were not used for this many days')
+    prune_parser.add_argument('--max_size', type=float,
+                              help='maximum size of the store in GB')
+    prune_parser.set_defaults(func=prune_store)
+    subparsers.add_parser('gc', help='remove incomplete and outdated results').set_defaults(
+        func=gc_store)
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -5,11 +5,8 @@ import sys
 import argparse
 from argparse import RawTextHelpFormatter
 from collections import OrderedDict
-import matplotlib.pyplot as plt
 
 from mpet.version import __version__
-import mpet.plot.outmat2txt as outmat2txt
-import mpet.plot.plot_data as plot_data
 
 # Ordered dictionary of plot types
 plotTypes = OrderedDict([
@@ -73,6 +70,8 @@ parser.add_argument('-st', '--smooth_type', choices=['GnYlRd_1', 'GnYlRd_2', 'Gn
                     default='GnYlRd_3')
 parser.add_argument('-v','--version', action='version',
                     version='%(prog)s '+__version__)
+# the output and plotting modules are only imported once the arguments are parsed, so that
+# --help and --version return immediately, and matplotlib is never imported for text output
 args = parser.parse_args()
 
 # Get input file from script parameters
@@ -83,8 +82,10 @@ if not os.path.exists(os.path.join(os.getcwd(), indir)):
     raise Exception("Input file doesn't exist")
 # Optionally just convert output to text
 if args.text == 'text':
+    import mpet.plot.outmat2txt as outmat2txt
     outmat2txt.main(indir)
     sys.exit()
+import mpet.plot.plot_data as plot_data  # noqa: E402
 # Get plot type from script parameters
 plots = args.plotType
 # Save the plot instead of showing on screen?
@@ -106,4 +107,4 @@ for plot_type in plots:
     out.append(plot_data.show_data(
         indir, plot_type, print_flag, save_flag, data_only, color_changes, smooth_type))
 if not save_only:
-    plt.show()
+    plot_data.plt.show()
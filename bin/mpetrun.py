@@ -5,7 +5,7 @@ import argparse
 from argparse import RawTextHelpFormatter
 
 from mpet.version import __version__
-import mpet.main as main
+import mpet.profiler as profiler
 
 desc = """MPET - Multiphase Porous Electrode Theory
 This software is designed to run simulations of batteries with porous electrodes
@@ -19,13 +19,60 @@ detailing its development as presented in the LICENSE file.
 See also: https://bitbucket.org/bazantgroup/mpet"""
 
 parser = argparse.ArgumentParser(description=desc, formatter_class=RawTextHelpFormatter)
-parser.add_argument('file', help='MPET system configuration file')
+parser.add_argument('file', nargs='?', help='MPET system configuration file')
+parser.add_argument('--check', action='store_true',
+                    help='only validate the configuration and print the size of\n'
+                    'the DAE system, without running the simulation')
+parser.add_argument('--compare-reduction', action='store_true',
+                    help='run the configuration with and without particleReduction\n'
+                    'and print the difference in voltage and capacity')
+parser.add_argument('--resume', metavar='DIR',
+                    help='continue the simulation in output directory DIR\n'
+                    'from its latest checkpoint (see checkpointWallTime)')
+parser.add_argument('--profile', action='store_true',
+                    help='time the phases of the simulation, the timings are\n'
+                    'printed and stored in profile.json in the output directory')
+parser.add_argument('--profile-phase', metavar='PHASE',
+                    help='profile a single phase in detail (implies --profile),\n'
+                    'e.g. Config, ModCell, Initialize, SolveInitial or Run')
+parser.add_argument('--profile-mode', choices=profiler.MODES, default='cprofile',
+                    help='detailed profiler of --profile-phase (default: %(default)s)')
 parser.add_argument('-v','--version', action='version',
                     version='%(prog)s '+__version__)
+
+
+def check_config(paramfile):
+    """Read and process the config files, which raises an error if they are invalid,
+    and print the size of the resulting DAE system."""
+    from mpet.config import Config
+    import mpet.cost as cost
+    size = cost.dae_size(Config(paramfile))
+    print(f"Configuration {paramfile} is valid")
+    for trode in size["particle_vars"]:
+        print(f"Electrode {trode}: {size['Nvol'][trode]} volumes, "
+              f"{size['Npart'][trode]} particles per volume, "
+              f"{size['psd_total'][trode]} particle discretization points")
+    print(f"Number of variables: {size['total']}")
+
+
+# the simulation modules are only imported once the arguments are parsed,
+# so that --help and --version return immediately
 args = parser.parse_args()
 
-try:
-    main.main(sys.argv[1])
-except IndexError:
+if args.profile or args.profile_phase:
+    profiler.enable(args.profile_phase, args.profile_mode)
+
+if args.resume:
+    from mpet.main import resume
+    resume(args.resume)
+elif args.file is None:
     print("ERROR: No parameter file specified. Aborting")
-    raise
+    sys.exit(1)
+elif args.check:
+    check_config(args.file)
+elif args.compare_reduction:
+    from mpet.main import compare_particle_reduction
+    compare_particle_reduction(args.file)
+else:
+    from mpet.main import main
+    main(args.file)
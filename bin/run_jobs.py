@@ -3,14 +3,13 @@
 import argparse
 import os
 import shutil
-import mpet.main as main
 
-from dask_jobqueue import SLURMCluster, PBSCluster
-from dask.distributed import Client, LocalCluster
+import mpet.executor as executor
 
 
 def create_slurm_cluster(time, nproc, mem, queue, dashboard_port):
     """Create a SLURM cluster for use with dask"""
+    from dask_jobqueue import SLURMCluster
     cluster = SLURMCluster(cores=nproc,
                            processes=nproc,
                            memory=mem,
@@ -22,6 +21,7 @@ def create_slurm_cluster(time, nproc, mem, queue, dashboard_port):
 
 def create_pbs_cluster(time, nproc, mem, queue, dashboard_port):
     """Create a PBS cluster for use with dask"""
+    from dask_jobqueue import PBSCluster
     cluster = PBSCluster(cores=nproc,
                          processes=nproc,
                          memory=mem,
@@ -34,34 +34,74 @@ def create_pbs_cluster(time, nproc, mem, queue, dashboard_port):
 
 def create_local_cluster(mem, dashboard_port):
     """Create a local cluster for use with dask"""
+    from dask.distributed import LocalCluster
     cluster = LocalCluster(memory_limit=mem,
                            dashboard_address=dashboard_port)
     return cluster
 
 
-def run_mpet(client, output_folder, mpet_configs):
-    """Run MPET on each config file present in the mpet_configs folder"""
-    # In order to copy or move simulation output to current directory, remove old existing folder
-    tmpDir = os.path.join(os.getcwd(), "sim_output")
-    shutil.rmtree(tmpDir, ignore_errors=True)
-
+def read_config_list(mpet_configs):
+    """Read the paths of the config files listed in the mpet_configs text file"""
     with open(mpet_configs, 'r') as fp:
-        config_files = fp.readlines()
-
+        config_files = [line.strip() for line in fp if line.strip()]
     folder = os.path.dirname(mpet_configs)
-    files = [f'{os.path.join(folder, fname.strip())}' for fname in config_files]
+    return [os.path.join(folder, fname) for fname in config_files]
+
+
+def schedule_jobs(files, history):
+    """Order the config files by their predicted run time, longest first, with a cost
+    model (mpet.cost) fitted on the finished runs in the history folders.
+
+    Returns the ordered files and their predicted (run time [s], memory [bytes])"""
+    from mpet.config import Config
+    import mpet.cost as cost
+    model = cost.CostModel.fit(history)
+    print(f'Cost model fitted on {model.nruns} previous runs')
+    costs = []
+    for paramfile in files:
+        try:
+            costs.append(model.predict(Config(paramfile)))
+        except Exception as e:
+            print(f'Cannot estimate the cost of {paramfile}: {e}')
+            costs.append((0., 0.))
+    order = sorted(range(len(files)), key=lambda i: costs[i][0], reverse=True)
+    print('\n{:<50} {:>12} {:>12}'.format('config', 'time [s]', 'memory [MB]'))
+    for i in order:
+        print('{:<50} {:>12.0f} {:>12.0f}'.format(os.path.basename(files[i]), costs[i][0],
+                                                  costs[i][1]/1e6))
+    return [files[i] for i in order], [costs[i] for i in order]
+
+
+def format_walltime(seconds):
+    """Walltime in hh:mm:ss format"""
+    seconds = int(seconds)
+    return f'{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}'
+
+
+def run_mpet(client, output_folder, mpet_configs, files=None):
+    """Run MPET on each config file present in the mpet_configs folder, or on the given
+    files in the given order"""
+    # Every job writes to its own directory in sim_output, remove old output
+    tmpDir = os.path.join(output_folder, "sim_output")
+    shutil.rmtree(tmpDir, ignore_errors=True)
+
+    if files is None:
+        files = read_config_list(mpet_configs)
     print('Running mpet for these config files:', files)
+    outdirs = executor.job_outdirs(files, os.path.abspath(output_folder))
 
-    # function to run MPET in directory given as input to run_mpet
-    def run_mpet_instance(*args, **kwargs):
-        print(f"Running in {output_folder} with args={args}, kwargs={kwargs}")
-        os.chdir(output_folder)
+    # function to run MPET with the output in the given directory
+    def run_mpet_instance(paramfile, outdir):
+        import mpet.main as main
+        print(f"Running {paramfile} with output in {outdir}")
         try:
-            main.main(*args, **kwargs)
+            main.main(paramfile, outdir=outdir)
         except Exception as e:
             print(f'MPET crashed with error: {e}')
 
-    futures = client.map(run_mpet_instance, files, keepFullRun=True)
+    # earlier files get a higher priority
+    futures = [client.submit(run_mpet_instance, paramfile, outdir, priority=len(files) - i)
+               for i, (paramfile, outdir) in enumerate(zip(files, outdirs))]
     print('Waiting for MPET to finish')
     client.gather(futures)
     client.close()
@@ -69,15 +109,26 @@ def run_mpet(client, output_folder, mpet_configs):
     return
 
 
+def run_mpet_pool(output_folder, mpet_configs, nproc, max_jobs=None, files=None):
+    """Run MPET on each config file with a local process pool instead of dask, each job
+    pinned to nproc cores"""
+    tmpDir = os.path.join(output_folder, "sim_output")
+    shutil.rmtree(tmpDir, ignore_errors=True)
+    if files is None:
+        files = read_config_list(mpet_configs)
+    print('Running mpet for these config files:', files)
+    return executor.run_local(files, output_folder, jobs=max_jobs, threads=nproc)
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Runs several instances of MPET on a SLURM or'
                                      ' PBS cluster, or local cluster')
     # cluster settings
-    parser.add_argument('--time', '-t', required=True,
+    parser.add_argument('--time', '-t',
                         help='Maximum walltime per job (hh:mm:ss format)')
-    parser.add_argument('--nproc', '-n', type=int, required=True,
-                        help='Number of CPU cores per job')
-    parser.add_argument('--mem', '-m', required=True,
+    parser.add_argument('--nproc', '-n', type=int, default=1,
+                        help='Number of CPU cores per job (default: %(default)s)')
+    parser.add_argument('--mem', '-m',
                         help=('Max memory usage per job. When using a '
                               'local cluster it sets the memory limit per worker process.'))
     parser.add_argument('--queue', '-q', default='default',
@@ -86,40 +137,81 @@ if __name__ == '__main__':
                         help='Port for dask dashboard (default: %(default)s)')
 
     # script settings
-    parser.add_argument('--scheduler', '-s', default='slurm', choices=('slurm', 'pbs', 'local'),
-                        help='Scheduling system to use (default: %(default)s)')
+    parser.add_argument('--scheduler', '-s', default='slurm',
+                        choices=('slurm', 'pbs', 'local', 'pool'),
+                        help=('Scheduling system to use, pool runs the jobs in a local '
+                              'process pool without dask (default: %(default)s)'))
     parser.add_argument('--min_jobs', type=int, default=1,
                         help='Minimum number of jobs to launch (default: %(default)s)')
-    parser.add_argument('--max_jobs', type=int, default=1,
-                        help='Maximum number of jobs to launch (default: %(default)s)')
+    parser.add_argument('--max_jobs', type=int,
+                        help=('Maximum number of jobs to launch (default: 1, with pool as '
+                              'many as fit on the available cores)'))
+    parser.add_argument('--history', nargs='+',
+                        help=('Folders with previous runs to fit the cost model on, used to '
+                              'start the longest jobs first and to set --time and --mem if '
+                              'they are not given (default: sim_output and history in the '
+                              'current folder)'))
+    parser.add_argument('--no_schedule', action='store_true',
+                        help='Run the jobs in the order of mpet_configs without cost model')
+    parser.add_argument('--safety', type=float, default=2.,
+                        help=('Factor applied to the predicted walltime and memory '
+                              '(default: %(default)s)'))
     parser.add_argument('mpet_configs',
                         help='Text file containg the path to each MPET config file to run')
 
     args = parser.parse_args()
     # split cluster settings from the rest
     main_settings = {}
-    for arg in ['scheduler', 'mpet_configs', 'min_jobs', 'max_jobs']:
+    for arg in ['scheduler', 'mpet_configs', 'min_jobs', 'max_jobs', 'history', 'no_schedule',
+                'safety']:
         main_settings[arg] = getattr(args, arg)
         delattr(args, arg)
     cluster_settings = vars(args)
 
-    # create cluster
-    if main_settings['scheduler'] == 'slurm':
-        cluster = create_slurm_cluster(**cluster_settings)
-    elif main_settings['scheduler'] == 'pbs':
-        cluster = create_pbs_cluster(**cluster_settings)
-    elif main_settings['scheduler'] == 'local':
-        cluster = create_local_cluster(args.mem, args.dashboard_port)
-
-    # Scale Dask cluster automatically based on scheduler activity (only if not local cluster)
-    if main_settings['scheduler'] != 'local':
-        cluster.adapt(minimum_jobs=main_settings['min_jobs'],
-                      maximum_jobs=main_settings['max_jobs'])
-    client = Client(cluster)
-
     # Store output in folder this script was called from
     output_folder = os.getcwd()
 
-    run_mpet(client, output_folder, os.path.abspath(main_settings['mpet_configs']))
-
-    client.shutdown()
+    mpet_configs = os.path.abspath(main_settings['mpet_configs'])
+    files = read_config_list(mpet_configs)
+    if not main_settings['no_schedule']:
+        history = main_settings['history']
+        if history is None:
+            history = [os.path.join(output_folder, folder) for folder in ['sim_output', 'history']]
+        files, costs = schedule_jobs(files, history)
+        # size the resource requests for the most expensive job
+        safety = main_settings['safety']
+        if args.time is None and costs:
+            # at least 10 minutes
+            args.time = format_walltime(max(600, safety*max(c[0] for c in costs)))
+            print('Walltime per job:', args.time)
+        if args.mem is None and costs:
+            args.mem = '{:.1f}GB'.format(max(0.5, safety*max(c[1] for c in costs)/1e9))
+            print('Memory per job:', args.mem)
+
+    if main_settings['scheduler'] == 'pool':
+        run_mpet_pool(output_folder, mpet_configs, args.nproc, main_settings['max_jobs'],
+                      files=files)
+    else:
+        if args.mem is None or (main_settings['scheduler'] != 'local' and args.time is None):
+            parser.error('--mem is required for dask schedulers, and --time for slurm and pbs')
+        if main_settings['max_jobs'] is None:
+            main_settings['max_jobs'] = 1
+
+        # create cluster
+        if main_settings['scheduler'] == 'slurm':
+            cluster = create_slurm_cluster(**cluster_settings)
+        elif main_settings['scheduler'] == 'pbs':
+            cluster = create_pbs_cluster(**cluster_settings)
+        elif main_settings['scheduler'] == 'local':
+            cluster = create_local_cluster(args.mem, args.dashboard_port)
+
+        # Scale Dask cluster automatically based on scheduler activity (only if not local cluster)
+        if main_settings['scheduler'] != 'local':
+            cluster.adapt(minimum_jobs=main_settings['min_jobs'],
+                          maximum_jobs=main_settings['max_jobs'])
+        from dask.distributed import Client
+        client = Client(cluster)
+
+        run_mpet(client, output_folder, mpet_configs, files=files)
+
+        client.shutdown()
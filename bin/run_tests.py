@@ -7,7 +7,7 @@ from shutil import rmtree
 import argparse
 
 
-def run(test_outputs, testDir, tests=None):
+def run(test_outputs, testDir, tests=None, backend=None):
     pflag = False
     dirDict = {}
     # Get the default configs
@@ -36,7 +36,7 @@ def run(test_outputs, testDir, tests=None):
     makedirs(dirDict["out"])
     dirDict["plots"] = osp.join(dirDict["out"], "plots")
     makedirs(dirDict["plots"])
-    run_test_sims(tests, dirDict, pflag)
+    run_test_sims(tests, dirDict, pflag, backend=backend)
     try:
         run_test_sims_analyt(runInfoAnalyt, dirDict)
     except Exception:
@@ -52,10 +52,12 @@ def main():
     parser.add_argument('--test_dir', metavar='t', type=str,
                         default=osp.join(osp.dirname(osp.abspath(__file__)),"../tests"),
                         help='where are the tests located?')
+    parser.add_argument('--backend', type=str, default=None, choices=["daetools", "numpy"],
+                        help='simulation backend, default is the one set in the test configs')
     parser.add_argument('tests', nargs='*', default=[], help='which tests do I run?')
     args = parser.parse_args()
 
-    run(args.output_dir,args.test_dir, args.tests)
+    run(args.output_dir,args.test_dir, args.tests, args.backend)
 
     return (args)
 
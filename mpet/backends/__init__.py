@@ -0,0 +1 @@
+"""Simulation backends that do not build daetools models, see mpet.backends.numpy."""
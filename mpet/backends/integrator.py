@@ -0,0 +1,362 @@
+"""Variable order BDF integration of semi-explicit DAE systems with a constant mass matrix.
+
+The systems have the form ``M y' = f(t, y)``, where rows of ``M`` that are zero define
+algebraic equations. The time stepping follows the quasi-constant step size
+backward differentiation formulas (with NDF modifications) used by
+:class:`scipy.integrate.BDF`, which cannot handle mass matrices itself.
+The Newton iterations solve ``(M - c J) dy = c f - M (psi + d)`` instead of the
+ODE form, so algebraic variables are treated exactly like in an IDA-type solver.
+"""
+import numpy as np
+import scipy.sparse as sprs
+import scipy.sparse.linalg as splinalg
+
+
+MAX_ORDER = 5
+NEWTON_MAXITER = 4
+MIN_FACTOR = 0.2
+MAX_FACTOR = 10
+EPS = np.finfo(float).eps
+
+
+def rms_norm(x):
+    """Root mean square norm of a vector."""
+    return np.linalg.norm(x) / np.sqrt(x.size)
+
+
+def color_columns(sparsity):
+    """
+    Group the columns of a sparsity pattern such that no two columns in the same
+    group have a nonzero in the same row (greedy graph coloring). All columns of a
+    group can then be perturbed at once when computing a finite difference Jacobian.
+
+    :param sparsity: (n, n) sparse matrix with the nonzero pattern
+    :return: array with the group of each column, number of groups
+    """
+    pattern = sprs.csc_matrix(sparsity)
+    pattern_rows = sprs.csr_matrix(sparsity)
+    n = pattern.shape[1]
+    groups = np.full(n, -1, dtype=int)
+    ngroups = 0
+    for col in range(n):
+        rows = pattern.indices[pattern.indptr[col]:pattern.indptr[col+1]]
+        # groups of all columns that share a row with this column
+        neighbours = np.concatenate([pattern_rows.indices[pattern_rows.indptr[row]:
+                                                          pattern_rows.indptr[row+1]]
+                                     for row in rows]) if len(rows) else np.empty(0, int)
+        used = np.zeros(ngroups + 1, dtype=bool)
+        taken = groups[neighbours]
+        used[taken[taken >= 0]] = True
+        group = np.argmin(used)
+        groups[col] = group
+        ngroups = max(ngroups, group + 1)
+    return groups, ngroups
+
+
+class FiniteDifferenceJacobian:
+    """
+    Sparse Jacobian of f(t, y) with respect to y by forward differences, perturbing all
+    columns of a group (see :func:`color_columns`) at once. Rows with known (analytic)
+    derivatives can be excluded from the pattern and added by the caller.
+
+    :param sparsity: (n, n) sparse matrix with the nonzero pattern of the Jacobian
+    """
+    def __init__(self, sparsity):
+        pattern = sprs.coo_matrix(sparsity)
+        order = np.lexsort((pattern.row, pattern.col))
+        self.rows = pattern.row[order]
+        self.cols = pattern.col[order]
+        self.shape = pattern.shape
+        self.groups, self.ngroups = color_columns(sparsity)
+        entry_groups = self.groups[self.cols]
+        self.group_entries = [np.nonzero(entry_groups == g)[0] for g in range(self.ngroups)]
+        self.group_columns = [np.nonzero(self.groups == g)[0] for g in range(self.ngroups)]
+
+    def __call__(self, fun, t, y, f0):
+        h = np.sqrt(EPS) * np.maximum(np.abs(y), 1.)
+        # use exactly representable steps
+        h = (y + h) - y
+        data = np.empty(len(self.rows))
+        for entries, columns in zip(self.group_entries, self.group_columns):
+            y_pert = y.copy()
+            y_pert[columns] += h[columns]
+            df = fun(t, y_pert) - f0
+            if not np.all(np.isfinite(df[self.rows[entries]])):
+                # the step left the domain of the functions, use a backward difference
+                y_pert[columns] = y[columns] - h[columns]
+                df = f0 - fun(t, y_pert)
+            data[entries] = df[self.rows[entries]] / h[self.cols[entries]]
+        return sprs.csc_matrix((data, (self.rows, self.cols)), shape=self.shape)
+
+
+def compute_R(order, factor):
+    """Matrix to change the differences array to a new step size."""
+    ind = np.arange(1, order + 1)[:, None]
+    jnd = np.arange(1, order + 1)
+    M = np.zeros((order + 1, order + 1))
+    M[1:, 1:] = (ind - 1 - factor * jnd) / ind
+    M[0] = 1
+    return np.cumprod(M, axis=0)
+
+
+def change_D(D, order, factor):
+    """Change the differences array in-place when the step size is changed."""
+    R = compute_R(order, factor)
+    U = compute_R(order, 1)
+    RU = R.dot(U)
+    D[:order + 1] = np.dot(RU.T, D[:order + 1])
+
+
+class BDF:
+    """
+    Variable order (1 to 5), variable step BDF integrator for ``M y' = f(t, y)``.
+
+    :param callable fun: f(t, y)
+    :param callable jac: jac(t, y, f) returning the sparse Jacobian df/dy
+    :param mass: sparse (n, n) mass matrix
+    :param float t0: initial time
+    :param ndarray y0: consistent initial values
+    :param ndarray ydot0: consistent initial time derivatives
+    :param float rtol: relative tolerance
+    :param atol: absolute tolerance, scalar or per variable
+    :param float first_step: initial step size, estimated from ydot0 if not given
+    """
+    def __init__(self, fun, jac, mass, t0, y0, ydot0, rtol, atol, first_step=None):
+        self.fun = fun
+        self.jac = jac
+        self.M = sprs.csc_matrix(mass)
+        self.t = t0
+        self.t_old = None
+        self.y = np.array(y0, dtype=float)
+        self.n = len(self.y)
+        self.rtol = rtol
+        self.atol = np.broadcast_to(atol, (self.n,)).astype(float)
+        self.newton_tol = max(10 * EPS / rtol, min(0.03, rtol ** 0.5))
+        # statistics
+        self.nfev = 0
+        self.njev = 0
+        self.nlu = 0
+        self.nsteps = 0
+        self.nfailed = 0
+
+        if first_step is None:
+            scale = self.atol + rtol * np.abs(self.y)
+            d1 = rms_norm(ydot0 / scale)
+            first_step = 0.01 / d1 if d1 > 1e-5 else 1e-6
+        self.h_abs = first_step
+
+        kappa = np.array([0, -0.1850, -1/9, -0.0823, -0.0415, 0])
+        self.gamma = np.hstack((0, np.cumsum(1 / np.arange(1, MAX_ORDER + 1))))
+        self.alpha = (1 - kappa) * self.gamma
+        self.error_const = kappa * self.gamma + 1 / np.arange(1, MAX_ORDER + 2)
+
+        self.D = np.zeros((MAX_ORDER + 3, self.n))
+        self.D[0] = self.y
+        self.D[1] = ydot0 * self.h_abs
+        self.order = 1
+        self.n_equal_steps = 0
+        self.J = self._jac(self.t, self.y)
+        self.LU = None
+
+    def _fun(self, t, y):
+        self.nfev += 1
+        return self.fun(t, y)
+
+    def _jac(self, t, y):
+        self.njev += 1
+        return sprs.csc_matrix(self.jac(t, y, self._fun(t, y)))
+
+    def _lu(self, A):
+        """LU factorization of the iteration matrix, None if it is singular or not finite."""
+        self.nlu += 1
+        A = sprs.csc_matrix(A)
+        if not np.all(np.isfinite(A.data)):
+            return None
+        try:
+            return splinalg.splu(A)
+        except RuntimeError:
+            return None
+
+    def _solve_newton(self, t_new, y_predict, c, psi, LU, scale):
+        """Solve M (d + psi) = c f(t_new, y_predict + d) with a simplified Newton method."""
+        d = np.zeros(self.n)
+        y = y_predict.copy()
+        M_psi = self.M @ psi
+        dy_norm_old = None
+        converged = False
+        for k in range(NEWTON_MAXITER):
+            f = self._fun(t_new, y)
+            if not np.all(np.isfinite(f)):
+                break
+            dy = LU.solve(c * f - M_psi - self.M @ d)
+            # maximum norm: with many variables, a single slowly converging (e.g.
+            # algebraic) variable would not show in the rms norm
+            dy_norm = np.max(np.abs(dy / scale))
+            if dy_norm <= 1e-4 * self.newton_tol:
+                # updates at the level of round-off errors (e.g. at steady state)
+                y += dy
+                d += dy
+                converged = True
+                break
+            rate = None if dy_norm_old is None else dy_norm / dy_norm_old
+            if rate is not None and rate >= 1:
+                # with the maximum norm the largest update can move between
+                # variables, so only corrections above the tolerance diverge
+                if dy_norm > self.newton_tol:
+                    break
+            elif (rate is not None and rate ** (NEWTON_MAXITER - k)
+                  / (1 - rate) * dy_norm > self.newton_tol):
+                break
+            y += dy
+            d += dy
+            if rate is None:
+                converged = dy_norm == 0
+            elif rate < 1:
+                converged = rate / (1 - rate) * dy_norm < self.newton_tol
+            else:
+                # no contraction, but the corrections are far below the tolerance:
+                # the iteration reached its round-off floor
+                converged = dy_norm <= 1e-2 * self.newton_tol
+            if converged:
+                break
+            dy_norm_old = dy_norm
+        return converged, k + 1, y, d
+
+    def step(self, t_bound):
+        """
+        Advance the solution by a single step, without passing t_bound.
+
+        :return: True if the step succeeded, False if the step size became too small
+        """
+        t = self.t
+        D = self.D
+        min_step = 10 * np.abs(np.nextafter(t, np.inf) - t)
+        if self.h_abs < min_step:
+            change_D(D, self.order, min_step / self.h_abs)
+            self.h_abs = min_step
+            self.n_equal_steps = 0
+            self.LU = None
+        h_abs = self.h_abs
+        order = self.order
+        J = self.J
+        LU = self.LU
+        current_jac = False
+
+        step_accepted = False
+        n_failed = 0
+        while not step_accepted:
+            if h_abs < min_step:
+                return False
+            if n_failed >= 2 and order > 1:
+                # repeated failures, e.g. close to a singularity: fall back to order 1
+                # (the differences of the lower orders remain valid), as IDA does
+                order = 1
+                LU = None
+            t_new = t + h_abs
+            if t_new > t_bound:
+                t_new = t_bound
+                change_D(D, order, (t_new - t) / h_abs)
+                self.n_equal_steps = 0
+                LU = None
+            h = t_new - t
+            h_abs = h
+
+            y_predict = np.sum(D[:order + 1], axis=0)
+            scale = self.atol + self.rtol * np.abs(y_predict)
+            psi = np.dot(D[1:order + 1].T, self.gamma[1:order + 1]) / self.alpha[order]
+            c = h / self.alpha[order]
+
+            converged = False
+            while not converged:
+                if LU is None:
+                    LU = self._lu(self.M - c * J)
+                if LU is not None:
+                    converged, n_iter, y_new, d = self._solve_newton(
+                        t_new, y_predict, c, psi, LU, scale)
+                if not converged:
+                    if current_jac:
+                        break
+                    J = self._jac(t_new, y_predict)
+                    if not np.all(np.isfinite(J.data)):
+                        # the predictor left the domain of the model functions
+                        J = self._jac(t, self.y)
+                    LU = None
+                    current_jac = True
+
+            if not converged:
+                self.nfailed += 1
+                n_failed += 1
+                factor = 0.5
+                h_abs *= factor
+                change_D(D, order, factor)
+                self.n_equal_steps = 0
+                LU = None
+                continue
+
+            safety = 0.9 * (2 * NEWTON_MAXITER + 1) / (2 * NEWTON_MAXITER + n_iter)
+            scale = self.atol + self.rtol * np.abs(y_new)
+            error_norm = rms_norm(self.error_const[order] * d / scale)
+            if error_norm > 1:
+                self.nfailed += 1
+                n_failed += 1
+                factor = max(MIN_FACTOR, safety * error_norm ** (-1 / (order + 1)))
+                h_abs *= factor
+                change_D(D, order, factor)
+                self.n_equal_steps = 0
+                # Unlike for ODEs, the factorization has to match the new step size:
+                # the algebraic rows of M - c J scale with c
+                LU = None
+            else:
+                step_accepted = True
+
+        self.nsteps += 1
+        self.n_equal_steps += 1
+        self.t_old = t
+        self.t = t_new
+        self.y = y_new
+        self.h_abs = h_abs
+        self.order = order
+        self.J = J
+        self.LU = LU
+
+        # Update the differences, d is the difference of order + 1 of the new solution
+        D[order + 2] = d - D[order + 1]
+        D[order + 1] = d
+        for i in reversed(range(order + 1)):
+            D[i] += D[i + 1]
+        self.dense = self._dense_output()
+
+        if self.n_equal_steps < order + 1:
+            return True
+
+        if order > 1:
+            error_m_norm = rms_norm(self.error_const[order - 1] * D[order] / scale)
+        else:
+            error_m_norm = np.inf
+        if order < MAX_ORDER:
+            error_p_norm = rms_norm(self.error_const[order + 1] * D[order + 2] / scale)
+        else:
+            error_p_norm = np.inf
+        error_norms = np.array([error_m_norm, error_norm, error_p_norm])
+        with np.errstate(divide='ignore'):
+            factors = error_norms ** (-1 / np.arange(order, order + 3))
+        self.order = order + np.argmax(factors) - 1
+        factor = min(MAX_FACTOR, safety * np.max(factors))
+        self.h_abs *= factor
+        change_D(D, self.order, factor)
+        self.n_equal_steps = 0
+        self.LU = None
+        return True
+
+    def _dense_output(self):
+        """Interpolating polynomial of the last step, valid on [t_old, t]."""
+        order = self.order
+        h = self.t - self.t_old
+        t_shift = self.t - h * np.arange(order)
+        denom = h * (1 + np.arange(order))
+        D = self.D[:order + 1].copy()
+
+        def interpolate(t):
+            p = np.cumprod((t - t_shift) / denom)
+            return D[0] + np.dot(D[1:].T, p)
+        return interpolate
@@ -0,0 +1,1140 @@
+"""Simulation of the cell model with NumPy and SciPy instead of daetools models.
+
+The residual of the equations of :mod:`mpet.mod_cell` and :mod:`mpet.mod_electrodes` is
+assembled with vectorized array operations over all electrolyte volumes and particles,
+rather than as an expression tree per element. The Jacobian is assembled analytically
+from the structure of the equations, with the derivatives of the material functions
+(chemical potentials, reaction rates, diffusivities and electrolyte properties) by
+central differences of those functions. Only the equations of particles with a
+chemical potential that depends on the whole particle (e.g. with gradient energy
+terms) are differentiated by finite differences of groups of structurally independent
+columns. The system is integrated with the mass matrix BDF method of
+:mod:`mpet.backends.integrator`.
+
+The backend reads the same config and writes the same output file as the daetools
+simulation. It supports the CC, CV, CP and (ramped) CCsegments/CVsegments profiles,
+homog, homog_sdn, diffn, CHR and ACR particles (with noise) and the dilute and SM
+electrolyte models. Other configurations raise a NotImplementedError, use the daetools
+backend for those.
+"""
+import os.path as osp
+import sys
+
+import h5py
+import numpy as np
+import scipy.interpolate as sintrp
+import scipy.optimize as sopt
+import scipy.sparse as sprs
+import scipy.sparse.linalg as splinalg
+
+import mpet.geometry as geom
+import mpet.model_funcs as model_funcs
+import mpet.output_data as output_data
+import mpet.props_am as props_am
+import mpet.props_elyte as props_elyte
+import mpet.tabulation as tabulation
+import mpet.utils as utils
+from mpet.backends.integrator import BDF, FiniteDifferenceJacobian, rms_norm
+
+#: Particle types supported by this backend
+PARTICLE_TYPES = ["homog", "homog_sdn", "diffn", "CHR", "ACR"]
+
+#: Reactions that are written in terms of daetools functions
+DAE_REACTIONS = ["Marcus"]
+
+#: Absolute tolerance of variables without a daetools variable type (dae.no_t)
+NO_T_ABSTOL = 1e-5
+
+#: Relative step of the central differences of the material functions
+DIFF_STEP = np.finfo(float).eps**(1/3)
+
+
+def check_supported(config):
+    """Raise a NotImplementedError if the config uses features that are not implemented
+    in this backend."""
+    unsupported = []
+    if config["profileType"] == "CCCVCPcycle":
+        unsupported.append("profileType CCCVCPcycle")
+    if config["profileType"] in ["CCsegments", "CVsegments"] and config["tramp"] <= 0:
+        unsupported.append("segments without ramp (tramp = 0)")
+    if config["linearSolver"] != "SuperLU":
+        unsupported.append("linearSolver {}".format(config["linearSolver"]))
+    if config["checkpointWallTime"] > 0 or config["checkpointSimTime"] > 0:
+        unsupported.append("checkpoints")
+    if config["elyteModelType"] == "solid":
+        unsupported.append("elyteModelType solid")
+    if config["localized_losses"]:
+        unsupported.append("localized_losses")
+    for trode in config["trodes"]:
+        if config[trode, "type"] not in PARTICLE_TYPES:
+            unsupported.append("particle type {}".format(config[trode, "type"]))
+        if config[trode, "rxnType"] in DAE_REACTIONS:
+            unsupported.append("rxnType {}".format(config[trode, "rxnType"]))
+        if config[f"simInterface_{trode}"]:
+            unsupported.append("simInterface")
+    if unsupported:
+        raise NotImplementedError("The numpy backend does not support "
+                                  + ", ".join(sorted(set(unsupported)))
+                                  + ", use backend = daetools instead")
+
+
+def derivative(func, x, h, *args):
+    """Derivative of an elementwise function func(x, *args) by central differences with
+    steps h."""
+    return (func(x + h, *args) - func(x - h, *args))/(2*h)
+
+
+def filling_step(c):
+    """Steps of central differences at filling fractions c, which remain in (0, 1)."""
+    return DIFF_STEP*np.minimum(np.abs(c), np.abs(1 - c))
+
+
+class ParticleGroup:
+    """Particles of one electrode with the same number of grid points. Their
+    concentrations form one (particles, N) block of the state vector, so that the
+    particle equations are evaluated for all particles of the group at once.
+
+    :param Config config: the simulation config
+    :param str trode: electrode, a or c
+    :param int N: number of grid points of each particle
+    :param list inds: (vInd, pInd) of the particles
+    """
+    def __init__(self, config, trode, N, inds):
+        self.trode = trode
+        self.N = N
+        self.inds = inds
+        self.type = config[trode, "type"]
+        self.vInd = np.array([ind[0] for ind in inds])
+        self.pInd = np.array([ind[1] for ind in inds])
+        params = [config.get_particle_params(trode, ind) for ind in inds]
+        for item in ["k0", "E_A", "Rfilm", "delta_L", "D", "E_D"]:
+            setattr(self, item, np.array([p[item] for p in params], dtype=float))
+        self.template = model_funcs.get_particle_template(config, params[0])
+        self.lmbda = config[trode, "lambda"]
+        self.alpha = config[trode, "alpha"]
+
+        # ACR particles react at every grid point, other particles at the surface
+        if self.type == "ACR":
+            self.nR = N
+            self.surf = slice(0, N)
+        else:
+            self.nR = 1
+            self.surf = slice(N - 1, N)
+        # the chemical potential is needed at every grid point or only at the surface
+        self.full_muR = self.type in ["CHR", "ACR"]
+
+        # Rate of filling per reaction rate, as (particles, nR). For 1D particles, the
+        # interior fluxes conserve mass and volfrac_vec.M^-1 is uniform, so that
+        # dcbardt = volfrac_vec.M^-1.RHS only depends on the flux at the surface.
+        if self.type == "ACR":
+            self.rxn_to_dcbardt = self.delta_L[:, None]*self.template.volfrac_vec
+        elif N == 1:
+            self.rxn_to_dcbardt = self.delta_L[:, None]
+        else:
+            w = splinalg.spsolve(sprs.csc_matrix(self.template.Mmat.T),
+                                 self.template.volfrac_vec)
+            self.rxn_to_dcbardt = np.full((len(inds), 1), w[-1]*self.template.area_vec[-1])
+
+        # Particles with the same parameters share their material functions. Materials
+        # with a local chemical potential are evaluated for all of these particles at
+        # once, others (e.g. with gradient terms) per particle.
+        rows = {}
+        for row, p in enumerate(params):
+            rows.setdefault(p.particle_values, []).append(row)
+        self.muR_groups = []
+        for group_rows in rows.values():
+            funcs = props_am.get_muRfuncs(config, trode, inds[group_rows[0]],
+                                          params[group_rows[0]])
+            if config[trode, "muRfunc_tabulate"]:
+                kind = "table"
+            elif tabulation.muRfunc_is_local(funcs):
+                kind = "local"
+            else:
+                kind = "particle"
+            self.muR_groups.append((funcs, np.array(group_rows), kind))
+        # The equations of particles with a local chemical potential have an analytic
+        # Jacobian, the others are differentiated by finite differences
+        self.local = all(kind != "particle" for _, _, kind in self.muR_groups)
+        self.noise = None
+
+    def set_noise(self, tvec, noise_data):
+        """Noise of each particle, interpolated in time like in mod_electrodes.
+
+        :param tvec: times of the noise data
+        :param noise_data: (len(tvec), particles, N) array
+        """
+        self.noise = sintrp.interp1d(tvec, noise_data, axis=0, bounds_error=False,
+                                     fill_value=0.)
+
+    def get_noise(self, t):
+        """Noise of all particles at time t as (particles, N) array, None without noise"""
+        return None if self.noise is None else self.noise(t)
+
+    def calc_muR(self, c, cbar, muR_ref, full=True):
+        """Chemical potential and activity (None if not defined by the material) of all
+        particles of the group, as (particles, N) arrays, or at the surface of each
+        particle only (as (particles, 1) arrays) if not full."""
+        shape = c.shape if full else (c.shape[0], 1)
+        muR = np.empty(shape)
+        actR = None
+        for funcs, rows, kind in self.muR_groups:
+            if kind == "particle":
+                values = [funcs.muRfunc(c[row], cbar[row], muR_ref) for row in rows]
+                muR_rows = np.array([value[0] for value in values], dtype=float)
+                actR_rows = None
+                if values[0][1] is not None:
+                    actR_rows = np.array([value[1] for value in values], dtype=float)
+                if not full:
+                    muR_rows = muR_rows[:, -1:]
+                    actR_rows = None if actR_rows is None else actR_rows[:, -1:]
+            else:
+                y = c[rows] if full else c[rows, -1:]
+                if kind == "table":
+                    muR_table, actR_table = funcs.get_muR_tables()
+                    muR_rows = muR_table(y) + np.ravel(muR_ref)[0]
+                    actR_rows = None if actR_table is None else actR_table(y)
+                else:
+                    ybar = np.broadcast_to(cbar[rows, None], y.shape)
+                    muR_rows, actR_rows = funcs.muRfunc(y.ravel(), ybar.ravel(), muR_ref)
+                    muR_rows = np.broadcast_to(muR_rows, y.size).reshape(y.shape)
+                    if actR_rows is not None:
+                        actR_rows = np.broadcast_to(actR_rows, y.size).reshape(y.shape)
+            muR[rows] = muR_rows
+            if actR_rows is not None:
+                if actR is None:
+                    actR = np.empty(shape)
+                actR[rows] = actR_rows
+        return muR, actR
+
+    def surface(self, values):
+        """Values at the reacting grid points of (particles, N) values of calc_muR, as
+        (particles, nR) array."""
+        if values is None or not self.full_muR:
+            return values
+        return values[:, self.surf]
+
+    def calc_rxn_rate(self, eta, c_sld, c_lyte, T, actR, act_lyte):
+        """Reaction rates of all particles, as (particles, nR) array"""
+        return self.template.calc_rxn_rate(
+            eta, c_sld, c_lyte, self.k0[:, None], self.E_A[:, None], T, actR, act_lyte,
+            self.lmbda, self.alpha)
+
+
+class Triplets:
+    """Entries of a sparse matrix, collected as arrays of rows, columns and values."""
+    def __init__(self):
+        self.rows, self.cols, self.data = [], [], []
+
+    def add(self, rows, cols, values):
+        """Add entries, rows, cols and values are broadcast to the same shape."""
+        rows, cols, values = np.broadcast_arrays(rows, cols, values)
+        self.rows.append(rows.ravel())
+        self.cols.append(cols.ravel())
+        self.data.append(values.ravel())
+
+    def add_matrix(self, rows, matrix, scale=1.):
+        """Add scale times a sparse matrix, with its rows placed at rows."""
+        matrix = sprs.coo_matrix(matrix)
+        self.add(np.asarray(rows)[matrix.row], matrix.col, scale*matrix.data)
+
+    def tocsc(self, shape):
+        """Sparse matrix of the entries, entries at the same position are summed."""
+        return sprs.csc_matrix((np.concatenate(self.data),
+                                (np.concatenate(self.rows), np.concatenate(self.cols))),
+                               shape=shape)
+
+
+class CellModel:
+    """Residual, mass matrix and Jacobian of the cell model of :mod:`mpet.mod_cell`, in the
+    form M dy/dt = f(t, y).
+
+    The state vector holds the electrolyte concentration and potential (with the ghost
+    points of the left boundary), the potentials of the electrode bulk and the particles,
+    the reaction rates and concentrations of the particles per ParticleGroup, and the
+    current and applied potential. Each equation is stored at the index of the variable
+    it determines. phi_cell, R_Vp, ffrac, cbar and dcbardt are not part of the state,
+    they are calculated from it for the output.
+
+    :param Config config: the simulation config
+    """
+    def __init__(self, config):
+        check_supported(config)
+        self.config = config
+        self.trodes = trodes = config["trodes"]
+        Nvol, Npart = config["Nvol"], config["Npart"]
+        self.SVsim = 'a' not in trodes and not Nvol["s"] and Nvol["c"] == 1
+        self.Nlyte = int(np.sum(list(Nvol.values())))
+        # index of the first electrolyte volume of each section of the cell
+        Na = Nvol["a"] if "a" in Nvol else 0
+        self.lyte_start = {"a": 0, "s": Na, "c": Na + Nvol["s"]}
+
+        # Layout of the state vector
+        self.size = 0
+        self.i_c_lyte = self._allocate(self.Nlyte)
+        self.i_phi_lyte = self._allocate(self.Nlyte)
+        if not self.SVsim:
+            self.i_c_lyteGP, self.i_phi_lyteGP = self._allocate(2)
+        self.i_phi_bulk = {}
+        self.i_phi_part = {}
+        for trode in trodes:
+            self.i_phi_bulk[trode] = self._allocate(Nvol[trode])
+            self.i_phi_part[trode] = self._allocate(Nvol[trode]*Npart[trode]).reshape(
+                Nvol[trode], Npart[trode])
+        self.groups = []
+        for trode in trodes:
+            psd_num = config["psd_num"][trode]
+            inds = {}
+            for ind in np.ndindex(psd_num.shape):
+                inds.setdefault(int(psd_num[ind]), []).append(ind)
+            for N, group_inds in inds.items():
+                group = ParticleGroup(config, trode, N, group_inds)
+                group.i_Rxn = self._allocate(len(group_inds)*group.nR).reshape(-1, group.nR)
+                group.i_c = self._allocate(len(group_inds)*N).reshape(-1, N)
+                group.i_phi_part = self.i_phi_part[trode][group.vInd, group.pInd]
+                group.i_lyte = self.lyte_start[trode] + group.vInd
+                self.groups.append(group)
+            if config[trode, "noise"]:
+                self.set_noise(trode)
+        self.i_current, self.i_phi_applied = self._allocate(2)
+
+        # Electrolyte discretization
+        if np.all(config["specified_poros"]["c"]):
+            config_poros = config["specified_poros"]
+        else:
+            config_poros = config["poros"]
+        disc = geom.get_elyte_disc(Nvol, config["L"], config_poros, config["BruggExp"])
+        self.disc = {key: np.asarray(value, dtype=float) for key, value in disc.items()}
+
+        # The rates of filling of the particles (as (Nvol, Npart) raveled) and R_Vp of the
+        # electrode volumes are linear in the reaction rates
+        self.dcbardt_matrix = {}
+        self.R_Vp_matrix = {}
+        for trode in trodes:
+            rows, cols, data = [], [], []
+            for group in self.groups:
+                if group.trode == trode:
+                    particles = np.ravel_multi_index((group.vInd, group.pInd),
+                                                     (Nvol[trode], Npart[trode]))
+                    rows.append(np.repeat(particles, group.nR))
+                    cols.append(group.i_Rxn.ravel())
+                    data.append(group.rxn_to_dcbardt.ravel())
+            self.dcbardt_matrix[trode] = sprs.csr_matrix(
+                (np.concatenate(data), (np.concatenate(rows), np.concatenate(cols))),
+                shape=(Nvol[trode]*Npart[trode], self.size))
+            weights = -(config["beta"][trode] * (1-config["poros"][trode])
+                        * config["P_L"][trode] * config["psd_vol_FracVol"][trode])
+            volumes = sprs.csr_matrix(
+                (np.ravel(weights), (np.repeat(np.arange(Nvol[trode]), Npart[trode]),
+                                     np.arange(Nvol[trode]*Npart[trode]))),
+                shape=(Nvol[trode], Nvol[trode]*Npart[trode]))
+            self.R_Vp_matrix[trode] = sprs.csr_matrix(volumes @ self.dcbardt_matrix[trode])
+
+        # Conductivity of the bulk electrode at the volume walls
+        self.poros_walls = {}
+        for trode in trodes:
+            porosvec = np.full(Nvol[trode] + 2, (1-config["poros"][trode])
+                               ** (1-config["BruggExp"][trode]))
+            if np.all(config['specified_poros'][trode]):
+                specified_por = config['specified_poros'][trode]
+                porosvec = utils.pad_vec((1 - specified_por)**(1 - config["BruggExp"][trode]))
+            self.poros_walls[trode] = np.asarray(
+                utils.mean_harmonic(np.asarray(porosvec, dtype=float)), dtype=float)
+
+        # Segments profiles start from the previous current or voltage
+        self.segments_setvec = np.array(config["segments_setvec"], dtype=float)
+        if config["profileType"] == "CCsegments":
+            self.segments_setvec[0] = config["currPrev"]
+        elif config["profileType"] == "CVsegments":
+            self.segments_setvec[0] = config["phiPrev"]
+
+        self.mass = self.get_mass_matrix()
+        mass_csc = sprs.csc_matrix(self.mass)
+        self.differential = np.unique(mass_csc.nonzero()[1])
+        self.algebraic = np.setdiff1d(np.arange(self.size), self.differential)
+        self.current_row = self.get_current_row()
+        sparsity = self.get_sparsity()
+        self.fd_jacobian = None if sparsity is None else FiniteDifferenceJacobian(sparsity)
+
+    def _allocate(self, size):
+        """Reserve the next size entries of the state vector, returns their indices."""
+        indices = np.arange(self.size, self.size + size)
+        self.size += size
+        return indices
+
+    def set_noise(self, trode):
+        """Draw the noise of the particles of an electrode, per particle in the order in
+        which mod_cell creates the particle models, like Mod1var does."""
+        config = self.config
+        numnoise = config[trode, "numnoise"]
+        tvec = np.linspace(0., 1.05*config["tend"], numnoise)
+        psd_num = config["psd_num"][trode]
+        noise_prefac = config[trode, "noise_prefac"]
+        noise_data = {ind: noise_prefac*np.random.randn(numnoise, int(psd_num[ind]))
+                      for ind in np.ndindex(psd_num.shape)}
+        for group in self.groups:
+            if group.trode == trode:
+                group.set_noise(tvec, np.stack([noise_data[ind] for ind in group.inds],
+                                               axis=1))
+
+    def particle_state(self, group, y):
+        """Concentrations, reaction rates and the electrolyte and particle potentials of
+        the particles of a group, with the latter as (particles, 1) arrays."""
+        c_lyte = y[self.i_c_lyte[group.i_lyte]][:, None]
+        phi_lyte = y[self.i_phi_lyte[group.i_lyte]][:, None]
+        phi_part = y[group.i_phi_part][:, None]
+        return y[group.i_c], y[group.i_Rxn], c_lyte, phi_lyte, phi_part
+
+    def residual(self, t, y):
+        """Right hand side f(t, y) of M dy/dt = f(t, y)."""
+        config = self.config
+        T = config["T"]
+        f = np.empty(self.size)
+        current = y[self.i_current]
+        phi_applied = y[self.i_phi_applied]
+        phi_cell = phi_applied - config["Rser"]*current
+        c_lyte = y[self.i_c_lyte]
+        phi_lyte = y[self.i_phi_lyte]
+
+        # Particles
+        for group in self.groups:
+            trode = group.trode
+            c, Rxn, c_l, phi_l, phi_m = self.particle_state(group, y)
+            noise = group.get_noise(t)
+            mu_O, act_lyte = model_funcs.calc_mu_O(c_l, phi_l, phi_m, T, config, trode)
+            cbar = c @ group.template.volfrac_vec
+            muR, actR = group.calc_muR(c, cbar, config[trode, "muR_ref"],
+                                       full=group.full_muR)
+            eta_eff = model_funcs.calc_eta(group.surface(muR), mu_O) \
+                + Rxn*group.Rfilm[:, None]
+            if noise is not None and group.N == 1:
+                eta_eff = eta_eff + noise
+            rate = group.calc_rxn_rate(eta_eff, c[:, group.surf], c_l, T, group.surface(actR),
+                                       act_lyte)
+            f[group.i_Rxn] = Rxn - rate
+            if group.N == 1 or group.type == "ACR":
+                f[group.i_c] = group.delta_L[:, None]*Rxn
+            else:
+                f[group.i_c] = self.particle_rhs(group, c, muR, Rxn[:, 0], noise)
+
+        R_Vp = {trode: self.R_Vp_matrix[trode] @ y for trode in self.trodes}
+
+        # Electrolyte
+        if self.SVsim:
+            f[self.i_c_lyte] = 0.
+            f[self.i_phi_lyte] = phi_lyte - phi_cell
+        else:
+            disc = self.disc
+            ctmp = np.hstack((y[self.i_c_lyteGP], c_lyte, c_lyte[-1]))
+            phitmp = np.hstack((y[self.i_phi_lyteGP], phi_lyte, phi_lyte[-1]))
+            Nm_edges, i_edges = model_funcs.get_lyte_internal_fluxes(ctmp, phitmp, disc, config)
+            Nm_edges = np.asarray(Nm_edges, dtype=float)
+            i_edges = np.asarray(i_edges, dtype=float)
+            if 'a' not in self.trodes:
+                # Li foil: mass flux and BV kinetics at the foil
+                f[self.i_c_lyteGP] = Nm_edges[0]
+                cWall = .5*(ctmp[0] + ctmp[1])
+                ecd = config["k0_foil"]*cWall**0.5
+                eta = phi_cell - current*config["Rfilm_foil"] - .5*(phitmp[0] + phitmp[1])
+                if config["elyteModelType"] == "dilute":
+                    eta -= T*np.log(cWall)
+                f[self.i_phi_lyteGP] = current - ecd*2*np.sinh(eta/2)
+            else:
+                # porous anode: no flux through the current collector
+                f[self.i_c_lyteGP] = ctmp[0] - ctmp[1]
+                f[self.i_phi_lyteGP] = phitmp[0] - phitmp[1]
+            Rvvec = np.zeros(self.Nlyte)
+            for trode in self.trodes:
+                start = self.lyte_start[trode]
+                Rvvec[start:start + len(R_Vp[trode])] = R_Vp[trode]
+            f[self.i_c_lyte] = -(1./config["num"])*np.diff(Nm_edges)/disc["dxvec"]
+            f[self.i_phi_lyte] = -np.diff(i_edges)/disc["dxvec"] + config["zp"]*Rvvec
+
+        # Potential drop along the electrodes and between particles
+        for trode in self.trodes:
+            phi_bulk = y[self.i_phi_bulk[trode]]
+            if config['simBulkCond'][trode]:
+                phi_tmp = np.hstack((0., phi_bulk, 0.))
+                if trode == "a":
+                    phi_tmp[0] = phi_cell
+                    phi_tmp[-1] = phi_tmp[-2]
+                else:
+                    phi_tmp[0] = phi_tmp[1]
+                    phi_tmp[-1] = config["phi_cathode"]
+                dx = config["L"][trode]/config["Nvol"][trode]
+                dvg_curr_dens = np.diff(-self.poros_walls[trode]*config["sigma_s"][trode]
+                                        * np.diff(phi_tmp)/dx)/dx
+                f[self.i_phi_bulk[trode]] = -dvg_curr_dens - R_Vp[trode]
+            elif trode == "a":
+                f[self.i_phi_bulk[trode]] = phi_bulk - phi_cell
+            else:
+                f[self.i_phi_bulk[trode]] = phi_bulk - config["phi_cathode"]
+
+            phi_part = y[self.i_phi_part[trode]]
+            if config['simPartCond'][trode]:
+                G = config["G"][trode]
+                dcbardt = (self.dcbardt_matrix[trode] @ y).reshape(phi_part.shape)
+                phi_l = np.hstack((phi_bulk[:, None], phi_part[:, :-1]))
+                phi_r = np.hstack((phi_part[:, 1:], phi_part[:, -1:]))
+                G_r = np.hstack((G[:, 1:], np.zeros((G.shape[0], 1))))
+                # -dcsbar/dt = I_l - I_r
+                f[self.i_phi_part[trode]] = (dcbardt + ((-G*(phi_part - phi_l))
+                                                        - (-G_r*(phi_r - phi_part))))
+            else:
+                f[self.i_phi_part[trode]] = phi_part - phi_bulk[:, None]
+
+        # Total current, defined at the capacity limiting electrode
+        f[self.i_current] = (self.current_row @ y)[0]
+        f[self.i_phi_applied] = self.profile_residual(t, current, phi_applied)
+        return f
+
+    def particle_driving_force(self, group, c, muR, noise):
+        """Quantity of which the gradient drives the interior fluxes of 1D particles: the
+        concentration (diffn) or muR/T (CHR), with the noise of the particles."""
+        if group.type == "diffn":
+            return c if noise is None else c + noise
+        T = self.config["T"]
+        return muR/T if noise is None else (muR + noise)/T
+
+    def particle_prefactor(self, group, c_edges):
+        """Diffusivity prefactor of the interior fluxes of 1D particles at the edges"""
+        T = self.config["T"]
+        return (group.D*np.exp(-group.E_D/T + group.E_D/1))[:, None] \
+            * group.template.Dfunc(c_edges)
+
+    def particle_rhs(self, group, c, muR, Rxn, noise=None):
+        """Right hand side of the mass matrix equations of 1D particles, calc_flux_diffn
+        and calc_flux_CHR of mod_electrodes for all particles of a group."""
+        template = group.template
+        c_edges = utils.mean_linear(c.T).T
+        Flux_int = -self.particle_prefactor(group, c_edges) * np.diff(
+            self.particle_driving_force(group, c, muR, noise), axis=1)/template.dr
+        # Symmetry at r=0, reaction at the surface
+        Flux_vec = np.hstack((np.zeros((len(Rxn), 1)), Flux_int, -Rxn[:, None]))
+        return -np.diff(Flux_vec*template.area_vec, axis=1)
+
+    def profile_residual(self, t, current, phi_applied):
+        """Residual of the current, voltage or power specification."""
+        config = self.config
+        profileType = config["profileType"]
+        ramp = 1.
+        if config["tramp"] > 0:
+            ramp = 1 - np.exp(-t/(config["tend"]*config["tramp"]))
+        if profileType == "CC":
+            return current - (config["currPrev"]
+                              + (config["currset"] - config["currPrev"])*ramp)
+        elif profileType == "CV":
+            return phi_applied - (config["phiPrev"] + (config["Vset"] - config["phiPrev"])*ramp)
+        elif profileType == "CP":
+            ndDVref = config["c", "phiRef"]
+            if 'a' in config["trodes"]:
+                ndDVref = config["c", "phiRef"] - config["a", "phiRef"]
+            powerPrev = config["currPrev"]*(config["phiPrev"] + ndDVref)
+            return current*(phi_applied + ndDVref) - (
+                powerPrev + (config["power"] - powerPrev)*ramp)
+        setpoint = np.interp(t, config["segments_tvec"], self.segments_setvec)
+        if profileType == "CCsegments":
+            return current - setpoint
+        return phi_applied - setpoint
+
+    def get_breakpoints(self):
+        """Times at which the specified profile has a kink"""
+        if self.config["profileType"] in ["CCsegments", "CVsegments"]:
+            return np.unique(self.config["segments_tvec"][1:])
+        return np.empty(0)
+
+    def get_mass_matrix(self):
+        """Mass matrix M of M dy/dt = f(t, y)"""
+        rows, cols, data = [self.i_c_lyte], [self.i_c_lyte], []
+        if self.SVsim:
+            data.append(np.ones(self.Nlyte))
+        else:
+            data.append(self.disc["porosvec"])
+        for group in self.groups:
+            if group.N == 1:
+                rows.append(group.i_c[:, 0])
+                cols.append(group.i_c[:, 0])
+                data.append(np.ones(len(group.inds)))
+            else:
+                Mmat = sprs.coo_matrix(group.template.Mmat)
+                rows.append(group.i_c[:, Mmat.row].ravel())
+                cols.append(group.i_c[:, Mmat.col].ravel())
+                data.append(np.tile(Mmat.data, len(group.inds)))
+        return sprs.csc_matrix((np.concatenate(data), (np.concatenate(rows),
+                                                       np.concatenate(cols))),
+                               shape=(self.size, self.size))
+
+    def get_sparsity(self):
+        """Nonzero pattern of the rows of the Jacobian that are evaluated by finite
+        differences, the equations of the particles with a chemical potential that is not
+        local (see ParticleGroup). None if there are no such particles."""
+        rows, cols = [], []
+        for group in self.groups:
+            if group.local:
+                continue
+            for k in range(len(group.inds)):
+                eqs = np.hstack((group.i_Rxn[k], group.i_c[k]))
+                variables = np.hstack((eqs, group.i_phi_part[k],
+                                       self.i_c_lyte[group.i_lyte[k]],
+                                       self.i_phi_lyte[group.i_lyte[k]]))
+                rows.append(np.repeat(eqs, len(variables)))
+                cols.append(np.tile(variables, len(eqs)))
+        if not rows:
+            return None
+        rows, cols = np.concatenate(rows), np.concatenate(cols)
+        pattern = sprs.csc_matrix((np.ones(len(rows)), (rows, cols)),
+                                  shape=(self.size, self.size))
+        pattern.data[:] = 1.
+        return pattern
+
+    def get_current_row(self):
+        """The total current equation, which is linear in the current and the reaction
+        rates of the limiting electrode, as a sparse (1, size) matrix."""
+        config = self.config
+        limtrode = config["limtrode"]
+        dx = 1./config["Nvol"][limtrode]
+        rxn_scl = config["beta"][limtrode] * (1-config["poros"][limtrode]) \
+            * config["P_L"][limtrode]
+        sign = -1. if limtrode == "a" else 1.
+        R_Vp = sprs.coo_matrix(self.R_Vp_matrix[limtrode])
+        columns = np.hstack((self.i_current, R_Vp.col))
+        data = np.hstack((1., sign*dx*R_Vp.data/rxn_scl))
+        return sprs.csr_matrix((data, (np.zeros(len(columns), dtype=int), columns)),
+                               shape=(1, self.size))
+
+    def jacobian(self, t, y, f):
+        """Sparse Jacobian df/dy at (t, y), where f = f(t, y)"""
+        config = self.config
+        jac = Triplets()
+
+        def add_phi_cell(rows, values):
+            # phi_cell = phi_applied - Rser*current
+            jac.add(rows, self.i_phi_applied, values)
+            jac.add(rows, self.i_current, -config["Rser"]*np.asarray(values))
+
+        for group in self.groups:
+            if group.local:
+                self.particle_jacobian(jac, group, t, y)
+
+        # Electrolyte
+        if self.SVsim:
+            jac.add(self.i_phi_lyte, self.i_phi_lyte, 1.)
+            add_phi_cell(self.i_phi_lyte, -1.)
+        else:
+            self.lyte_jacobian(jac, y)
+            for trode in self.trodes:
+                start = self.lyte_start[trode]
+                jac.add_matrix(self.i_phi_lyte[start:start + config["Nvol"][trode]],
+                               self.R_Vp_matrix[trode], config["zp"])
+
+        # Potential drop along the electrodes and between particles
+        for trode in self.trodes:
+            i_bulk = self.i_phi_bulk[trode]
+            if config['simBulkCond'][trode]:
+                dx = config["L"][trode]/config["Nvol"][trode]
+                # coefficients of the potential differences at the walls
+                s = self.poros_walls[trode]*config["sigma_s"][trode]/dx**2
+                jac.add(i_bulk, i_bulk, -(s[:-1] + s[1:]))
+                jac.add(i_bulk[1:], i_bulk[:-1], s[1:-1])
+                jac.add(i_bulk[:-1], i_bulk[1:], s[1:-1])
+                if trode == "a":
+                    add_phi_cell(i_bulk[0], s[0])
+                    jac.add(i_bulk[-1], i_bulk[-1], s[-1])
+                else:
+                    jac.add(i_bulk[0], i_bulk[0], s[0])
+                jac.add_matrix(i_bulk, self.R_Vp_matrix[trode], -1.)
+            else:
+                jac.add(i_bulk, i_bulk, 1.)
+                if trode == "a":
+                    add_phi_cell(i_bulk, -1.)
+
+            i_part = self.i_phi_part[trode]
+            if config['simPartCond'][trode]:
+                G = config["G"][trode]
+                G_r = np.hstack((G[:, 1:], np.zeros((G.shape[0], 1))))
+                jac.add_matrix(i_part.ravel(), self.dcbardt_matrix[trode])
+                jac.add(i_part, i_part, -G - G_r)
+                jac.add(i_part[:, 0], i_bulk, G[:, 0])
+                jac.add(i_part[:, 1:], i_part[:, :-1], G[:, 1:])
+                jac.add(i_part[:, :-1], i_part[:, 1:], G_r[:, :-1])
+            else:
+                jac.add(i_part, i_part, 1.)
+                jac.add(i_part, i_bulk[:, None], -1.)
+
+        # Total current and the specified profile
+        jac.add_matrix([self.i_current], self.current_row)
+        profileType = config["profileType"]
+        if profileType in ["CC", "CCsegments"]:
+            jac.add(self.i_phi_applied, self.i_current, 1.)
+        elif profileType in ["CV", "CVsegments"]:
+            jac.add(self.i_phi_applied, self.i_phi_applied, 1.)
+        else:
+            ndDVref = config["c", "phiRef"]
+            if 'a' in config["trodes"]:
+                ndDVref = config["c", "phiRef"] - config["a", "phiRef"]
+            jac.add(self.i_phi_applied, self.i_current, y[self.i_phi_applied] + ndDVref)
+            jac.add(self.i_phi_applied, self.i_phi_applied, y[self.i_current])
+
+        J = jac.tocsc((self.size, self.size))
+        if self.fd_jacobian is not None:
+            J = J + self.fd_jacobian(self.residual, t, y, f)
+        return sprs.csc_matrix(J)
+
+    def particle_jacobian(self, jac, group, t, y):
+        """Add the derivatives of the equations of the particles of a group with a local
+        chemical potential to jac."""
+        config = self.config
+        T = config["T"]
+        trode = group.trode
+        muR_ref = config[trode, "muR_ref"]
+        c, Rxn, c_l, phi_l, phi_m = self.particle_state(group, y)
+        noise = group.get_noise(t)
+        mu_O, act_lyte = model_funcs.calc_mu_O(c_l, phi_l, phi_m, T, config, trode)
+        cbar = c @ group.template.volfrac_vec
+
+        # The local chemical potential and activity, and their derivatives
+        h = filling_step(c)
+        muR, actR = group.calc_muR(c, cbar, muR_ref, full=group.full_muR)
+        muR_p, actR_p = group.calc_muR(c + h, cbar, muR_ref, full=group.full_muR)
+        muR_m, actR_m = group.calc_muR(c - h, cbar, muR_ref, full=group.full_muR)
+        h_muR = h if group.full_muR else h[:, -1:]
+        dmuR = (muR_p - muR_m)/(2*h_muR)
+
+        # Derivatives of the reaction rates with respect to the overpotential and (with all
+        # functions of them) the concentrations in the particles and the electrolyte
+        c_surf = c[:, group.surf]
+        h_surf = h[:, group.surf]
+        muR_surf, actR_surf = group.surface(muR), group.surface(actR)
+        eta_eff = model_funcs.calc_eta(muR_surf, mu_O) + Rxn*group.Rfilm[:, None]
+        if noise is not None and group.N == 1:
+            eta_eff = eta_eff + noise
+        h_eta = DIFF_STEP*np.maximum(np.abs(eta_eff), 1.)
+        dR_deta = (group.calc_rxn_rate(eta_eff + h_eta, c_surf, c_l, T, actR_surf, act_lyte)
+                   - group.calc_rxn_rate(eta_eff - h_eta, c_surf, c_l, T, actR_surf,
+                                         act_lyte))/(2*h_eta)
+        dR_dc = (group.calc_rxn_rate(eta_eff + group.surface(muR_p) - muR_surf,
+                                     c_surf + h_surf, c_l, T, group.surface(actR_p),
+                                     act_lyte)
+                 - group.calc_rxn_rate(eta_eff + group.surface(muR_m) - muR_surf,
+                                       c_surf - h_surf, c_l, T, group.surface(actR_m),
+                                       act_lyte))/(2*h_surf)
+        h_lyte = DIFF_STEP*np.abs(c_l)
+        mu_O_p, act_lyte_p = model_funcs.calc_mu_O(c_l + h_lyte, phi_l, phi_m, T, config,
+                                                   trode)
+        mu_O_m, act_lyte_m = model_funcs.calc_mu_O(c_l - h_lyte, phi_l, phi_m, T, config,
+                                                   trode)
+        dR_dc_lyte = (group.calc_rxn_rate(eta_eff - (mu_O_p - mu_O), c_surf, c_l + h_lyte, T,
+                                          actR_surf, act_lyte_p)
+                      - group.calc_rxn_rate(eta_eff - (mu_O_m - mu_O), c_surf, c_l - h_lyte,
+                                            T, actR_surf, act_lyte_m))/(2*h_lyte)
+
+        # Rxn - rate, with eta = muR - mu_lyte + phi_part (+ Rxn*Rfilm)
+        i_Rxn = group.i_Rxn
+        jac.add(i_Rxn, i_Rxn, 1 - dR_deta*group.Rfilm[:, None])
+        jac.add(i_Rxn, group.i_c[:, group.surf], -dR_dc)
+        jac.add(i_Rxn, self.i_c_lyte[group.i_lyte][:, None], -dR_dc_lyte)
+        jac.add(i_Rxn, self.i_phi_lyte[group.i_lyte][:, None], dR_deta)
+        jac.add(i_Rxn, group.i_phi_part[:, None], -dR_deta)
+
+        if group.N == 1 or group.type == "ACR":
+            jac.add(group.i_c, i_Rxn, group.delta_L[:, None])
+            return
+
+        # 1D particles: the reaction is the flux at the surface, the interior flux F_j
+        # between the grid points j-1 and j enters the equation of j-1 with -area_j and
+        # that of j with area_j
+        template = group.template
+        area = template.area_vec[1:-1]
+        i_c = group.i_c
+        jac.add(i_c[:, -1], i_Rxn[:, 0], template.area_vec[-1])
+        c_edges = utils.mean_linear(c.T).T
+        h_edges = filling_step(c_edges)
+        prefac = self.particle_prefactor(group, c_edges)
+        dprefac = (self.particle_prefactor(group, c_edges + h_edges)
+                   - self.particle_prefactor(group, c_edges - h_edges))/(2*h_edges)
+        driving = np.diff(self.particle_driving_force(group, c, muR, noise), axis=1)
+        if group.type == "diffn":
+            ddriving = np.ones_like(c)
+        else:
+            ddriving = dmuR/T
+        dF_left = (-0.5*dprefac*driving + prefac*ddriving[:, :-1])/template.dr
+        dF_right = (-0.5*dprefac*driving - prefac*ddriving[:, 1:])/template.dr
+        jac.add(i_c[:, :-1], i_c[:, :-1], -area*dF_left)
+        jac.add(i_c[:, :-1], i_c[:, 1:], -area*dF_right)
+        jac.add(i_c[:, 1:], i_c[:, :-1], area*dF_left)
+        jac.add(i_c[:, 1:], i_c[:, 1:], area*dF_right)
+
+    def lyte_jacobian(self, jac, y):
+        """Add the derivatives of the electrolyte equations (mod_cell.
+        get_lyte_internal_fluxes) and the ghost point equations to jac, except for the
+        reaction terms."""
+        config = self.config
+        T = config["T"]
+        zp, zm, nup, num = config["zp"], config["zm"], config["nup"], config["num"]
+        disc = self.disc
+        dxd1, dxvec, eps_o_tau = disc["dxd1"], disc["dxvec"], disc["eps_o_tau"]
+        c_ext = np.hstack((self.i_c_lyteGP, self.i_c_lyte, self.i_c_lyte[-1]))
+        phi_ext = np.hstack((self.i_phi_lyteGP, self.i_phi_lyte, self.i_phi_lyte[-1]))
+        ctmp, phitmp = y[c_ext], y[phi_ext]
+
+        # Derivatives of the fluxes at the edges with respect to the values to the left
+        # (L) and right (R) of each edge
+        wt = np.asarray(utils.pad_vec(dxvec), dtype=float)
+        w_L = wt[:-1]/(wt[1:] + wt[:-1])
+        w_R = wt[1:]/(wt[1:] + wt[:-1])
+        c_edges = utils.weighted_linear_mean(ctmp, wt)
+        dc = np.diff(ctmp)/dxd1
+        dphi = np.diff(phitmp)/dxd1
+        if config["elyteModelType"] == "dilute":
+            eps_o_tau_edges = utils.weighted_linear_mean(eps_o_tau, wt)
+            Dp = eps_o_tau_edges * config["Dp"]
+            Dm = eps_o_tau_edges * config["Dm"]
+            A = nup*zp*Dp + num*zm*Dm
+            B = (nup*zp**2*Dp + num*zm**2*Dm)/T
+            dN = {"c_L": num*(Dm/dxd1 - Dm/T*zm*w_L*dphi),
+                  "c_R": num*(-Dm/dxd1 - Dm/T*zm*w_R*dphi),
+                  "phi_L": num*Dm/T*zm*c_edges/dxd1,
+                  "phi_R": -num*Dm/T*zm*c_edges/dxd1}
+            di = {"c_L": A/dxd1 - B*w_L*dphi,
+                  "c_R": -A/dxd1 - B*w_R*dphi,
+                  "phi_L": B*c_edges/dxd1,
+                  "phi_R": -B*c_edges/dxd1}
+        else:
+            D_fs, sigma_fs, thermFac, tp0 = props_elyte.get_elyte_properties(config)
+            sp, n = config["sp"], config["n"]
+            nu = nup + num
+            h = DIFF_STEP*np.abs(ctmp)
+            h_edges = DIFF_STEP*np.abs(c_edges)
+
+            def harmonic_mean(func):
+                """weighted harmonic mean of eps_o_tau*func(c) and its derivatives with
+                respect to c_L and c_R"""
+                values = eps_o_tau*func(ctmp, T)
+                dvalues = eps_o_tau*derivative(func, ctmp, h, T)
+                mean = utils.weighted_harmonic_mean(values, wt)
+                return (mean, mean**2*w_L*dvalues[:-1]/values[:-1]**2,
+                        mean**2*w_R*dvalues[1:]/values[1:]**2)
+            D_edges, dD_L, dD_R = harmonic_mean(D_fs)
+            sigma_edges, dsigma_L, dsigma_R = harmonic_mean(sigma_fs)
+            tp0_edges = tp0(c_edges, T)
+            dtp0 = derivative(tp0, c_edges, h_edges, T)
+            thermFac_edges = thermFac(c_edges, T)
+            dthermFac = derivative(thermFac, c_edges, h_edges, T)
+            # i = -sigma*(dphi + K*dlogc)
+            K = nu*T*(sp/(n*nup) + tp0_edges/(zp*nup))*thermFac_edges
+            dK = nu*T*(dtp0/(zp*nup)*thermFac_edges
+                       + (sp/(n*nup) + tp0_edges/(zp*nup))*dthermFac)
+            dlogc = np.diff(np.log(ctmp))/dxd1
+            i_edges = -sigma_edges*(dphi + K*dlogc)
+            di = {"c_L": (-dsigma_L*(dphi + K*dlogc)
+                          - sigma_edges*(dK*w_L*dlogc - K/(ctmp[:-1]*dxd1))),
+                  "c_R": (-dsigma_R*(dphi + K*dlogc)
+                          - sigma_edges*(dK*w_R*dlogc + K/(ctmp[1:]*dxd1))),
+                  "phi_L": sigma_edges/dxd1,
+                  "phi_R": -sigma_edges/dxd1}
+            # Nm = -num*D*dc + (1 - tp0)*i/zm
+            dN = {"c_L": (-num*(dD_L*dc - D_edges/dxd1)
+                          + (-dtp0*w_L*i_edges + (1 - tp0_edges)*di["c_L"])/zm),
+                  "c_R": (-num*(dD_R*dc + D_edges/dxd1)
+                          + (-dtp0*w_R*i_edges + (1 - tp0_edges)*di["c_R"])/zm),
+                  "phi_L": (1 - tp0_edges)*di["phi_L"]/zm,
+                  "phi_R": (1 - tp0_edges)*di["phi_R"]/zm}
+
+        # The edge e is the left edge of volume e and the right edge of volume e-1
+        columns = {"c_L": c_ext[:-1], "c_R": c_ext[1:],
+                   "phi_L": phi_ext[:-1], "phi_R": phi_ext[1:]}
+        for key, cols in columns.items():
+            jac.add(self.i_c_lyte, cols[1:], -dN[key][1:]/(num*dxvec))
+            jac.add(self.i_c_lyte, cols[:-1], dN[key][:-1]/(num*dxvec))
+            jac.add(self.i_phi_lyte, cols[1:], -di[key][1:]/dxvec)
+            jac.add(self.i_phi_lyte, cols[:-1], di[key][:-1]/dxvec)
+
+        # Ghost points
+        if 'a' not in self.trodes:
+            for key, cols in columns.items():
+                jac.add(self.i_c_lyteGP, cols[0], dN[key][0])
+            current = y[self.i_current]
+            phi_cell = y[self.i_phi_applied] - config["Rser"]*current
+            cWall = .5*(ctmp[0] + ctmp[1])
+            ecd = config["k0_foil"]*cWall**0.5
+            eta = phi_cell - current*config["Rfilm_foil"] - .5*(phitmp[0] + phitmp[1])
+            deta_dc = 0.
+            if config["elyteModelType"] == "dilute":
+                eta -= T*np.log(cWall)
+                deta_dc = -T/cWall
+            # current - ecd*2*sinh(eta/2)
+            deta = -ecd*np.cosh(eta/2)
+            jac.add(self.i_phi_lyteGP, self.i_current,
+                    1 - deta*(config["Rser"] + config["Rfilm_foil"]))
+            jac.add(self.i_phi_lyteGP, self.i_phi_applied, deta)
+            jac.add(self.i_phi_lyteGP, phi_ext[:2], -.5*deta)
+            jac.add(self.i_phi_lyteGP, c_ext[:2],
+                    .5*(-ecd/cWall*np.sinh(eta/2) + deta*deta_dc))
+        else:
+            jac.add(self.i_c_lyteGP, c_ext[:2], [1., -1.])
+            jac.add(self.i_phi_lyteGP, phi_ext[:2], [1., -1.])
+
+    def get_initial_state(self, data=None):
+        """Initial values of the differential variables and guesses of the algebraic
+        variables, like mpet.sim.SimMPET.SetUpVariables. If data of a previous simulation
+        is given, the final state of that simulation is used."""
+        config = self.config
+        y = np.zeros(self.size)
+        if data is None:
+            y[self.i_c_lyte] = config["c0"]
+            if not self.SVsim:
+                y[self.i_c_lyteGP] = config["c0"]
+            for trode in self.trodes:
+                if trode == "a":
+                    y[self.i_phi_bulk[trode]] = config["a", "phiRef"]
+                else:
+                    y[self.i_phi_bulk[trode]] = config["phi_cathode"]
+                y[self.i_phi_part[trode]] = y[self.i_phi_bulk[trode]][:, None]
+            for group in self.groups:
+                y[group.i_c] = config["cs0"][group.trode]
+            if config['tramp'] > 0:
+                phi_guess = 0
+            elif config['profileType'] == 'CV':
+                phi_guess = config['Vset']
+            elif config['profileType'] == 'CVsegments':
+                phi_guess = config['segments'][0][0]
+            else:
+                phi_guess = 0
+            y[self.i_phi_applied] = phi_guess
+            return y
+
+        for sectn in ["a", "s", "c"]:
+            if sectn in self.lyte_start and config["Nvol"].get(sectn, 0):
+                lyte = self.lyte_start[sectn] + np.arange(config["Nvol"][sectn])
+                y[self.i_c_lyte[lyte]] = utils.get_final_values(data, "c_lyte_" + sectn)
+                y[self.i_phi_lyte[lyte]] = utils.get_final_values(data, "phi_lyte_" + sectn)
+        for trode in self.trodes:
+            y[self.i_phi_bulk[trode]] = utils.get_final_values(data, "phi_bulk_" + trode)
+            y[self.i_phi_part[trode]] = y[self.i_phi_bulk[trode]][:, None]
+        for group in self.groups:
+            for k, (vInd, pInd) in enumerate(group.inds):
+                y[group.i_c[k]] = utils.get_particle_field(data, group.trode, vInd, pInd, "c",
+                                                           final=True)
+                y[group.i_Rxn[k]] = utils.get_dict_key(
+                    data, "partTrode{l}vol{i}part{j}_Rxn".format(l=group.trode, i=vInd, j=pInd),
+                    final=True)
+        if not self.SVsim:
+            y[self.i_c_lyteGP] = utils.get_dict_key(data, "c_lyteGP_L", final=True)
+            y[self.i_phi_lyteGP] = utils.get_dict_key(data, "phi_lyteGP_L", final=True)
+        y[self.i_current] = config["currPrev"]
+        y[self.i_phi_applied] = config["phiPrev"]
+        return y
+
+    def get_absolute_tolerances(self):
+        """Absolute tolerance of each variable, as set for the daetools variable types"""
+        atol = np.full(self.size, self.config["absTol"])
+        for group in self.groups:
+            atol[group.i_Rxn] = NO_T_ABSTOL
+        atol[self.i_current] = NO_T_ABSTOL
+        return atol
+
+    def solve_initial_conditions(self, t, y, max_iter=1000):
+        """Solve the algebraic equations for the algebraic variables, with the
+        differential variables fixed, by Newton's method with a line search."""
+        alg = self.algebraic
+        y = y.copy()
+        scale = self.get_absolute_tolerances() + self.config["relTol"]*np.abs(y)
+        f = self.residual(t, y)
+        for _ in range(max_iter):
+            J = self.jacobian(t, y, f)[alg][:, alg]
+            dy = splinalg.splu(sprs.csc_matrix(J)).solve(-f[alg])
+            norm = np.linalg.norm(f[alg])
+            step = 1.
+            while True:
+                y_new = y.copy()
+                y_new[alg] += step*dy
+                f_new = self.residual(t, y_new)
+                if ((np.all(np.isfinite(f_new)) and np.linalg.norm(f_new[alg])
+                     <= (1 - 1e-4*step)*norm) or step < 1e-8):
+                    break
+                step *= 0.5
+            y, f = y_new, f_new
+            if rms_norm(step*dy/scale[alg]) < 1e-6:
+                return y
+        raise RuntimeError("Could not find consistent initial conditions")
+
+    def get_initial_derivatives(self, t, y):
+        """Time derivatives of all variables that are consistent with the equations, for
+        consistent values y"""
+        dif, alg = self.differential, self.algebraic
+        f = self.residual(t, y)
+        J = self.jacobian(t, y, f)
+        ydot = np.zeros(self.size)
+        ydot[dif] = splinalg.splu(sprs.csc_matrix(self.mass[dif][:, dif])).solve(f[dif])
+        # the algebraic equations remain satisfied: J_aa ydot_a = -(J_ad ydot_d + df_a/dt)
+        dt = np.sqrt(np.finfo(float).eps)*max(1., abs(t))
+        dfdt = (self.residual(t + dt, y)[alg] - f[alg])/dt
+        ydot[alg] = splinalg.splu(sprs.csc_matrix(J[alg][:, alg])).solve(
+            -(J[alg][:, dif] @ ydot[dif] + dfdt))
+        return ydot
+
+    def get_end_condition(self, y):
+        """End condition (see model_funcs.endConditions) reached in state y, or 0"""
+        config = self.config
+        if config["profileType"] not in ["CC", "CCsegments", "CV", "CVsegments"]:
+            return 0
+        if y[self.i_phi_applied] <= config["phimin"]:
+            return 1
+        if y[self.i_phi_applied] >= config["phimax"]:
+            return 2
+        return 0
+
+    def find_event(self, endCondition, t_old, t, dense):
+        """Time at which the end condition was reached within the last step"""
+        limit = self.config["phimin"] if endCondition == 1 else self.config["phimax"]
+
+        def distance(time):
+            return dense(time)[self.i_phi_applied] - limit
+        if distance(t_old)*distance(t) > 0:
+            return t
+        return sopt.brentq(distance, t_old, t, xtol=1e-12*max(1., abs(t)))
+
+    def get_output_variables(self, times, states):
+        """The reported variables of the simulation, as ReportedVariables with the same
+        names as the daetools variables of mod_cell.ModCell"""
+        config = self.config
+        Nvol = config["Nvol"]
+        times = np.asarray(times)
+        Y = np.asarray(states)
+        values = {}
+        for sectn in ["a", "s", "c"]:
+            if sectn in Nvol and Nvol[sectn] and (sectn == "s" or sectn in self.trodes):
+                lyte = self.lyte_start[sectn] + np.arange(Nvol[sectn])
+                values["c_lyte_" + sectn] = Y[:, self.i_c_lyte[lyte]]
+                values["phi_lyte_" + sectn] = Y[:, self.i_phi_lyte[lyte]]
+        if not self.SVsim:
+            values["c_lyteGP_L"] = Y[:, self.i_c_lyteGP]
+            values["phi_lyteGP_L"] = Y[:, self.i_phi_lyteGP]
+        values["current"] = Y[:, self.i_current]
+        values["phi_applied"] = Y[:, self.i_phi_applied]
+        values["phi_cell"] = values["phi_applied"] - config["Rser"]*values["current"]
+        for trode in self.trodes:
+            values["phi_bulk_" + trode] = Y[:, self.i_phi_bulk[trode]]
+            values["phi_part_" + trode] = Y[:, self.i_phi_part[trode]]
+            values["R_Vp_" + trode] = (self.R_Vp_matrix[trode] @ Y.T).T
+            values["ffrac_" + trode] = np.zeros(len(times))
+        for group in self.groups:
+            trode = group.trode
+            dx = 1./Nvol[trode]
+            c = Y[:, group.i_c]
+            cbar = c @ group.template.volfrac_vec
+            for k, (vInd, pInd) in enumerate(group.inds):
+                name = "partTrode{l}vol{i}part{j}.".format(l=trode, i=vInd, j=pInd)
+                Rxn = Y[:, group.i_Rxn[k]]
+                values[name + "c"] = c[:, k, :]
+                values[name + "cbar"] = cbar[:, k]
+                values[name + "dcbardt"] = Rxn @ group.rxn_to_dcbardt[k]
+                # the reaction rate of ACR particles is defined at every grid point
+                values[name + "Rxn"] = Rxn if group.type == "ACR" else Rxn[:, 0]
+                Vj = config["psd_vol_FracVol"][trode][vInd, pInd]
+                values["ffrac_" + trode] += cbar[:, k]*Vj*dx
+        variables = []
+        for name, value in values.items():
+            fullname = "mpet." + name
+            if output_data.is_reported(output_data.get_output_key(fullname), config):
+                variables.append(output_data.ReportedVariable(fullname, value, times))
+        return variables
+
+
+def start_solver(model, t, y):
+    """BDF integrator of the model from consistent values y at time t"""
+    config = model.config
+    return BDF(model.residual, model.jacobian, model.mass, t, y,
+               model.get_initial_derivatives(t, y), config["relTol"],
+               model.get_absolute_tolerances())
+
+
+def integrate(model, y0):
+    """Integrate the model from consistent values y0 at t = 0 up to the last reporting
+    time or until an end condition is reached, like mpet.sim.SimMPET.Run.
+
+    :return: reported times, reported states, and whether the integration reached the
+        end (it did not fail)
+    """
+    config = model.config
+    tScale = config["t_ref"]
+    times = np.hstack((0., config["times"]))
+    t_final = times[-1]
+    breakpoints = model.get_breakpoints()
+    solver = start_solver(model, 0., y0)
+    stats = np.zeros(3, dtype=int)
+    reported_times = [0.]
+    reported_states = [y0]
+    next_report = 1
+    completed = True
+    while next_report < len(times):
+        # restart at kinks in the profile rather than integrating across them
+        t_bound = t_final
+        upcoming = breakpoints[breakpoints > solver.t]
+        if len(upcoming) > 0 and upcoming[0] < t_final:
+            t_bound = upcoming[0]
+        if not solver.step(t_bound):
+            print("\nIntegration failed at t = {t:.4g} s, the step size became too "
+                  "small".format(t=solver.t*tScale))
+            if solver.t > reported_times[-1]:
+                reported_times.append(solver.t)
+                reported_states.append(solver.y)
+            completed = False
+            break
+
+        endCondition = model.get_end_condition(solver.y)
+        t_reached = solver.t
+        if endCondition:
+            t_reached = model.find_event(endCondition, solver.t_old, solver.t, solver.dense)
+        while next_report < len(times) and times[next_report] <= t_reached:
+            t = times[next_report]
+            reported_times.append(t)
+            reported_states.append(solver.y if t == solver.t else solver.dense(t))
+            next_report += 1
+            sys.stdout.write("\rIntegrated to {t:.2f} s ({percent:.0f}%)".format(
+                t=t*tScale, percent=100.*t/t_final))
+            sys.stdout.flush()
+        if endCondition:
+            # daetools reports the state before and after the discontinuity of the end
+            # condition and once more at the end of the run
+            if t_reached > reported_times[-1]:
+                reported_times.extend(3*[t_reached])
+                reported_states.extend(3*[solver.dense(t_reached)])
+            sys.stdout.write("\nEnding condition: " + model_funcs.endConditions[endCondition])
+            break
+        if solver.t == t_bound and t_bound < t_final:
+            stats += [solver.nsteps, solver.nfev, solver.njev]
+            solver = start_solver(model, solver.t, solver.y)
+    stats += [solver.nsteps, solver.nfev, solver.njev]
+    print("\nSteps: {}, residual evaluations: {}, Jacobian evaluations: {}".format(*stats))
+    return reported_times, reported_states, completed
+
+
+def run_simulation(config, outdir):
+    """Run the simulation defined by config and write the output file to outdir, in the
+    same way as mpet.main.run_simulation does with daetools.
+
+    :return: whether the simulation ran to the end, i.e. the integration did not fail
+    """
+    config["currPrev"] = 0.
+    config["phiPrev"] = 0.
+    data = None
+    if config["prevDir"] and config["prevDir"] != "false":
+        data = utils.open_data_file(osp.join(config["prevDir"], "output_data"))
+        config["currPrev"] = utils.get_dict_key(data, "current", final=True)
+        config["phiPrev"] = utils.get_dict_key(data, "phi_applied", final=True)
+
+    model = CellModel(config)
+    y0 = model.get_initial_state(data)
+    # close file if it is a h5py file
+    if isinstance(data, h5py._hl.files.File):
+        data.close()
+
+    # Trial states of rejected steps may lie outside of the domain of the material
+    # functions, the step size control takes care of those
+    with np.errstate(over="ignore", invalid="ignore", divide="ignore"):
+        y0 = model.solve_initial_conditions(0., y0)
+        reported_times, reported_states, completed = integrate(model, y0)
+
+    variables = model.get_output_variables(reported_times, reported_states)
+    output_data.write_output_data(config, outdir, variables)
+    return completed
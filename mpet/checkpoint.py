@@ -0,0 +1,244 @@
+"""Checkpoints of running simulations and resuming from them.
+
+A checkpoint is a folder ``checkpoint`` in the output directory of a simulation with
+
+- ``values.dat``: the values of all (differential and algebraic) variables, written by
+  ``daeSimulation.StoreInitializationValues``
+- ``state.npz``: the simulation time, the current and voltage, and for CCCVCPcycle
+  the active state of the cycler and the values of its assigned variables
+- the output data reported up to the checkpoint (``output_data.*``) for the mat data
+  reporter, which rewrites its whole output file at every checkpoint
+- ``solver_stats.npy``: the solver statistics up to the checkpoint (mpet.solver_stats)
+
+A resumed simulation is a continuation of the simulation from the checkpoint time, with
+the remaining part of the current/voltage profile. Its output is appended to the output
+data of the checkpoint, like for continued simulations in the same directory, which
+results in one output file as if the simulation had never stopped.
+
+The hdf5, hdf5Fast and matSegments data reporters keep the output of the checkpoints in
+the folder ``checkpoint_data`` of the output directory instead, to which each checkpoint
+only appends the time points reported since the previous checkpoint (as rows of the hdf5
+file or as a new segment). The hdf5Stream data reporter writes its output file during
+the simulation, which is truncated to the checkpoint time when the simulation is resumed.
+"""
+import glob
+import os
+import shutil
+
+import h5py
+import numpy as np
+
+import mpet.solver_stats as solver_stats
+import mpet.utils as utils
+
+#: Assigned variables of the CCCVCPcycle model that are stored in a checkpoint
+CYCLE_VARIABLES = ["last_current", "last_phi_applied", "maccor_cycle_counter",
+                   "maccor_step_number", "time_counter", "cycle_number"]
+#: Folder of the output of the checkpoints of the data reporters in INCREMENTAL
+DATA_DIR = "checkpoint_data"
+#: Data reporters whose checkpoints only write the output since the previous checkpoint
+INCREMENTAL = ["hdf5", "hdf5Fast", "matSegments"]
+
+
+def checkpoint_dir(outdir):
+    """Folder of the latest complete checkpoint of a simulation, or None."""
+    for name in ["checkpoint", "checkpoint_old"]:
+        folder = os.path.join(outdir, name)
+        if os.path.isfile(os.path.join(folder, "state.npz")):
+            return folder
+    return None
+
+
+def write_checkpoint(simulation, outdir):
+    """Write a checkpoint of a running simulation (at a reporting time).
+
+    The checkpoint is written to a new folder first, so that the previous checkpoint
+    remains valid if the simulation is killed while writing.
+    """
+    config = simulation.config
+    newdir = os.path.join(outdir, "checkpoint_new")
+    shutil.rmtree(newdir, ignore_errors=True)
+    os.makedirs(newdir)
+
+    if config["dataReporter"] in INCREMENTAL:
+        # appended before the checkpoint replaces the previous one, the output after the
+        # time of the previous checkpoint is removed again if the simulation is resumed
+        # from it (see restore_output)
+        write_output_increment(simulation, outdir)
+    elif config["dataReporter"] != "hdf5Stream":
+        # output of the part of the simulation before a previous resume
+        for fname in glob.glob(os.path.join(outdir, "output_data*")):
+            shutil.copy2(fname, newdir)
+        write_output(simulation.dr, os.path.join(newdir, "output_data"))
+
+    simulation.StoreInitializationValues(os.path.join(newdir, "values.dat"))
+    # the time of a resumed simulation starts at zero again
+    state = {"time": simulation.CurrentTime + simulation.tOffset,
+             "current": simulation.m.current.npyValues,
+             "phi_applied": simulation.m.phi_applied.npyValues}
+    if config["profileType"] == "CCCVCPcycle":
+        cyc = simulation.m.cycle
+        state["stn_state"] = cyc.stnCCCV.ActiveState
+        for name in CYCLE_VARIABLES:
+            state[name] = getattr(cyc, name).npyValues
+        # time_counter holds the (simulation) start time of the current cycler step
+        state["time_counter"] = state["time_counter"] + simulation.tOffset
+    np.savez(os.path.join(newdir, "state.npz"), **state)
+    if simulation.solverStats is not None:
+        np.save(os.path.join(newdir, solver_stats.CHECKPOINT_FILE), simulation.solverStats.table())
+
+    # replace the previous checkpoint
+    current = os.path.join(outdir, "checkpoint")
+    old = os.path.join(outdir, "checkpoint_old")
+    shutil.rmtree(old, ignore_errors=True)
+    if os.path.isdir(current):
+        os.rename(current, old)
+    os.rename(newdir, current)
+    shutil.rmtree(old, ignore_errors=True)
+
+
+def write_output(dr, dataFile):
+    """Write the output of a data reporter up to the current time to dataFile."""
+    connection = dr.ConnectionString
+    dr.ConnectionString = dataFile
+    # the resumed simulation continues the reporting strides from the checkpoint
+    dr.final_output = False
+    try:
+        dr.WriteDataToFile()
+    finally:
+        dr.ConnectionString = connection
+        dr.final_output = True
+
+
+def write_output_increment(simulation, outdir):
+    """Append the time points reported since the previous checkpoint of a simulation
+    to the output in the DATA_DIR folder."""
+    dr = simulation.dr
+    datadir = os.path.join(outdir, DATA_DIR)
+    if simulation.checkpointRows == 0 and simulation.resume is None:
+        # first checkpoint of the simulation, which continues the output of the earlier
+        # simulations in the directory (but not a left over of an interrupted one)
+        shutil.rmtree(datadir, ignore_errors=True)
+    if not os.path.isdir(datadir):
+        os.makedirs(datadir)
+        for fname in glob.glob(os.path.join(outdir, "output_data*")):
+            shutil.copy2(fname, datadir)
+    rows = dr.reported_rows()
+    if rows <= max(simulation.checkpointRows, 1 if dr.skip_first else 0):
+        return
+    dr.first_row = simulation.checkpointRows
+    try:
+        write_output(dr, os.path.join(datadir, "output_data"))
+    finally:
+        dr.first_row = 0
+    simulation.checkpointRows = rows
+
+
+def remove_checkpoints(outdir):
+    """Remove the checkpoints of a finished simulation."""
+    for name in ["checkpoint", "checkpoint_old", "checkpoint_new", DATA_DIR]:
+        shutil.rmtree(os.path.join(outdir, name), ignore_errors=True)
+
+
+def load_state(folder):
+    """Read the state of a checkpoint as a dict."""
+    with np.load(os.path.join(folder, "state.npz")) as data:
+        state = {key: data[key][()] for key in data.files}
+    if "stn_state" in state:
+        state["stn_state"] = str(state["stn_state"])
+    return state
+
+
+def restore_output(folder, outdir, config, t_resume):
+    """Reset the output data in the output directory to the time of a checkpoint.
+
+    :param str folder: checkpoint folder
+    :param str outdir: output directory of the simulation
+    :param Config config: the simulation config
+    :param float t_resume: time of the checkpoint
+    """
+    if config["dataReporter"] == "hdf5Stream":
+        # the file was written up to the time the simulation stopped
+        truncate_hdf5(os.path.join(outdir, "output_data.hdf5"), t_resume)
+        return
+    datadir = os.path.join(outdir, DATA_DIR)
+    if config["dataReporter"] in INCREMENTAL and os.path.isdir(datadir):
+        # the output of checkpoints after the one that is resumed from
+        if config["dataReporter"] == "matSegments":
+            truncate_segments(os.path.join(datadir, "output_data"), t_resume)
+        else:
+            truncate_hdf5(os.path.join(datadir, "output_data.hdf5"), t_resume)
+        folder = datadir
+    for fname in glob.glob(os.path.join(outdir, "output_data*")):
+        os.remove(fname)
+    for fname in glob.glob(os.path.join(folder, "output_data*")):
+        shutil.copy2(fname, outdir)
+
+
+def truncate_hdf5(filename, t_end):
+    """Remove all time points after t_end from an hdf5 output file."""
+    tol = 1e-10 * max(1., abs(t_end))
+    with h5py.File(filename, 'a') as mat_dat:
+        times = mat_dat['phi_applied_times'][()]
+        keep = int(np.sum(times <= t_end + tol))
+        for dkeybase in list(mat_dat.keys()):
+            dset = mat_dat[dkeybase]
+            if dset.ndim == 0 or dset.maxshape[0] is not None:
+                # time independent data and the solver statistics, which are replaced by
+                # the table of the resumed simulation, are not resizable
+                continue
+            if dkeybase + '_times' in mat_dat:
+                # variable with a reporting stride
+                keep_var = int(np.sum(mat_dat[dkeybase + '_times'][()] <= t_end + tol))
+            elif dkeybase.endswith('_times') and dkeybase != 'phi_applied_times':
+                keep_var = int(np.sum(dset[()] <= t_end + tol))
+            else:
+                keep_var = keep
+            # hdf5Fast only stores the last time points of internal particle data
+            dset.resize(min(keep_var, dset.shape[0]), axis=0)
+
+
+def truncate_segments(dataFile, t_end):
+    """Remove the segments that start after t_end from a segmented mat output
+    (see output_data.MATSegmentWriter)."""
+    manifest = utils.read_segment_manifest(dataFile)
+    if manifest is None:
+        return
+    tol = 1e-10 * max(1., abs(t_end))
+    folder = os.path.dirname(dataFile)
+    segments = manifest["segments"]
+    keep = [segment for segment in segments if segment["t_start"] <= t_end + tol]
+    for segment in segments[len(keep):]:
+        os.remove(os.path.join(folder, segment["file"]))
+    manifest["segments"] = keep
+    utils.write_segment_manifest(dataFile, manifest)
+
+
+def shift_profile(config, t_resume, state):
+    """Change the current/voltage profile of a config in-place, such that a simulation
+    starting at time zero continues the original profile from t_resume.
+
+    :param Config config: processed simulation config
+    :param float t_resume: (non-dimensional) time at which the simulation is resumed
+    :param dict state: checkpoint state, see :func:`load_state`
+    """
+    # Ramps towards the set point are exponential and continue seamlessly from the
+    # checkpoint values, as the ramp time constant (tend * tramp) is not changed.
+    config["currPrev"] = float(state["current"])
+    config["phiPrev"] = float(state["phi_applied"])
+    if config["profileType"] in ["CCsegments", "CVsegments"]:
+        if config["tramp"] > 0:
+            tvec = np.asarray(config["segments_tvec"])
+            setvec = np.asarray(config["segments_setvec"])
+            later = tvec > t_resume
+            config["segments_tvec"] = np.concatenate(([0.], tvec[later] - t_resume))
+            config["segments_setvec"] = np.concatenate(
+                ([np.interp(t_resume, tvec, setvec)], setvec[later]))
+        else:
+            segments = []
+            tEnd = 0.
+            for setpoint, duration in config["segments"]:
+                tEnd += duration
+                if tEnd > t_resume:
+                    segments.append((setpoint, min(duration, tEnd - t_resume)))
+            config["segments"] = segments if segments else config["segments"][-1:]
@@ -11,9 +11,10 @@ import pickle
 
 import numpy as np
 
-from mpet.config import constants
+from mpet.config import constants, particle_reduction
 from mpet.config.derived_values import DerivedValues
 from mpet.config.parameterset import ParameterSet
+from mpet.config.particle_params import ParticleParams
 
 
 class Config:
@@ -282,6 +283,10 @@ class Config:
                     for key in ['psd_num', 'psd_len', 'psd_area', 'psd_vol',
                                 'psd_vol_FracVol', 'G']:
                         self[key] = d[key]
+                    # the number of particles may differ from the config file
+                    # if the particles were reduced to representatives
+                    for trode in self['trodes']:
+                        self['Npart'][trode] = self['psd_num'][trode].shape[1]
                 elif section in ['anode', 'cathode']:
                     trode = section[0]
                     self[trode, 'indvPart'] = d['indvPart']
@@ -402,6 +407,73 @@ class Config:
 
         del d[item]
 
+    def get_particle_params(self, trode, ind):
+        """
+        Collect the parameters of a single particle in an immutable record, so that
+        models can access them without going through the ``[]`` operator.
+        Can only be used after the particle distributions have been generated.
+
+        :param str trode: electrode, a or c
+        :param tuple ind: (vInd, pInd) of the particle
+
+        :return: :class:`mpet.config.particle_params.ParticleParams`
+        """
+        return ParticleParams(self, trode, ind)
+
+    def scale_operating_conditions(self, values):
+        """
+        Scale new values of the operating conditions of a processed config to their
+        non-dimensional values, as :meth:`_process_config` does for the values in the
+        config file. The config itself is not changed. Used by parameter sweeps
+        (:mod:`mpet.sweep`), which only change these values on an existing model.
+
+        :param dict values: values of Crate, Vset, power, tend and/or segments
+            (CCsegments/CVsegments), in the units of the system config file
+
+        :return: dict with the non-dimensional values of the changed config keys,
+            including the resulting tend and reporting times
+        """
+        unknown = set(values) - set(constants.OPERATING_CONDITIONS)
+        if unknown:
+            raise ValueError(f'Cannot scale {", ".join(sorted(unknown))}, only '
+                             f'{", ".join(constants.OPERATING_CONDITIONS)} are supported')
+        kT = constants.k * constants.T_ref
+        factor = constants.e / kT
+        theoretical_1C_current = self[self['limtrode'], 'cap'] / 3600.  # A/m^2
+        current_scale = self['1C_current_density'] / (theoretical_1C_current * self['curr_ref'])
+        Vref = self['c', 'phiRef']
+        if 'a' in self['trodes']:
+            Vref -= self['a', 'phiRef']
+
+        scaled = {}
+        if 'Crate' in values:
+            scaled['currset'] = values['Crate'] * current_scale
+        if 'Vset' in values:
+            scaled['Vset'] = -(factor * values['Vset'] + Vref)
+        if 'power' in values:
+            scaled['power'] = values['power'] / self['power_ref']
+        if 'tend' in values:
+            scaled['tend'] = values['tend'] / self['t_ref']
+        if 'segments' in values:
+            if self['profileType'] == 'CCsegments':
+                scaled['segments'] = [(setpoint * current_scale, duration * 60 / self['t_ref'])
+                                      for setpoint, duration in values['segments']]
+            elif self['profileType'] == 'CVsegments':
+                scaled['segments'] = [(-(factor * setpoint + Vref), duration * 60 / self['t_ref'])
+                                      for setpoint, duration in values['segments']]
+            else:
+                raise ValueError('segments can only be changed for CCsegments and CVsegments')
+            scaled['tend'] = sum(duration for _, duration in scaled['segments'])
+
+        # the end time of CC simulations follows from the current
+        currset = scaled.get('currset', self['currset'])
+        if self['profileType'] == 'CC' and 'currset' in scaled \
+                and not np.allclose(currset, 0., atol=1e-12):
+            scaled['tend'] = np.abs(self['capFrac'] / currset)
+        if 'tend' in scaled:
+            scaled['times'] = list(np.linspace(0, scaled['tend'], self['tsteps'] + 1))[1:]
+        return scaled
+
     def _process_config(self, prevDir=None):
         """
         Process raw config after loading files from disk. This can only be done once per
@@ -461,6 +533,8 @@ class Config:
             self._distr_part()
             # Gibss free energy, must be done after distr_part
             self._G()
+            # Optionally replace the particles by weighted representatives
+            self._reduce_particles()
             # Electrode parameters that depend on invidividual particle
             self._indvPart()
 
@@ -689,7 +763,6 @@ class Config:
         self['gamma_contact'] = {}
 
         for trode in self['trodes']:
-            solidType = self[trode, 'type']
             Nvol = self['Nvol'][trode]
             Npart = self['Npart'][trode]
 
@@ -730,37 +803,8 @@ class Config:
             else:
                 raise NotImplementedError('Contact error should be between 0 and 1')
 
-            # For particles with internal profiles, convert psd to
-            # integers -- number of steps
-            solidDisc = self[trode, 'discretization']
-            if solidType in ['ACR','ACR_Diff','ACR2']:
-                psd_num = np.ceil(raw / solidDisc).astype(int)
-                psd_len = solidDisc * psd_num
-            elif solidType in ['CHR', 'diffn', 'CHR2', 'diffn2']:
-                psd_num = np.ceil(raw / solidDisc).astype(int) + 1
-                psd_len = solidDisc * (psd_num - 1)
-            # For homogeneous particles (only one 'volume' per particle)
-            elif solidType in ['homog', 'homog_sdn', 'homog2', 'homog2_sdn']:
-                # Each particle is only one volume
-                psd_num = np.ones(raw.shape, dtype=int)
-                # The lengths are given by the original length distr.
-                psd_len = raw
-            else:
-                raise NotImplementedError(f'Unknown solid type: {solidType}')
-
-            # Calculate areas and volumes
-            solidShape = self[trode, 'shape']
-            if solidShape == 'sphere':
-                psd_area = 4 * np.pi * psd_len**2
-                psd_vol = (4. / 3) * np.pi * psd_len**3
-            elif solidShape == 'C3':
-                psd_area = 2 * 1.2263 * psd_len**2
-                psd_vol = 1.2263 * psd_len**2 * self[trode, 'thickness']
-            elif solidShape == 'cylinder':
-                psd_area = 2 * np.pi * psd_len * self[trode, 'thickness']
-                psd_vol = np.pi * psd_len**2 * self[trode, 'thickness']
-            else:
-                raise NotImplementedError(f'Unknown solid shape: {solidShape}')
+            psd_num, psd_len = self._discretize_particles(trode, raw)
+            psd_area, psd_vol = self._particle_area_vol(trode, psd_len)
 
             # Fraction of individual particle volume compared to total
             # volume of particles _within the simulated electrode
@@ -775,6 +819,59 @@ class Config:
             self['psd_vol_FracVol'][trode] = psd_frac_vol
             self['gamma_contact'][trode] = gamma_contact
 
+    def _discretize_particles(self, trode, raw):
+        """
+        Convert particle sizes to the number of grid points in each particle
+        and the corresponding discretized particle sizes.
+
+        :param str trode: electrode, a or c
+        :param ndarray raw: particle sizes
+
+        :return: psd_num, psd_len
+        """
+        solidType = self[trode, 'type']
+        # For particles with internal profiles, convert psd to
+        # integers -- number of steps
+        solidDisc = self[trode, 'discretization']
+        if solidType in ['ACR','ACR_Diff','ACR2']:
+            psd_num = np.ceil(raw / solidDisc).astype(int)
+            psd_len = solidDisc * psd_num
+        elif solidType in ['CHR', 'diffn', 'CHR2', 'diffn2']:
+            psd_num = np.ceil(raw / solidDisc).astype(int) + 1
+            psd_len = solidDisc * (psd_num - 1)
+        # For homogeneous particles (only one 'volume' per particle)
+        elif solidType in ['homog', 'homog_sdn', 'homog2', 'homog2_sdn']:
+            # Each particle is only one volume
+            psd_num = np.ones(raw.shape, dtype=int)
+            # The lengths are given by the original length distr.
+            psd_len = raw
+        else:
+            raise NotImplementedError(f'Unknown solid type: {solidType}')
+        return psd_num, psd_len
+
+    def _particle_area_vol(self, trode, psd_len):
+        """
+        Calculate particle areas and volumes from the particle sizes.
+
+        :param str trode: electrode, a or c
+        :param ndarray psd_len: particle sizes
+
+        :return: psd_area, psd_vol
+        """
+        solidShape = self[trode, 'shape']
+        if solidShape == 'sphere':
+            psd_area = 4 * np.pi * psd_len**2
+            psd_vol = (4. / 3) * np.pi * psd_len**3
+        elif solidShape == 'C3':
+            psd_area = 2 * 1.2263 * psd_len**2
+            psd_vol = 1.2263 * psd_len**2 * self[trode, 'thickness']
+        elif solidShape == 'cylinder':
+            psd_area = 2 * np.pi * psd_len * self[trode, 'thickness']
+            psd_vol = np.pi * psd_len**2 * self[trode, 'thickness']
+        else:
+            raise NotImplementedError(f'Unknown solid shape: {solidShape}')
+        return psd_area, psd_vol
+
     def _G(self):
         """
         Generate Gibbs free energy distribution and store in config.
@@ -797,6 +894,107 @@ class Config:
             self['G'][trode] = G * constants.k * constants.T_ref * self['t_ref'] \
                 / (constants.e * constants.F * self[trode, 'csmax'] * self['psd_vol'][trode])
 
+    def _reduce_particles(self):
+        """
+        Replace the particles in each electrode volume by ``Nrep`` weighted representative
+        particles, see :mod:`mpet.config.particle_reduction`. Each representative gets the
+        volume-weighted mean size, contact fraction and conductance of its group, and the
+        combined volume fraction of the group. Geometric measures of how well the
+        representatives describe the full particle distribution are stored in
+        ``psd_reduction``, see :meth:`particle_reduction_summary`. They are not an
+        estimate of the error in the simulated response, which
+        :func:`mpet.main.compare_particle_reduction` determines by simulation.
+        Must be done after _distr_part and _G, and before _indvPart.
+        """
+        method = self['particleReduction']
+        if method == 'none':
+            return
+
+        self['psd_reduction'] = {}
+        for trode in self['trodes']:
+            Nvol = self['Nvol'][trode]
+            Npart = self['Npart'][trode]
+            K = self['Nrep'][trode]
+            if K < 1 or K >= Npart:
+                # nothing to reduce
+                continue
+
+            psd_len = self['psd_len'][trode]
+            psd_frac_vol = self['psd_vol_FracVol'][trode]
+            gamma_contact = self['gamma_contact'][trode]
+            # G was scaled by the particle volume, undo that before averaging
+            G_vol = self['G'][trode] * self['psd_vol'][trode]
+
+            labels = np.empty((Nvol, Npart), dtype=int)
+            rep_len = np.empty((Nvol, K))
+            rep_frac_vol = np.empty((Nvol, K))
+            rep_gamma_contact = np.empty((Nvol, K))
+            rep_G_vol = np.empty((Nvol, K))
+            for i in range(Nvol):
+                labels[i] = particle_reduction.group_particles(
+                    method, psd_len[i], gamma_contact[i], G_vol[i], psd_frac_vol[i], K)
+                for k in range(K):
+                    members = labels[i] == k
+                    weights = psd_frac_vol[i, members]
+                    rep_len[i, k] = np.average(psd_len[i, members], weights=weights)
+                    rep_gamma_contact[i, k] = np.average(gamma_contact[i, members],
+                                                         weights=weights)
+                    rep_G_vol[i, k] = np.average(G_vol[i, members], weights=weights)
+                    rep_frac_vol[i, k] = weights.sum()
+
+            psd_num, rep_len = self._discretize_particles(trode, rep_len)
+            psd_area, psd_vol = self._particle_area_vol(trode, rep_len)
+
+            # Geometric measures of the reduction: the relative change in specific
+            # surface area of the electrode volume (which scales the reaction rate per
+            # volume) and the volume-weighted spread of the particle sizes within each
+            # group (which changes the diffusion time scales). These are proxies, the
+            # error in the simulated response is not estimated.
+            full_num = self['psd_num'][trode]
+            full_specific_area = np.sum(
+                psd_frac_vol * self['psd_area'][trode] / self['psd_vol'][trode], axis=1)
+            specific_area = np.sum(rep_frac_vol * psd_area / psd_vol, axis=1)
+            area_change = np.max(np.abs(specific_area / full_specific_area - 1))
+            member_rep_len = np.take_along_axis(rep_len, labels, axis=1)
+            size_spread = np.max(
+                np.sqrt(np.sum(psd_frac_vol * (psd_len - member_rep_len)**2, axis=1))
+                / np.sum(psd_frac_vol * psd_len, axis=1))
+
+            self['psd_reduction'][trode] = {'method': method,
+                                            'labels': labels,
+                                            'Npart_full': Npart,
+                                            'grid_points_full': int(full_num.sum()),
+                                            'grid_points': int(psd_num.sum()),
+                                            'specific_area_change': area_change,
+                                            'size_spread': size_spread}
+
+            # store values to config
+            self['Npart'][trode] = K
+            self['psd_num'][trode] = psd_num
+            self['psd_len'][trode] = rep_len
+            self['psd_area'][trode] = psd_area
+            self['psd_vol'][trode] = psd_vol
+            self['psd_vol_FracVol'][trode] = rep_frac_vol
+            self['gamma_contact'][trode] = rep_gamma_contact
+            self['G'][trode] = rep_G_vol / psd_vol
+
+    def particle_reduction_summary(self):
+        """
+        Summary of the particle reduction of each electrode, see :meth:`_reduce_particles`.
+
+        :return: list of lines, empty if no particles were reduced
+        """
+        lines = []
+        for trode, info in self.D_s.params.get('psd_reduction', {}).items():
+            Nvol = self['Nvol'][trode]
+            lines.append(f"Particle reduction ({info['method']}), electrode {trode}: "
+                         f"{Nvol*info['Npart_full']} -> {Nvol*self['Npart'][trode]} particles, "
+                         f"{info['grid_points_full']} -> {info['grid_points']} solid grid "
+                         f"points, max. change in specific surface area "
+                         f"{info['specific_area_change']:.2%}, max. size spread within "
+                         f"groups {info['size_spread']:.2%}")
+        return lines
+
     def _indvPart(self):
         """
         Generate particle-specific parameter values and store in config.
@@ -872,6 +1070,8 @@ class Config:
                 raise Exception("ACR, ACR_Diff, ACR2 and homog_sdn req. C3 shape")
             if (solidType in ["CHR", "diffn"] and solidShape not in ["sphere", "cylinder"]):
                 raise NotImplementedError("CHR and diffn req. sphere or cylinder")
+            if self[trode, 'muRfunc_tabulate'] and solidType in constants.two_var_types:
+                raise NotImplementedError("muRfunc_tabulate req. a 1-variable particle type")
 
     @staticmethod
     def size2regsln(size):
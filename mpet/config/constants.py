@@ -22,10 +22,13 @@ reactions_epsilon = 1e-12
 #: parameter that are defined per electrode with a ``_{electrode}`` suffix
 PARAMS_PER_TRODE = ['Nvol', 'Npart', 'mean', 'stddev', 'cs0', 'simBulkCond', 'sigma_s',
                     'simPartCond', 'G_mean', 'G_stddev', 'L', 'P_L', 'poros', 'BruggExp',
-                    'specified_psd','specified_poros']
+                    'specified_psd','specified_poros', 'Nrep']
 #: subset of ``PARAMS_PER_TRODE``` that is defined for the separator as well
 PARAMS_SEPARATOR = ['Nvol', 'L', 'poros', 'BruggExp', 'specified_poros']
 #: parameters that are defined for each particle, and their type
 PARAMS_PARTICLE = {'N': int, 'kappa': float, 'beta_s': float, 'D': float, 'k0': float,
                    'Rfilm': float, 'delta_L': float, 'Omega_a': float, 'E_D': float,
                    'E_A': float, 'gamma_con': float}
+#: operating conditions that are parameters of the cell model and can be changed
+#: without rebuilding it, see :meth:`mpet.config.configuration.Config.scale_operating_conditions`
+OPERATING_CONDITIONS = ['Crate', 'Vset', 'power', 'tend', 'segments']
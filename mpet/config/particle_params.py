@@ -0,0 +1,70 @@
+"""
+Immutable records of the parameters of a single particle, see :class:`ParticleParams`.
+"""
+from mpet.config import constants
+
+
+class ParticleParams:
+    """
+    All parameters needed to declare the equations of a single particle, read once from
+    the :class:`mpet.config.configuration.Config` instead of on every use.
+
+    Values are accessed either as attributes or with the ``[]`` operator, using the same
+    names as in the config. ``lambda`` is a Python keyword and is therefore stored as
+    ``lambda_``, but ``params['lambda']`` works as expected.
+
+    Use :meth:`mpet.config.configuration.Config.get_particle_params` to create a record.
+
+    :param Config config: processed MPET configuration
+    :param str trode: electrode, a or c
+    :param tuple ind: (vInd, pInd) of the particle
+    """
+    #: electrode-level parameters that are stored in the record
+    trode_params = ('type', 'shape', 'noise', 'numnoise', 'noise_prefac', 'lambda', 'alpha',
+                    'B', 'cwet', 'Dfunc', 'Dfunc_filename', 'rxnType', 'rxnType_filename',
+                    'muRfunc', 'muRfunc_filename')
+    #: parameters that are defined per particle
+    particle_params = tuple(constants.PARAMS_PARTICLE.keys())
+
+    __slots__ = ('trode', 'ind', 'particle_values') \
+        + tuple(item.replace('lambda', 'lambda_') for item in trode_params + particle_params)
+
+    def __init__(self, config, trode, ind):
+        set_value = super().__setattr__
+        set_value('trode', trode)
+        set_value('ind', tuple(ind))
+        for item in self.trode_params:
+            set_value(self._slot(item), config[trode, item])
+        indvPart = config[trode, 'indvPart']
+        values = []
+        for item in self.particle_params:
+            value = indvPart[item][self.ind]
+            set_value(item, value)
+            # unset parameters are stored as NaN, which never compares equal
+            if value != value:
+                value = None
+            values.append(value.item() if hasattr(value, 'item') else value)
+        # all particle-specific values, e.g. to identify particles with equal parameters
+        set_value('particle_values', tuple(values))
+
+    @staticmethod
+    def _slot(item):
+        return 'lambda_' if item == 'lambda' else item
+
+    def __getitem__(self, item):
+        try:
+            return getattr(self, self._slot(item))
+        except AttributeError:
+            raise KeyError(item) from None
+
+    def __contains__(self, item):
+        return self._slot(item) in self.__slots__
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f'{type(self).__name__} is immutable')
+
+    def __delattr__(self, name):
+        raise AttributeError(f'{type(self).__name__} is immutable')
+
+    def __repr__(self):
+        return f'{type(self).__name__}(trode={self.trode!r}, ind={self.ind!r})'
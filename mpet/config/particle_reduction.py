@@ -0,0 +1,132 @@
+"""
+Reduction of the sampled particle size distribution to a smaller number of weighted
+representative particles per electrode volume.
+
+Each electrode volume simulates ``Npart`` particles, and every particle is a separate
+sub-model of the DAE system. Particles with similar size, contact and conductance
+behave nearly identically, so they can be grouped and replaced by one representative
+per group. The representative carries the combined volume fraction of its group.
+These functions only decide which particles are grouped together,
+:meth:`mpet.config.configuration.Config._reduce_particles` builds the representatives.
+"""
+import numpy as np
+
+
+#: Available reduction methods
+methods = ['none', 'binning', 'kmeans']
+
+
+def standardize(features):
+    """
+    Scale each feature (column) to zero mean and unit standard deviation.
+    Features that are (nearly) constant are set to zero.
+
+    :param ndarray features: (Npart, Nfeatures) array
+    :return: scaled features
+    """
+    features = np.asarray(features, dtype=float)
+    std = features.std(axis=0)
+    scaled = np.zeros_like(features)
+    varying = std > 1e-12 * np.maximum(np.abs(features).max(axis=0), 1.)
+    scaled[:, varying] = (features[:, varying] - features[:, varying].mean(axis=0)) \
+        / std[varying]
+    return scaled
+
+
+def bin_particles(size, K):
+    """
+    Group particles into K bins of (nearly) equal particle count, ordered by size.
+
+    :param ndarray size: particle sizes
+    :param int K: number of bins
+    :return: group index of each particle
+    """
+    order = np.argsort(size, kind='stable')
+    labels = np.empty(len(size), dtype=int)
+    for k, members in enumerate(np.array_split(order, K)):
+        labels[members] = k
+    return labels
+
+
+def kmeans_particles(features, weights, K, maxiter=100):
+    """
+    Weighted k-means clustering of the particles. The initial centres are chosen
+    deterministically (the heaviest particle, followed by repeatedly selecting the
+    particle with the largest weighted distance to the existing centres), so that
+    the result does not depend on, or change, the state of the random number generator.
+
+    :param ndarray features: (Npart, Nfeatures) standardized features
+    :param ndarray weights: weight of each particle, e.g. its volume fraction
+    :param int K: number of clusters
+    :param int maxiter: maximum number of Lloyd iterations
+    :return: cluster index of each particle
+    """
+    features = np.asarray(features, dtype=float)
+    weights = np.asarray(weights, dtype=float)
+    centres = np.empty((K, features.shape[1]))
+    centres[0] = features[np.argmax(weights)]
+    dist2 = ((features - centres[0])**2).sum(axis=1)
+    for k in range(1, K):
+        centres[k] = features[np.argmax(weights * dist2)]
+        dist2 = np.minimum(dist2, ((features - centres[k])**2).sum(axis=1))
+
+    labels = None
+    for _ in range(maxiter):
+        dist2 = ((features[:, None, :] - centres[None, :, :])**2).sum(axis=2)
+        new_labels = np.argmin(dist2, axis=1)
+        if labels is not None and np.array_equal(new_labels, labels):
+            break
+        labels = new_labels
+        for k in range(K):
+            members = labels == k
+            if np.any(members):
+                centres[k] = np.average(features[members], axis=0, weights=weights[members])
+    return fill_empty_groups(labels, K)
+
+
+def fill_empty_groups(labels, K):
+    """
+    Make sure each of the K groups has at least one member, by moving particles out of
+    the largest groups. This keeps the number of particles equal in every volume, even
+    if there are fewer distinct particles than groups.
+
+    :param ndarray labels: group index of each particle, len(labels) >= K
+    :param int K: number of groups
+    :return: updated group indices
+    """
+    labels = labels.copy()
+    for k in range(K):
+        if not np.any(labels == k):
+            counts = np.bincount(labels, minlength=K)
+            largest = np.argmax(counts)
+            labels[np.nonzero(labels == largest)[0][-1]] = k
+    return labels
+
+
+def group_particles(method, size, gamma_contact, G, weights, K):
+    """
+    Determine the groups of particles within a single electrode volume.
+
+    :param str method: binning (by size only) or kmeans (size, contact and conductance)
+    :param ndarray size: particle sizes
+    :param ndarray gamma_contact: contact fraction of each particle
+    :param ndarray G: conductance between particles
+    :param ndarray weights: volume fraction of each particle
+    :param int K: number of groups
+    :return: group index of each particle
+    """
+    if method == 'binning':
+        labels = bin_particles(size, K)
+    elif method == 'kmeans':
+        G_feature = np.log(G) if np.all(G > 0) else G
+        features = standardize(np.column_stack((np.log(size), gamma_contact, G_feature)))
+        labels = kmeans_particles(features, weights, K)
+    else:
+        raise NotImplementedError(f'Unknown particle reduction method: {method}')
+
+    # number the groups by increasing mean particle size
+    mean_size = np.array([np.average(size[labels == k], weights=weights[labels == k])
+                          for k in range(K)])
+    rank = np.empty(K, dtype=int)
+    rank[np.argsort(mean_size, kind='stable')] = np.arange(K)
+    return rank[labels]
@@ -6,7 +6,7 @@ from distutils.util import strtobool
 from schema import Schema, Use, Optional, And, Or
 import numpy as np
 
-from mpet.config import constants
+from mpet.config import constants, particle_reduction
 
 
 def parse_segments(key):
@@ -26,6 +26,37 @@ def parse_segments(key):
     return segments
 
 
+def parse_patterns(key):
+    """
+    Parse a list of variable name patterns in the configuration file
+
+    :param str key: The raw key from the config file
+    :return: patterns (list of str)
+    """
+    patterns = ast.literal_eval(key)
+    assert isinstance(patterns, list), "patterns must be a list"
+    for item in patterns:
+        assert isinstance(item, str), "Each pattern must be a string"
+    return patterns
+
+
+def parse_report_stride(key):
+    """
+    Parse the reportStride key of the configuration file and
+    validate it
+
+    :param str key: The raw key from the config file
+    :return: list of (pattern, stride)
+    """
+    report_stride = ast.literal_eval(key)
+    assert isinstance(report_stride, list), "reportStride must be a list"
+    for item in report_stride:
+        assert len(item) == 2 and isinstance(item[0], str) \
+            and isinstance(item[1], int) and item[1] >= 1, \
+            "Each reportStride item must be a tuple of (pattern, stride)"
+    return [tuple(item) for item in report_stride]
+
+
 def check_allowed_values(value, allowed_values):
     """
     Check if value was chosen from a set of allowed values
@@ -77,7 +108,35 @@ system = {'Sim Params': {'profileType': lambda x:
                          'T': Use(float),
                          'randomSeed': Use(tobool),
                          Optional('seed'): And(Use(int), lambda x: x >= 0),
-                         Optional('dataReporter', default='mat'): str,
+                         Optional('dataReporter', default='mat'):
+                             lambda x: check_allowed_values(x, ["mat", "matSegments", "hdf5",
+                                                                "hdf5Fast", "hdf5Stream"]),
+                         Optional('particleDataLayout', default='perParticle'):
+                             lambda x: check_allowed_values(x, ["perParticle",
+                                                                "consolidated"]),
+                         Optional('backend', default='daetools'):
+                             lambda x: check_allowed_values(x, ["daetools", "numpy"]),
+                         Optional('linearSolver', default='SuperLU'):
+                             lambda x: check_allowed_values(x, ["SuperLU", "SuperLU_MT",
+                                                                "Pardiso", "IntelPardiso",
+                                                                "Trilinos_Amesos_Klu",
+                                                                "Trilinos_Amesos_Superlu",
+                                                                "Trilinos_Amesos_Umfpack",
+                                                                "Trilinos_Amesos_Lapack"]),
+                         Optional('linearSolverThreads', default=0):
+                             And(Use(int), lambda x: x >= 0),
+                         Optional('evaluationMode', default='auto'):
+                             lambda x: check_allowed_values(x, ["auto", "computeStack",
+                                                                "evaluationTree"]),
+                         Optional('evaluationThreads', default=0):
+                             And(Use(int), lambda x: x >= 0),
+                         Optional('parallelEvaluation', default=True): Use(tobool),
+                         Optional('icCache', default=False): Use(tobool),
+                         Optional('checkpointWallTime', default=0.):
+                             And(Use(float), lambda x: x >= 0),
+                         Optional('checkpointSimTime', default=0.):
+                             And(Use(float), lambda x: x >= 0),
+                         Optional('resultCache', default=''): str,
                          'Rser': Use(float),
                          'Nvol_c': And(Use(int), lambda x: x > 0),
                          'Nvol_s': And(Use(int), lambda x: x >= 0),
@@ -102,7 +161,11 @@ system = {'Sim Params': {'profileType': lambda x:
                         Optional('specified_psd_c', default=False):
                             Or(Use(tobool), Use(lambda x: np.array(ast.literal_eval(x)))),
                         Optional('specified_psd_a', default=False):
-                            Or(Use(tobool), Use(lambda x: np.array(ast.literal_eval(x))))},
+                            Or(Use(tobool), Use(lambda x: np.array(ast.literal_eval(x)))),
+                        Optional('particleReduction', default='none'):
+                            lambda x: check_allowed_values(x, particle_reduction.methods),
+                        Optional('Nrep_c', default=0): And(Use(int), lambda x: x >= 0),
+                        Optional('Nrep_a', default=0): And(Use(int), lambda x: x >= 0)},
           'Conductivity': {'simBulkCond_c': Use(tobool),
                            'simBulkCond_a': Use(tobool),
                            'sigma_s_c': Use(float),
@@ -143,7 +206,16 @@ system = {'Sim Params': {'profileType': lambda x:
                           Optional('Dp', default=None): Use(float),
                           Optional('Dm', default=None): Use(float),
                           Optional('cmax'): Use(float),
-                          Optional('a_slyte'): Use(float)},
+                          Optional('a_slyte'): Use(float),
+                          Optional('elyteTabulate', default=False): Use(tobool),
+                          Optional('elyteTable_points', default=501):
+                              And(Use(int), lambda x: x > 1),
+                          Optional('elyteTable_tol', default=1e-6): Use(float),
+                          Optional('elyteTable_range', default=(1e-4, 5.)):
+                              Use(lambda x: tuple(float(v) for v in ast.literal_eval(x)))},
+          'Reporting': {Optional('reportVars', default=['*']): Use(parse_patterns),
+                        Optional('reportExclude', default=[]): Use(parse_patterns),
+                        Optional('reportStride', default=[]): Use(parse_report_stride)},
           'Interface': {Optional('simInterface_a',default=False): Use(tobool),
                         Optional('simInterface_c',default=False): Use(tobool),
                         Optional('Nvol_i'): And(Use(int), lambda x: x > 0),
@@ -167,6 +239,12 @@ electrode = {'Particles': {'type': lambda x: check_allowed_values(x,
                            Optional('thickness'): Use(float)},
              'Material': {Optional('muRfunc_filename', default=None): str,
                           'muRfunc': str,
+                          Optional('muRfunc_tabulate', default=False): Use(tobool),
+                          Optional('muRfunc_table_points', default=2001):
+                              And(Use(int), lambda x: x > 2),
+                          Optional('muRfunc_table_tol', default=1e-6): Use(float),
+                          Optional('muRfunc_table_range', default=None):
+                              Use(lambda x: tuple(float(v) for v in ast.literal_eval(x))),
                           'noise': Use(tobool),
                           'noise_prefac': Use(float),
                           'numnoise': Use(int),
@@ -0,0 +1,244 @@
+"""Estimates of the size and cost of a simulation before it is run.
+
+:func:`dae_size` counts the variables of the DAE system that :mod:`mpet.mod_cell`
+builds for a processed config. :class:`CostModel` predicts the run time and peak
+memory from that size and the operating conditions (:func:`cost_features`), with a
+power law (run time) and a linear model (memory) fitted on the ``run_info.txt`` of
+previous runs, e.g. to schedule the longest jobs first (``bin/run_jobs.py``).
+"""
+import json
+import os
+
+import numpy as np
+
+from mpet.config import Config, constants
+
+
+def particle_variables(config, trode, N):
+    """Number of variables of a particle model with N discretization points."""
+    ptype = config[trode, "type"]
+    if ptype in constants.two_var_types:
+        # c1, c2, cbar, c1bar, c2bar, dcbardt, Rxn1, Rxn2
+        nvar = 2*N + 4 + (2*N if ptype == "ACR2" else 2)
+    else:
+        # c, cbar, dcbardt, Rxn
+        nvar = N + 2 + (N if ptype in ["ACR", "ACR_Diff"] else 1)
+        if ptype == "ACR_Diff":
+            # ghost points
+            nvar += 2
+    # ports from the electrolyte and the electron conducting phase
+    nvar += 3
+    if config[f"simInterface_{trode}"]:
+        nvar += 1
+    return nvar
+
+
+def interface_variables(config):
+    """Number of variables of an interface region model (including ports)."""
+    # c, phi and the ports from the electrolyte/particle and to the particle/electrolyte
+    return 2*config["Nvol_i"] + 7
+
+
+def dae_size(config):
+    """Size of the DAE system of a processed config.
+
+    :param Config config: processed simulation config
+    :return: dict with the number of volumes (Nvol) and particles per volume (Npart)
+        of each section, the total number of particle discretization points (psd_total),
+        the variables of the particles (particle_vars), interface regions
+        (interface_vars) and the macroscopic cell (cell_vars) of each electrode, and
+        the total number of variables (total)
+    """
+    Nvol = config["Nvol"]
+    Npart = config["Npart"]
+    size = {"Nvol": dict(Nvol), "Npart": dict(Npart), "psd_total": {},
+            "particle_vars": {}, "interface_vars": {}, "cell_vars": {}}
+    # current, voltages and end condition
+    total = 4
+    # operating conditions: current, voltage and power set points and ramp time, and the
+    # set point and end time of each segment
+    total += 4
+    if config["profileType"] in ["CCsegments", "CVsegments"] and config["tramp"] <= 0:
+        total += 2*len(config["segments"])
+    if config["profileType"] == "CCCVCPcycle":
+        total += 6
+    if ("a" in config["trodes"]) or Nvol["s"] or Nvol["c"] > 1:
+        # ghost points of the electrolyte boundary condition
+        total += 2
+    if Nvol["s"]:
+        total += 2*Nvol["s"]
+    for trode in config["trodes"]:
+        psd_num = np.asarray(config["psd_num"][trode], dtype=int)
+        nparts = int(psd_num.size)
+        interface = config[f"simInterface_{trode}"]
+        size["psd_total"][trode] = int(psd_num.sum())
+        size["particle_vars"][trode] = int(sum(particle_variables(config, trode, int(N))
+                                               for N in psd_num.flat))
+        size["interface_vars"][trode] = interface_variables(config)*nparts if interface else 0
+        # c_lyte, phi_lyte, phi_bulk, R_Vp (and R_Vi) and the electrolyte ports per
+        # volume, phi_part and the bulk (and interface) ports per particle, ffrac
+        cell_vars = Nvol[trode]*(6 + (1 if interface else 0)) \
+            + nparts*(2 + (2 if interface else 0)) + 1
+        size["cell_vars"][trode] = cell_vars
+        total += size["particle_vars"][trode] + size["interface_vars"][trode] + cell_vars
+    size["total"] = int(total)
+    return size
+
+
+def throughput(config):
+    """Charge passed in a simulation as a fraction of the capacity, i.e. the simulated
+    time times the (dimensionless) current."""
+    profileType = config["profileType"]
+    if profileType == "CC":
+        value = abs(config["currset"])*config["tend"]
+    elif profileType == "CCsegments":
+        value = sum(abs(setpoint)*duration for setpoint, duration in config["segments"])
+    elif profileType == "CCCVCPcycle":
+        value = config["capFrac"]*max(config["totalCycle"], 1)
+    else:
+        # voltage or power controlled, ends at capFrac unless the profile ends earlier
+        value = config["capFrac"]
+    # rests pass no charge, but still need to be integrated
+    return max(float(value), 1e-3)
+
+
+def cost_features(config):
+    """Properties of a processed config that determine the cost of its simulation.
+
+    :return: dict with the number of variables of the DAE system (nvar), the number of
+        reporting times (steps) and the :func:`throughput`
+    """
+    return {"nvar": dae_size(config)["total"], "steps": len(config["times"]),
+            "throughput": throughput(config)}
+
+
+def read_run_info(folder):
+    """Run time [s] and peak memory [bytes] of a previous run from its run_info.txt.
+
+    :return: (run time, peak memory), the memory is None for runs that did not
+        record it, or None if the run did not finish
+    """
+    runtime = memory = None
+    try:
+        with open(os.path.join(folder, "run_info.txt")) as fi:
+            for line in fi:
+                if line.startswith("Total run time:"):
+                    runtime = float(line.split()[-2])
+                elif line.startswith("Peak memory:"):
+                    memory = float(line.split()[-2])*1e6
+    except OSError:
+        return None
+    if runtime is None:
+        return None
+    return runtime, memory
+
+
+def find_runs(folders):
+    """Output directories of finished runs in the given folders (searched recursively)."""
+    runs = []
+    for folder in folders:
+        for root, _, files in os.walk(folder):
+            if "run_info.txt" in files and "input_dict_system.p" in files:
+                runs.append(root)
+    return sorted(runs)
+
+
+class CostModel:
+    """Predicts the run time and peak memory of a simulation from the size and the
+    operating conditions of its DAE system (see :func:`cost_features`).
+
+    The run time is ``runtime_coef[0] * nvar**runtime_coef[1] * steps**runtime_coef[2]
+    * throughput**runtime_coef[3]`` seconds and the peak memory ``memory_coef[0]
+    + memory_coef[1]*nvar + memory_coef[2]*nvar*steps`` bytes, the last term is the
+    reported output. The default coefficients are rough estimates, use :meth:`fit` to
+    calibrate them on previous runs.
+    """
+    def __init__(self, runtime_coef=(0.05, 1., 0., 0.), memory_coef=(3e8, 2e4, 8.)):
+        # models saved without the operating conditions do not depend on them
+        self.runtime_coef = tuple(runtime_coef) + (0.,)*(4 - len(runtime_coef))
+        self.memory_coef = tuple(memory_coef) + (0.,)*(3 - len(memory_coef))
+        # number of runs the run time was fitted on
+        self.nruns = 0
+
+    @staticmethod
+    def runtime_terms(features):
+        """Logarithms of the factors of the run time power law."""
+        return np.log([features["nvar"], features["steps"], features["throughput"]])
+
+    @staticmethod
+    def memory_terms(features):
+        """Terms of the linear peak memory model, without the constant."""
+        return np.array([features["nvar"], features["nvar"]*features["steps"]], dtype=float)
+
+    @classmethod
+    def fit(cls, folders):
+        """Fit the model on the runs found in folders (see :func:`find_runs`).
+        Coefficients that cannot be fitted (too few runs) keep their defaults, terms
+        that are the same in all runs are not used."""
+        model = cls()
+        runtimeX, runtimes, memoryX, memories = [], [], [], []
+        for run in find_runs(folders):
+            info = read_run_info(run)
+            if info is None:
+                continue
+            try:
+                features = cost_features(Config.from_dicts(run))
+            except Exception:
+                # runs of older mpet versions with incompatible config dicts
+                continue
+            runtime, memory = info
+            if runtime > 0:
+                runtimeX.append(model.runtime_terms(features))
+                runtimes.append(runtime)
+            if memory is not None:
+                memoryX.append(model.memory_terms(features))
+                memories.append(memory)
+        coef = fit_linear(runtimeX, np.log(runtimes))
+        if coef is not None:
+            # linear regression of log(run time) on the logarithms of the features
+            model.runtime_coef = (float(np.exp(coef[0])),) + tuple(float(c) for c in coef[1:])
+        coef = fit_linear(memoryX, memories)
+        if coef is not None:
+            model.memory_coef = tuple(max(float(c), 0.) for c in coef)
+        model.nruns = len(runtimes)
+        return model
+
+    def predict(self, config):
+        """Predicted run time [s] and peak memory [bytes] of a processed config."""
+        features = cost_features(config)
+        runtime = self.runtime_coef[0]*np.exp(np.dot(self.runtime_coef[1:],
+                                                     self.runtime_terms(features)))
+        memory = self.memory_coef[0] + np.dot(self.memory_coef[1:],
+                                              self.memory_terms(features))
+        return float(runtime), float(memory)
+
+    def save(self, filename):
+        with open(filename, "w") as fo:
+            json.dump({"runtime_coef": self.runtime_coef, "memory_coef": self.memory_coef},
+                      fo, indent=1)
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename) as fi:
+            return cls(**json.load(fi))
+
+
+def fit_linear(X, y):
+    """Least squares fit of y on a constant and the columns of X that are not the same in
+    all rows.
+
+    :return: constant and coefficient of each column, zero for the unused columns, or
+        None if no column varies or there are not more rows than fitted coefficients
+    """
+    if len(X) == 0:
+        return None
+    X = np.asarray(X, dtype=float)
+    varies = np.ptp(X, axis=0) > 1e-12*np.max(np.abs(X), axis=0)
+    if not np.any(varies) or len(X) <= np.sum(varies):
+        return None
+    A = np.column_stack([np.ones(len(X)), X[:, varies]])
+    fitted, *_ = np.linalg.lstsq(A, np.asarray(y, dtype=float), rcond=None)
+    coef = np.zeros(X.shape[1] + 1)
+    coef[0] = fitted[0]
+    coef[1:][varies] = fitted[1:]
+    return coef
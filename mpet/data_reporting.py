@@ -1,219 +1,342 @@
 """Helper functions/classes for outputting data generated by the simulation."""
 import numpy as np
-import re
 import os
 import sys
 import time
 import h5py
-import scipy.io as sio
 
 import daetools.pyDAE as dae
 from daetools.pyDAE.data_reporters import daeMatlabMATFileDataReporter
 
+import mpet.output_data as output_data
+import mpet.utils as utils
+from mpet.output_data import get_output_key, get_report_stride, is_reported, \
+    write_static_data
 
-class Myhdf5DataReporterFast(daeMatlabMATFileDataReporter):
+
+class Myhdf5DataReporterFast(output_data.Hdf5FastWriter, daeMatlabMATFileDataReporter):
     """Ignores internal particle concentrations with hdf5 data saving to be faster.
     Input is dataReporter"""
 
-    def WriteDataToFile(self):
-        mdict = {}
-        # 0 if single simulation, 1 if continued simulation
-        continued_sim = 0
-        # if we are in a directory that has continued simulations (maccor reader)
-        if os.path.isfile(self.ConnectionString + ".hdf5"):
-            if os.stat(self.ConnectionString + ".hdf5").st_size != 0:
-                continued_sim = 1
-                # remains 0 if not continued sim
-        with h5py.File(self.ConnectionString + ".hdf5", 'a') as mat_dat:
-            for var in self.Process.Variables:
-                # Remove the model name part of the output key for
-                # brevity.
-                dkeybase = var.Name[var.Name.index(".")+1:]
-                # Remove dots from variable keys. This enables the mat
-                # file to be read by, e.g., MATLAB.
-                dkeybase = dkeybase.replace(".", "_")
-                # Remove port variables
-                if "port" not in dkeybase:
-                    mdict[dkeybase] = var.Values  # mdict stores the new data
-                    # if we are in a directory that has continued simulations (maccor reader)
-                    if continued_sim == 1:
-                        # increment time by the previous end time of the last simulation
-                        tend = mat_dat['phi_applied_times'][-1]
-
-                        # if particle concentrations, remove and overwrite, but not if its cbar
-                        if (re.match("partTrode.vol.part._c", dkeybase) is None) or \
-                                (re.search("cbar", dkeybase) is not None):
-                            # resize and append dkeybase variable
-                            mat_dat[dkeybase].resize(
-                                (mat_dat[dkeybase].shape[0] + mdict[dkeybase].shape[0]), axis=0)
-                            mat_dat[dkeybase][-mdict[dkeybase].shape[0]:] = mdict[dkeybase]
-
-                            if dkeybase == 'phi_applied':
-                                mdict['times'] = var.TimeValues + tend
-                                # resize and append dkeybase varibale
-                                mat_dat['phi_applied_times'].resize(
-                                    (mat_dat['phi_applied_times'].shape[0]
-                                     + mdict['times'].shape[0]), axis=0)
-                                mat_dat['phi_applied_times'][-mdict['times'].shape[0]:] = \
-                                    mdict['times']
-
-                        else:
-                            # overwrite the old file
-                            del mat_dat[dkeybase]
-                            mat_dat.create_dataset(
-                                dkeybase, data=mdict[dkeybase][-2:,:], compression='lzf')
-
-                    else:  # (continued_sim == 1)
-                        # if cwe are not in a continuation directory
-                        # if particle concentrations, remove and overwrite, but not if its cbar
-                        if (re.match("partTrode.vol.part._c", dkeybase) is None) or \
-                                (re.search("cbar", dkeybase) is not None):
-                            # create dataset if continued_sim == 0
-                            # maxshape is set dpeending on whether its a 2D array or a 1D array
-                            shape = len(mdict[dkeybase].shape)
-                            mat_dat.create_dataset(dkeybase, data=mdict[dkeybase],
-                                                   maxshape=(None,)*shape, compression='lzf')
-
-                            if dkeybase == 'phi_applied':
-                                # only save times for voltage
-                                mdict['times'] = var.TimeValues
-                                mat_dat.create_dataset('phi_applied_times', data=mdict['times'],
-                                                       maxshape=(None,), compression='lzf')
-
-                        else:
-                            # only save the last two points
-                            shape = len(mdict[dkeybase].shape)
-                            mat_dat.create_dataset(dkeybase, data=mdict[dkeybase][-2:],
-                                                   maxshape=(None,)*shape, compression='lzf')
-
-
-class Myhdf5DataReporter(daeMatlabMATFileDataReporter):
+
+class Myhdf5DataReporter(output_data.Hdf5Writer, daeMatlabMATFileDataReporter):
     """Reports hdf5 file outputs in full, otherwise ignores internal particle concentrations"""
 
-    def WriteDataToFile(self):
-        mdict = {}
-        # 0 if single simulaiton, 1 if continued simulation
-        continued_sim = 0
-        # if we are in a directory that has continued simulations (maccor reader)
-        if os.path.isfile(self.ConnectionString + ".hdf5"):
-            if os.stat(self.ConnectionString + ".hdf5").st_size != 0:
-                continued_sim = 1
-                # remains 0 if not continued sim
-        with h5py.File(self.ConnectionString + ".hdf5", 'a') as mat_dat:
-            for var in self.Process.Variables:
-                # Remove the model name part of the output key for
-                # brevity.
-                dkeybase = var.Name[var.Name.index(".")+1:]
-                # Remove dots from variable keys. This enables the mat
-                # file to be read by, e.g., MATLAB.
-                dkeybase = dkeybase.replace(".", "_")
-                # remove port variables
-                if "port" not in dkeybase:
-                    mdict[dkeybase] = var.Values
-                    # if we are in a directory that has continued simulations (maccor reader)
-                    if continued_sim == 1:
-                        # increment time by the previous end time of the last simulation
-                        tend = mat_dat['phi_applied_times'][-1]
-
-                        mat_dat[dkeybase].resize(
-                            (mat_dat[dkeybase].shape[0] + mdict[dkeybase].shape[0]), axis=0)
-                        mat_dat[dkeybase][-mdict[dkeybase].shape[0]:] = mdict[dkeybase]
-
-                        if dkeybase == 'phi_applied':
-                            mdict['times'] = var.TimeValues + tend
-                            # resize and append dkeybase varibale
-                            mat_dat['phi_applied_times'].resize(
-                                (mat_dat['phi_applied_times'].shape[0]
-                                 + mdict['times'].shape[0]), axis=0)
-                            mat_dat['phi_applied_times'][-mdict['times'].shape[0]:] \
-                                = mdict['times']
-
-                    else:  # (continued_sim == 0)
-                        # create dataset if continued_sim == 0
-                        # maxshape is set dpeending on whether its a 2D array or a 1D array
-                        shape = len(mdict[dkeybase].shape)
-                        mat_dat.create_dataset(dkeybase, data=mdict[dkeybase],
-                                               maxshape=(None,)*shape, compression='lzf')
-
-                        if dkeybase == 'phi_applied':
-                            # only save times for voltage
-                            mdict['times'] = var.TimeValues
-                            mat_dat.create_dataset('phi_applied_times', data=mdict['times'],
-                                                   maxshape=(None,), compression='lzf')
-
-
-class MyMATDataReporter(daeMatlabMATFileDataReporter):
+
+class MyMATDataReporter(output_data.MATWriter, daeMatlabMATFileDataReporter):
     """See source code for pyDataReporting.daeMatlabMATFileDataReporter
     Takes in dataReporter"""
 
-    def WriteDataToFile(self):
-        mdict = {}
-        # 0 if single simulaiton, 1 if continued simulation
-        continued_sim = 0
-        # set an empty mat_dat
-        mat_dat = {}
-        # if we are in a directory that has continued simulations (maccor reader)
-        if os.path.isfile(self.ConnectionString + ".mat"):
-            if os.stat(self.ConnectionString + ".mat").st_size != 0:
-                continued_sim = 1
-                mat_dat = sio.loadmat(self.ConnectionString + ".mat")
-                # remains 0 if not continued sim
-        for var in self.Process.Variables:
-            # Remove the model name part of the output key for
-            # brevity.
-            dkeybase = var.Name[var.Name.index(".")+1:]
-            # Remove dots from variable keys. This enables the mat
-            # file to be read by, e.g., MATLAB.
-            dkeybase = dkeybase.replace(".", "_")
-            # Remove port variables
-            if "port" not in dkeybase:
-                if continued_sim == 0:
-                    mdict[dkeybase] = var.Values
-                    if dkeybase == 'phi_applied':
-                        # if we are not in a continuation directory
-                        mdict[dkeybase + '_times'] = var.TimeValues
-                else:
-                    # if we are in a directory that has continued simulations (maccor reader)
-                    # increment time by the previous end time of the last simulation
-                    tend = mat_dat['phi_applied_times'][0, -1]
-                    # get previous values from old output_mat
-                    if dkeybase == 'phi_applied':
-
-                        mdict[dkeybase + '_times'] = (var.TimeValues + tend).T
-                        mdict[dkeybase + '_times'] = np.append(mat_dat[dkeybase + '_times'],
-                                                               mdict[dkeybase + '_times'])
-                    # may flatten array, so we specify axis
-                    if mat_dat[dkeybase].shape[0] == 1:
-                        mat_dat[dkeybase] = mat_dat[dkeybase].T
-                        mdict[dkeybase] = mdict[dkeybase].reshape(-1, 1)
-                    # data output does weird arrays where its (n, 2) but (1, n) if only one row
-                    if mdict[dkeybase].ndim == 1:
-                        mdict[dkeybase] = mdict[dkeybase].reshape(-1, 1)
-                    mdict[dkeybase] = np.append(mat_dat[dkeybase], mdict[dkeybase], axis=0)
-                    # flip axes to be consistent with plotting if shape is not (x,1)
-                    if mdict[dkeybase].shape[1] == 1:
-                        mdict[dkeybase] = np.squeeze(mdict[dkeybase])
-
-        sio.savemat(self.ConnectionString + ".mat",
-                    mdict, appendmat=False, format='5',
-                    long_field_names=False, do_compression=False,
-                    oned_as='row')
 
+class MyMATSegmentDataReporter(output_data.MATSegmentWriter, daeMatlabMATFileDataReporter):
+    """Writes mat file output in segments, see output_data.MATSegmentWriter."""
 
-def setup_data_reporters(simulation, config, outdir):
-    """Create daeDelegateDataReporter and add data reporter."""
-    datareporter = dae.daeDelegateDataReporter()
+
+class Myhdf5StreamingDataReporter(dae.daeDataReporter_t):
+    """Writes every reported time point straight to an hdf5 file.
+
+    Unlike the reporters above, which keep the full history in memory
+    until WriteDataToFile is called at the end of the simulation, this
+    reporter only buffers the values of the current reporting interval.
+    Each interval is appended to chunked, resizable datasets and the file
+    is flushed, so memory use stays bounded and the output file is
+    readable (also with SWMR readers) at any point during the run.
+    The layout of the file is identical to that of Myhdf5DataReporter."""
+
+    # layout of the particle data and reporting strides, see setup_data_reporters
+    particle_layout = "perParticle"
+    psd_num = None
+    report_stride = []
+
+    def __init__(self):
+        dae.daeDataReporter_t.__init__(self)
+        self.ConnectionString = ""
+        self.ProcessName = ""
+        self.mat_dat = None
+        # shapes of the registered variables (excluding the time axis)
+        self.var_shapes = {}
+        self.domain_sizes = {}
+        # values of the current reporting interval
+        self.time = None
+        self.buffer = {}
+        # offset added to the reported times for continued simulations
+        self.tend = 0.
+        # number of time points written to the file so far
+        self.rows_written = 0
+        self.datasets_created = False
+        self.static = {}
+        # latest values of variables with a reporting stride that were not written yet
+        self.pending = {}
+        # drop the first reported time point, see output_data.OutputWriter
+        self.skip_first = False
+
+    def Connect(self, ConnectionString, ProcessName):
+        # The delegate data reporter may connect again without a connection string
+        if self.IsConnected() and not ConnectionString:
+            return True
+        self.ConnectionString = ConnectionString
+        self.ProcessName = ProcessName
+        filename = self.ConnectionString + ".hdf5"
+        # continue an existing file if we are in a directory that has continued
+        # simulations (maccor reader)
+        continued_sim = os.path.isfile(filename) and os.stat(filename).st_size != 0
+        try:
+            self.mat_dat = h5py.File(filename, 'a', libver='latest')
+        except (OSError, ValueError):
+            return False
+        if continued_sim and 'phi_applied_times' in self.mat_dat:
+            # increment time by the previous end time of the last simulation
+            self.tend = self.mat_dat['phi_applied_times'][-1]
+            self.rows_written = self.mat_dat['phi_applied_times'].shape[0]
+        return True
+
+    def Disconnect(self):
+        if self.mat_dat is not None:
+            self.write_result_set()
+            self.write_pending()
+            self.mat_dat.close()
+            self.mat_dat = None
+        return True
+
+    def IsConnected(self):
+        return self.mat_dat is not None
+
+    def StartRegistration(self):
+        return True
+
+    def RegisterDomain(self, domain):
+        self.domain_sizes[domain.Name] = domain.NumberOfPoints
+        return True
+
+    def RegisterVariable(self, variable):
+        dkeybase = get_output_key(variable.Name)
+        if dkeybase is None:
+            return True
+        domains = list(variable.Domains)
+        if len(domains) == 0:
+            shape = ()
+        elif all(dmn in self.domain_sizes for dmn in domains):
+            shape = tuple(self.domain_sizes[dmn] for dmn in domains)
+        else:
+            shape = (variable.NumberOfPoints,)
+        self.var_shapes[dkeybase] = shape
+        return True
+
+    def EndRegistration(self):
+        return True
+
+    def StartNewResultSet(self, time):
+        # the previous interval is complete, move it from memory to disk
+        self.write_result_set()
+        self.time = time
+        return True
+
+    def SendVariable(self, variableValue):
+        dkeybase = get_output_key(variableValue.Name)
+        if dkeybase in self.var_shapes:
+            self.buffer[dkeybase] = np.array(variableValue.Values, dtype=float).reshape(
+                self.var_shapes[dkeybase])
+        return True
+
+    def EndOfData(self):
+        self.write_result_set()
+        # always store the final state
+        self.write_pending()
+        return True
+
+    def create_datasets(self):
+        """Create the resizable datasets before the first time point is written."""
+        shapes = {}
+        for dkeybase, values in self.buffer.items():
+            shapes[dkeybase] = values.shape
+            if get_report_stride(dkeybase, self.report_stride) > 1:
+                shapes[dkeybase + '_times'] = ()
+        shapes['phi_applied_times'] = ()
+        write_static_data(self.mat_dat, self.static)
+        for dkeybase, shape in shapes.items():
+            if dkeybase in self.mat_dat:
+                continue
+            # one chunk holds a block of time points of a single variable
+            chunk_rows = max(1, min(1024, 65536 // max(1, int(np.prod(shape)))))
+            self.mat_dat.create_dataset(dkeybase, shape=(0,) + shape,
+                                        maxshape=(None,) + shape,
+                                        chunks=(chunk_rows,) + shape,
+                                        dtype=float, compression='lzf')
+        # from now on readers can follow the file while it is being written
+        try:
+            self.mat_dat.swmr_mode = True
+        except (OSError, ValueError):
+            # files from older simulations may not support swmr
+            pass
+
+    def write_result_set(self):
+        """Append the buffered reporting interval to the file and flush it."""
+        if self.time is None or self.mat_dat is None:
+            return
+        if self.skip_first:
+            self.skip_first = False
+            self.time = None
+            self.buffer = {}
+            return
+        if self.particle_layout == "consolidated":
+            self.static = utils.consolidate_particle_data(self.buffer, self.psd_num,
+                                                          time_axis=False)
+        if not self.datasets_created:
+            self.create_datasets()
+            self.datasets_created = True
+        t_report = self.time + self.tend
+        for dkeybase, values in self.buffer.items():
+            stride = get_report_stride(dkeybase, self.report_stride)
+            if stride == 1:
+                self.append(dkeybase, values)
+            elif self.rows_written % stride == 0:
+                # every stride-th time point of the whole file, also when a simulation
+                # is continued
+                self.append(dkeybase, values)
+                self.append(dkeybase + '_times', t_report)
+                self.pending.pop(dkeybase, None)
+            else:
+                self.pending[dkeybase] = (values, t_report)
+        self.append('phi_applied_times', t_report)
+        self.mat_dat.flush()
+        self.rows_written += 1
+        self.time = None
+        self.buffer = {}
+
+    def write_pending(self):
+        """Write the latest values of variables with a reporting stride."""
+        if self.mat_dat is None or not self.pending:
+            return
+        for dkeybase, (values, t_report) in self.pending.items():
+            self.append(dkeybase, values)
+            self.append(dkeybase + '_times', t_report)
+        self.pending = {}
+        self.mat_dat.flush()
+
+    def append(self, dkeybase, values):
+        """Append a single time point to a dataset."""
+        dset = self.mat_dat[dkeybase]
+        row = dset.shape[0]
+        dset.resize(row + 1, axis=0)
+        dset[row] = values
+
+
+class MemoryDataReporter(dae.daeDataReporter_t):
+    """Keeps the reported values in memory as output_data.ReportedVariable, to be
+    written with output_data.write_output_data. The values can be cleared between runs
+    of the same simulation, e.g. the points of a parameter sweep (mpet.sweep)."""
+
+    def __init__(self):
+        dae.daeDataReporter_t.__init__(self)
+        self.ConnectionString = ""
+        self.ProcessName = ""
+        self.connected = False
+        # shapes of the registered variables (excluding the time axis)
+        self.var_shapes = {}
+        self.domain_sizes = {}
+        self.clear()
+
+    def clear(self):
+        """Forget the values reported so far."""
+        self.times = []
+        self.values = {}
+
+    def get_variables(self):
+        """The reported variables since the last call to clear."""
+        times = np.array(self.times)
+        return [output_data.ReportedVariable(name, np.array(values), times)
+                for name, values in self.values.items()]
+
+    def Connect(self, ConnectionString, ProcessName):
+        self.ConnectionString = ConnectionString
+        self.ProcessName = ProcessName
+        self.connected = True
+        return True
+
+    def Disconnect(self):
+        self.connected = False
+        return True
+
+    def IsConnected(self):
+        return self.connected
+
+    def StartRegistration(self):
+        return True
+
+    def RegisterDomain(self, domain):
+        self.domain_sizes[domain.Name] = domain.NumberOfPoints
+        return True
+
+    def RegisterVariable(self, variable):
+        domains = list(variable.Domains)
+        if all(dmn in self.domain_sizes for dmn in domains):
+            shape = tuple(self.domain_sizes[dmn] for dmn in domains)
+        else:
+            shape = (variable.NumberOfPoints,)
+        self.var_shapes[variable.Name] = shape
+        return True
+
+    def EndRegistration(self):
+        return True
+
+    def StartNewResultSet(self, time):
+        self.times.append(time)
+        return True
+
+    def SendVariable(self, variableValue):
+        name = variableValue.Name
+        if get_output_key(name) is not None:
+            values = np.array(variableValue.Values, dtype=float)
+            self.values.setdefault(name, []).append(
+                values.reshape(self.var_shapes.get(name, values.shape)))
+        return True
+
+    def EndOfData(self):
+        return True
+
+
+def set_reporting(model, config):
+    """Turn on reporting of the variables of a model (and its submodels)
+    that are selected by reportVars and not excluded by reportExclude.
+    Patterns are matched against the keys in the output file, i.e. the
+    variable name without the model name, with dots replaced by
+    underscores (e.g. phi_applied, partTrodecvol0part0_c).
+    phi_applied is always reported, it holds the reported times."""
+    for var in model.Variables:
+        dkeybase = get_output_key(var.CanonicalName)
+        var.ReportingOn = dkeybase is not None and is_reported(dkeybase, config)
+    for submodel in model.Models:
+        set_reporting(submodel, config)
+
+
+def create_data_reporter(config, dataReporter=None):
+    """Create the data reporter selected in the config (or the given one),
+    with the particle data layout and reporting strides of the config."""
+    if dataReporter is None:
+        dataReporter = config["dataReporter"]
     # if default, use mat data reporter
-    simulation.dr = MyMATDataReporter()
+    dr = MyMATDataReporter()
     # else if specified, we use hdf5 data reporter
-    if config["dataReporter"] == "hdf5":
-        simulation.dr = Myhdf5DataReporter()
-    elif config["dataReporter"] == "hdf5Fast":
-        simulation.dr = Myhdf5DataReporterFast()
-    elif config["dataReporter"] != "mat":
+    if dataReporter == "hdf5":
+        dr = Myhdf5DataReporter()
+    elif dataReporter == "hdf5Fast":
+        dr = Myhdf5DataReporterFast()
+    elif dataReporter == "matSegments":
+        dr = MyMATSegmentDataReporter()
+    elif dataReporter == "hdf5Stream":
+        dr = Myhdf5StreamingDataReporter()
+    elif dataReporter != "mat":
         # if the data reporter called hasn't been implemented yet
-        raise Exception("Data Reporter " + config["dataReporter"] + " not installed")
+        raise Exception("Data Reporter " + dataReporter + " not installed")
+
+    # layout of the particle data in the output file
+    return output_data.configure_writer(dr, config)
+
 
+def setup_data_reporters(simulation, config, outdir):
+    """Create daeDelegateDataReporter and add data reporter."""
+    datareporter = dae.daeDelegateDataReporter()
+    simulation.dr = create_data_reporter(config)
     datareporter.AddDataReporter(simulation.dr)
     # Connect data reporters
     simName = simulation.m.Name + time.strftime(" [%d.%m.%Y %H:%M:%S]",
@@ -31,3 +31,7 @@ def LiCoO2_LIONSIMBA(self, y, ybar, muR_ref):
     muR = self.get_muR_from_OCV(OCV, muR_ref)
     actR = None
     return muR, actR
+
+
+# The OCV fit has poles at y = 0.277 and y = 0.423, see mpet.tabulation.get_muRfunc_table_range
+LiCoO2_LIONSIMBA.table_range = (0.43, 1 - 1e-6)
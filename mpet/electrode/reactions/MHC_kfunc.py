@@ -1,15 +1,42 @@
 import numpy as np
-import daetools.pyDAE as dae
 import scipy.special as spcl
 
+from mpet.utils import lazy_import
+
+# only needed for daetools expressions, floats are evaluated with scipy
+dae = lazy_import("daetools.pyDAE")
+
+
+def _erf(x):
+    if isinstance(x, np.ndarray):
+        if x.dtype == object:
+            # element-wise dae.Erf for arrays of adoubles
+            return np.frompyfunc(dae.Erf, 1, 1)(x)
+        return spcl.erf(x)
+    if isinstance(x, (float, int, np.number)):
+        return spcl.erf(x)
+    return dae.Erf(x)
+
 
 def MHC_kfunc(eta, lmbda):
     a = 1. + np.sqrt(lmbda)
-    if isinstance(eta, dae.pyCore.adouble):
-        ERF = dae.Erf
-    else:
-        ERF = spcl.erf
     # evaluate with eta for oxidation, -eta for reduction
     return (np.sqrt(np.pi*lmbda) / (1 + np.exp(-eta))
-            * (1. - ERF((lmbda - np.sqrt(a + eta**2))
+            * (1. - _erf((lmbda - np.sqrt(a + eta**2))
                / (2*np.sqrt(lmbda)))))
+
+
+def MHC_rate_kernel(eta, lmbda, c_red, c_ox):
+    """
+    Net MHC rate krd*c_red - kox*c_ox, with krd = MHC_kfunc(-eta) and
+    kox = MHC_kfunc(eta), for a scalar eta or a whole array of overpotentials at once.
+    The erfc term only depends on eta**2 and is shared by both directions,
+    and the two Fermi factors add up to one, so each element needs a single
+    erf, sqrt and exp instead of two of each.
+    """
+    a = 1. + np.sqrt(lmbda)
+    erfc_term = np.sqrt(np.pi*lmbda) * (1. - _erf((lmbda - np.sqrt(a + eta**2))
+                                                  / (2*np.sqrt(lmbda))))
+    # 1/(1 + exp(eta)) for reduction, 1/(1 + exp(-eta)) = 1 - f_red for oxidation
+    f_red = 1. / (1 + np.exp(eta))
+    return erfc_term * (f_red*c_red - (1. - f_red)*c_ox)
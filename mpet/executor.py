@@ -0,0 +1,171 @@
+"""Run many simulations in parallel on a single machine.
+
+Every job runs :func:`mpet.main.main` in its own (spawned) process, with
+
+- its own output directory, so jobs never change directory or share sim_output
+- a fixed set of CPU cores (on Linux), so jobs do not compete for the same cores
+- an OpenMP/BLAS thread budget equal to its number of cores
+
+The outcome of every job is collected in a summary table (summary.csv).
+"""
+import csv
+import multiprocessing
+import multiprocessing.connection
+import os
+import time
+import traceback
+
+#: environment variables that limit the threads of OpenMP and the BLAS libraries
+THREAD_VARIABLES = ["OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"]
+
+#: columns of the summary table
+SUMMARY_COLUMNS = ["config", "outdir", "status", "time", "cpus", "error"]
+
+
+def available_cpus():
+    """The CPUs this process may run on."""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def cpu_slots(jobs, threads, pin=True):
+    """Divide the available CPUs in sets of threads CPUs for jobs parallel jobs.
+
+    :return: list of CPU lists, or of None for unpinned jobs (if pin is False, the
+        platform does not support pinning or there are not enough CPUs)
+    """
+    cpus = available_cpus()
+    if not pin or not hasattr(os, "sched_setaffinity") or jobs*threads > len(cpus):
+        return [None]*jobs
+    return [cpus[i*threads:(i+1)*threads] for i in range(jobs)]
+
+
+def run_job(paramfile, outdir, cpus, threads):
+    """Run a single simulation in a worker process.
+
+    :return: dict with the columns of the summary table
+    """
+    # The thread budget has to be set before daetools and the linear algebra
+    # libraries are loaded, so mpet.main is only imported in the worker
+    for var in THREAD_VARIABLES:
+        os.environ[var] = str(threads)
+    if cpus is not None:
+        os.sched_setaffinity(0, cpus)
+
+    result = {"config": paramfile, "outdir": outdir, "status": "done", "error": "",
+              "cpus": " ".join(str(cpu) for cpu in cpus) if cpus is not None else ""}
+    timeStart = time.time()
+    try:
+        import mpet.main as main
+        main.main(paramfile, outdir=outdir)
+    except (Exception, SystemExit) as e:
+        traceback.print_exc()
+        result["status"] = "failed"
+        result["error"] = f"{type(e).__name__}: {e}"
+    result["time"] = time.time() - timeStart
+    return result
+
+
+def job_process(conn, paramfile, outdir, cpus, threads):
+    """Entry point of the process of a job, sends the result of :func:`run_job` to the
+    parent process."""
+    conn.send(run_job(paramfile, outdir, cpus, threads))
+    conn.close()
+
+
+def job_outdirs(paramfiles, output_folder):
+    """Output directory of each job: sim_output/<index>_<config name> in output_folder."""
+    outdirs = []
+    for i, paramfile in enumerate(paramfiles):
+        config_base = os.path.splitext(os.path.basename(paramfile))[0]
+        outdirs.append(os.path.join(output_folder, "sim_output", f"{i:04d}_{config_base}"))
+    return outdirs
+
+
+def run_local(paramfiles, output_folder, jobs=None, threads=1, pin=True):
+    """Run the simulations of a list of system config files in parallel.
+
+    :param list paramfiles: system config files
+    :param str output_folder: folder for the output directories of the jobs
+        (see :func:`job_outdirs`) and the summary table
+    :param int jobs: number of simultaneous jobs, default as many as fit on the
+        available CPUs with the given threads per job
+    :param int threads: CPU cores and OpenMP threads per job
+    :param bool pin: pin every job to its own CPU cores
+
+    :return: list of job results (dicts with the columns of the summary table), in the
+        order of paramfiles
+    """
+    paramfiles = [os.path.abspath(paramfile) for paramfile in paramfiles]
+    output_folder = os.path.abspath(output_folder)
+    if jobs is None:
+        jobs = max(1, len(available_cpus()) // threads)
+    jobs = max(1, min(jobs, len(paramfiles)))
+    free_slots = cpu_slots(jobs, threads, pin)
+    outdirs = job_outdirs(paramfiles, output_folder)
+    results = [None]*len(paramfiles)
+    pending = list(range(len(paramfiles)))
+
+    # A new process for every job: daetools keeps global state between runs, and the
+    # thread budget only applies to libraries that are loaded after it is set
+    ctx = multiprocessing.get_context("spawn")
+    running = {}
+
+    def submit():
+        # start jobs as long as there are free CPU slots
+        while pending and free_slots:
+            i = pending.pop(0)
+            cpus = free_slots.pop(0)
+            receiver, sender = ctx.Pipe(duplex=False)
+            process = ctx.Process(target=job_process,
+                                  args=(sender, paramfiles[i], outdirs[i], cpus, threads))
+            process.start()
+            sender.close()
+            running[process.sentinel] = (i, cpus, process, receiver)
+
+    try:
+        submit()
+        while running:
+            for sentinel in multiprocessing.connection.wait(list(running)):
+                i, cpus, process, receiver = running.pop(sentinel)
+                process.join()
+                free_slots.append(cpus)
+                try:
+                    results[i] = receiver.recv()
+                except EOFError:
+                    # the process died, e.g. in a crash of the solver
+                    results[i] = {"config": paramfiles[i], "outdir": outdirs[i],
+                                  "status": "failed", "time": float("nan"), "cpus": "",
+                                  "error": f"process exited with code {process.exitcode}"}
+                receiver.close()
+                print(f"[{len(paramfiles) - len(pending) - len(running)}/{len(paramfiles)}] "
+                      f"{results[i]['status']}: {paramfiles[i]}")
+            submit()
+    finally:
+        # stop the running jobs if the parent is interrupted
+        for _, _, process, _ in running.values():
+            process.terminate()
+
+    write_summary(results, os.path.join(output_folder, "summary.csv"))
+    print_summary(results)
+    return results
+
+
+def write_summary(results, filename):
+    """Write the job results to a csv file."""
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    with open(filename, "w", newline="") as fo:
+        writer = csv.DictWriter(fo, fieldnames=SUMMARY_COLUMNS)
+        writer.writeheader()
+        for result in results:
+            writer.writerow(result)
+
+
+def print_summary(results):
+    """Print the job results as a table."""
+    print("\n{:<40} {:<8} {:>10}  {}".format("config", "status", "time [s]", "error"))
+    for result in results:
+        print("{:<40} {:<8} {:>10.1f}  {}".format(
+            os.path.basename(result["config"]), result["status"], result["time"],
+            result["error"]))
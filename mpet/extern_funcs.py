@@ -4,9 +4,10 @@ These functions are handled here because they cannot be written in a form that D
 to automatically differentiate. For example, they may contain `if` statements or a function from an
 external library that the DAE Tools library doesn't know about.
 """
+import numpy as np
 import scipy.interpolate as sintrp
 
-from daetools.pyDAE import daeScalarExternalFunction, adouble
+from daetools.pyDAE import daeScalarExternalFunction, adouble, unit
 
 
 class InterpTimeScalar(daeScalarExternalFunction):
@@ -31,3 +32,34 @@ class InterpTimeScalar(daeScalarExternalFunction):
         yval = float(self.interp(time.Value))
         self.cache = (time.Value, yval)
         return adouble(yval)
+
+
+class SplineScalar(daeScalarExternalFunction):
+    """Evaluate a :class:`mpet.tabulation.SplineTable` at a single point,
+    including the derivative for the Jacobian."""
+    def __init__(self, Name, Model, units, x, table):
+        arguments = {}
+        arguments["x"] = x
+        self.table = table
+        daeScalarExternalFunction.__init__(self, Name, Model, units, arguments)
+
+    def Calculate(self, values):
+        x = values["x"]
+        value, derivative = self.table.evaluate(x.Value)
+        return adouble(value, derivative*x.Derivative)
+
+
+def spline_vector(model, table, x, name):
+    """Evaluate a :class:`mpet.tabulation.SplineTable` at each element of x as
+    SplineScalar external functions of the given model. The external functions
+    are stored in ``model.extern_funcs`` to keep them alive as long as the model.
+
+    :return: array of adoubles
+    """
+    out = np.empty(len(x), dtype=object)
+    for k in range(len(x)):
+        func = SplineScalar("{name}{n}".format(name=name, n=len(model.extern_funcs)),
+                            model, unit(), x[k], table)
+        model.extern_funcs.append(func)
+        out[k] = func()
+    return out
@@ -0,0 +1,96 @@
+"""Cache of consistent initial conditions.
+
+The converged values of the algebraic variables at t=0 are stored in one file per
+model, named after a hash of the processed config. Parameters that only set the
+operating conditions (current, voltage, times, tolerances and output options) do not
+enter the hash, so that simulations which differ only in those parameters, e.g. the
+C-rate in a sweep, share their cached state. The cached values are used as initial
+guesses only; the initial conditions are always solved again.
+"""
+import hashlib
+import os
+import zipfile
+
+import numpy as np
+
+#: System parameters that do not change the model equations or the particle
+#: distributions, and therefore do not enter the config hash
+OPERATING_PARAMETERS = {
+    "Crate", "1C_current_density", "currset", "Vset", "power", "capFrac", "Vmax", "Vmin",
+    "phimax", "phimin", "segments", "segments_tvec", "segments_setvec", "tramp",
+    "prevDir", "currPrev", "phiPrev", "tend", "tsteps", "times", "relTol", "absTol",
+    "totalCycle", "dataReporter", "particleDataLayout", "backend", "linearSolver",
+    "linearSolverThreads", "evaluationMode", "evaluationThreads", "parallelEvaluation",
+    "icCache", "checkpointWallTime", "checkpointSimTime", "resultCache", "reportVars",
+    "reportExclude", "reportStride"}
+
+
+def update_hash(h, value):
+    """Add a (nested) config value to a hash in a type-aware, deterministic way."""
+    if isinstance(value, dict):
+        h.update(b"dict")
+        for key in sorted(value, key=str):
+            update_hash(h, key)
+            update_hash(h, value[key])
+    elif isinstance(value, (list, tuple)):
+        h.update(b"list%d" % len(value))
+        for item in value:
+            update_hash(h, item)
+    elif isinstance(value, np.ndarray):
+        h.update(f"array{value.dtype.str}{value.shape}".encode())
+        h.update(np.ascontiguousarray(value).tobytes())
+    elif callable(value):
+        h.update(f"{getattr(value, '__module__', '')}.{getattr(value, '__qualname__', '')}"
+                 .encode())
+    else:
+        h.update(repr(value).encode())
+
+
+def config_hash(config):
+    """Hash of the processed config, excluding the operating parameters.
+
+    :param Config config: processed simulation config
+    :return: hexadecimal hash string
+    """
+    h = hashlib.sha256()
+    system = {key: value for key, value in config.D_s.params.items()
+              if key not in OPERATING_PARAMETERS}
+    update_hash(h, system)
+    for trode in config["trodes"]:
+        update_hash(h, trode)
+        update_hash(h, config.D_c.params if trode == "c" else config.D_a.params)
+    return h.hexdigest()
+
+
+def cache_file(config, cachedir):
+    """Path of the cache file of a config."""
+    return os.path.join(cachedir, f"ic_{config_hash(config)}.npz")
+
+
+def load_initial_state(config, cachedir):
+    """Read the cached initial state of a config.
+
+    :return: dict of variable name to values, or None if there is no cached state
+    """
+    fname = cache_file(config, cachedir)
+    if not os.path.isfile(fname):
+        return None
+    try:
+        with np.load(fname) as data:
+            return {key: data[key] for key in data.files}
+    except (OSError, ValueError, zipfile.BadZipFile):
+        # incomplete or corrupt file, e.g. from an interrupted run
+        return None
+
+
+def save_initial_state(config, cachedir, values):
+    """Store the initial state of a config.
+
+    :param dict values: variable name to (converged) values
+    """
+    os.makedirs(cachedir, exist_ok=True)
+    fname = cache_file(config, cachedir)
+    # write to a temporary file first, so that simultaneous runs never read partial files
+    tmpname = f"{fname}.{os.getpid()}.tmp.npz"
+    np.savez(tmpname, **{key: np.asarray(value, dtype=float) for key, value in values.items()})
+    os.replace(tmpname, fname)
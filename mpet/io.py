@@ -0,0 +1,380 @@
+"""
+This module provides lazy access to the output of a simulation.
+
+:class:`SimResult` indexes the variables in an output folder without loading them.
+Only the parts of the data that are requested are read from disk:
+
+* hdf5 output is read through (chunked) h5py datasets
+* uncompressed mat files, as written by the mpet data reporters, are memory-mapped
+* segmented mat output (see :class:`mpet.output_data.MATSegmentWriter`)
+  only reads the segments that overlap with the requested time window
+
+Example usage:
+
+>>> from mpet.io import SimResult
+>>> with SimResult('/path/to/sim_output') as result:
+...     t = result.times()
+...     voltage = result.get('phi_applied', t_start=0., t_end=3600.)
+...     c = result.get_particle('c', 3, 0, 'c', t_start=0., t_end=3600.)
+"""
+import os
+import struct
+
+import numpy as np
+import scipy.io as sio
+
+import mpet.utils as utils
+
+# MAT-file level 5 data types
+# (https://www.mathworks.com/help/pdf_doc/matlab/matfile_format.pdf)
+_miMATRIX = 14
+_miCOMPRESSED = 15
+_MAT_DTYPES = {1: 'i1', 2: 'u1', 3: 'i2', 4: 'u2', 5: 'i4', 6: 'u4',
+               7: 'f4', 9: 'f8', 12: 'i8', 13: 'u8'}
+# data types of the numeric array classes, mxDOUBLE_CLASS up to mxUINT64_CLASS
+_MAT_CLASS_DTYPES = {6: 'f8', 7: 'f4', 8: 'i1', 9: 'u1', 10: 'i2', 11: 'u2',
+                     12: 'i4', 13: 'u4', 14: 'i8', 15: 'u8'}
+_MAT_COMPLEX_FLAG = 0x0800
+
+# Config objects of output folders, with the modification time of the dicts they were read from
+_config_cache = {}
+
+
+class MatFile():
+    """Read-only, dict-like access to the variables in a MAT-file (level 5).
+
+    On opening, only the headers of the variables are read. Real, numeric,
+    uncompressed variables are returned as copy-on-write memory-mapped arrays
+    (changes are never written to the file) with the same shape as
+    :func:`scipy.io.loadmat` would return. All variables have the data type of their
+    MATLAB class, as with ``loadmat(..., mat_dtype=True)``: variables that are stored
+    with a smaller data type, as MATLAB does for integer-valued doubles, are
+    converted when they are read. Any other
+    variable is loaded with :func:`scipy.io.loadmat` when it is first requested.
+
+    :param str filename: Path to the .mat file
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        # name -> (dtype, shape, offset, class dtype) of memory-mappable variables, or None
+        self._index = {}
+        self._loaded = {}
+        self._scan()
+
+    def _scan(self):
+        with open(self.filename, "rb") as fi:
+            header = fi.read(128)
+            self._endian = '<' if header[126:128] == b'IM' else '>'
+            offset = 128
+            size = os.fstat(fi.fileno()).st_size
+            compressed = False
+            while offset + 8 <= size:
+                fi.seek(offset)
+                mtype, nbytes = struct.unpack(self._endian + 'II', fi.read(8))
+                if mtype == _miMATRIX:
+                    name, info = self._parse_matrix(fi.read(min(nbytes, 512)), offset + 8)
+                    if name is not None:
+                        self._index[name] = info
+                elif mtype == _miCOMPRESSED:
+                    compressed = True
+                # elements are aligned to 8 bytes
+                offset += 8 + nbytes + (-nbytes % 8)
+        if compressed:
+            # names of compressed variables are only known after decompression
+            for name, _, _ in sio.whosmat(self.filename):
+                self._index.setdefault(name, None)
+
+    def _parse_matrix(self, buf, offset):
+        """Parse the subelements of a matrix, returns the name and
+        (dtype, shape, offset, class dtype)"""
+        pos = 0
+        fields = []
+        while pos + 8 <= len(buf) and len(fields) < 4:
+            mtype, nbytes = struct.unpack(self._endian + 'II', buf[pos:pos+8])
+            if mtype >> 16:
+                # small data element: size and data are packed in the tag
+                nbytes = mtype >> 16
+                mtype = mtype & 0xffff
+                fields.append((mtype, buf[pos+4:pos+4+nbytes], None))
+                pos += 8
+            else:
+                fields.append((mtype, buf[pos+8:pos+8+nbytes], offset + pos + 8))
+                pos += 8 + nbytes + (-nbytes % 8)
+        if len(fields) < 3:
+            return None, None
+        flags = struct.unpack(self._endian + 'I', fields[0][1][:4])[0]
+        dims = np.frombuffer(fields[1][1], dtype=self._endian + 'i4')
+        name = fields[2][1].decode('latin1')
+        mappable = (len(fields) == 4 and (flags & 0xff) in _MAT_CLASS_DTYPES
+                    and not flags & _MAT_COMPLEX_FLAG
+                    and fields[3][0] in _MAT_DTYPES and fields[3][2] is not None)
+        if not mappable:
+            return name, None
+        dtype = np.dtype(self._endian + _MAT_DTYPES[fields[3][0]])
+        class_dtype = np.dtype(_MAT_CLASS_DTYPES[flags & 0xff])
+        return name, (dtype, tuple(int(d) for d in dims), fields[3][2], class_dtype)
+
+    def keys(self):
+        return self._index.keys()
+
+    def __iter__(self):
+        return iter(self._index)
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def __getitem__(self, key):
+        if key not in self._loaded:
+            info = self._index[key]
+            if info is None:
+                self._loaded[key] = sio.loadmat(self.filename, variable_names=[key],
+                                                mat_dtype=True)[key]
+            else:
+                dtype, shape, offset, class_dtype = info
+                if int(np.prod(shape)) == 0:
+                    self._loaded[key] = np.zeros(shape, dtype=class_dtype)
+                else:
+                    values = np.memmap(self.filename, dtype=dtype, mode='c',
+                                       offset=offset, shape=shape, order='F')
+                    if dtype.newbyteorder('=') != class_dtype:
+                        # stored with a smaller data type, which is read in full
+                        values = values.astype(class_dtype)
+                    self._loaded[key] = values
+        return self._loaded[key]
+
+    def close(self):
+        self._loaded = {}
+
+
+class SimResult():
+    """Lazy access to the output of a simulation.
+
+    Variables are indexed by their key in the output file, e.g. ``phi_applied``
+    or ``c_lyte_c``. :meth:`get` returns the values with time as the first axis,
+    independent of the file format. Particle data is read with :meth:`get_particle`,
+    for either particle data layout.
+
+    :param str indir: Output folder of the simulation (containing output_data.*)
+    :param str dataFileName: Name of the output data file, without extension
+    """
+    def __init__(self, indir, dataFileName="output_data"):
+        self.indir = indir
+        dataFile = os.path.join(indir, dataFileName)
+        self._segments = None
+        manifest = utils.read_segment_manifest(dataFile)
+        if manifest is not None:
+            # segmented mat output: one file per segment
+            self.format = "matSegments"
+            self._manifest = manifest
+            self._segments = [MatFile(os.path.join(indir, segment["file"]))
+                              for segment in manifest["segments"]]
+            self._keys = manifest["keys"]
+            self.data = utils.SegmentedMatData(dataFile)
+        elif os.path.isfile(dataFile + ".mat"):
+            self.format = "mat"
+            self.data = MatFile(dataFile + ".mat")
+            self._keys = list(self.data.keys())
+        elif os.path.isfile(dataFile + ".hdf5"):
+            import h5py
+            self.format = "hdf5"
+            self.data = h5py.File(dataFile + ".hdf5", 'r')
+            self._keys = list(self.data.keys())
+        else:
+            raise Exception("Data output file not found for either mat or hdf5 in " + dataFile)
+        # output of old versions of mpet has the model name in the keys
+        self.pfx = 'mpet.' if 'mpet.phi_applied_times' in self._keys else ''
+        self._times = None
+        self._config = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """Close the output files."""
+        self.data.close()
+        if self._segments is not None:
+            for segment in self._segments:
+                segment.close()
+
+    def keys(self):
+        """Keys of all variables in the output."""
+        return list(self._keys)
+
+    def __contains__(self, key):
+        return key in self._keys
+
+    def __getitem__(self, key):
+        """Raw (lazy) variable as stored in the output file, see also :meth:`get`"""
+        return self.data[key]
+
+    @property
+    def config(self):
+        """The :class:`mpet.config.Config` of the simulation. Reading the config
+        dicts from disk is cached for as long as they are not modified."""
+        if self._config is None:
+            self._config = load_config(self.indir)
+        return self._config
+
+    def times(self, key=None, dimensional=True):
+        """Reported times, in seconds if dimensional is true.
+        If key is given, the times at which that variable is stored (which differ
+        from the reported times if the variable has a reporting stride)."""
+        if key is not None and key + '_times' in self:
+            times = self.get(key + '_times')
+        else:
+            if self._times is None:
+                self._times = np.ravel(self.data[self.pfx + 'phi_applied_times'][...])
+            times = self._times
+        if dimensional:
+            return times * self.config["t_ref"]
+        return times
+
+    def time_slice(self, t_start=None, t_end=None, key=None):
+        """Slice of time indices with t_start <= t <= t_end, times in seconds.
+        If key is given, the indices refer to the time points of that variable."""
+        times = self.times(key)
+        start = 0 if t_start is None else int(np.searchsorted(times, t_start, side='left'))
+        stop = len(times) if t_end is None else int(np.searchsorted(times, t_end, side='right'))
+        return slice(start, stop)
+
+    def _is_series(self, raw, key):
+        """Whether a raw mat variable is a time series stored as a row vector"""
+        if self.format == "matSegments":
+            return key in self._manifest["series"]
+        if self.format == "mat" and raw.ndim == 2 and raw.shape[0] == 1:
+            return len(self.times(dimensional=False)) != 1
+        return False
+
+    def _read(self, raw, key, tslice, cols):
+        if self._is_series(raw, key):
+            return np.asarray(raw[0, tslice])
+        if raw.ndim == 1 or cols is None:
+            return np.asarray(raw[tslice])
+        return np.asarray(raw[tslice, cols])
+
+    def get(self, key, t_start=None, t_end=None, tslice=None, cols=None, squeeze=True):
+        """Values of a variable, with time as the first axis.
+        Only the requested part of the variable is read from disk.
+
+        :param str key: Key of the variable in the output
+        :param float t_start: Start of the time window, in seconds (optional)
+        :param float t_end: End of the time window, in seconds (optional)
+        :param slice tslice: Slice of the time points of the variable, instead of a
+            time window (optional)
+        :param cols: Index or slice of the spatial axis (optional)
+        :param bool squeeze: Whether to squeeze the output
+
+        :return: numpy array
+        """
+        if tslice is None:
+            if t_start is None and t_end is None:
+                tslice = slice(None)
+            else:
+                tslice = self.time_slice(t_start, t_end, key=key)
+        if self.format != "matSegments" or key in self._manifest["static"]:
+            values = self._read(self.data[key], key, tslice, cols)
+        else:
+            # only read the segments that overlap with the time window
+            series = key in self._manifest["series"]
+            # first time index of each segment
+            starts = np.cumsum([0] + [segment[key].shape[1 if series else 0]
+                                      for segment in self._segments])
+            start, stop, step = tslice.indices(int(starts[-1]))
+            if step != 1:
+                raise ValueError("Time slices of segmented output must be contiguous")
+            parts = []
+            for seg, segment in enumerate(self._segments):
+                seg_start, seg_stop = starts[seg], starts[seg+1]
+                if seg_stop <= start or seg_start >= stop:
+                    continue
+                local = slice(max(start, seg_start) - seg_start,
+                              min(stop, seg_stop) - seg_start)
+                parts.append(self._read(segment[key], key, local, cols))
+            values = np.concatenate(parts, axis=0)
+        return np.squeeze(values) if squeeze else values
+
+    def get_particle(self, trode, vInd, pInd, field, t_start=None, t_end=None, tslice=None,
+                     squeeze=True):
+        """Values of one field of a single particle, with time as the first axis,
+        independent of the particle data layout of the output.
+
+        :param str trode: Electrode (c or a)
+        :param int vInd: Volume index
+        :param int pInd: Particle index
+        :param str field: Name of the particle variable, e.g. c, cbar, c1
+        :param float t_start: Start of the time window, in seconds (optional)
+        :param float t_end: End of the time window, in seconds (optional)
+        :param slice tslice: Slice of time indices, instead of a time window (optional)
+        :param bool squeeze: Whether to squeeze the output
+
+        :return: numpy array
+        """
+        sStr = "_" if self.pfx + "partTrode{l}vol0part0_cbar".format(l=trode) in self else "."
+        key = "{pfx}partTrode{l}vol{i}part{j}{sStr}{field}".format(
+            pfx=self.pfx, l=trode, i=vInd, j=pInd, sStr=sStr, field=field)
+        if key in self:
+            return self.get(key, t_start, t_end, tslice, squeeze=squeeze)
+        # consolidated layout
+        base = "partTrode{l}_".format(l=trode)
+        offsets = np.ravel(self.get(base + "offsets"))
+        k = int(np.atleast_2d(self.get(base + "index", squeeze=False))[vInd, pInd])
+        ncols = self.get(base + field, tslice=slice(0, 1), squeeze=False).shape[-1]
+        if ncols == offsets[-1]:
+            cols = slice(int(offsets[k]), int(offsets[k+1]))
+        else:
+            cols = slice(k, k+1)
+        return self.get(base + field, t_start, t_end, tslice, cols=cols, squeeze=squeeze)
+
+    def get_particles(self, trode, field, vInds=None, pInds=None, t_start=None, t_end=None,
+                      tslice=None):
+        """Values of one field for a subset of the particles of an electrode.
+
+        :param str trode: Electrode (c or a)
+        :param str field: Name of the particle variable, e.g. c, cbar, c1
+        :param list vInds: Volume indices, all volumes if None
+        :param list pInds: Particle indices, all particles if None
+        :param float t_start: Start of the time window, in seconds (optional)
+        :param float t_end: End of the time window, in seconds (optional)
+        :param slice tslice: Slice of time indices, instead of a time window (optional)
+
+        :return: dict of (vInd, pInd) -> numpy array
+        """
+        if vInds is None:
+            vInds = range(self.config["Nvol"][trode])
+        if pInds is None:
+            pInds = range(self.config["Npart"][trode])
+        # the time window is converted to indices per variable, as variables with a
+        # reporting stride have their own times
+        return {(i, j): self.get_particle(trode, i, j, field, t_start, t_end, tslice)
+                for i in vInds for j in pInds}
+
+    def solver_stats(self):
+        """Statistics of the solver per reporting interval, see mpet.solver_stats.
+
+        :return: dict of column -> numpy array, or None if they were not recorded
+        """
+        from mpet.solver_stats import read_solver_stats
+        return read_solver_stats(self.indir)
+
+
+def load_config(indir):
+    """Read the config of a simulation from its output folder, reusing
+    a previously read config if the config dicts were not modified since.
+
+    :param str indir: Output folder of the simulation
+
+    :return: Config object
+    """
+    from mpet.config import Config
+    key = os.path.realpath(indir)
+    dictfile = os.path.join(indir, "input_dict_system.p")
+    mtime = os.path.getmtime(dictfile) if os.path.isfile(dictfile) else None
+    if key not in _config_cache or _config_cache[key][0] != mtime:
+        _config_cache[key] = (mtime, Config.from_dicts(indir))
+    return _config_cache[key][1]
@@ -1,40 +1,123 @@
 """The main module that organizes the simulation and manages data IO."""
+import configparser
 import errno
 import glob
+import json
 import os
 import shutil
 import subprocess as subp
 import sys
+import tempfile
 import time
 from shutil import copyfile
 
-import daetools.pyDAE as dae
-from daetools.solvers.superlu import pySuperLU
+import numpy as np
 
 import mpet
-import mpet.data_reporting as data_reporting
-from mpet.config import Config
-import mpet.sim as sim
+import mpet.ic_cache as ic_cache
+import mpet.profiler as profiler
+import mpet.result_cache as result_cache
+from mpet.config import Config, constants
 import mpet.utils as utils
 
+# daetools and the modules that build on it are only imported when a simulation is run
+dae = utils.lazy_import("daetools.pyDAE")
+numpy_backend = utils.lazy_import("mpet.backends.numpy")
+checkpoint = utils.lazy_import("mpet.checkpoint")
+data_reporting = utils.lazy_import("mpet.data_reporting")
+sim = utils.lazy_import("mpet.sim")
+solver_stats = utils.lazy_import("mpet.solver_stats")
 
-def run_simulation(config, outdir):
-    tScale = config["t_ref"]
-    # Create Log, Solver, DataReporter and Simulation object
-    log = dae.daePythonStdOutLog()
+
+def create_lasolver(config):
+    """Create the daetools linear solver selected with linearSolver in the config.
+
+    The solvers other than SuperLU are optional parts of daetools and are only
+    imported when they are selected.
+    """
+    name = config["linearSolver"]
+    threads = config["linearSolverThreads"]
+    cfg = dae.daeGetConfig()
+    if name == "SuperLU":
+        from daetools.solvers.superlu import pySuperLU
+        return pySuperLU.daeCreateSuperLUSolver()
+    try:
+        if name == "SuperLU_MT":
+            from daetools.solvers.superlu_mt import pySuperLU_MT
+            if threads > 0 and "daetools.superlu_mt.numThreads" in cfg:
+                cfg.SetInteger("daetools.superlu_mt.numThreads", threads)
+            return pySuperLU_MT.daeCreateSuperLUSolver()
+        if name == "IntelPardiso":
+            from daetools.solvers.intel_pardiso import pyIntelPardiso
+            if threads > 0 and "daetools.intel_pardiso.numThreads" in cfg:
+                cfg.SetInteger("daetools.intel_pardiso.numThreads", threads)
+            return pyIntelPardiso.daeCreateIntelPardisoSolver()
+        if name == "Pardiso":
+            from daetools.solvers.pardiso import pyPardiso
+            if threads > 0 and "daetools.pardiso.numThreads" in cfg:
+                cfg.SetInteger("daetools.pardiso.numThreads", threads)
+            return pyPardiso.daeCreatePardisoSolver()
+        from daetools.solvers.trilinos import pyTrilinos
+    except ImportError as e:
+        raise ImportError(f"linearSolver {name} is not available in this daetools "
+                          f"installation: {e}") from e
+    # Trilinos_Amesos_<solver>
+    return pyTrilinos.daeCreateTrilinosSolver(name[len("Trilinos_"):], "")
+
+
+def set_daetools_options(config):
+    """Set the global daetools options needed by the config and return the daetools config."""
+    cfg = dae.daeGetConfig()
+    # External functions are not supported by the Compute Stack approach.
+    # The Evaluation Tree approach is required if noise, CCsegments,
+    # CVsegments or tabulated material functions are used
+    segments = config["profileType"] in ["CCsegments","CVsegments"]
+    tabulated = any(config[trode, "muRfunc_tabulate"] for trode in config["trodes"]) \
+        or config["elyteTabulate"]
+    needs_tree = (segments and config["tramp"] > 0) or tabulated
+    mode = config["evaluationMode"]
+    if mode == "computeStack" and needs_tree:
+        raise ValueError("evaluationMode = computeStack does not support ramped segments "
+                         "or tabulated material functions, use evaluationTree or auto")
+    if mode == "auto":
+        mode = "evaluationTree" if needs_tree else None
+    if 'daetools.core.equations.evaluationMode' in cfg:
+        if mode is not None:
+            cfg.SetString('daetools.core.equations.evaluationMode', mode + '_OpenMP')
+        # Number of OpenMP threads of the residual and Jacobian evaluation, one thread
+        # disables parallel evaluation (0 is the number of cores)
+        threads = config["evaluationThreads"] if config["parallelEvaluation"] else 1
+        for evaluator in ["computeStack_OpenMP", "evaluationTree_OpenMP"]:
+            key = f'daetools.core.equations.{evaluator}.numThreads'
+            if key in cfg:
+                cfg.SetInteger(key, threads)
+    elif mode is not None or config["evaluationThreads"] > 0 \
+            or not config["parallelEvaluation"]:
+        print("Warning: this daetools version does not support setting the evaluation "
+              "mode and threads, using its defaults")
+
+    # Disable printStats
+    cfg.SetString('daetools.activity.printStats','false')
+    return cfg
+
+
+def initialize_simulation(simulation, datareporter, log):
+    """Create the DAE and linear solvers, select the reported variables and initialize
+    the simulation. Returns the DAE solver and the linear solver."""
+    config = simulation.config
     daesolver = dae.daeIDAS()
-    simulation = sim.SimMPET(config, tScale)
-    datareporter = data_reporting.setup_data_reporters(simulation, config, outdir)
 
-    # Use SuperLU direct sparse LA solver
-    lasolver = pySuperLU.daeCreateSuperLUSolver()
+    # Use the selected direct sparse LA solver (SuperLU by default)
+    lasolver = create_lasolver(config)
     daesolver.SetLASolver(lasolver)
 
-    # Enable reporting of all variables
-    simulation.m.SetReportingOn(True)
+    # Enable reporting of the selected variables (all by default)
+    data_reporting.set_reporting(simulation.m, config)
 
     # Turn off reporting of some variables
     simulation.m.endCondition.ReportingOn = False
+    for var in simulation.m.operatingVars:
+        var.ReportingOn = False
 
     # Turn off reporting of particle and interface ports
     for trode in simulation.m.trodes:
@@ -59,9 +142,12 @@ def run_simulation(config, outdir):
     daesolver.RelativeTolerance = config["relTol"]
 
     # Set the time horizon and the reporting interval
-    simulation.TimeHorizon = config["tend"]
+    # A resumed simulation starts at time zero at the checkpoint time
+    tOffset = simulation.tOffset
+    simulation.TimeHorizon = config["tend"] - tOffset
     # The list of reporting times excludes the first index (zero, which is implied)
-    simulation.ReportingTimes = config["times"]
+    simulation.ReportingTimes = [t - tOffset for t in config["times"]
+                                 if t - tOffset > 1e-10*config["tend"]]
 
     # Connect data reporter
     simName = simulation.m.Name + time.strftime(
@@ -70,40 +156,160 @@ def run_simulation(config, outdir):
         sys.exit()
 
     # Initialize the simulation
-    simulation.Initialize(daesolver, datareporter, log)
+    with profiler.phase("Initialize"):
+        simulation.Initialize(daesolver, datareporter, log)
+    return daesolver, lasolver
+
+
+def run_simulation(config, outdir, checkpointDir=None):
+    """Run a simulation with daetools and write its output to outdir.
+
+    If checkpointDir is given, the simulation is resumed from that checkpoint
+    (see mpet.checkpoint) and the output is appended to the output in outdir.
+
+    :return: whether the simulation ran to the end (it was not stopped by a solver
+        failure or an interruption), and the daetools linear solver
+    """
+    tScale = config["t_ref"]
+    resume = None if checkpointDir is None else checkpoint.load_state(checkpointDir)
+    # Create Log, DataReporter and Simulation object
+    log = dae.daePythonStdOutLog()
+    # Converged initial values of a previous run of the same model, see mpet.ic_cache
+    initialGuesses = None
+    useCache = config["icCache"] and resume is None \
+        and not (config["prevDir"] and config["prevDir"] != "false")
+    if useCache:
+        cachedir = os.path.join(os.getcwd(), "ic_cache")
+        initialGuesses = ic_cache.load_initial_state(config, cachedir)
+        if initialGuesses is not None:
+            print("Using cached initial values as initial guesses")
+    with profiler.phase("SimMPET"):
+        simulation = sim.SimMPET(config, tScale, initialGuesses, resume)
+    simulation.outdir = outdir
+    if resume is not None:
+        # reset the output to the checkpoint, the data reporters append to it
+        checkpoint.restore_output(checkpointDir, outdir, config, simulation.tOffset)
+    datareporter = data_reporting.setup_data_reporters(simulation, config, outdir)
+    if resume is not None:
+        # the initial values are already in the output as the last checkpoint point
+        simulation.dr.skip_first = True
+    if hasattr(simulation.dr, "WriteDataToFile"):
+        simulation.dr.WriteDataToFile = profiler.wrap("WriteDataToFile",
+                                                      simulation.dr.WriteDataToFile)
+
+    daesolver, lasolver = initialize_simulation(simulation, datareporter, log)
+    if resume is not None:
+        simulation.load_checkpoint_values(checkpointDir)
+    simulation.solverStats = create_solver_stats(simulation, daesolver, outdir, checkpointDir)
 
     # Solve at time=0 (initialization)
     # Increase the number of Newton iterations for more robust initialization
     dae.daeGetConfig().SetString("daetools.IDAS.MaxNumItersIC","1000")
     dae.daeGetConfig().SetString("daetools.IDAS.MaxNumSteps","100000")
-    simulation.SolveInitial()
+    with profiler.phase("SolveInitial"):
+        simulation.SolveInitial()
+    simulation.solverStats.record(0., solver_stats.PHASE_INIT)
+    if useCache:
+        ic_cache.save_initial_state(config, cachedir, simulation.get_guess_values())
 
     # Run
+    completed = False
     try:
-        simulation.Run()
+        with profiler.phase("Run"):
+            simulation.Run()
+        completed = True
     except Exception as e:
         print(str(e))
+        simulation.solverStats.record(simulation.CurrentTime)
         simulation.ReportData(simulation.CurrentTime)
         pass
     except KeyboardInterrupt:
         print("\nphi_applied at ctrl-C:",
               simulation.m.phi_applied.GetValue(), "\n")
+        simulation.solverStats.record(simulation.CurrentTime)
         simulation.ReportData(simulation.CurrentTime)
-    simulation.Finalize()
-
-
-def main(paramfile, keepArchive=True, keepFullRun=False):
+    with profiler.phase("Finalize"):
+        simulation.Finalize()
+    solver_stats.write_solver_stats(outdir, config["dataReporter"],
+                                    simulation.solverStats.table())
+    totals = simulation.solverStats.summary()
+    print("Steps: {steps:.0f}, residual evaluations: {residual_evals:.0f}, "
+          "Jacobian evaluations: {jacobian_evals:.0f}, "
+          "linear solver setups: {linear_setups:.0f}".format(**totals))
+    if completed:
+        # a failed or interrupted simulation can be resumed from its latest checkpoint
+        checkpoint.remove_checkpoints(outdir)
+    # The LA solver holds the factorization statistics (bin/benchmark_lasolvers.py)
+    return completed, lasolver
+
+
+def create_solver_stats(simulation, daesolver, outdir, checkpointDir=None):
+    """Collector of the solver statistics of a simulation (mpet.solver_stats), which
+    continues the table of a checkpoint or of an earlier run in the output directory."""
+    config = simulation.config
+    tScale = config["t_ref"]
+    if checkpointDir is not None:
+        statsFile = os.path.join(checkpointDir, solver_stats.CHECKPOINT_FILE)
+        previous = np.load(statsFile) if os.path.isfile(statsFile) else None
+        return solver_stats.SolverStats(daesolver, tScale, simulation.tOffset, previous)
+    try:
+        previous = solver_stats.read_solver_stats(outdir)
+    except Exception:
+        previous = None
+    if previous is None:
+        return solver_stats.SolverStats(daesolver, tScale)
+    # continued simulation in the same directory, its times follow the earlier run
+    table = np.column_stack([previous[column] for column in solver_stats.COLUMNS])
+    tOffset = previous["t_end"][-1]/tScale if len(table) else 0.
+    return solver_stats.SolverStats(daesolver, tScale, tOffset, table)
+
+
+def main(paramfile, keepArchive=True, keepFullRun=False, outdir=None):
+    """Run the simulation of a system config file.
+
+    The output is stored in a new directory in history and copied or moved to
+    sim_output in the current directory (see keepArchive and keepFullRun). If outdir
+    is given, the output is only written to that (new) directory, which lets parallel
+    runs (mpet.executor) keep their output apart without changing directory.
+    If resultCache is set in the config and the store holds the result of an identical
+    simulation, the stored result is copied to the output directory instead.
+
+    :return: the output directory
+    """
     timeStart = time.time()
     # Get the parameters dictionary (and the config instance) from the
     # parameter file
-    config = Config(paramfile)
+    with profiler.phase("Config"):
+        config = Config(paramfile)
+    for line in config.particle_reduction_summary():
+        print(line)
+    if config["backend"] == "numpy":
+        numpy_backend.check_supported(config)
 
     # Directories we'll store output in.
-    config_file = os.path.basename(paramfile)
-    config_base = os.path.splitext(config_file)[0]
-    outdir_name = "_".join((time.strftime("%Y%m%d_%H%M%S", time.localtime()), config_base))
-    outdir_path = os.path.join(os.getcwd(), "history")
-    outdir = os.path.join(outdir_path, outdir_name)
+    copyOutput = outdir is None
+    if outdir is None:
+        config_file = os.path.basename(paramfile)
+        config_base = os.path.splitext(config_file)[0]
+        outdir_name = "_".join((time.strftime("%Y%m%d_%H%M%S", time.localtime()), config_base))
+        outdir_path = os.path.join(os.getcwd(), "history")
+        outdir = os.path.join(outdir_path, outdir_name)
+
+    # Reuse the result of an identical simulation, see mpet.result_cache
+    resultKey = None
+    if config["resultCache"] and not (config["prevDir"] and config["prevDir"] != "false"):
+        store = os.path.abspath(config["resultCache"])
+        resultKey = result_cache.result_hash(config)
+        entry = result_cache.lookup(store, resultKey)
+        if entry is not None:
+            print("Using the stored result of an identical simulation:", entry)
+            os.makedirs(os.path.dirname(outdir), exist_ok=True)
+            # a copy, as copy_output may move the output directory
+            result_cache.copy_result(entry, outdir)
+            if copyOutput:
+                copy_output(outdir, keepArchive, keepFullRun)
+            return outdir
+
     # Make sure there's a place to store the output
     try:
         os.makedirs(outdir)
@@ -172,36 +378,73 @@ def main(paramfile, keepArchive=True, keepFullRun=False):
 
     fo.close()
 
-    # External functions are not supported by the Compute Stack approach.
-    # Activate the Evaluation Tree approach if noise, CCsegments,
-    # or CVsegments are used
-    cfg = dae.daeGetConfig()
-    segments = config["profileType"] in ["CCsegments","CVsegments"]
-    if (segments and config["tramp"] > 0) \
-            and 'daetools.core.equations.evaluationMode' in cfg:
-        cfg.SetString('daetools.core.equations.evaluationMode', 'evaluationTree_OpenMP')
-
-    # Disable printStats
-    cfg.SetString('daetools.activity.printStats','false')
+    if config["backend"] == "numpy":
+        # Carry out the simulation without daetools
+        with profiler.phase("numpy backend"):
+            completed = numpy_backend.run_simulation(config, outdir)
+    else:
+        cfg = set_daetools_options(config)
 
-    # Write config file
-    with open(os.path.join(outdir, "daetools_config_options.txt"), 'w') as fo:
-        print(cfg, file=fo)
+        # Write config file
+        with open(os.path.join(outdir, "daetools_config_options.txt"), 'w') as fo:
+            print(cfg, file=fo)
 
-    # Carry out the simulation
-    run_simulation(config, outdir)
+        # Carry out the simulation
+        completed, _ = run_simulation(config, outdir)
 
     # Final output for user
     print("\n\nUsed parameter file ""{fname}""\n\n".format(fname=paramfile))
+    record_run_time(outdir, timeStart)
+    if resultKey is not None:
+        if completed:
+            result_cache.store_result(store, resultKey, outdir, os.path.abspath(paramfile))
+        else:
+            # the output of a failed or interrupted run is not a result to reuse
+            print("The simulation did not finish, its result is not stored in the cache")
+    write_profile(outdir)
+    if copyOutput:
+        copy_output(outdir, keepArchive, keepFullRun)
+    return outdir
+
+
+def record_run_time(outdir, timeStart):
+    """Print the total run time and store it in run_info.txt."""
     timeEnd = time.time()
     tTot = timeEnd - timeStart
     print("Total time:", tTot, "s")
     try:
         with open(os.path.join(outdir, 'run_info.txt'), 'a') as fo:
+            peakMemory = get_peak_memory()
+            if peakMemory is not None:
+                # used by the cost model of mpet.cost
+                print("\nPeak memory:", peakMemory/1e6, "MB", file=fo)
             print("\nTotal run time:", tTot, "s", file=fo)
     except Exception:
         pass
 
+
+def write_profile(outdir):
+    """Print and store the timings of the phases of the run, if profiling is enabled
+    (mpet.profiler)."""
+    prof = profiler.disable()
+    if prof is not None:
+        prof.print_summary()
+        prof.save(outdir)
+
+
+def get_peak_memory():
+    """Peak resident memory of this process in bytes, None if unknown."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return maxrss if sys.platform == "darwin" else maxrss*1024
+
+
+def copy_output(outdir, keepArchive=True, keepFullRun=False):
+    """Copy or move the output directory to sim_output in the current directory."""
     # Copy or move simulation output to current directory. If running multiple jobs,
     # make sure to keep all sim_output
     tmpDir = os.path.join(os.getcwd(), "sim_output")
@@ -209,9 +452,123 @@ def main(paramfile, keepArchive=True, keepFullRun=False):
         shutil.rmtree(tmpDir, ignore_errors=True)
         tmpsubDir = tmpDir
     else:
-        tmpsubDir = os.path.join(tmpDir, outdir_name)
+        tmpsubDir = os.path.join(tmpDir, os.path.basename(os.path.normpath(outdir)))
 
     if keepArchive:
         shutil.copytree(outdir, tmpsubDir)
     else:
         shutil.move(outdir, tmpsubDir)
+
+
+def resume(outdir, keepArchive=True, keepFullRun=False):
+    """Resume an interrupted simulation from the latest checkpoint in its output directory.
+
+    The output of the resumed part is appended to the output in outdir, such that the
+    final output is the same as that of an uninterrupted run.
+    """
+    timeStart = time.time()
+    checkpointDir = checkpoint.checkpoint_dir(outdir)
+    if checkpointDir is None:
+        raise FileNotFoundError(f"No checkpoint found in {outdir}")
+    # The processed config of the original run
+    config = Config.from_dicts(outdir)
+    if config["backend"] == "numpy":
+        raise NotImplementedError("Resuming is not supported by the numpy backend")
+    set_daetools_options(config)
+    print("Resuming simulation in {outdir} from {folder}".format(
+        outdir=outdir, folder=checkpointDir))
+    run_simulation(config, outdir, checkpointDir)
+    record_run_time(outdir, timeStart)
+    write_profile(outdir)
+    copy_output(outdir, keepArchive, keepFullRun)
+
+
+def compare_particle_reduction(paramfile, outdir=None):
+    """Run a config with particle reduction (particleReduction) and the same config
+    without it, and report the difference in the simulated response, which the
+    geometric measures of :meth:`Config.particle_reduction_summary` do not estimate.
+
+    The output of the full and the reduced simulation is stored in the subdirectories
+    ``full`` and ``reduced`` of outdir, and the differences (see
+    :func:`reduction_difference`) in ``reduction_comparison.json``.
+
+    :param str paramfile: system config file with particle reduction
+    :param str outdir: output directory, by default a new directory in history
+
+    :return: dict of the differences
+    :raises ValueError: if the config does not reduce any particles
+    :raises FileExistsError: if the output directory exists
+    """
+    config = Config(paramfile)
+    if not config.D_s.params.get('psd_reduction'):
+        raise ValueError("The config does not reduce any particles, see particleReduction")
+    if not config['randomSeed']:
+        print("Warning: randomSeed = false, the full and the reduced simulation have "
+              "different particle size distributions")
+    if outdir is None:
+        config_base = os.path.splitext(os.path.basename(paramfile))[0]
+        outdir_name = "_".join((time.strftime("%Y%m%d_%H%M%S", time.localtime()),
+                                config_base, "reduction"))
+        outdir = os.path.join(os.getcwd(), "history", outdir_name)
+    if os.path.exists(outdir):
+        raise FileExistsError(errno.EEXIST, "The output directory exists", outdir)
+    os.makedirs(outdir)
+
+    parser = configparser.ConfigParser()
+    parser.optionxform = str
+    parser.read(paramfile)
+    for section in parser.sections():
+        if 'particleReduction' in parser[section]:
+            parser[section]['particleReduction'] = 'none'
+    # next to the config file, as its relative paths refer to its folder
+    fd, fullfile = tempfile.mkstemp(suffix='.cfg', prefix='full_',
+                                    dir=os.path.dirname(os.path.abspath(paramfile)))
+    try:
+        with os.fdopen(fd, 'w') as fo:
+            parser.write(fo)
+        fullDir = main(fullfile, outdir=os.path.join(outdir, 'full'))
+    finally:
+        os.remove(fullfile)
+    reducedDir = main(paramfile, outdir=os.path.join(outdir, 'reduced'))
+
+    difference = reduction_difference(fullDir, reducedDir)
+    with open(os.path.join(outdir, 'reduction_comparison.json'), 'w') as fo:
+        json.dump(difference, fo, indent=2)
+    for line in config.particle_reduction_summary():
+        print(line)
+    print("Difference of the reduced to the full simulation: max. voltage difference "
+          "{max_voltage_difference:.4g} V (mean {mean_voltage_difference:.4g} V), "
+          "difference in final filling fraction of electrode {limtrode} "
+          "{capacity_difference:.2%}".format(**difference))
+    return difference
+
+
+def reduction_difference(fullDir, reducedDir):
+    """Difference in the simulated response of two simulations of the same cell, e.g.
+    with and without particle reduction.
+
+    :return: dict with the maximum and mean absolute difference in voltage (in V) over
+        the time both simulations ran, and the difference in the final filling fraction
+        of the limiting electrode, the fraction of its capacity that was (dis)charged
+    """
+    config = Config.from_dicts(fullDir)
+    limtrode = config['limtrode']
+    results = []
+    for folder in [fullDir, reducedDir]:
+        data = utils.open_data_file(os.path.join(folder, 'output_data'))
+        results.append({key: utils.get_dict_key(data, key)
+                        for key in ['phi_applied_times', 'phi_applied', 'ffrac_' + limtrode]})
+        if hasattr(data, 'close'):
+            data.close()
+    full, reduced = results
+    # the simulations may end at different times, e.g. at a voltage cutoff
+    times = full['phi_applied_times']
+    times = times[times <= reduced['phi_applied_times'][-1]]
+    dphi = np.abs(np.interp(times, full['phi_applied_times'], full['phi_applied'])
+                  - np.interp(times, reduced['phi_applied_times'], reduced['phi_applied']))
+    dV = constants.k * constants.T_ref / constants.e * dphi
+    return {'max_voltage_difference': float(np.max(dV)),
+            'mean_voltage_difference': float(np.mean(dV)),
+            'limtrode': limtrode,
+            'capacity_difference': float(reduced['ffrac_' + limtrode][-1]
+                                         - full['ffrac_' + limtrode][-1])}
@@ -8,6 +8,7 @@ from pyUnits import s
 import daetools.pyDAE as dae
 import numpy as np
 
+import mpet.profiler as profiler
 from mpet.daeVariableTypes import elec_pot_t
 
 
@@ -42,6 +43,7 @@ class CCCVCPcycle(dae.daeModel):
         self.phi_applied = Parent.phi_applied
         self.ffrac_limtrode = Parent.ffrac[config['limtrode']]
 
+    @profiler.timed("DeclareEquations")
     def DeclareEquations(self):
         dae.daeModel.DeclareEquations(self)
 
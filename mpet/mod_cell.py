@@ -18,15 +18,11 @@ import mpet.mod_CCCVCPcycle as mod_CCCVCPcycle
 import mpet.mod_electrodes as mod_electrodes
 from mpet.mod_interface import InterfaceRegion
 import mpet.ports as ports
+import mpet.profiler as profiler
 import mpet.utils as utils
 from mpet.config import constants
 from mpet.daeVariableTypes import mole_frac_t, elec_pot_t, conc_t
-
-# Dictionary of end conditions
-endConditions = {
-    1:"Vmax reached",
-    2:"Vmin reached",
-    3:"End condition for CCCVCPcycle reached"}
+from mpet.model_funcs import get_lyte_internal_fluxes
 
 
 class ModCell(dae.daeModel):
@@ -35,6 +31,8 @@ class ModCell(dae.daeModel):
 
         self.config = config
         self.profileType = config['profileType']
+        # external functions used by the equations, kept alive with the model
+        self.extern_funcs = []
         Nvol = config["Nvol"]
         Npart = config["Npart"]
         self.trodes = trodes = config["trodes"]
@@ -124,6 +122,31 @@ class ModCell(dae.daeModel):
         self.endCondition = dae.daeVariable(
             "endCondition", dae.no_t, self, "A nonzero value halts the simulation")
 
+        # Operating conditions are assigned variables, so that a parameter sweep
+        # (mpet.sweep) can re-assign them on an initialized simulation without rebuilding
+        # the model. The Compute Stack evaluates parameters as constants, but reads the
+        # values of assigned variables at every evaluation.
+        self.currset = dae.daeVariable(
+            "currset", dae.no_t, self, "Total current set point (CC)")
+        self.Vset = dae.daeVariable(
+            "Vset", dae.no_t, self, "Applied potential set point (CV)")
+        self.power = dae.daeVariable(
+            "power", dae.no_t, self, "Power set point (CP)")
+        self.tau_ramp = dae.daeVariable(
+            "tau_ramp", dae.no_t, self, "Time constant of the ramp to the set point")
+        self.segSet = None
+        self.segEnd = None
+        if self.profileType in ["CCsegments", "CVsegments"] and config["tramp"] <= 0:
+            self.DmnSegments = dae.daeDomain(
+                "DmnSegments", self, dae.unit(), "Current or voltage segments")
+            self.segSet = dae.daeVariable(
+                "segSet", dae.no_t, self, "Set point of each segment", [self.DmnSegments])
+            self.segEnd = dae.daeVariable(
+                "segEnd", dae.no_t, self, "End time of each segment", [self.DmnSegments])
+        self.operatingVars = [self.currset, self.Vset, self.power, self.tau_ramp]
+        if self.segSet is not None:
+            self.operatingVars += [self.segSet, self.segEnd]
+
         # Create models for representative particles within electrode
         # volumes and ports with which to talk to them.
         self.portsOutLyte = {}
@@ -160,7 +183,8 @@ class ModCell(dae.daeModel):
                         config, trode, vInd, pInd,
                         Name="partTrode{trode}vol{vInd}part{pInd}".format(
                             trode=trode, vInd=vInd, pInd=pInd),
-                        Parent=self)
+                        Parent=self,
+                        params=config.get_particle_params(trode, (vInd, pInd)))
 
                     if config[f"simInterface_{trode}"]:
                         # instantiate interfaces between particle and electrolyte per particle
@@ -205,6 +229,7 @@ class ModCell(dae.daeModel):
             pCycle = mod_CCCVCPcycle.CCCVCPcycle
             self.cycle = pCycle(config, Name="CCCVCPcycle", Parent=self)
 
+    @profiler.timed("DeclareEquations")
     def DeclareEquations(self):
         dae.daeModel.DeclareEquations(self)
 
@@ -380,7 +405,7 @@ class ModCell(dae.daeModel):
             ctmp = np.hstack((self.c_lyteGP_L(), cvec, cvec[-1]))
             phitmp = np.hstack((self.phi_lyteGP_L(), phivec, phivec[-1]))
 
-            Nm_edges, i_edges = get_lyte_internal_fluxes(ctmp, phitmp, disc, config)
+            Nm_edges, i_edges = get_lyte_internal_fluxes(ctmp, phitmp, disc, config, self)
 
             # If we don't have a porous anode:
             # 1) the total current flowing into the electrolyte is set
@@ -449,20 +474,20 @@ class ModCell(dae.daeModel):
             eq = self.CreateEquation("Total_Current_Constraint")
             if config["tramp"] > 0:
                 eq.Residual = self.current() - (
-                    config["currPrev"] + (config["currset"] - config["currPrev"])
-                    * (1 - np.exp(-dae.Time()/(config["tend"]*config["tramp"]))))
+                    config["currPrev"] + (self.currset() - config["currPrev"])
+                    * (1 - np.exp(-dae.Time()/self.tau_ramp())))
             else:
-                eq.Residual = self.current() - config["currset"]
+                eq.Residual = self.current() - self.currset()
         elif self.profileType == "CV":
             # Keep applied potential constant
             eq = self.CreateEquation("applied_potential")
             if config["tramp"] > 0:
                 eq.Residual = self.phi_applied() - (
-                    config["phiPrev"] + (config["Vset"] - config["phiPrev"])
-                    * (1 - np.exp(-dae.Time()/(config["tend"]*config["tramp"])))
+                    config["phiPrev"] + (self.Vset() - config["phiPrev"])
+                    * (1 - np.exp(-dae.Time()/self.tau_ramp()))
                     )
             else:
-                eq.Residual = self.phi_applied() - config["Vset"]
+                eq.Residual = self.phi_applied() - self.Vset()
         elif self.profileType == "CP":
             # constant power constraint
             ndDVref = config["c", "phiRef"]
@@ -473,70 +498,43 @@ class ModCell(dae.daeModel):
             if config["tramp"] > 0:
                 eq.Residual = self.current()*(self.phi_applied() + ndDVref) - (
                     config["currPrev"]*(config["phiPrev"] + ndDVref)
-                    + (config["power"] - (config["currPrev"]*(config["phiPrev"]
-                                                              + ndDVref)))
-                    * (1 - np.exp(-dae.Time()/(config["tend"]*config["tramp"])))
+                    + (self.power() - (config["currPrev"]*(config["phiPrev"]
+                                                           + ndDVref)))
+                    * (1 - np.exp(-dae.Time()/self.tau_ramp()))
                     )
             else:
-                eq.Residual = self.current()*(self.phi_applied() + ndDVref) - config["power"]
-        elif self.profileType == "CCsegments":
-            if config["tramp"] > 0:
-                config["segments_setvec"][0] = config["currPrev"]
-                self.segSet = extern_funcs.InterpTimeScalar(
-                    "segSet", self, dae.unit(), dae.Time(),
-                    config["segments_tvec"], config["segments_setvec"])
-                eq = self.CreateEquation("Total_Current_Constraint")
-                eq.Residual = self.current() - self.segSet()
-
-            # CCsegments implemented as discontinuous equations
+                eq.Residual = self.current()*(self.phi_applied() + ndDVref) - self.power()
+        elif self.profileType in ["CCsegments", "CVsegments"]:
+            if self.profileType == "CCsegments":
+                name, var, prev = "Total_Current_Constraint", self.current, config["currPrev"]
             else:
-                # First segment
-                time = config["segments"][0][1]
-                self.IF(dae.Time() < dae.Constant(time*s), 1.e-3)
-                eq = self.CreateEquation("Total_Current_Constraint")
-                eq.Residual = self.current() - config["segments"][0][0]
-
-                # Middle segments
-                for i in range(1,len(config["segments"])-1):
-                    time = time+config["segments"][i][1]
-                    self.ELSE_IF(dae.Time() < dae.Constant(time*s), 1.e-3)
-                    eq = self.CreateEquation("Total_Current_Constraint")
-                    eq.Residual = self.current() - config["segments"][i][0]
-
-                # Last segment
-                self.ELSE()
-                eq = self.CreateEquation("Total_Current_Constraint")
-                eq.Residual = self.current() - config["segments"][-1][0]
-                self.END_IF()
-
-        elif self.profileType == "CVsegments":
+                name, var, prev = "applied_potential", self.phi_applied, config["phiPrev"]
             if config["tramp"] > 0:
-                config["segments_setvec"][0] = config["phiPrev"]
-                self.segSet = extern_funcs.InterpTimeScalar(
-                    "segSet", self, dae.unit(), dae.Time(),
+                config["segments_setvec"][0] = prev
+                self.segInterp = extern_funcs.InterpTimeScalar(
+                    "segInterp", self, dae.unit(), dae.Time(),
                     config["segments_tvec"], config["segments_setvec"])
-                eq = self.CreateEquation("applied_potential")
-                eq.Residual = self.phi_applied() - self.segSet()
+                eq = self.CreateEquation(name)
+                eq.Residual = var() - self.segInterp()
 
-            # CVsegments implemented as discontinuous equations
+            # Segments implemented as discontinuous equations
             else:
+                Nseg = len(config["segments"])
                 # First segment
-                time = config["segments"][0][1]
-                self.IF(dae.Time() < dae.Constant(time*s), 1.e-3)
-                eq = self.CreateEquation("applied_potential")
-                eq.Residual = self.phi_applied() - config["segments"][0][0]
+                self.IF(dae.Time() < self.segEnd(0)*dae.Constant(1*s), 1.e-3)
+                eq = self.CreateEquation(name)
+                eq.Residual = var() - self.segSet(0)
 
                 # Middle segments
-                for i in range(1,len(config["segments"])-1):
-                    time = time+config["segments"][i][1]
-                    self.ELSE_IF(dae.Time() < dae.Constant(time*s), 1.e-3)
-                    eq = self.CreateEquation("applied_potential")
-                    eq.Residual = self.phi_applied() - config["segments"][i][0]
+                for i in range(1, Nseg-1):
+                    self.ELSE_IF(dae.Time() < self.segEnd(i)*dae.Constant(1*s), 1.e-3)
+                    eq = self.CreateEquation(name)
+                    eq.Residual = var() - self.segSet(i)
 
                 # Last segment
                 self.ELSE()
-                eq = self.CreateEquation("applied_potential")
-                eq.Residual = self.phi_applied() - config["segments"][-1][0]
+                eq = self.CreateEquation(name)
+                eq.Residual = var() - self.segSet(Nseg-1)
                 self.END_IF()
 
         for eq in self.Equations:
@@ -559,70 +557,3 @@ class ModCell(dae.daeModel):
                 self.ON_CONDITION((self.cycle.cycle_number() >= config["totalCycle"]+1)
                                   & (self.endCondition() < 1),
                                   setVariableValues=[(self.endCondition, 3)])
-
-
-def get_lyte_internal_fluxes(c_lyte, phi_lyte, disc, config):
-    zp, zm, nup, num = config["zp"], config["zm"], config["nup"], config["num"]
-    nu = nup + num
-    T = config["T"]
-    dxd1 = disc["dxd1"]
-    eps_o_tau = disc["eps_o_tau"]
-
-    # Get concentration at cell edges using weighted mean
-    wt = utils.pad_vec(disc["dxvec"])
-
-    c_edges_int = utils.weighted_linear_mean(c_lyte, wt)
-
-    if config["elyteModelType"] == "dilute":
-        # Get porosity at cell edges using weighted harmonic mean
-        eps_o_tau_edges = utils.weighted_linear_mean(eps_o_tau, wt)
-        Dp = eps_o_tau_edges * config["Dp"]
-        Dm = eps_o_tau_edges * config["Dm"]
-        Nm_edges_int = num*(-Dm*np.diff(c_lyte)/dxd1
-                            - Dm/T*zm*c_edges_int*np.diff(phi_lyte)/dxd1)
-        i_edges_int = (-((nup*zp*Dp + num*zm*Dm)*np.diff(c_lyte)/dxd1)
-                       - (nup*zp**2*Dp + num*zm**2*Dm)/T*c_edges_int*np.diff(phi_lyte)/dxd1)
-    elif config["elyteModelType"] == "SM":
-        SMset = config["SMset"]
-        elyte_function = utils.import_function(config["SMset_filename"], SMset,
-                                               mpet_module=f"mpet.electrolyte.{SMset}")
-        D_fs, sigma_fs, thermFac, tp0 = elyte_function()[:-1]
-
-        # Get diffusivity and conductivity at cell edges using weighted harmonic mean
-        D_edges = utils.weighted_harmonic_mean(eps_o_tau*D_fs(c_lyte, T), wt)
-        sigma_edges = utils.weighted_harmonic_mean(eps_o_tau*sigma_fs(c_lyte, T), wt)
-
-        sp, n = config["sp"], config["n"]
-        # there is an error in the MPET paper, temperature dependence should be
-        # in sigma and not outside of sigma
-        i_edges_int = -sigma_edges * (
-            np.diff(phi_lyte)/dxd1
-            + nu*T*(sp/(n*nup)+tp0(c_edges_int, T)/(zp*nup))
-            * thermFac(c_edges_int, T)
-            * np.diff(np.log(c_lyte))/dxd1
-            )
-        Nm_edges_int = num*(-D_edges*np.diff(c_lyte)/dxd1
-                            + (1./(num*zm)*(1-tp0(c_edges_int, T))*i_edges_int))
-    elif config["elyteModelType"] == "solid":
-        SMset = config["SMset"]
-        elyte_function = utils.import_function(config["SMset_filename"], SMset,
-                                               mpet_module=f"mpet.electrolyte.{SMset}")
-        D_fs, sigma_fs, thermFac, tp0 = elyte_function()[:-1]
-        # sigma_fs and thermFac not used bc the solid system is considered linear
-        a_slyte = config["a_slyte"]
-        c_edges_int_norm = c_edges_int / config["cmax"]
-
-        # Get diffusivity at cell edges using weighted harmonic mean
-        eps_o_tau_edges = utils.weighted_linear_mean(eps_o_tau, wt)
-        Dp = eps_o_tau_edges * config["Dp"]
-        Dm = (zp * Dp - zp * Dp * tp0) / (tp0 * zm)
-        Dp0 = Dp / (1-c_edges_int_norm)  # should be c0/cmax
-        Dchemp = Dp0 * (1 - 2 * a_slyte * c_edges_int_norm + 2 * a_slyte * c_edges_int_norm**2)
-        Dchemm = Dm
-        Damb = (zp * Dp * Dchemm + zm * Dm * Dchemp) / (zp * Dp - zm * Dm)
-        i_edges_int = (-((nup*zp*Dchemp + num*zm*Dchemm)*np.diff(c_lyte)/dxd1)
-                       - (nup * zp ** 2 * Dp0 * (1 - c_edges_int_norm) + num * zm ** 2 * Dm) / T
-                       * c_edges_int * np.diff(phi_lyte) / dxd1)
-        Nm_edges_int = num * (-Damb * np.diff(c_lyte) / dxd1
-                              + (1. / (num * zm) * (1 - tp0) * i_edges_int))
-    return Nm_edges_int, i_edges_int
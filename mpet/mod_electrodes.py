@@ -20,21 +20,27 @@ import numpy as np
 import scipy.sparse as sprs
 import scipy.interpolate as sintrp
 
-import mpet.geometry as geo
+import mpet.extern_funcs as extern_funcs
 import mpet.ports as ports
+import mpet.profiler as profiler
 import mpet.props_am as props_am
 import mpet.utils as utils
 from mpet.daeVariableTypes import mole_frac_t
+from mpet.model_funcs import calc_eta, calc_mu_O, get_particle_template
 
 
 class Mod2var(dae.daeModel):
     def __init__(self, config, trode, vInd, pInd,
-                 Name, Parent=None, Description=""):
+                 Name, Parent=None, Description="", params=None):
         super().__init__(Name, Parent, Description)
 
         self.config = config
         self.trode = trode
         self.ind = (vInd, pInd)
+        # Parameters of this particle, see mpet.config.particle_params
+        if params is None:
+            params = config.get_particle_params(trode, self.ind)
+        self.params = params
 
         # Domain
         self.Dmn = dae.daeDomain("discretizationDomain", self, dae.unit(),
@@ -64,11 +70,10 @@ class Mod2var(dae.daeModel):
             self.Rxn1 = dae.daeVariable("Rxn1", dae.no_t, self, "Rate of reaction 1", [self.Dmn])
             self.Rxn2 = dae.daeVariable("Rxn2", dae.no_t, self, "Rate of reaction 2", [self.Dmn])
 
-        # Get reaction rate function
-        rxnType = config[trode, "rxnType"]
-        self.calc_rxn_rate = utils.import_function(config[trode, "rxnType_filename"],
-                                                   rxnType,
-                                                   f"mpet.electrode.reactions.{rxnType}")
+        # Discretization data and material functions shared by all
+        # particles with the same type, shape, size and material
+        self.template = get_particle_template(config, params)
+        self.calc_rxn_rate = self.template.calc_rxn_rate
 
         # Ports
         self.portInLyte = ports.portFromElyte(
@@ -88,17 +93,20 @@ class Mod2var(dae.daeModel):
         """
         Shorthand to retrieve electrode-specific value
         """
+        if item in self.params:
+            return self.params[item]
         value = self.config[self.trode, item]
         # check if it is a particle-specific parameter
         if item in self.config.params_per_particle:
             value = value[self.ind]
         return value
 
+    @profiler.timed("DeclareEquations")
     def DeclareEquations(self):
         dae.daeModel.DeclareEquations(self)
         N = self.get_trode_param("N")  # number of grid points in particle
         T = self.config["T"]  # nondimensional temperature
-        r_vec, volfrac_vec = geo.get_unit_solid_discr(self.get_trode_param('shape'), N)
+        volfrac_vec = self.template.volfrac_vec
 
         # Prepare noise
         self.noise1 = self.noise2 = None
@@ -161,7 +169,7 @@ class Mod2var(dae.daeModel):
         c2_surf = c2
         (mu1R_surf, mu2R_surf), (act1R_surf, act2R_surf) = calc_muR(
             (c1_surf, c2_surf), (self.c1bar(), self.c2bar()), self.config,
-            self.trode, self.ind)
+            self.trode, self.ind, self.params)
         eta1 = calc_eta(mu1R_surf, muO)
         eta2 = calc_eta(mu2R_surf, muO)
         eta1_eff = eta1 + self.Rxn1()*self.get_trode_param("Rfilm")
@@ -193,13 +201,13 @@ class Mod2var(dae.daeModel):
         T = self.config["T"]
         # Equations for concentration evolution
         # Mass matrix, M, where M*dcdt = RHS, where c and RHS are vectors
-        Mmat = get_Mmat(self.get_trode_param('shape'), N)
-        dr, edges = geo.get_dr_edges(self.get_trode_param('shape'), N)
+        dr = self.template.dr
 
         # Get solid particle chemical potential, overpotential, reaction rate
         if self.get_trode_param("type") in ["diffn2", "CHR2"]:
             (mu1R, mu2R), (act1R, act2R) = calc_muR(
-                (c1, c2), (self.c1bar(), self.c2bar()), self.config, self.trode, self.ind)
+                (c1, c2), (self.c1bar(), self.c2bar()), self.config, self.trode, self.ind,
+                self.params)
             c1_surf = c1[-1]
             c2_surf = c2[-1]
             mu1R_surf, act1R_surf = mu1R[-1], act1R[-1]
@@ -210,7 +218,8 @@ class Mod2var(dae.daeModel):
             c1_surf = c1
             c2_surf = c2
             (mu1R, mu2R), (act1R, act2R) = calc_muR(
-                (c1, c2), (self.c1bar(), self.c2bar()), self.config, self.trode, self.ind)
+                (c1, c2), (self.c1bar(), self.c2bar()), self.config, self.trode, self.ind,
+                self.params)
             mu1R_surf, act1R_surf = mu1R, act1R
             mu2R_surf, act2R_surf = mu2R, act2R
             eta1 = calc_eta(mu1R, muO)
@@ -251,19 +260,13 @@ class Mod2var(dae.daeModel):
             # flux of Li at the surface.
             Flux1_bc = -0.5 * self.Rxn1()
             Flux2_bc = -0.5 * self.Rxn2()
-            Dfunc_name = self.get_trode_param("Dfunc")
-            Dfunc = utils.import_function(self.get_trode_param("Dfunc_filename"),
-                                          Dfunc_name,
-                                          f"mpet.electrode.diffusion.{Dfunc_name}")
+            Dfunc = self.template.Dfunc
             if self.get_trode_param("type") == "CHR2":
                 noise1, noise2 = noises
                 Flux1_vec, Flux2_vec = calc_flux_CHR2(
                     c1, c2, mu1R, mu2R, self.get_trode_param("D"), Dfunc,
                     self.get_trode_param("E_D"), Flux1_bc, Flux2_bc, dr, T, noise1, noise2)
-            if self.get_trode_param("shape") == "sphere":
-                area_vec = 4*np.pi*edges**2
-            elif self.get_trode_param("shape") == "cylinder":
-                area_vec = 2*np.pi*edges  # per unit height
+            area_vec = self.template.area_vec
             RHS1 = -np.diff(Flux1_vec * area_vec)
             RHS2 = -np.diff(Flux2_vec * area_vec)
 #            kinterlayer = 1e-3
@@ -279,8 +282,8 @@ class Mod2var(dae.daeModel):
         dc2dt_vec = np.empty(N, dtype=object)
         dc1dt_vec[0:N] = [self.c1.dt(k) for k in range(N)]
         dc2dt_vec[0:N] = [self.c2.dt(k) for k in range(N)]
-        LHS1_vec = MX(Mmat, dc1dt_vec)
-        LHS2_vec = MX(Mmat, dc2dt_vec)
+        LHS1_vec = self.template.mass_matvec(dc1dt_vec)
+        LHS2_vec = self.template.mass_matvec(dc2dt_vec)
         for k in range(N):
             eq1 = self.CreateEquation("dc1sdt_discr{k}".format(k=k))
             eq2 = self.CreateEquation("dc2sdt_discr{k}".format(k=k))
@@ -290,12 +293,16 @@ class Mod2var(dae.daeModel):
 
 class Mod1var(dae.daeModel):
     def __init__(self, config, trode, vInd, pInd,
-                 Name, Parent=None, Description=""):
+                 Name, Parent=None, Description="", params=None):
         super().__init__(Name, Parent, Description)
 
         self.config = config
         self.trode = trode
         self.ind = (vInd, pInd)
+        # Parameters of this particle, see mpet.config.particle_params
+        if params is None:
+            params = config.get_particle_params(trode, self.ind)
+        self.params = params
 
         # Domain
         self.Dmn = dae.daeDomain("discretizationDomain", self, dae.unit(),
@@ -317,16 +324,18 @@ class Mod1var(dae.daeModel):
             "cbar", mole_frac_t, self,
             "Average concentration in active particle")
         self.dcbardt = dae.daeVariable("dcbardt", dae.no_t, self, "Rate of particle filling")
-        if config[trode, "type"] not in ["ACR", "ACR_Diff"]:
+        if self.get_trode_param("type") not in ["ACR", "ACR_Diff"]:
             self.Rxn = dae.daeVariable("Rxn", dae.no_t, self, "Rate of reaction")
         else:
             self.Rxn = dae.daeVariable("Rxn", dae.no_t, self, "Rate of reaction", [self.Dmn])
 
-        # Get reaction rate function
-        rxnType = config[trode, "rxnType"]
-        self.calc_rxn_rate = utils.import_function(config[trode, "rxnType_filename"],
-                                                   rxnType,
-                                                   f"mpet.electrode.reactions.{rxnType}")
+        # External functions must be kept alive as long as the model exists
+        self.extern_funcs = []
+
+        # Discretization data and material functions shared by all
+        # particles with the same type, shape, size and material
+        self.template = get_particle_template(config, params)
+        self.calc_rxn_rate = self.template.calc_rxn_rate
 
         # Ports
         self.portInLyte = ports.portFromElyte(
@@ -347,17 +356,20 @@ class Mod1var(dae.daeModel):
         """
         Shorthand to retrieve electrode-specific value
         """
+        if item in self.params:
+            return self.params[item]
         value = self.config[self.trode, item]
         # check if it is a particle-specific parameter
         if item in self.config.params_per_particle:
             value = value[self.ind]
         return value
 
+    @profiler.timed("DeclareEquations")
     def DeclareEquations(self):
         dae.daeModel.DeclareEquations(self)
         N = self.get_trode_param("N")  # number of grid points in particle
         T = self.config["T"]  # nondimensional temperature
-        r_vec, volfrac_vec = geo.get_unit_solid_discr(self.get_trode_param('shape'), N)
+        volfrac_vec = self.template.volfrac_vec
 
         # Prepare noise
         self.noise = None
@@ -410,7 +422,7 @@ class Mod1var(dae.daeModel):
         T = self.config["T"]
         c_surf = c
         muR_surf, actR_surf = calc_muR(c_surf, self.cbar(), self.config,
-                                       self.trode, self.ind)
+                                       self.trode, self.ind, self.params, model=self)
         eta = calc_eta(muR_surf, muO)
         eta_eff = eta + self.Rxn()*self.get_trode_param("Rfilm")
         if self.get_trode_param("noise"):
@@ -430,8 +442,7 @@ class Mod1var(dae.daeModel):
         T = self.config["T"]
         # Equations for concentration evolution
         # Mass matrix, M, where M*dcdt = RHS, where c and RHS are vectors
-        Mmat = get_Mmat(self.get_trode_param('shape'), N)
-        dr, edges = geo.get_dr_edges(self.get_trode_param('shape'), N)
+        dr = self.template.dr
 
         # Get solid particle chemical potential, overpotential, reaction rate
         if self.get_trode_param("type") in ["ACR", "ACR_Diff"]:
@@ -449,9 +460,10 @@ class Mod1var(dae.daeModel):
 
         if self.get_trode_param("type") in ["ACR", "ACR_Diff"]:
             muR_surf, actR_surf = calc_muR(
-                c_surf, self.cbar(), self.config, self.trode, self.ind)
+                c_surf, self.cbar(), self.config, self.trode, self.ind, self.params, model=self)
         elif self.get_trode_param("type") in ["diffn", "CHR"]:
-            muR, actR = calc_muR(c, self.cbar(), self.config, self.trode, self.ind)
+            muR, actR = calc_muR(c, self.cbar(), self.config, self.trode, self.ind, self.params,
+                                 model=self)
             c_surf = c[-1]
             muR_surf = muR[-1]
             if actR is None:
@@ -519,25 +531,19 @@ class Mod1var(dae.daeModel):
             # Positive reaction (reduction, intercalation) is negative
             # flux of Li at the surface.
             Flux_bc = -self.Rxn()
-            Dfunc_name = self.get_trode_param("Dfunc")
-            Dfunc = utils.import_function(self.get_trode_param("Dfunc_filename"),
-                                          Dfunc_name,
-                                          f"mpet.electrode.diffusion.{Dfunc_name}")
+            Dfunc = self.template.Dfunc
             if self.get_trode_param("type") == "diffn":
                 Flux_vec = calc_flux_diffn(c, self.get_trode_param("D"), Dfunc,
                                            self.get_trode_param("E_D"), Flux_bc, dr, T, noise)
             elif self.get_trode_param("type") == "CHR":
                 Flux_vec = calc_flux_CHR(c, muR, self.get_trode_param("D"), Dfunc,
                                          self.get_trode_param("E_D"), Flux_bc, dr, T, noise)
-            if self.get_trode_param("shape") == "sphere":
-                area_vec = 4*np.pi*edges**2
-            elif self.get_trode_param("shape") == "cylinder":
-                area_vec = 2*np.pi*edges  # per unit height
+            area_vec = self.template.area_vec
             RHS = -np.diff(Flux_vec * area_vec)
 
         dcdt_vec = np.empty(N, dtype=object)
         dcdt_vec[0:N] = [self.c.dt(k) for k in range(N)]
-        LHS_vec = MX(Mmat, dcdt_vec)
+        LHS_vec = self.template.mass_matvec(dcdt_vec)
         if self.get_trode_param("type") in ["ACR_Diff"]:
             # surface diffusion in the ACR C3 model
             surf_diff_vec = calc_surf_diff(c_surf, muR_surf, self.get_trode_param("D"))
@@ -559,31 +565,6 @@ def calc_surf_diff(c_surf, muR_surf, D):
     return surf_diff
 
 
-def calc_eta(muR, muO):
-    return muR - muO
-
-
-def get_Mmat(shape, N):
-    r_vec, volfrac_vec = geo.get_unit_solid_discr(shape, N)
-    if shape == "C3":
-        Mmat = sprs.eye(N, N, format="csr")
-    elif shape in ["sphere", "cylinder"]:
-        Rs = 1.
-        # For discretization background, see Zeng & Bazant 2013
-        # Mass matrix is common for each shape, diffn or CHR
-        if shape == "sphere":
-            Vp = 4./3. * np.pi * Rs**3
-        elif shape == "cylinder":
-            Vp = np.pi * Rs**2  # per unit height
-        vol_vec = Vp * volfrac_vec
-        M1 = sprs.diags([1./8, 3./4, 1./8], [-1, 0, 1],
-                        shape=(N, N), format="csr")
-        M1[1,0] = M1[-2,-1] = 1./4
-        M2 = sprs.diags(vol_vec, 0, format="csr")
-        Mmat = M1*M2
-    return Mmat
-
-
 def calc_flux_diffn(c, D, Dfunc, E_D, Flux_bc, dr, T, noise):
     N = len(c)
     Flux_vec = np.empty(N+1, dtype=object)
@@ -633,31 +614,23 @@ def calc_flux_CHR2(c1, c2, mu1_R, mu2_R, D, Dfunc, E_D, Flux1_bc, Flux2_bc, dr,
     return Flux1_vec, Flux2_vec
 
 
-def calc_mu_O(c_lyte, phi_lyte, phi_sld, T, config, trode):
-    elyteModelType = config["elyteModelType"]
-
-    if config[f"simInterface_{trode}"]:
-        elyteModelType = config["interfaceModelType"]
-
-    if elyteModelType == "SM":
-        mu_lyte = phi_lyte
-        act_lyte = c_lyte
-    elif elyteModelType == "dilute":
-        act_lyte = c_lyte
-        mu_lyte = T*np.log(act_lyte) + phi_lyte
-    elif elyteModelType == "solid":
-        a_slyte = config['a_slyte']
-        cmax = config['cmax']
-        act_lyte = (c_lyte / cmax) / (1 - c_lyte / cmax)*np.exp(a_slyte*(1 - 2*c_lyte))
-        mu_lyte = phi_lyte
-    mu_O = mu_lyte - phi_sld
-    return mu_O, act_lyte
+def calc_muR(c, cbar, config, trode, ind, params=None, model=None):
+    funcs = props_am.get_muRfuncs(config, trode, ind, params)
+    muR_ref = config[trode, "muR_ref"]
+    if model is not None and config[trode, "muRfunc_tabulate"]:
+        return calc_muR_tabulated(c, funcs.get_muR_tables(), muR_ref, model)
+    muR, actR = funcs.muRfunc(c, cbar, muR_ref)
+    return muR, actR
 
 
-def calc_muR(c, cbar, config, trode, ind):
-    muRfunc = props_am.muRfuncs(config, trode, ind).muRfunc
-    muR_ref = config[trode, "muR_ref"]
-    muR, actR = muRfunc(c, cbar, muR_ref)
+def calc_muR_tabulated(c, tables, muR_ref, model):
+    """Evaluate the tabulated chemical potential and activity at each element of c
+    as external functions of the given model."""
+    muR_table, actR_table = tables
+    muR = extern_funcs.spline_vector(model, muR_table, c, "muR_table") + np.ravel(muR_ref)[0]
+    actR = None
+    if actR_table is not None:
+        actR = extern_funcs.spline_vector(model, actR_table, c, "actR_table")
     return muR, actR
 
 
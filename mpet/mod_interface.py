@@ -1,7 +1,7 @@
 import numpy as np
 
 import daetools.pyDAE as dae
-from mpet import ports, utils
+from mpet import ports, profiler, props_elyte, utils
 import mpet.geometry as geom
 from mpet.daeVariableTypes import mole_frac_t, elec_pot_t
 
@@ -17,6 +17,8 @@ class InterfaceRegion(dae.daeModel):
                  trode=None):
         super().__init__(Name, Parent, Description)
         self.config = config
+        # external functions used by the equations, kept alive with the model
+        self.extern_funcs = []
 
         # Domain
         self.Dmn = dae.daeDomain("discretizationDomain", self, dae.unit(),
@@ -63,6 +65,7 @@ class InterfaceRegion(dae.daeModel):
         self.pInd = pInd
         self.trode = trode
 
+    @profiler.timed("DeclareEquations")
     def DeclareEquations(self):
         super().DeclareEquations()
         config = self.config
@@ -95,7 +98,7 @@ class InterfaceRegion(dae.daeModel):
         else:
             phitmp = np.hstack((self.portInLyte.phi_lyte(), phivec, phivec[-1]))
 
-        Nm_edges, i_edges = get_interface_internal_fluxes(ctmp, phitmp, disc, config)
+        Nm_edges, i_edges = get_interface_internal_fluxes(ctmp, phitmp, disc, config, self)
 
         # The reaction rate per volume (Rvp) is normalized to the total length of the electrode.
         dlc = config["L"][self.trode]/config["Nvol"][self.trode]
@@ -148,7 +151,7 @@ class InterfaceRegion(dae.daeModel):
             eq.CheckUnitsConsistency = False
 
 
-def get_interface_internal_fluxes(c, phi, disc, config):
+def get_interface_internal_fluxes(c, phi, disc, config, model=None):
     zp, zm, nup, num = config["zp"], config["zm"], config["nup"], config["num"]
     nu = nup + num
     T = config["T"]
@@ -172,32 +175,29 @@ def get_interface_internal_fluxes(c, phi, disc, config):
                        - (nup*zp**2*Dp + num*zm**2*Dm)/T*c_edges_int*np.diff(phi)/dxd1)
 #        i_edges_int = zp*Np_edges_int + zm*Nm_edges_int
     elif config["interfaceModelType"] == "SM":
-        SMset = config["SMset"]
-        elyte_function = utils.import_function(config["SMset_filename"], SMset,
-                                               mpet_module=f"mpet.electrolyte.{SMset}")
-        D_fs, sigma_fs, thermFac, tp0 = elyte_function()[:-1]
+        D_fs, sigma_fs, thermFac, tp0 = props_elyte.get_elyte_properties(config, model)
 
         # Get diffusivity and conductivity at cell edges using weighted harmonic mean
         D_edges = utils.weighted_harmonic_mean(eps_o_tau*D_fs(c, T), wt)
         sigma_edges = utils.weighted_harmonic_mean(eps_o_tau*sigma_fs(c, T), wt)
+        # Transference number and thermodynamic factor at cell edges
+        tp0_edges = tp0(c_edges_int, T)
+        thermFac_edges = thermFac(c_edges_int, T)
 
         sp, n = config["sp"], config["n"]
         # there is an error in the MPET paper, temperature dependence should be
         # in sigma and not outside of sigma
         i_edges_int = -sigma_edges * (
             np.diff(phi)/dxd1
-            + nu*T*(sp/(n*nup)+tp0(c_edges_int, T)/(zp*nup))
-            * thermFac(c_edges_int, T)
+            + nu*T*(sp/(n*nup)+tp0_edges/(zp*nup))
+            * thermFac_edges
             * np.diff(np.log(c))/dxd1
             )
         Nm_edges_int = num*(-D_edges*np.diff(c)/dxd1
-                            + (1./(num*zm)*(1-tp0(c_edges_int, T))*i_edges_int))
+                            + (1./(num*zm)*(1-tp0_edges)*i_edges_int))
 
     elif config["interfaceModelType"] == "solid":
-        SMset = config["SMset"]
-        elyte_function = utils.import_function(config["SMset_filename"], SMset,
-                                               mpet_module=f"mpet.electrolyte.{SMset}")
-        D_fs, sigma_fs, thermFac, tp0 = elyte_function()[:-1]
+        D_fs, sigma_fs, thermFac, tp0 = props_elyte.get_elyte_properties(config)
 
         a_slyte = config["a_slyte"]
         tp0 = 0.99999
@@ -0,0 +1,210 @@
+"""Parts of the cell and particle models that do not depend on daetools.
+
+They are shared by the daetools models of :mod:`mpet.mod_cell` and
+:mod:`mpet.mod_electrodes` and by the numpy backend (mpet.backends.numpy), and evaluate
+on floats as well as on daetools expressions.
+"""
+import os
+import weakref
+
+import numpy as np
+import scipy.sparse as sprs
+
+import mpet.geometry as geo
+import mpet.props_elyte as props_elyte
+import mpet.utils as utils
+
+# Dictionary of end conditions
+endConditions = {
+    1:"Vmax reached",
+    2:"Vmin reached",
+    3:"End condition for CCCVCPcycle reached"}
+
+
+class ParticleTemplate():
+    """Discretization data and material functions for one kind of particle.
+
+    Every particle with the same type, shape, number of grid points and
+    reaction/diffusion functions shares a single template, so the mass
+    matrix, grid vectors and imported functions are only built once per
+    simulation instead of once per particle.
+    """
+    def __init__(self, ptype, shape, N, rxnType, rxnType_filename, Dfunc, Dfunc_filename):
+        self.ptype = ptype
+        self.shape = shape
+        self.N = N
+        self.r_vec, self.volfrac_vec = geo.get_unit_solid_discr(shape, N)
+        self.dr, self.edges = geo.get_dr_edges(shape, N)
+        self.area_vec = None
+        if self.edges is not None:
+            if shape == "sphere":
+                self.area_vec = 4*np.pi*self.edges**2
+            elif shape == "cylinder":
+                self.area_vec = 2*np.pi*self.edges  # per unit height
+        # The mass matrix is only needed for 1D particles. For C3 particles
+        # it is the identity, so the multiplication can be skipped entirely.
+        self.Mmat = None
+        self.Mmat_identity = shape == "C3"
+        self.Mrows = None
+        if N > 1:
+            self.Mmat = get_Mmat(shape, N)
+            self.Mrows = [(self.Mmat.indices[low:up], self.Mmat.data[low:up])
+                          for low, up in zip(self.Mmat.indptr[:-1], self.Mmat.indptr[1:])]
+
+        self.calc_rxn_rate = utils.import_function(rxnType_filename, rxnType,
+                                                   f"mpet.electrode.reactions.{rxnType}")
+        # Only diffusion-type particles use the diffusivity function
+        self.Dfunc = None
+        if ptype in ["diffn", "CHR", "diffn2", "CHR2"]:
+            self.Dfunc = utils.import_function(Dfunc_filename, Dfunc,
+                                               f"mpet.electrode.diffusion.{Dfunc}")
+
+    def mass_matvec(self, objvec):
+        """Multiply the mass matrix with a vector of (adouble) objects."""
+        if self.Mmat_identity:
+            return objvec
+        n = objvec.shape[0]
+        if objvec.dtype == object:
+            out = np.empty(n, dtype=object)
+        else:
+            out = np.zeros(n, dtype=float)
+        for i, (indices, data) in enumerate(self.Mrows):
+            out[i] = np.sum(data * objvec[indices]) if len(indices) > 0 else 0.0
+        return out
+
+
+# Templates per config, shared between all particles of a simulation with an
+# identical key, see get_particle_template
+_particle_templates = weakref.WeakKeyDictionary()
+
+
+def get_particle_template(config, params):
+    """Return the (cached) ParticleTemplate for a particle with the given ParticleParams.
+
+    Templates are cached per config and keyed on the absolute paths of the reaction
+    and diffusion function files, so that simulations in the same process only share
+    a template if they use the same config.
+    """
+    key = (params.type, params.shape, int(params.N),
+           params.rxnType, _abspath(params.rxnType_filename),
+           params.Dfunc, _abspath(params.Dfunc_filename))
+    cache = _particle_templates.setdefault(config, {})
+    template = cache.get(key)
+    if template is None:
+        template = ParticleTemplate(*key)
+        cache[key] = template
+    return template
+
+
+def _abspath(filename):
+    return None if filename is None else os.path.abspath(filename)
+
+
+def calc_eta(muR, muO):
+    return muR - muO
+
+
+def get_Mmat(shape, N):
+    r_vec, volfrac_vec = geo.get_unit_solid_discr(shape, N)
+    if shape == "C3":
+        Mmat = sprs.eye(N, N, format="csr")
+    elif shape in ["sphere", "cylinder"]:
+        Rs = 1.
+        # For discretization background, see Zeng & Bazant 2013
+        # Mass matrix is common for each shape, diffn or CHR
+        if shape == "sphere":
+            Vp = 4./3. * np.pi * Rs**3
+        elif shape == "cylinder":
+            Vp = np.pi * Rs**2  # per unit height
+        vol_vec = Vp * volfrac_vec
+        M1 = sprs.diags([1./8, 3./4, 1./8], [-1, 0, 1],
+                        shape=(N, N), format="csr")
+        M1[1,0] = M1[-2,-1] = 1./4
+        M2 = sprs.diags(vol_vec, 0, format="csr")
+        Mmat = M1*M2
+    return Mmat
+
+
+def calc_mu_O(c_lyte, phi_lyte, phi_sld, T, config, trode):
+    elyteModelType = config["elyteModelType"]
+
+    if config[f"simInterface_{trode}"]:
+        elyteModelType = config["interfaceModelType"]
+
+    if elyteModelType == "SM":
+        mu_lyte = phi_lyte
+        act_lyte = c_lyte
+    elif elyteModelType == "dilute":
+        act_lyte = c_lyte
+        mu_lyte = T*np.log(act_lyte) + phi_lyte
+    elif elyteModelType == "solid":
+        a_slyte = config['a_slyte']
+        cmax = config['cmax']
+        act_lyte = (c_lyte / cmax) / (1 - c_lyte / cmax)*np.exp(a_slyte*(1 - 2*c_lyte))
+        mu_lyte = phi_lyte
+    mu_O = mu_lyte - phi_sld
+    return mu_O, act_lyte
+
+
+def get_lyte_internal_fluxes(c_lyte, phi_lyte, disc, config, model=None):
+    zp, zm, nup, num = config["zp"], config["zm"], config["nup"], config["num"]
+    nu = nup + num
+    T = config["T"]
+    dxd1 = disc["dxd1"]
+    eps_o_tau = disc["eps_o_tau"]
+
+    # Get concentration at cell edges using weighted mean
+    wt = np.asarray(utils.pad_vec(disc["dxvec"]), dtype=float)
+
+    c_edges_int = utils.weighted_linear_mean(c_lyte, wt)
+
+    if config["elyteModelType"] == "dilute":
+        # Get porosity at cell edges using weighted harmonic mean
+        eps_o_tau_edges = utils.weighted_linear_mean(eps_o_tau, wt)
+        Dp = eps_o_tau_edges * config["Dp"]
+        Dm = eps_o_tau_edges * config["Dm"]
+        Nm_edges_int = num*(-Dm*np.diff(c_lyte)/dxd1
+                            - Dm/T*zm*c_edges_int*np.diff(phi_lyte)/dxd1)
+        i_edges_int = (-((nup*zp*Dp + num*zm*Dm)*np.diff(c_lyte)/dxd1)
+                       - (nup*zp**2*Dp + num*zm**2*Dm)/T*c_edges_int*np.diff(phi_lyte)/dxd1)
+    elif config["elyteModelType"] == "SM":
+        D_fs, sigma_fs, thermFac, tp0 = props_elyte.get_elyte_properties(config, model)
+
+        # Get diffusivity and conductivity at cell edges using weighted harmonic mean
+        D_edges = utils.weighted_harmonic_mean(eps_o_tau*D_fs(c_lyte, T), wt)
+        sigma_edges = utils.weighted_harmonic_mean(eps_o_tau*sigma_fs(c_lyte, T), wt)
+        # Transference number and thermodynamic factor at cell edges
+        tp0_edges = tp0(c_edges_int, T)
+        thermFac_edges = thermFac(c_edges_int, T)
+
+        sp, n = config["sp"], config["n"]
+        # there is an error in the MPET paper, temperature dependence should be
+        # in sigma and not outside of sigma
+        i_edges_int = -sigma_edges * (
+            np.diff(phi_lyte)/dxd1
+            + nu*T*(sp/(n*nup)+tp0_edges/(zp*nup))
+            * thermFac_edges
+            * np.diff(np.log(c_lyte))/dxd1
+            )
+        Nm_edges_int = num*(-D_edges*np.diff(c_lyte)/dxd1
+                            + (1./(num*zm)*(1-tp0_edges)*i_edges_int))
+    elif config["elyteModelType"] == "solid":
+        D_fs, sigma_fs, thermFac, tp0 = props_elyte.get_elyte_properties(config)
+        # sigma_fs and thermFac not used bc the solid system is considered linear
+        a_slyte = config["a_slyte"]
+        c_edges_int_norm = c_edges_int / config["cmax"]
+
+        # Get diffusivity at cell edges using weighted harmonic mean
+        eps_o_tau_edges = utils.weighted_linear_mean(eps_o_tau, wt)
+        Dp = eps_o_tau_edges * config["Dp"]
+        Dm = (zp * Dp - zp * Dp * tp0) / (tp0 * zm)
+        Dp0 = Dp / (1-c_edges_int_norm)  # should be c0/cmax
+        Dchemp = Dp0 * (1 - 2 * a_slyte * c_edges_int_norm + 2 * a_slyte * c_edges_int_norm**2)
+        Dchemm = Dm
+        Damb = (zp * Dp * Dchemm + zm * Dm * Dchemp) / (zp * Dp - zm * Dm)
+        i_edges_int = (-((nup*zp*Dchemp + num*zm*Dchemm)*np.diff(c_lyte)/dxd1)
+                       - (nup * zp ** 2 * Dp0 * (1 - c_edges_int_norm) + num * zm ** 2 * Dm) / T
+                       * c_edges_int * np.diff(phi_lyte) / dxd1)
+        Nm_edges_int = num * (-Damb * np.diff(c_lyte) / dxd1
+                              + (1. / (num * zm) * (1 - tp0) * i_edges_int))
+    return Nm_edges_int, i_edges_int
@@ -0,0 +1,482 @@
+"""Writing of the output data files of a simulation.
+
+The writers collect the reported values of all variables in the layout of the output
+files (see :class:`OutputWriter`) and write them in one of the formats of the
+dataReporter option. They do not depend on daetools: the data reporters of
+:mod:`mpet.data_reporting` are daetools data reporters that write their data with these
+writers, and simulations that did not run in a daetools process (see mpet.backends)
+write their variables with :func:`write_output_data`.
+"""
+import fnmatch
+import os
+import re
+
+import h5py
+import numpy as np
+import scipy.io as sio
+
+import mpet.utils as utils
+
+
+class OutputWriter:
+    """Collects the reported data of a simulation in the layout of the output files.
+    The data reporters of mpet.data_reporting write their data with these classes."""
+    # layout of the particle data and reporting strides, see configure_writer
+    particle_layout = "perParticle"
+    psd_num = None
+    report_stride = []
+    # variables of a simulation that did not run in a daetools process, see write_output_data
+    variables = None
+    # drop the first reported time point, which a resumed simulation (mpet.checkpoint)
+    # shares with the output of the checkpoint
+    skip_first = False
+    # store the last time point of variables with a reporting stride, which is not done
+    # for the output of a checkpoint that the simulation continues from
+    final_output = True
+    # reported time points of this simulation that are in the output file already,
+    # which the checkpoints (mpet.checkpoint) do not write again
+    first_row = 0
+
+    def get_variables(self):
+        """The reported variables, by default those of the daetools process."""
+        if self.variables is not None:
+            return self.variables
+        return self.Process.Variables
+
+    def reported_rows(self):
+        """Number of time points reported by this simulation so far."""
+        for var in self.get_variables():
+            if get_output_key(var.Name) == 'phi_applied':
+                return len(var.TimeValues)
+        return 0
+
+    def get_output_data(self):
+        """Returns the reported values by output key, the reported times, and
+        the time independent data to store along with them.
+        Variables with a reporting stride only keep every n-th time point of the
+        whole output, including the time points in the output file of the simulation
+        that is continued (see written_rows), and the last one. Their times are
+        stored as key_times."""
+        mdict = {}
+        times = None
+        for var in self.get_variables():
+            dkeybase = get_output_key(var.Name)
+            if dkeybase is not None:
+                mdict[dkeybase] = var.Values
+                if dkeybase == 'phi_applied':
+                    # only save times for voltage
+                    times = var.TimeValues
+        # the time points that are in the output file already, their last time is the end
+        # time of the output file that the times are continued from
+        start = max(self.first_row, 1 if self.skip_first else 0)
+        if start > 0:
+            mdict = {dkeybase: values[start:] for dkeybase, values in mdict.items()}
+            times = times[start:] - times[start - 1]
+        static = {}
+        if self.particle_layout == "consolidated":
+            static = utils.consolidate_particle_data(mdict, self.psd_num)
+        offset = self.written_rows()
+        for dkeybase in list(mdict.keys()):
+            stride = get_report_stride(dkeybase, self.report_stride)
+            if stride > 1:
+                rows = get_stride_rows(len(times), stride, offset, self.final_output)
+                mdict[dkeybase] = mdict[dkeybase][rows]
+                mdict[dkeybase + '_times'] = times[rows]
+        return mdict, times, static
+
+    def written_rows(self):
+        """Number of time points in the output file of an earlier simulation in the
+        same directory, which this simulation continues."""
+        return 0
+
+    def offset_stride_times(self, mdict, tend):
+        """Increment the times of variables with a reporting stride by the end time
+        of the previous simulation, for continued simulations."""
+        for dkeybase in list(mdict.keys()):
+            if get_report_stride(dkeybase, self.report_stride) > 1:
+                mdict[dkeybase + '_times'] = mdict[dkeybase + '_times'] + tend
+
+
+class Hdf5FastWriter(OutputWriter):
+    """Ignores internal particle concentrations with hdf5 data saving to be faster.
+    Input is dataReporter"""
+
+    def written_rows(self):
+        return hdf5_rows(self.ConnectionString + ".hdf5")
+
+    def WriteDataToFile(self):
+        mdict, times, static = self.get_output_data()
+        # 0 if single simulation, 1 if continued simulation
+        continued_sim = 0
+        # if we are in a directory that has continued simulations (maccor reader)
+        if os.path.isfile(self.ConnectionString + ".hdf5"):
+            if os.stat(self.ConnectionString + ".hdf5").st_size != 0:
+                continued_sim = 1
+                # remains 0 if not continued sim
+        with h5py.File(self.ConnectionString + ".hdf5", 'a') as mat_dat:
+            write_static_data(mat_dat, static)
+            if continued_sim == 1:
+                self.offset_stride_times(mdict, mat_dat['phi_applied_times'][-1])
+            for dkeybase in list(mdict.keys()):
+                # if we are in a directory that has continued simulations (maccor reader)
+                if continued_sim == 1:
+                    # increment time by the previous end time of the last simulation
+                    tend = mat_dat['phi_applied_times'][-1]
+
+                    # if particle concentrations, remove and overwrite, but not if its cbar
+                    if not is_internal_particle_data(dkeybase):
+                        # resize and append dkeybase variable
+                        mat_dat[dkeybase].resize(
+                            (mat_dat[dkeybase].shape[0] + mdict[dkeybase].shape[0]), axis=0)
+                        mat_dat[dkeybase][-mdict[dkeybase].shape[0]:] = mdict[dkeybase]
+
+                        if dkeybase == 'phi_applied':
+                            mdict['times'] = times + tend
+                            # resize and append dkeybase varibale
+                            mat_dat['phi_applied_times'].resize(
+                                (mat_dat['phi_applied_times'].shape[0]
+                                 + mdict['times'].shape[0]), axis=0)
+                            mat_dat['phi_applied_times'][-mdict['times'].shape[0]:] = \
+                                mdict['times']
+
+                    else:
+                        # overwrite the old file
+                        del mat_dat[dkeybase]
+                        mat_dat.create_dataset(
+                            dkeybase, data=mdict[dkeybase][-2:,:], compression='lzf')
+
+                else:  # (continued_sim == 1)
+                    # if cwe are not in a continuation directory
+                    # if particle concentrations, remove and overwrite, but not if its cbar
+                    if not is_internal_particle_data(dkeybase):
+                        # create dataset if continued_sim == 0
+                        # maxshape is set dpeending on whether its a 2D array or a 1D array
+                        shape = len(mdict[dkeybase].shape)
+                        mat_dat.create_dataset(dkeybase, data=mdict[dkeybase],
+                                               maxshape=(None,)*shape, compression='lzf')
+
+                        if dkeybase == 'phi_applied':
+                            # only save times for voltage
+                            mdict['times'] = times
+                            mat_dat.create_dataset('phi_applied_times', data=mdict['times'],
+                                                   maxshape=(None,), compression='lzf')
+
+                    else:
+                        # only save the last two points
+                        shape = len(mdict[dkeybase].shape)
+                        mat_dat.create_dataset(dkeybase, data=mdict[dkeybase][-2:],
+                                               maxshape=(None,)*shape, compression='lzf')
+
+
+class Hdf5Writer(OutputWriter):
+    """Reports hdf5 file outputs in full, otherwise ignores internal particle concentrations"""
+
+    def written_rows(self):
+        return hdf5_rows(self.ConnectionString + ".hdf5")
+
+    def WriteDataToFile(self):
+        mdict, times, static = self.get_output_data()
+        # 0 if single simulaiton, 1 if continued simulation
+        continued_sim = 0
+        # if we are in a directory that has continued simulations (maccor reader)
+        if os.path.isfile(self.ConnectionString + ".hdf5"):
+            if os.stat(self.ConnectionString + ".hdf5").st_size != 0:
+                continued_sim = 1
+                # remains 0 if not continued sim
+        with h5py.File(self.ConnectionString + ".hdf5", 'a') as mat_dat:
+            write_static_data(mat_dat, static)
+            if continued_sim == 1:
+                self.offset_stride_times(mdict, mat_dat['phi_applied_times'][-1])
+            for dkeybase in list(mdict.keys()):
+                # if we are in a directory that has continued simulations (maccor reader)
+                if continued_sim == 1:
+                    # increment time by the previous end time of the last simulation
+                    tend = mat_dat['phi_applied_times'][-1]
+
+                    mat_dat[dkeybase].resize(
+                        (mat_dat[dkeybase].shape[0] + mdict[dkeybase].shape[0]), axis=0)
+                    mat_dat[dkeybase][-mdict[dkeybase].shape[0]:] = mdict[dkeybase]
+
+                    if dkeybase == 'phi_applied':
+                        mdict['times'] = times + tend
+                        # resize and append dkeybase varibale
+                        mat_dat['phi_applied_times'].resize(
+                            (mat_dat['phi_applied_times'].shape[0]
+                             + mdict['times'].shape[0]), axis=0)
+                        mat_dat['phi_applied_times'][-mdict['times'].shape[0]:] \
+                            = mdict['times']
+
+                else:  # (continued_sim == 0)
+                    # create dataset if continued_sim == 0
+                    # maxshape is set dpeending on whether its a 2D array or a 1D array
+                    shape = len(mdict[dkeybase].shape)
+                    mat_dat.create_dataset(dkeybase, data=mdict[dkeybase],
+                                           maxshape=(None,)*shape, compression='lzf')
+
+                    if dkeybase == 'phi_applied':
+                        # only save times for voltage
+                        mdict['times'] = times
+                        mat_dat.create_dataset('phi_applied_times', data=mdict['times'],
+                                               maxshape=(None,), compression='lzf')
+
+
+class MATWriter(OutputWriter):
+    """See source code for pyDataReporting.daeMatlabMATFileDataReporter
+    Takes in dataReporter"""
+
+    def written_rows(self):
+        return mat_rows(self.ConnectionString + ".mat")
+
+    def WriteDataToFile(self):
+        mdict, times, static = self.get_output_data()
+        # 0 if single simulaiton, 1 if continued simulation
+        continued_sim = 0
+        # set an empty mat_dat
+        mat_dat = {}
+        # if we are in a directory that has continued simulations (maccor reader)
+        if os.path.isfile(self.ConnectionString + ".mat"):
+            if os.stat(self.ConnectionString + ".mat").st_size != 0:
+                continued_sim = 1
+                mat_dat = sio.loadmat(self.ConnectionString + ".mat")
+                self.offset_stride_times(mdict, mat_dat['phi_applied_times'][0, -1])
+                # remains 0 if not continued sim
+        for dkeybase in list(mdict.keys()):
+            if continued_sim == 0:
+                if dkeybase == 'phi_applied':
+                    # if we are not in a continuation directory
+                    mdict[dkeybase + '_times'] = times
+            else:
+                # if we are in a directory that has continued simulations (maccor reader)
+                # increment time by the previous end time of the last simulation
+                tend = mat_dat['phi_applied_times'][0, -1]
+                # get previous values from old output_mat
+                if dkeybase == 'phi_applied':
+
+                    mdict[dkeybase + '_times'] = (times + tend).T
+                    mdict[dkeybase + '_times'] = np.append(mat_dat[dkeybase + '_times'],
+                                                           mdict[dkeybase + '_times'])
+                # may flatten array, so we specify axis
+                if mat_dat[dkeybase].shape[0] == 1:
+                    mat_dat[dkeybase] = mat_dat[dkeybase].T
+                    mdict[dkeybase] = mdict[dkeybase].reshape(-1, 1)
+                # data output does weird arrays where its (n, 2) but (1, n) if only one row
+                if mdict[dkeybase].ndim == 1:
+                    mdict[dkeybase] = mdict[dkeybase].reshape(-1, 1)
+                mdict[dkeybase] = np.append(mat_dat[dkeybase], mdict[dkeybase], axis=0)
+                # flip axes to be consistent with plotting if shape is not (x,1)
+                if mdict[dkeybase].shape[1] == 1:
+                    mdict[dkeybase] = np.squeeze(mdict[dkeybase])
+        mdict.update(static)
+
+        sio.savemat(self.ConnectionString + ".mat",
+                    mdict, appendmat=False, format='5',
+                    long_field_names=False, do_compression=False,
+                    oned_as='row')
+
+
+class MATSegmentWriter(OutputWriter):
+    """Writes mat file output in segments.
+    The first simulation writes the usual output_data.mat. Each continued
+    simulation in the same directory (maccor reader) writes only its own data
+    to a new file output_data_segXXXX.mat, with times shifted by the end time
+    of the previous segment, and adds it to the manifest output_data_segments.json.
+    In contrast to MATWriter, previous segments are never read or
+    rewritten. utils.open_data_file stitches the segments together."""
+
+    def written_rows(self):
+        manifest = utils.read_segment_manifest(self.ConnectionString)
+        if manifest is not None:
+            return sum(segment["nt"] for segment in manifest["segments"])
+        return mat_rows(self.ConnectionString + ".mat")
+
+    def WriteDataToFile(self):
+        mdict, times, static = self.get_output_data()
+        dataFile = self.ConnectionString
+        folder, basename = os.path.split(dataFile)
+        manifest = utils.read_segment_manifest(dataFile)
+        if manifest is None and os.path.isfile(dataFile + ".mat") \
+                and os.stat(dataFile + ".mat").st_size != 0:
+            # continue a simulation that was written by MATWriter
+            manifest = get_mat_segment_manifest(dataFile + ".mat")
+        if manifest is None:
+            # single simulation, or first segment of continued simulations
+            manifest = {"keys": [], "series": [], "static": list(static.keys()), "segments": []}
+            filename = basename + ".mat"
+            tend = 0.
+        else:
+            # increment time by the previous end time of the last simulation
+            filename = basename + "_seg{:04d}.mat".format(len(manifest["segments"]))
+            tend = manifest["segments"][-1]["t_end"]
+        mdict['phi_applied_times'] = times + tend
+        self.offset_stride_times(mdict, tend)
+        for dkeybase, values in mdict.items():
+            if np.ndim(values) == 1 and dkeybase not in manifest["series"]:
+                manifest["series"].append(dkeybase)
+        mdict.update(static)
+        for dkeybase in mdict:
+            if dkeybase not in manifest["keys"]:
+                manifest["keys"].append(dkeybase)
+
+        sio.savemat(os.path.join(folder, filename),
+                    mdict, appendmat=False, format='5',
+                    long_field_names=False, do_compression=False,
+                    oned_as='row')
+        manifest["segments"].append({"file": filename,
+                                     "t_start": float(mdict['phi_applied_times'][0]),
+                                     "t_end": float(mdict['phi_applied_times'][-1]),
+                                     "nt": int(len(times))})
+        utils.write_segment_manifest(dataFile, manifest)
+
+
+class ReportedVariable:
+    """The reported values of a variable that was computed outside of a daetools
+    process (see mpet.backends), with the attributes of a daetools reporter variable.
+
+    :param str Name: full name of the variable, e.g. mpet.phi_applied
+    :param ndarray Values: values at the reported times, time along the first axis
+    :param ndarray TimeValues: reported times
+    """
+    def __init__(self, Name, Values, TimeValues):
+        self.Name = Name
+        self.Values = Values
+        self.TimeValues = TimeValues
+
+
+def get_output_key(name):
+    """Convert a daetools variable name to its key in the output file.
+    Returns None for variables that are not written (port variables)."""
+    # Remove the model name part of the output key for brevity.
+    dkeybase = name[name.index(".")+1:]
+    # Remove dots from variable keys. This enables the mat
+    # file to be read by, e.g., MATLAB.
+    dkeybase = dkeybase.replace(".", "_")
+    # Remove port variables
+    if "port" in dkeybase:
+        return None
+    return dkeybase
+
+
+def match_pattern(key, pattern):
+    """Check if an output key matches a glob pattern, or a regular
+    expression if the pattern starts with re:"""
+    if pattern.startswith("re:"):
+        return re.fullmatch(pattern[3:], key) is not None
+    return fnmatch.fnmatchcase(key, pattern)
+
+
+def get_report_stride(dkeybase, report_stride):
+    """Reporting stride of an output key. report_stride is a list of
+    (pattern, stride), the first matching pattern is used.
+    phi_applied holds the reported times and is always reported in full."""
+    if dkeybase == 'phi_applied' or dkeybase.endswith('_times'):
+        return 1
+    for pattern, stride in report_stride:
+        if match_pattern(dkeybase, pattern):
+            return stride
+    return 1
+
+
+def get_stride_rows(nt, stride, offset=0, last=True):
+    """Indices of the time points that are stored for a given reporting stride.
+    offset is the number of time points written before, e.g. by the simulation that is
+    continued, so that a continued output keeps every stride-th time point of the whole
+    output like an uninterrupted one. The last time point is included if last is true."""
+    rows = np.arange(-offset % stride, nt, stride)
+    if last and nt > 0 and (len(rows) == 0 or rows[-1] != nt - 1):
+        rows = np.append(rows, nt - 1)
+    return rows
+
+
+def hdf5_rows(filename):
+    """Number of time points in an hdf5 output file, 0 if there is none."""
+    if not os.path.isfile(filename) or os.stat(filename).st_size == 0:
+        return 0
+    with h5py.File(filename, 'r') as mat_dat:
+        if 'phi_applied_times' not in mat_dat:
+            return 0
+        return mat_dat['phi_applied_times'].shape[0]
+
+
+def mat_rows(filename):
+    """Number of time points in a mat output file, 0 if there is none."""
+    if not os.path.isfile(filename) or os.stat(filename).st_size == 0:
+        return 0
+    shapes = {key: shape for (key, shape, _) in sio.whosmat(filename)}
+    return int(np.prod(shapes.get('phi_applied_times', (0,))))
+
+
+def is_reported(dkeybase, config):
+    """Check if the variable with the given output key is selected by reportVars and
+    not excluded by reportExclude, see set_reporting."""
+    if dkeybase == 'phi_applied':
+        return True
+    return (any(match_pattern(dkeybase, pattern) for pattern in config["reportVars"])
+            and not any(match_pattern(dkeybase, pattern) for pattern in config["reportExclude"]))
+
+
+def get_mat_segment_manifest(filename):
+    """Create the segment manifest for a mat file that was written without one,
+    so that it can be continued by MATSegmentWriter."""
+    # the solver statistics table (mpet.solver_stats) of all runs so far is stored in
+    # the latest segment only, it is not a variable of the segments
+    info = [item for item in sio.whosmat(filename) if not item[0].startswith("solver_stats")]
+    times = sio.loadmat(filename, variable_names=['phi_applied_times'])['phi_applied_times']
+    nt = times.size
+    series = [key for (key, shape, _) in info if len(shape) == 2 and shape[0] == 1
+              and shape[1] == nt and nt != 1]
+    static = [key for (key, _, _) in info if re.match("partTrode._(index|offsets)", key)]
+    return {"keys": [key for (key, _, _) in info], "series": series, "static": static,
+            "segments": [{"file": os.path.basename(filename),
+                          "t_start": float(times[0, 0]),
+                          "t_end": float(times[0, -1]),
+                          "nt": int(nt)}]}
+
+
+def is_internal_particle_data(dkeybase):
+    """Check if an output key holds internal particle concentrations (but not cbar),
+    which hdf5Fast only stores at the last time points."""
+    if re.search("cbar", dkeybase) is not None:
+        return False
+    return (re.match("partTrode.vol.part._c", dkeybase) is not None
+            or re.match("partTrode._c", dkeybase) is not None)
+
+
+def write_static_data(mat_dat, static):
+    """Write time independent data to an hdf5 file, if not present yet."""
+    for key, value in static.items():
+        if key not in mat_dat:
+            mat_dat.create_dataset(key, data=value)
+
+
+#: Writer of each dataReporter that keeps the data in memory until the end of the run
+WRITERS = {"mat": MATWriter, "hdf5": Hdf5Writer, "hdf5Fast": Hdf5FastWriter,
+           "matSegments": MATSegmentWriter}
+
+
+def configure_writer(writer, config):
+    """Set the particle data layout and the reporting strides of the config on a
+    writer or data reporter."""
+    writer.particle_layout = config["particleDataLayout"]
+    writer.psd_num = {trode: config["psd_num"][trode] for trode in config["trodes"]}
+    writer.report_stride = config["reportStride"]
+    return writer
+
+
+def write_output_data(config, outdir, variables):
+    """Write the output file of a simulation that did not run in a daetools process,
+    in the same format as the data reporter selected in the config.
+
+    :param Config config: the simulation config
+    :param str outdir: output directory
+    :param list variables: :class:`ReportedVariable` of all reported variables
+    """
+    dataReporter = config["dataReporter"]
+    if dataReporter == "hdf5Stream":
+        # all data is available at once, which gives the same file as streaming
+        dataReporter = "hdf5"
+    if dataReporter not in WRITERS:
+        raise Exception("Data Reporter " + dataReporter + " not installed")
+    writer = configure_writer(WRITERS[dataReporter](), config)
+    writer.variables = variables
+    writer.ConnectionString = os.path.join(outdir, "output_data")
+    writer.WriteDataToFile()
@@ -2,7 +2,6 @@
 import os
 
 import numpy as np
-import h5py
 
 import mpet.plot.plot_data as plot_data
 import mpet.utils as utils
@@ -49,7 +48,6 @@ elytediviHdr = ("Electrolyte Divergence of Current Density [A/m^3]\n"
                 + RowsStr + CCStr)
 
 seeDiscStr = "See discData.txt for particle indexing information."
-partStr = "partTrode{l}vol{j}part{i}_"
 solffStr = "Solid Filling Fractions"
 solTail = ("\n" + RowsStr + CCStr + "\n" + seeDiscStr)
 solHdr = (solffStr + solTail)
@@ -213,20 +211,12 @@ def main(indir, genData=True, discData=True, elyteData=True,
         data = utils.open_data_file(dataFile)
         for tr in trodes:
             Trode = get_trode_str(tr)
-            type2c = False
-            if config[tr, "type"] in constants.one_var_types:
-                str_base = partStr + "c"
-            elif config[tr, "type"] in constants.two_var_types:
-                type2c = True
-                str1_base = partStr + "c1"
-                str2_base = partStr + "c2"
+            type2c = config[tr, "type"] in constants.two_var_types
             for i in range(config["Npart"][tr]):
                 for j in range(config["Nvol"][tr]):
                     if type2c:
-                        sol1 = str1_base.format(l=tr, i=i, j=j)
-                        sol2 = str2_base.format(l=tr, i=i, j=j)
-                        datay1 = utils.get_dict_key(data, sol1)
-                        datay2 = utils.get_dict_key(data, sol2)
+                        datay1 = utils.get_particle_field(data, tr, j, i, "c1")
+                        datay2 = utils.get_particle_field(data, tr, j, i, "c2")
                         filename1 = fnameSol1Base.format(l=Trode, i=i, j=j)
                         filename2 = fnameSol2Base.format(l=Trode, i=i, j=j)
                         np.savetxt(os.path.join(indir, filename1), datay1,
@@ -234,14 +224,13 @@ def main(indir, genData=True, discData=True, elyteData=True,
                         np.savetxt(os.path.join(indir, filename2), datay2,
                                    delimiter=dlm, header=sol2Hdr)
                     else:
-                        sol = str_base.format(l=tr, i=i, j=j)
-                        datay = utils.get_dict_key(data, sol)
+                        datay = utils.get_particle_field(data, tr, j, i, "c")
                         filename = fnameSolBase.format(l=Trode, i=i, j=j)
                         np.savetxt(os.path.join(indir, filename), datay,
                                    delimiter=dlm, header=solHdr)
 
-        # close file if it is a h5py file
-        if isinstance(data, h5py._hl.files.File):
+        # close file if it is a h5py file or a mat file read on demand
+        if hasattr(data, "close"):
             data.close()
 
     if cbarData:
@@ -320,8 +309,8 @@ def main(indir, genData=True, discData=True, elyteData=True,
         np.savetxt(os.path.join(indir, fname), genMat, delimiter=dlm,
                    header=vdQCyclerHdr)
 
-        # close file if it is a h5py file
-        if isinstance(data, h5py._hl.files.File):
+        # close file if it is a h5py file or a mat file read on demand
+        if hasattr(data, "close"):
             data.close()
 
     return
@@ -1,18 +1,21 @@
 import os
 
-import matplotlib as mpl
-import matplotlib.animation as manim
-import matplotlib.collections as mcollect
-import matplotlib.pyplot as plt
 import numpy as np
 import scipy.integrate as integrate
 from scipy.interpolate import interp1d
 
 import mpet.geometry as geom
-import mpet.mod_cell as mod_cell
 import mpet.utils as utils
 from mpet.config import Config, constants
 
+# matplotlib and the cell model (daetools) are only imported when they are used, so that
+# the data_only output (e.g. text export with mpet.plot.outmat2txt) does not need them
+mpl = utils.lazy_import("matplotlib")
+manim = utils.lazy_import("matplotlib.animation")
+mcollect = utils.lazy_import("matplotlib.collections")
+plt = utils.lazy_import("matplotlib.pyplot")
+model_funcs = utils.lazy_import("mpet.model_funcs")
+
 """Set list of matplotlib rc parameters to make more readable plots."""
 # axtickfsize = 18
 # labelfsize = 20
@@ -194,20 +197,18 @@ def show_data(indir, plot_type, print_flag, save_flag, data_only, color_changes,
         voltage = (Vstd
                    - (k*Tref/e)*utils.get_dict_key(data, pfx + 'phi_applied'))
         ffvec = utils.get_dict_key(data, pfx + 'ffrac_c')
+        if data_only:
+            if plot_type == "v":
+                return ffvec, voltage
+            return times*td, voltage
         fig, ax = plt.subplots(figsize=figsize)
         if plot_type == "v":
-            if data_only:
-                plt.close(fig)
-                return ffvec, voltage
             ax.plot(ffvec, voltage)
             xmin = 0.
             xmax = 1.
             ax.set_xlim((xmin, xmax))
             ax.set_xlabel("Cathode Filling Fraction [dimensionless]")
         elif plot_type == "vt":
-            if data_only:
-                plt.close(fig)
-                return times*td, voltage
             ax.plot(times*td, voltage)
             ax.set_xlabel("Time [s]")
         ax.set_ylabel("Voltage [V]")
@@ -263,16 +264,9 @@ def show_data(indir, plot_type, print_flag, save_flag, data_only, color_changes,
 
     # Check to make sure mass is conserved in elyte
     if plot_type == "elytecons":
-        fig, ax = plt.subplots(figsize=figsize)
-        eps = 1e-2
-        ymin = 1-eps
-        ymax = 1+eps
-#        ax.set_ylim((ymin, ymax))
-        ax.set_ylabel('Avg. Concentration of electrolyte [nondim]')
         sep = pfx + 'c_lyte_s'
         anode = pfx + 'c_lyte_a'
         cath = pfx + 'c_lyte_c'
-        ax.set_xlabel('Time [s]')
         cvec = utils.get_dict_key(data, cath)
         if Nvol["s"]:
             cvec_s = utils.get_dict_key(data, sep)
@@ -282,8 +276,14 @@ def show_data(indir, plot_type, print_flag, save_flag, data_only, color_changes,
             cvec = np.hstack((cvec_a, cvec))
         cavg = np.sum(porosvec*dxvec*cvec, axis=1)/np.sum(porosvec*dxvec)
         if data_only:
-            plt.close(fig)
             return times*td, cavg
+        fig, ax = plt.subplots(figsize=figsize)
+        eps = 1e-2
+        ymin = 1-eps
+        ymax = 1+eps
+#        ax.set_ylim((ymin, ymax))
+        ax.set_ylabel('Avg. Concentration of electrolyte [nondim]')
+        ax.set_xlabel('Time [s]')
         np.set_printoptions(precision=8)
         ax.plot(times*td, cavg)
         if save_flag:
@@ -370,7 +370,7 @@ def show_data(indir, plot_type, print_flag, save_flag, data_only, color_changes,
                 Nvol, config["L"], config["poros"], config["BruggExp"])
             i_edges = np.zeros((numtimes, len(facesvec)))
             for tInd in range(numtimes):
-                i_edges[tInd, :] = mod_cell.get_lyte_internal_fluxes(
+                i_edges[tInd, :] = model_funcs.get_lyte_internal_fluxes(
                     cmat[tInd, :], pmat[tInd, :], disc, config)[1]
             if plot_type in ["elytei", "elyteif"]:
                 ylbl = r'Current density of electrolyte [A/m$^2$]'
@@ -427,8 +427,6 @@ def show_data(indir, plot_type, print_flag, save_flag, data_only, color_changes,
     # Plot solid particle-average concentrations
     elif plot_type[:-2] in ["cbarLine", "dcbardtLine"]:
         trode = plot_type[-1]
-        fig, ax = plt.subplots(Npart[trode], Nvol[trode], squeeze=False, sharey=True,
-                               figsize=figsize)
         partStr = "partTrode{trode}vol{{vInd}}part{{pInd}}".format(trode=trode) + sStr
         type2c = False
         if config[trode, "type"] in constants.one_var_types:
@@ -447,7 +445,6 @@ def show_data(indir, plot_type, print_flag, save_flag, data_only, color_changes,
         ylim = (0, 1.01)
         datax = times*td
         if data_only:
-            plt.close(fig)
             if type2c:
                 sol1_str = str1_base.format(pInd=pOut, vInd=vOut)
                 sol2_str = str2_base.format(pInd=pOut, vInd=vOut)
@@ -458,6 +455,8 @@ def show_data(indir, plot_type, print_flag, save_flag, data_only, color_changes,
                 sol_str = str_base.format(pInd=pOut, vInd=vOut)
                 datay = utils.get_dict_key(data, sol_str)
             return datax, datay
+        fig, ax = plt.subplots(Npart[trode], Nvol[trode], squeeze=False, sharey=True,
+                               figsize=figsize)
         xLblNCutoff = 4
         xLbl = "Time [s]"
         yLbl = "Particle Average Filling Fraction"
@@ -511,7 +510,6 @@ def show_data(indir, plot_type, print_flag, save_flag, data_only, color_changes,
             type2c = True
         Nv, Np = Nvol[trode], Npart[trode]
         partStr = "partTrode{trode}vol{vInd}part{pInd}" + sStr
-        fig, ax = plt.subplots(Np, Nv, squeeze=False, sharey=True, figsize=figsize)
         if not type2c:
             cstr_base = pfx + partStr + "c"
             cbarstr_base = pfx + partStr + "cbar"
@@ -549,8 +547,8 @@ def show_data(indir, plot_type, print_flag, save_flag, data_only, color_changes,
                 datay = utils.get_dict_key(data, cstr)[tOut]
                 numy = len(datay)
             datax = np.linspace(0, lenval * Lfac, numy)
-            plt.close(fig)
             return datax, datay
+        fig, ax = plt.subplots(Np, Nv, squeeze=False, sharey=True, figsize=figsize)
         ylim = (0, 1.01)
         for pInd in range(Np):
             for vInd in range(Nv):
@@ -790,12 +788,6 @@ def show_data(indir, plot_type, print_flag, save_flag, data_only, color_changes,
         trode = plot_type[-1]
         fplot = (True if plot_type[-3] == "f" else False)
         t0ind = (0 if not fplot else -1)
-        fig, ax = plt.subplots(figsize=figsize)
-        ax.set_xlabel('Position in electrode [{unit}]'.format(unit=Lunit))
-        ax.set_ylabel('Potential of cathode [nondim]')
-        ttl = ax.text(0.5, 1.05, ttl_fmt.format(perc=0),
-                      transform=ax.transAxes, verticalalignment="center",
-                      horizontalalignment="center")
         bulkp = pfx + 'phi_bulk_{trode}'.format(trode=trode)
         datay = utils.get_dict_key(data, bulkp)
         ymin = np.min(datay) - 0.2
@@ -805,8 +797,13 @@ def show_data(indir, plot_type, print_flag, save_flag, data_only, color_changes,
         elif trode == "c":
             datax = cellsvec[-Nvol["c"]:]
         if data_only:
-            plt.close(fig)
             return datax, datay
+        fig, ax = plt.subplots(figsize=figsize)
+        ax.set_xlabel('Position in electrode [{unit}]'.format(unit=Lunit))
+        ax.set_ylabel('Potential of cathode [nondim]')
+        ttl = ax.text(0.5, 1.05, ttl_fmt.format(perc=0),
+                      transform=ax.transAxes, verticalalignment="center",
+                      horizontalalignment="center")
         # returns tuble of line objects, thus comma
         line1, = ax.plot(datax, datay[t0ind])
 
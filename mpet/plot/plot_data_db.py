@@ -5,7 +5,7 @@ import argparse
 from argparse import RawTextHelpFormatter
 
 import mpet.geometry as geom
-from mpet import mod_cell
+from mpet import model_funcs
 from mpet import utils
 from mpet.config import Config, constants
 from mpet.exceptions import UnknownParameterError
@@ -165,7 +165,7 @@ def main():
             pmat = np.hstack((pGP_L.reshape((-1,1)), datay_p, datay_p[:,-1].reshape((-1,1))))
             disc = geom.get_elyte_disc(Nvol, config["L"], config["poros"], config["BruggExp"])
             for tInd in range(numtimes):
-                i_edges[tInd, :] = mod_cell.get_lyte_internal_fluxes(
+                i_edges[tInd, :] = model_funcs.get_lyte_internal_fluxes(
                     cmat[tInd, :], pmat[tInd, :], disc, config)[1]
             datay_cd = i_edges * (F*constants.c_ref*config["D_ref"]/config["L_ref"])
             datay_d = np.diff(i_edges, axis=1) / disc["dxvec"]
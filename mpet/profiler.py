@@ -0,0 +1,177 @@
+"""Timing of the phases of a simulation.
+
+When enabled (``mpetrun.py --profile``), the wall time of each phase of a run is
+measured: config processing, model construction, DeclareEquations of every sub-model
+type, Initialize, SolveInitial, Run and the writing of the output file. Phases can
+be nested. The summary table lists the total time of each phase, which includes its
+nested phases, and its self time, which does not. It is printed at the end of the run
+and stored in ``profile.json`` in the output directory.
+
+A single phase can be profiled in detail with cProfile (the statistics are stored in
+``profile_<phase>.prof``, which can be read with :mod:`pstats` or snakeviz) or with
+tracemalloc (the largest allocations are stored in the JSON file).
+
+Phases are marked with the :func:`phase` context manager or the :func:`timed`
+decorator, which cost nothing when profiling is disabled::
+
+    with profiler.phase("SolveInitial"):
+        simulation.SolveInitial()
+"""
+import contextlib
+import functools
+import json
+import os
+import time
+
+#: Detailed profiling modes of a single phase
+MODES = ["cprofile", "tracemalloc"]
+
+#: Number of functions/allocations in the detailed profiles
+TOP_ENTRIES = 25
+
+# the active profiler, None when profiling is disabled
+_profiler = None
+
+
+class Profiler:
+    """Collects the wall time of the phases of a run.
+
+    :param str detail_phase: name of a phase to profile in detail, or None
+    :param str mode: detailed profiling mode of detail_phase, see :data:`MODES`
+    """
+    def __init__(self, detail_phase=None, mode="cprofile"):
+        if mode not in MODES:
+            raise ValueError(f"Unknown profiling mode {mode}, choose from {MODES}")
+        self.detail_phase = detail_phase
+        self.mode = mode
+        # name -> total time, self time and number of calls, in order of first call
+        self.phases = {}
+        # time spent in nested phases of each running phase
+        self.stack = []
+        # result of the detailed profile
+        self.detail = None
+        self.timeStart = time.time()
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        detailed = name == self.detail_phase and self.detail is None
+        if detailed:
+            tracker = self.start_detail()
+        stats = self.phases.setdefault(name, {"total": 0., "self": 0., "calls": 0})
+        self.stack.append(0.)
+        tStart = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - tStart
+            nested = self.stack.pop()
+            if self.stack:
+                self.stack[-1] += elapsed
+            stats["total"] += elapsed
+            stats["self"] += elapsed - nested
+            stats["calls"] += 1
+            if detailed:
+                self.stop_detail(tracker)
+
+    def start_detail(self):
+        if self.mode == "cprofile":
+            import cProfile
+            tracker = cProfile.Profile()
+            tracker.enable()
+        else:
+            import tracemalloc
+            tracemalloc.start()
+            tracker = tracemalloc
+        return tracker
+
+    def stop_detail(self, tracker):
+        if self.mode == "cprofile":
+            tracker.disable()
+            self.detail = tracker
+        else:
+            snapshot = tracker.take_snapshot()
+            current, peak = tracker.get_traced_memory()
+            tracker.stop()
+            self.detail = {
+                "peak_memory": peak,
+                "current_memory": current,
+                "top_allocations": [
+                    {"location": str(stat.traceback), "size": stat.size, "count": stat.count}
+                    for stat in snapshot.statistics("lineno")[:TOP_ENTRIES]]}
+
+    def results(self):
+        """The timings as a JSON serializable dict."""
+        result = {"total_time": time.time() - self.timeStart,
+                  "phases": [{"name": name, **stats} for name, stats in self.phases.items()]}
+        if self.detail_phase is not None:
+            result["detail"] = {"phase": self.detail_phase, "mode": self.mode}
+            if self.mode == "tracemalloc" and self.detail is not None:
+                result["detail"].update(self.detail)
+        return result
+
+    def print_summary(self):
+        results = self.results()
+        print("\n{:<40} {:>10} {:>10} {:>8}".format("phase", "total [s]", "self [s]", "calls"))
+        for stats in results["phases"]:
+            print("{name:<40} {total:>10.3f} {self:>10.3f} {calls:>8d}".format(**stats))
+        if self.detail is None:
+            return
+        print(f"\nDetailed profile ({self.mode}) of phase {self.detail_phase}:")
+        if self.mode == "cprofile":
+            import pstats
+            pstats.Stats(self.detail).sort_stats("cumulative").print_stats(TOP_ENTRIES)
+        else:
+            print("Peak traced memory: {:.1f} MB".format(self.detail["peak_memory"]/1e6))
+            for stat in self.detail["top_allocations"][:10]:
+                print("{:>10.1f} kB {}".format(stat["size"]/1e3, stat["location"]))
+
+    def save(self, outdir):
+        """Store the timings in profile.json (and the cProfile statistics) in outdir."""
+        with open(os.path.join(outdir, "profile.json"), "w") as fo:
+            json.dump(self.results(), fo, indent=1)
+        if self.mode == "cprofile" and self.detail is not None:
+            self.detail.dump_stats(os.path.join(outdir, f"profile_{self.detail_phase}.prof"))
+
+
+def enable(detail_phase=None, mode="cprofile"):
+    """Start profiling the phases of the following simulation."""
+    global _profiler
+    _profiler = Profiler(detail_phase, mode)
+    return _profiler
+
+
+def disable():
+    """Stop profiling, returns the profiler (or None if profiling was not enabled)."""
+    global _profiler
+    profiler, _profiler = _profiler, None
+    return profiler
+
+
+def phase(name):
+    """Context manager that times a phase, if profiling is enabled."""
+    if _profiler is None:
+        return contextlib.nullcontext()
+    return _profiler.phase(name)
+
+
+def timed(name):
+    """Decorator that times every call of a method as phase name[class name], e.g.
+    DeclareEquations[Mod2var], if profiling is enabled."""
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if _profiler is None:
+                return method(self, *args, **kwargs)
+            with _profiler.phase(f"{name}[{type(self).__name__}]"):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def wrap(name, func):
+    """A function that times every call of func as phase name, if profiling is enabled."""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with phase(name):
+            return func(*args, **kwargs)
+    return wrapper
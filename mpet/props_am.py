@@ -3,9 +3,12 @@ Only helper functions are defined here.
 Diffusion functions are defined in mpet.electrode.diffusion
 Chemical potential functions are defined in mpet.electrode.materials"""
 import types
+import weakref
+
 import numpy as np
 
 import mpet.geometry as geo
+import mpet.tabulation as tabulation
 from mpet.config import constants
 from mpet.utils import import_function
 
@@ -62,6 +65,15 @@ class muRfuncs():
             value = value[self.ind]
         return value
 
+    def get_muR_tables(self):
+        """
+        Spline tables of muR (without muR_ref) and actR, see
+        :func:`mpet.tabulation.tabulate_muRfunc`. Created on first use.
+        """
+        if getattr(self, "muR_tables", None) is None:
+            self.muR_tables = tabulation.tabulate_muRfunc(self)
+        return self.muR_tables
+
     def get_muR_from_OCV(self, OCV, muR_ref):
         return -self.eokT*OCV + muR_ref
 
@@ -145,7 +157,8 @@ class muRfuncs():
     def non_homog_rect_fixed_csurf(self, y, ybar, B, kappa, ywet):
         """ Helper function """
         N = len(y)
-        ytmp = np.empty(N+2, dtype=object)
+        # object arrays of daetools expressions or floats
+        ytmp = np.empty(N+2, dtype=np.asarray(y).dtype)
         ytmp[1:-1] = y
         ytmp[0] = ywet
         ytmp[-1] = ywet
@@ -158,7 +171,7 @@ class muRfuncs():
         """ Helper function """
         # the taylor expansion at the edges is used
         N_2 = len(y)
-        ytmp = np.empty(N_2+2, dtype=object)
+        ytmp = np.empty(N_2+2, dtype=np.asarray(y).dtype)
         dxs = 1./N_2
         ytmp[1:-1] = y
         ytmp[0] = y[0] + np.diff(y)[0]*dxs + 0.5*np.diff(y,2)[0]*dxs**2
@@ -229,6 +242,34 @@ class muRfuncs():
         return muR_nh
 
 
+# muRfuncs instances per config, see get_muRfuncs
+_muRfuncs_cache = weakref.WeakKeyDictionary()
+
+
+def get_muRfuncs(config, trode, ind=None, params=None):
+    """Return a muRfuncs instance for the given electrode and (optionally) particle.
+
+    Instances are shared between all particles of an electrode that have the same
+    particle-specific parameters, so the material function is bound only once per
+    parameter set instead of on every call. The config must be fully processed,
+    as the electrode parameters are read when the material function is evaluated.
+    The parameter set is taken from the ParticleParams of the particle, which are
+    created from the config if not given.
+    """
+    if ind is None:
+        key = (trode, None)
+    else:
+        if params is None:
+            params = config.get_particle_params(trode, ind)
+        key = (trode, params.particle_values)
+    cache = _muRfuncs_cache.setdefault(config, {})
+    funcs = cache.get(key)
+    if funcs is None:
+        funcs = muRfuncs(config, trode, ind)
+        cache[key] = funcs
+    return funcs
+
+
 def step_down(x, xc, delta):
     return 0.5*(-np.tanh((x - xc)/delta) + 1)
 
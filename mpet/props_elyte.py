@@ -0,0 +1,64 @@
+"""This module handles properties associated with the electrolyte.
+Only helper functions are defined here.
+The Stefan-Maxwell property sets are defined in mpet.electrolyte"""
+import weakref
+
+import mpet.tabulation as tabulation
+from mpet.utils import import_function, lazy_import
+
+# the external functions of the tables are daetools functions, which are only needed by
+# the daetools models
+extern_funcs = lazy_import("mpet.extern_funcs")
+
+
+# Electrolyte tables per config, see get_elyte_tables
+_elyte_tables = weakref.WeakKeyDictionary()
+
+
+def get_elyte_function(config):
+    """Return the SMset function of the config"""
+    SMset = config["SMset"]
+    return import_function(config["SMset_filename"], SMset,
+                           mpet_module=f"mpet.electrolyte.{SMset}")
+
+
+def get_elyte_tables(config):
+    """
+    Tables of the SMset transport properties at the simulation temperature, see
+    :func:`mpet.tabulation.tabulate_elyte`. The tables are created on first use and
+    verified on a dense grid, an error is raised if a table exceeds elyteTable_tol.
+    The maximum error of each table is printed.
+    """
+    tables = _elyte_tables.get(config)
+    if tables is None:
+        elyte_function = get_elyte_function(config)
+        T = config["T"]
+        tables = tabulation.tabulate_elyte(elyte_function, config["SMset"], T,
+                                           config["elyteTable_range"],
+                                           config["elyteTable_points"], config["elyteTable_tol"])
+        errors = tabulation.verify_elyte_tables(tables, elyte_function, T,
+                                                config["elyteTable_tol"])
+        print("Tabulated electrolyte properties of {SMset}, max. relative errors: {errors}".format(
+            SMset=config["SMset"],
+            errors=", ".join(f"{prop} {error:.2g}" for prop, error in errors.items())))
+        _elyte_tables[config] = tables
+    return tables
+
+
+def get_elyte_properties(config, model=None):
+    """
+    Return the transport property functions of the SMset: D, sigma, thermFac and tp0,
+    each called as f(c, T). If elyteTabulate is enabled and a model is given, the
+    functions evaluate tables at the simulation temperature as external functions
+    of that model instead.
+    """
+    if model is None or not config["elyteTabulate"]:
+        return get_elyte_function(config)()[:-1]
+
+    tables = get_elyte_tables(config)
+
+    def tabulated(prop):
+        def func(c, T):
+            return extern_funcs.spline_vector(model, tables[prop], c, f"elyte_{prop}")
+        return func
+    return tuple(tabulated(prop) for prop in tabulation.ELYTE_PROPERTIES)
@@ -0,0 +1,221 @@
+"""Content-addressed store of simulation results.
+
+A result is stored under a hash of
+
+- the processed config dictionaries (including the particle distributions)
+- the source files of the material, reaction, diffusivity and electrolyte functions
+  used by the config
+- the mpet version
+
+so that a simulation which would give the same output as a stored one is not run
+again (see resultCache in the system config). Each entry is a directory with the
+complete output directory of the run and a ``cache_info.json`` file, which is
+written last and marks the entry as complete.
+"""
+import datetime
+import hashlib
+import importlib.util
+import json
+import os
+import shutil
+import time
+
+import mpet
+from mpet.ic_cache import update_hash
+
+#: Name of the metadata file of an entry
+INFO_FILE = "cache_info.json"
+
+#: System parameters that do not change the output of a simulation
+IGNORED_PARAMETERS = {
+    "resultCache", "icCache", "checkpointWallTime", "checkpointSimTime",
+    "linearSolverThreads", "evaluationThreads", "parallelEvaluation"}
+
+
+def _module_file(module):
+    """Path of the source file of an mpet module, or None if it does not exist."""
+    try:
+        spec = importlib.util.find_spec(module)
+    except (ImportError, ValueError):
+        return None
+    return None if spec is None else spec.origin
+
+
+def source_files(config):
+    """Source files of the functions that a config refers to by name.
+
+    :return: sorted list of file paths
+    """
+    files = set()
+    files.add(config["SMset_filename"] or _module_file(f"mpet.electrolyte.{config['SMset']}"))
+    for trode in config["trodes"]:
+        files.add(config[trode, "muRfunc_filename"]
+                  or _module_file(f"mpet.electrode.materials.{config[trode, 'muRfunc']}"))
+        files.add(config[trode, "rxnType_filename"]
+                  or _module_file(f"mpet.electrode.reactions.{config[trode, 'rxnType']}"))
+        if config[trode, "Dfunc"] is not None:
+            files.add(config[trode, "Dfunc_filename"]
+                      or _module_file(f"mpet.electrode.diffusion.{config[trode, 'Dfunc']}"))
+    return sorted(fname for fname in files if fname is not None)
+
+
+def result_hash(config):
+    """Hash of everything that determines the output of a simulation.
+
+    :param Config config: processed simulation config
+    :return: hexadecimal hash string
+    """
+    h = hashlib.sha256()
+    h.update(mpet.__version__.encode())
+    system = {key: value for key, value in config.D_s.params.items()
+              if key not in IGNORED_PARAMETERS}
+    update_hash(h, system)
+    for trode in config["trodes"]:
+        update_hash(h, trode)
+        update_hash(h, config.D_c.params if trode == "c" else config.D_a.params)
+    for fname in source_files(config):
+        with open(fname, "rb") as fi:
+            h.update(hashlib.sha256(fi.read()).digest())
+    return h.hexdigest()
+
+
+def lookup(store, key):
+    """Directory of a complete entry in the store, or None."""
+    entry = os.path.join(store, key)
+    info_file = os.path.join(entry, INFO_FILE)
+    if not os.path.isfile(info_file):
+        return None
+    # record the use for pruning the least recently used entries
+    try:
+        info = read_info(entry)
+        info["last_used"] = time.time()
+        write_info(entry, info)
+    except (OSError, ValueError):
+        pass
+    return entry
+
+
+def copy_result(entry, outdir):
+    """Copy a stored result to a new output directory. The output directory is
+    independent of the store, so it can be moved or changed like the output of a run."""
+    shutil.copytree(entry, outdir, symlinks=True,
+                    ignore=shutil.ignore_patterns(INFO_FILE, f".{INFO_FILE}.*"))
+    return outdir
+
+
+def store_result(store, key, outdir, paramfile=""):
+    """Copy an output directory into the store.
+
+    The entry is written to a temporary directory first and then renamed, so that
+    readers never see incomplete entries.
+    """
+    entry = os.path.join(store, key)
+    if os.path.isdir(entry):
+        return entry
+    os.makedirs(store, exist_ok=True)
+    tmpdir = os.path.join(store, f".{key}.{os.getpid()}.tmp")
+    shutil.rmtree(tmpdir, ignore_errors=True)
+    shutil.copytree(outdir, tmpdir, symlinks=True)
+    now = time.time()
+    write_info(tmpdir, {"config": paramfile, "version": mpet.__version__,
+                        "created": now, "last_used": now, "size": dir_size(tmpdir)})
+    try:
+        os.rename(tmpdir, entry)
+    except OSError:
+        # stored by a simultaneous run of the same simulation
+        shutil.rmtree(tmpdir, ignore_errors=True)
+    return entry
+
+
+def read_info(entry):
+    with open(os.path.join(entry, INFO_FILE)) as fi:
+        return json.load(fi)
+
+
+def write_info(entry, info):
+    tmpname = os.path.join(entry, f".{INFO_FILE}.{os.getpid()}")
+    with open(tmpname, "w") as fo:
+        json.dump(info, fo, indent=1)
+    os.replace(tmpname, os.path.join(entry, INFO_FILE))
+
+
+def dir_size(folder):
+    """Total size of the files in a directory tree in bytes."""
+    size = 0
+    for root, _, files in os.walk(folder):
+        for fname in files:
+            path = os.path.join(root, fname)
+            if not os.path.islink(path):
+                size += os.path.getsize(path)
+    return size
+
+
+def entries(store):
+    """The complete entries of a store.
+
+    :return: list of (key, info dict), most recently used first
+    """
+    if not os.path.isdir(store):
+        return []
+    result = []
+    for key in os.listdir(store):
+        entry = os.path.join(store, key)
+        if key.startswith(".") or not os.path.isfile(os.path.join(entry, INFO_FILE)):
+            continue
+        try:
+            result.append((key, read_info(entry)))
+        except (OSError, ValueError):
+            continue
+    return sorted(result, key=lambda item: item[1].get("last_used", 0), reverse=True)
+
+
+def remove_entry(store, key):
+    shutil.rmtree(os.path.join(store, key), ignore_errors=True)
+
+
+def prune(store, max_age=None, max_size=None):
+    """Remove entries that were not used for max_age days, and the least recently used
+    entries until the store is smaller than max_size bytes.
+
+    :return: removed keys
+    """
+    removed = []
+    now = time.time()
+    total = 0
+    for key, info in entries(store):
+        unused = now - info.get("last_used", 0)
+        size = info.get("size", 0)
+        if (max_age is not None and unused > max_age*86400) \
+                or (max_size is not None and total + size > max_size):
+            remove_entry(store, key)
+            removed.append(key)
+        else:
+            total += size
+    return removed
+
+
+def garbage_collect(store, tmp_age=1.):
+    """Remove incomplete entries (interrupted writes older than tmp_age days) and
+    entries of other mpet versions, which can never be used again.
+
+    :return: removed names
+    """
+    if not os.path.isdir(store):
+        return []
+    removed = []
+    now = time.time()
+    complete = dict(entries(store))
+    for name in os.listdir(store):
+        path = os.path.join(store, name)
+        if name in complete:
+            if complete[name].get("version") != mpet.__version__:
+                remove_entry(store, name)
+                removed.append(name)
+        elif os.path.isdir(path) and now - os.path.getmtime(path) > tmp_age*86400:
+            remove_entry(store, name)
+            removed.append(name)
+    return removed
+
+
+def format_time(timestamp):
+    return datetime.datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M")
@@ -6,22 +6,41 @@ been differentiated in time).
 """
 import sys
 import os.path as osp
+import time
 
 import daetools.pyDAE as dae
 import numpy as np
 import h5py
 
+import mpet.checkpoint as checkpoint
 import mpet.mod_cell as mod_cell
+import mpet.model_funcs as model_funcs
 import mpet.daeVariableTypes
+import mpet.profiler as profiler
 import mpet.utils as utils
 from mpet.config import constants
 
 
 class SimMPET(dae.daeSimulation):
-    def __init__(self, config, tScale=None):
+    def __init__(self, config, tScale=None, initialGuesses=None, resume=None):
         dae.daeSimulation.__init__(self)
         self.config = config
         self.tScale = tScale
+        # converged values of a previous run with the same model (mpet.ic_cache),
+        # used as initial guesses of the algebraic variables
+        self.initialGuesses = initialGuesses
+        # state of the checkpoint to resume from (mpet.checkpoint), the simulation
+        # then starts at the checkpoint time tOffset
+        self.resume = resume
+        self.tOffset = 0. if resume is None else float(resume["time"])
+        # output directory for checkpoints, set by run_simulation
+        self.outdir = None
+        self.lastCheckpoint = (time.time(), self.tOffset)
+        # reported time points of this run in the output of the checkpoints
+        self.checkpointRows = 0
+        # statistics of the solver per reporting interval (mpet.solver_stats),
+        # set by run_simulation
+        self.solverStats = None
         config["currPrev"] = 0.
         config["phiPrev"] = 0.
         if config["prevDir"] and config["prevDir"] != "false":
@@ -34,6 +53,9 @@ class SimMPET(dae.daeSimulation):
             # close file if it is a h5py file
             if isinstance(data, h5py._hl.files.File):
                 data.close()
+        if resume is not None:
+            # continue the current/voltage profile from the checkpoint
+            checkpoint.shift_profile(config, self.tOffset, resume)
 
         # Set absolute tolerances for variableTypes
         mpet.daeVariableTypes.mole_frac_t.AbsoluteTolerance = config["absTol"]
@@ -41,8 +63,10 @@ class SimMPET(dae.daeSimulation):
         mpet.daeVariableTypes.elec_pot_t.AbsoluteTolerance = config["absTol"]
 
         # Define the model we're going to simulate
-        self.m = mod_cell.ModCell(config, "mpet")
+        with profiler.phase("ModCell"):
+            self.m = mod_cell.ModCell(config, "mpet")
 
+    @profiler.timed("SetUpParametersAndDomains")
     def SetUpParametersAndDomains(self):
         # Domains
         config = self.config
@@ -58,7 +82,36 @@ class SimMPET(dae.daeSimulation):
                     if config[f"simInterface_{tr}"]:
                         self.m.interfaces[tr][i, j].Dmn.CreateArray(
                             int(config["Nvol_i"]))
+        if self.m.segSet is not None:
+            self.m.DmnSegments.CreateArray(len(config["segments"]))
 
+    def set_operating_conditions(self, reassign=False):
+        """Assign the current/voltage profile of the config to the assigned variables of
+        the cell model. Parameter sweeps (mpet.sweep) and resumed simulations re-assign
+        them after Initialize (reassign=True) after changing the profile in the config."""
+        config = self.config
+        m = self.m
+        values = [(m.currset, config["currset"]),
+                  (m.Vset, 0. if config["Vset"] is None else config["Vset"]),
+                  (m.power, 0. if config["power"] is None else config["power"]),
+                  (m.tau_ramp, config["tend"]*config["tramp"] if config["tramp"] > 0 else 1.)]
+        for var, value in values:
+            if reassign:
+                var.ReAssignValue(value)
+            else:
+                var.AssignValue(value)
+        if m.segSet is not None:
+            tEnd = 0.
+            for i, (setpoint, duration) in enumerate(config["segments"]):
+                tEnd += duration
+                if reassign:
+                    m.segSet.ReAssignValue(i, setpoint)
+                    m.segEnd.ReAssignValue(i, tEnd)
+                else:
+                    m.segSet.AssignValue(i, setpoint)
+                    m.segEnd.AssignValue(i, tEnd)
+
+    @profiler.timed("SetUpVariables")
     def SetUpVariables(self):
         config = self.config
         Nvol = config["Nvol"]
@@ -157,17 +210,22 @@ class SimMPET(dae.daeSimulation):
                 cyc.time_counter.AssignValue(0)
                 cyc.cycle_number.AssignValue(1)
 
+            if self.initialGuesses is not None:
+                self.set_cached_guesses(self.initialGuesses)
+
         else:
             dPrev = self.dataPrev
             data = utils.open_data_file(dPrev)
             for tr in config["trodes"]:
                 self.m.ffrac[tr].SetInitialGuess(
                     utils.get_dict_key(data, "ffrac_" + tr, final=True))
+                R_Vp = utils.get_final_values(data, "R_Vp_" + tr)
+                phi_bulk = utils.get_final_values(data, "phi_bulk_" + tr)
+                c_lyte = utils.get_final_values(data, "c_lyte_" + tr)
+                phi_lyte = utils.get_final_values(data, "phi_lyte_" + tr)
                 for i in range(Nvol[tr]):
-                    self.m.R_Vp[tr].SetInitialGuess(
-                        i, data["R_Vp_" + tr][-1,i])
-                    self.m.phi_bulk[tr].SetInitialGuess(
-                        i, data["phi_bulk_" + tr][-1,i])
+                    self.m.R_Vp[tr].SetInitialGuess(i, R_Vp[i])
+                    self.m.phi_bulk[tr].SetInitialGuess(i, phi_bulk[i])
                     for j in range(Npart[tr]):
                         Nij = config["psd_num"][tr][i,j]
                         part = self.m.particles[tr][i,j]
@@ -176,16 +234,16 @@ class SimMPET(dae.daeSimulation):
                             l=tr, i=i, j=j)
 
                         # Set the inlet port variables for each particle
-                        part.c_lyte.SetInitialGuess(data["c_lyte_" + tr][-1,i])
-                        part.phi_lyte.SetInitialGuess(data["phi_lyte_" + tr][-1,i])
-                        part.phi_m.SetInitialGuess(data["phi_bulk_" + tr][-1,i])
+                        part.c_lyte.SetInitialGuess(c_lyte[i])
+                        part.phi_lyte.SetInitialGuess(phi_lyte[i])
+                        part.phi_m.SetInitialGuess(phi_bulk[i])
 
                         if solidType in constants.one_var_types:
                             part.cbar.SetInitialGuess(
                                 utils.get_dict_key(data, partStr + "cbar", final=True))
+                            c = utils.get_particle_field(data, tr, i, j, "c", final=True)
                             for k in range(Nij):
-                                part.c.SetInitialCondition(
-                                    k, data[partStr + "c"][-1,k])
+                                part.c.SetInitialCondition(k, c[k])
                         elif solidType in constants.two_var_types:
                             part.c1bar.SetInitialGuess(
                                 utils.get_dict_key(data, partStr + "c1bar", final=True))
@@ -193,23 +251,23 @@ class SimMPET(dae.daeSimulation):
                                 utils.get_dict_key(data, partStr + "c2bar", final=True))
                             part.cbar.SetInitialGuess(
                                 utils.get_dict_key(data, partStr + "cbar", final=True))
+                            c1 = utils.get_particle_field(data, tr, i, j, "c1", final=True)
+                            c2 = utils.get_particle_field(data, tr, i, j, "c2", final=True)
                             for k in range(Nij):
-                                part.c1.SetInitialCondition(
-                                    k, data[partStr + "c1"][-1,k])
-                                part.c2.SetInitialCondition(
-                                    k, data[partStr + "c2"][-1,k])
+                                part.c1.SetInitialCondition(k, c1[k])
+                                part.c2.SetInitialCondition(k, c2[k])
             if config["Nvol"]["s"]:
+                c_lyte = utils.get_final_values(data, "c_lyte_s")
+                phi_lyte = utils.get_final_values(data, "phi_lyte_s")
                 for i in range(Nvol["s"]):
-                    self.m.c_lyte["s"].SetInitialCondition(
-                        i, data["c_lyte_s"][-1,i])
-                    self.m.phi_lyte["s"].SetInitialGuess(
-                        i, data["phi_lyte_s"][-1,i])
+                    self.m.c_lyte["s"].SetInitialCondition(i, c_lyte[i])
+                    self.m.phi_lyte["s"].SetInitialGuess(i, phi_lyte[i])
             for tr in config["trodes"]:
+                c_lyte = utils.get_final_values(data, "c_lyte_" + tr)
+                phi_lyte = utils.get_final_values(data, "phi_lyte_" + tr)
                 for i in range(Nvol[tr]):
-                    self.m.c_lyte[tr].SetInitialCondition(
-                        i, data["c_lyte_" + tr][-1,i])
-                    self.m.phi_lyte[tr].SetInitialGuess(
-                        i, data["phi_lyte_" + tr][-1,i])
+                    self.m.c_lyte[tr].SetInitialCondition(i, c_lyte[i])
+                    self.m.phi_lyte[tr].SetInitialGuess(i, phi_lyte[i])
 
             # Read in the ghost point values
             if not self.m.SVsim:
@@ -257,8 +315,91 @@ class SimMPET(dae.daeSimulation):
             if isinstance(data, h5py._hl.files.File):
                 data.close()
 
+        if self.resume is not None and config['profileType'] == "CCCVCPcycle":
+            # continue in the cycler step of the checkpoint
+            self.m.cycle.stnCCCV.ActiveState = self.resume["stn_state"]
+            for name, value in self.get_cycle_values().items():
+                if name == "maccor_step_number":
+                    self.m.cycle.maccor_step_number.SetInitialGuess(value)
+                else:
+                    getattr(self.m.cycle, name).AssignValue(value)
+
         # The simulation runs when the endCondition is 0
         self.m.endCondition.AssignValue(0)
+        self.set_operating_conditions()
+
+    def get_cycle_values(self):
+        """Values of the CCCVCPcycle variables of the checkpoint to resume from,
+        with the time shifted to the start of the resumed simulation."""
+        values = {name: float(self.resume[name]) for name in checkpoint.CYCLE_VARIABLES}
+        values["time_counter"] -= self.tOffset
+        return values
+
+    def load_checkpoint_values(self, folder):
+        """Set all variables to their values in a checkpoint. Call after Initialize."""
+        self.LoadInitializationValues(osp.join(folder, "values.dat"))
+        # the stored operating conditions are those of the original profile
+        self.set_operating_conditions(reassign=True)
+        if self.config['profileType'] == "CCCVCPcycle":
+            # the stored values of the assigned variables refer to the original time
+            for name, value in self.get_cycle_values().items():
+                if name != "maccor_step_number":
+                    getattr(self.m.cycle, name).ReAssignValue(value)
+
+    def checkpoint_due(self):
+        """Whether the checkpoint interval (wall clock or simulated time) has passed."""
+        config = self.config
+        wallTime, simTime = self.lastCheckpoint
+        if 0 < config["checkpointWallTime"] <= time.time() - wallTime:
+            return True
+        t = self.CurrentTime + self.tOffset
+        return 0 < config["checkpointSimTime"] <= (t - simTime)*self.tScale
+
+    def guess_variables(self):
+        """
+        Yield (name, variable) for the algebraic variables whose initial values are
+        guesses. Their values after SolveInitial are stored in the initial condition cache.
+        """
+        config = self.config
+        m = self.m
+        yield "phi_applied", m.phi_applied
+        yield "phi_cell", m.phi_cell
+        if not m.SVsim:
+            yield "c_lyteGP_L", m.c_lyteGP_L
+            yield "phi_lyteGP_L", m.phi_lyteGP_L
+        if config["Nvol"]["s"]:
+            yield "phi_lyte_s", m.phi_lyte["s"]
+        for tr in config["trodes"]:
+            yield "ffrac_" + tr, m.ffrac[tr]
+            yield "R_Vp_" + tr, m.R_Vp[tr]
+            yield "phi_bulk_" + tr, m.phi_bulk[tr]
+            yield "phi_lyte_" + tr, m.phi_lyte[tr]
+            if config[tr, "type"] in constants.one_var_types:
+                names = ["cbar", "c_lyte", "phi_lyte", "phi_m"]
+            else:
+                names = ["c1bar", "c2bar", "cbar", "c_lyte", "phi_lyte", "phi_m"]
+            for i in range(config["Nvol"][tr]):
+                for j in range(config["Npart"][tr]):
+                    part = self.m.particles[tr][i,j]
+                    partStr = "partTrode{l}vol{i}part{j}_".format(l=tr, i=i, j=j)
+                    for name in names:
+                        yield partStr + name, getattr(part, name)
+
+    def get_guess_values(self):
+        """Current values of the variables of :meth:`guess_variables`."""
+        return {name: var.npyValues for name, var in self.guess_variables()}
+
+    def set_cached_guesses(self, values):
+        """Use cached values (see :meth:`get_guess_values`) as initial guesses."""
+        for name, var in self.guess_variables():
+            if name not in values:
+                continue
+            value = values[name]
+            if np.ndim(value) == 0:
+                var.SetInitialGuess(float(value))
+            elif len(value) == var.NumberOfPoints:
+                for i, v in enumerate(value):
+                    var.SetInitialGuess(i, v)
 
     def Run(self):
         """
@@ -277,11 +418,17 @@ class SimMPET(dae.daeSimulation):
 
             # Integrate the equations
             self.IntegrateUntilTime(nextTime, dae.eStopAtModelDiscontinuity, True)
+            if self.solverStats is not None:
+                self.solverStats.record(self.CurrentTime)
             self.ReportData(self.CurrentTime)
             self.Log.SetProgress(int(100. * self.CurrentTime/self.TimeHorizon))
 
             # Break when an end condition has been met
             if self.m.endCondition.npyValues:
-                description = mod_cell.endConditions[int(self.m.endCondition.npyValues)]
+                description = model_funcs.endConditions[int(self.m.endCondition.npyValues)]
                 sys.stdout.write("\nEnding condition: " + description)
                 break
+
+            if self.outdir is not None and self.checkpoint_due():
+                checkpoint.write_checkpoint(self, self.outdir)
+                self.lastCheckpoint = (time.time(), self.CurrentTime + self.tOffset)
@@ -0,0 +1,217 @@
+"""Statistics of the IDAS solver for each phase of a simulation.
+
+:class:`SolverStats` records one row per phase of a daetools simulation: the
+initialization (SolveInitial) and every reporting interval of
+:meth:`mpet.sim.SimMPET.Run`. Each row holds the simulated time interval, the wall
+time and the number of steps, residual and Jacobian evaluations, linear solver
+setups, Newton and linear iterations and failures of the solver in that phase, and
+the step size and order at its end (see :data:`COLUMNS`).
+
+The table is stored as ``solver_stats`` in the output data file, with the columns in
+:data:`COLUMNS` (also stored as ``solver_stats_columns``). :func:`read_solver_stats`
+returns it as a dict of columns, e.g. to find which part of a discharge curve is slow::
+
+    stats = read_solver_stats("sim_output")
+    slowest = np.argsort(stats["wall_time"])[::-1]
+"""
+import os
+import time
+
+import h5py
+import numpy as np
+import scipy.io as sio
+
+import mpet.utils as utils
+
+#: Columns of the solver statistics table. Columns are only appended, so the table of
+#: an earlier version is the first columns of the table (see :func:`pad_table`).
+COLUMNS = ["phase", "t_start", "t_end", "wall_time", "steps", "residual_evals",
+           "jacobian_evals", "newton_iters", "linear_iters", "error_test_fails",
+           "convergence_fails", "step_size", "order", "linear_setups"]
+
+#: Phases of a simulation
+PHASE_INIT = 0
+PHASE_INTEGRATE = 1
+
+#: Keys of the daeIDAS IntegratorStats of the cumulative counters, by column
+COUNTERS = {
+    "steps": "NumSteps",
+    "residual_evals": "NumEquationEvals",
+    "jacobian_evals": "NumJacobianEvals",
+    "linear_setups": "NumLinSolvSetups",
+    "newton_iters": "NumNonlinSolvIters",
+    "linear_iters": "NumLinIters",
+    "error_test_fails": "NumErrTestFails",
+    "convergence_fails": "NumNonlinSolvConvFails",
+}
+
+#: Keys of the daeIDAS IntegratorStats of the current solver state, by column
+CURRENT = {
+    "step_size": "LastStep",
+    "order": "LastOrder",
+}
+
+#: Keys that are only reported by some linear solvers, e.g. the iterations of the
+#: iterative solvers. Their columns are NaN without a warning if they are missing.
+OPTIONAL_KEYS = {"NumJacobianEvals", "NumLinIters"}
+
+#: File with the table of a checkpoint (mpet.checkpoint)
+CHECKPOINT_FILE = "solver_stats.npy"
+
+
+def get_integrator_stats(daesolver):
+    """The IntegratorStats dict of a daeIDAS solver, empty if not available."""
+    try:
+        return dict(daesolver.IntegratorStats)
+    except Exception:
+        return {}
+
+
+def lookup(stats, key):
+    """The value of key in stats, NaN if it is not present."""
+    if key in stats:
+        return float(stats[key])
+    return np.nan
+
+
+def pad_table(table):
+    """The solver statistics table with all :data:`COLUMNS`, where the columns that
+    are missing in a table of an earlier version are NaN."""
+    table = np.atleast_2d(np.asarray(table, dtype=float))
+    if table.size == 0:
+        return np.empty((0, len(COLUMNS)))
+    missing = np.full((table.shape[0], len(COLUMNS) - table.shape[1]), np.nan)
+    return np.hstack((table, missing))
+
+
+class SolverStats:
+    """Collects the statistics of a daeIDAS solver for each phase of a simulation.
+
+    :param daesolver: daeIDAS solver of the simulation
+    :param float tScale: time scale to convert the simulation times to seconds
+    :param float tOffset: (non-dimensional) start time of a resumed simulation
+    :param ndarray previous: rows of an earlier part of the simulation, which the
+        rows of this run are appended to
+    """
+    def __init__(self, daesolver, tScale=1., tOffset=0., previous=None):
+        self.daesolver = daesolver
+        self.tScale = tScale
+        self.tOffset = tOffset
+        self.rows = [] if previous is None else [row for row in pad_table(previous)]
+        self.counters = {}
+        self.warned = False
+        self.wallTime = None
+        self.simTime = 0.
+        self.start(0.)
+
+    def start(self, t):
+        """Start a new phase at (non-dimensional) simulation time t."""
+        stats = get_integrator_stats(self.daesolver)
+        self.counters = {column: lookup(stats, key) for column, key in COUNTERS.items()}
+        self.wallTime = time.time()
+        self.simTime = t
+
+    def record(self, t, phase=PHASE_INTEGRATE):
+        """End the current phase at simulation time t, add its row to the table and
+        start the next phase."""
+        wallTime = time.time() - self.wallTime
+        stats = get_integrator_stats(self.daesolver)
+        self.check_keys(stats)
+        row = {"phase": phase, "wall_time": wallTime,
+               "t_start": (self.simTime + self.tOffset)*self.tScale,
+               "t_end": (t + self.tOffset)*self.tScale}
+        for column, key in COUNTERS.items():
+            value = lookup(stats, key)
+            # IDAS resets its counters when it is reinitialized at a discontinuity
+            previous = self.counters[column]
+            row[column] = value - previous if value >= previous else value
+        for column, key in CURRENT.items():
+            row[column] = lookup(stats, key)
+        self.rows.append(np.array([row[column] for column in COLUMNS], dtype=float))
+        self.start(t)
+
+    def check_keys(self, stats):
+        """Warn once if keys of the statistics are missing in the IntegratorStats of
+        the solver, as their columns are NaN."""
+        if self.warned:
+            return
+        keys = list(COUNTERS.values()) + list(CURRENT.values())
+        missing = [key for key in keys if key not in stats and key not in OPTIONAL_KEYS]
+        if missing:
+            print("Warning: the IntegratorStats of the solver do not contain "
+                  + ", ".join(missing) + ", their solver statistics are NaN")
+            self.warned = True
+
+    def table(self):
+        """The statistics as an array with one row per phase, see :data:`COLUMNS`."""
+        return np.array(self.rows, dtype=float).reshape(-1, len(COLUMNS))
+
+    def summary(self):
+        """Totals of the counters and the wall time over all phases."""
+        table = self.table()
+        totals = {"wall_time": float(np.sum(table[:, COLUMNS.index("wall_time")]))}
+        for column in COUNTERS:
+            totals[column] = float(np.nansum(table[:, COLUMNS.index(column)]))
+        return totals
+
+
+def write_solver_stats(outdir, dataReporter, table, dataFileName="output_data"):
+    """Store the solver statistics table in the output data file of a simulation,
+    replacing the table of earlier runs in the same directory.
+
+    :param str outdir: output directory
+    :param str dataReporter: data reporter of the simulation, which determines the file
+    :param ndarray table: the rows of :meth:`SolverStats.table`
+    """
+    dataFile = os.path.join(outdir, dataFileName)
+    if dataReporter in ["hdf5", "hdf5Fast", "hdf5Stream"]:
+        with h5py.File(dataFile + ".hdf5", "a") as mat_dat:
+            if "solver_stats" in mat_dat:
+                del mat_dat["solver_stats"]
+            dset = mat_dat.create_dataset("solver_stats", data=table)
+            dset.attrs["columns"] = COLUMNS
+        return
+    if dataReporter == "matSegments":
+        # the table is stored in the latest segment
+        manifest = utils.read_segment_manifest(dataFile)
+        if manifest is not None:
+            dataFile = os.path.join(outdir, os.path.splitext(
+                manifest["segments"][-1]["file"])[0])
+    # append the table to the mat file written by the data reporter, which was
+    # rewritten without the table of earlier runs
+    with open(dataFile + ".mat", "r+b") as fo:
+        # savemat only writes the file header at the start of the file
+        fo.seek(0, os.SEEK_END)
+        sio.savemat(fo, {"solver_stats": table, "solver_stats_columns": COLUMNS},
+                    format='5', long_field_names=False, do_compression=False)
+
+
+def read_solver_stats(indir, dataFileName="output_data"):
+    """Read the solver statistics table from the output of a simulation.
+
+    :param str indir: output directory
+    :return: dict of column -> array of the rows, or None if the output has no table
+    """
+    dataFile = os.path.join(indir, dataFileName)
+    table = None
+    manifest = utils.read_segment_manifest(dataFile)
+    if manifest is not None:
+        files = [os.path.join(indir, segment["file"])
+                 for segment in reversed(manifest["segments"])]
+    else:
+        files = [dataFile + ".mat"]
+    for filename in files:
+        if os.path.isfile(filename):
+            names = [name for name, _, _ in sio.whosmat(filename)]
+            if "solver_stats" in names:
+                table = sio.loadmat(filename, variable_names=["solver_stats"])["solver_stats"]
+                break
+    if table is None and manifest is None and os.path.isfile(dataFile + ".hdf5"):
+        with h5py.File(dataFile + ".hdf5", "r") as mat_dat:
+            if "solver_stats" in mat_dat:
+                table = mat_dat["solver_stats"][()]
+    if table is None:
+        return None
+    # tables of an earlier version have fewer columns
+    table = pad_table(table)
+    return {column: table[:, i] for i, column in enumerate(COLUMNS)}
@@ -0,0 +1,128 @@
+"""Parameter sweeps over the operating conditions of a single model.
+
+The model is built and initialized once. For every sweep point, the operating
+conditions (C-rate, voltage, power, end time or the current/voltage segments, see
+:data:`mpet.config.constants.OPERATING_CONDITIONS`) are re-assigned to the assigned
+variables of the cell model and the simulation is run again from the initial state, so
+each point costs one integration instead of a full rebuild. Other parameters, such as
+the temperature, enter the model equations as constants and require a separate run.
+
+Example::
+
+    from mpet.sweep import run_sweep
+    outdirs = run_sweep("configs/params_system.cfg", [{"Crate": c} for c in [0.5, 1, 2]])
+"""
+import errno
+import os
+import shutil
+import time
+
+import daetools.pyDAE as dae
+
+import mpet.data_reporting as data_reporting
+import mpet.main as main
+import mpet.output_data as output_data
+import mpet.sim as sim
+from mpet.config import Config
+
+#: profile types of which the operating conditions are parameters of the cell model
+SWEEP_PROFILES = ["CC", "CV", "CP", "CCsegments", "CVsegments"]
+
+
+def check_sweep(config, points):
+    """Raise a ValueError if the points cannot be run on a single model of the config."""
+    if config["backend"] != "daetools":
+        raise ValueError("Parameter sweeps require backend = daetools")
+    if config["profileType"] not in SWEEP_PROFILES:
+        raise ValueError(f"Parameter sweeps are not supported for profileType "
+                         f"{config['profileType']}")
+    for point in points:
+        if "segments" not in point:
+            continue
+        if config["tramp"] > 0:
+            raise ValueError("Segments can only be swept without ramp (tramp = 0)")
+        if len(point["segments"]) != len(config["segments"]):
+            raise ValueError("All sweep points need the same number of segments as the "
+                             "config file")
+
+
+def run_sweep(paramfile, points, outdir=None):
+    """Run a simulation for each set of operating conditions with a single model.
+
+    :param str paramfile: system config file of the model
+    :param list points: dicts of operating conditions of each sweep point, in the
+        units of the config file, e.g. ``[{"Crate": 1}, {"Crate": 2}]``
+    :param str outdir: output directory, by default a new directory in history.
+        The output of point i is written to the subdirectory ``point_<i>``
+
+    :return: list of the output directories of the points
+    :raises FileExistsError: if the output directory exists
+    """
+    timeStart = time.time()
+    config = Config(paramfile)
+    check_sweep(config, points)
+    # scale all points first, so that invalid values fail before any simulation
+    scaled = [config.scale_operating_conditions(point) for point in points]
+
+    if outdir is None:
+        config_base = os.path.splitext(os.path.basename(paramfile))[0]
+        outdir_name = "_".join((time.strftime("%Y%m%d_%H%M%S", time.localtime()),
+                                config_base, "sweep"))
+        outdir = os.path.join(os.getcwd(), "history", outdir_name)
+    if os.path.exists(outdir):
+        raise FileExistsError(errno.EEXIST, "The output directory exists", outdir)
+    os.makedirs(outdir)
+    shutil.copyfile(paramfile, os.path.join(outdir, "input_params_system.cfg"))
+    with open(os.path.join(outdir, "sweep_points.txt"), "w") as fo:
+        for i, point in enumerate(points):
+            print(f"point_{i}: {point}", file=fo)
+
+    # build and initialize the model with the conditions of the first point
+    for key, value in scaled[0].items():
+        config[key] = value
+    main.set_daetools_options(config)
+    log = dae.daePythonStdOutLog()
+    simulation = sim.SimMPET(config, config["t_ref"])
+    reporter = data_reporting.MemoryDataReporter()
+    datareporter = dae.daeDelegateDataReporter()
+    datareporter.AddDataReporter(reporter)
+    if not reporter.Connect(os.path.join(outdir, "output_data"), simulation.m.Name):
+        raise RuntimeError(f"Cannot connect the data reporter to {outdir}")
+    main.initialize_simulation(simulation, datareporter, log)
+    dae.daeGetConfig().SetString("daetools.IDAS.MaxNumItersIC","1000")
+    dae.daeGetConfig().SetString("daetools.IDAS.MaxNumSteps","100000")
+    # initial values of the model, the starting point of every sweep point
+    initfile = os.path.join(outdir, "initial_values.dat")
+    simulation.StoreInitializationValues(initfile)
+
+    pointdirs = []
+    for i, values in enumerate(scaled):
+        print(f"\nSweep point {i}: {points[i]}")
+        if i > 0:
+            for key, value in values.items():
+                config[key] = value
+            simulation.TimeHorizon = config["tend"]
+            simulation.ReportingTimes = config["times"]
+            simulation.Reset()
+            # the stored values include the operating conditions of the first point
+            simulation.LoadInitializationValues(initfile)
+            simulation.set_operating_conditions(reassign=True)
+            simulation.m.endCondition.ReAssignValue(0)
+        reporter.clear()
+        simulation.SolveInitial()
+        try:
+            simulation.Run()
+        except Exception as e:
+            print(str(e))
+            simulation.ReportData(simulation.CurrentTime)
+
+        pointdir = os.path.join(outdir, f"point_{i}")
+        os.makedirs(pointdir)
+        config.write(pointdir)
+        output_data.write_output_data(config, pointdir, reporter.get_variables())
+        pointdirs.append(pointdir)
+    simulation.Finalize()
+    os.remove(initfile)
+
+    print("\nTotal time:", time.time() - timeStart, "s")
+    return pointdirs
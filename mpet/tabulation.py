@@ -0,0 +1,430 @@
+"""Tabulation of expensive material functions as monotone cubic splines.
+
+Functions such as the chemical potential of a material are normally evaluated as a DAE Tools
+expression at every residual and Jacobian evaluation. For functions that depend only on the local
+concentration, the function can instead be sampled once into a piecewise cubic Hermite
+(PCHIP) spline. The spline is evaluated with its analytic derivative through a DAE Tools external
+function, see :class:`mpet.extern_funcs.SplineScalar`.
+
+Tables are verified against the original function on points between the sample points, and are
+stored on disk so that subsequent simulations with the same function and parameters can reuse
+them.
+"""
+import bisect
+import hashlib
+import os
+
+import numpy as np
+import scipy.interpolate as sintrp
+
+
+#: Environment variable to override the folder in which tables are stored
+CACHE_DIR_ENV = "MPET_TABLE_CACHE"
+
+#: Number of points at which a function is probed to identify it in the disk cache
+NUM_PROBES = 64
+
+#: Error measures of a table, see :func:`table_error`
+ERROR_MEASURES = ("absolute", "relative", "mixed")
+
+#: Version of the table construction, part of the disk cache key so that tables created
+#: by an older version are not reused
+TABLE_VERSION = 2
+
+
+class SplineTable:
+    """Monotone piecewise cubic spline of a function of one variable.
+
+    Outside of the tabulated range, the spline is extrapolated linearly.
+
+    :param ndarray x: sample points, strictly increasing
+    :param ndarray y: function values at the sample points
+    """
+    def __init__(self, x, y):
+        self.x = np.asarray(x, dtype=float)
+        self.y = np.asarray(y, dtype=float)
+        spline = sintrp.PchipInterpolator(self.x, self.y, extrapolate=False)
+        # store the polynomial coefficients as lists, evaluating single values with
+        # plain Python floats is much faster than calling the scipy interpolator
+        self._coeff_array = spline.c.T
+        self._breaks = self.x.tolist()
+        self._coeffs = self._coeff_array.tolist()
+        self._xmin, self._xmax = self._breaks[0], self._breaks[-1]
+        self._ymin, self._ymax = float(self.y[0]), float(self.y[-1])
+        dspline = spline.derivative()
+        self._dymin = float(dspline(self._xmin))
+        self._dymax = float(dspline(self._xmax))
+
+    @classmethod
+    def from_function(cls, func, xmin, xmax, npoints, tol=None, max_points=None,
+                      error="absolute", verify_points=None):
+        """Sample a vectorized function on points that are clustered near both ends of the
+        range, where material functions typically change fastest. If a tolerance is given,
+        the spline is compared with the function at three points within each interval, and
+        intervals where it deviates more than the tolerance are split in half, until the
+        tolerance is met or max_points is reached. Intervals that contain one of the
+        verify_points at which the tolerance is not met are split as well.
+
+        :param callable func: function to tabulate, called with an array of sample points
+        :param float xmin: lower end of the range
+        :param float xmax: upper end of the range
+        :param int npoints: initial number of sample points
+        :param float tol: maximum allowed error (optional)
+        :param int max_points: maximum number of sample points (default: 50*npoints)
+        :param str error: error measure of tol, see :func:`table_error`
+        :param ndarray verify_points: additional points at which the tolerance must be met,
+            e.g. a dense grid (optional)
+        """
+        x = get_sample_points(xmin, xmax, npoints)
+        table = cls(x, func(x))
+        if tol is None:
+            return table
+        if max_points is None:
+            max_points = 50*npoints
+        scale = np.max(np.abs(table.y))
+        if verify_points is not None:
+            verify_values = func(verify_points)
+        while True:
+            xcheck = get_check_points(table.x)
+            inaccurate = np.any(
+                table_error(table(xcheck), func(xcheck), error, scale).reshape(-1, 3) > tol,
+                axis=1)
+            if verify_points is not None:
+                failed = verify_points[
+                    table_error(table(verify_points), verify_values, error, scale) > tol]
+                intervals = np.searchsorted(table.x, failed, side="right") - 1
+                inaccurate[np.clip(intervals, 0, len(inaccurate) - 1)] = True
+            num_inaccurate = np.count_nonzero(inaccurate)
+            if num_inaccurate == 0 or len(table.x) + num_inaccurate > max_points:
+                return table
+            xmid = 0.5*(table.x[1:] + table.x[:-1])
+            x = np.sort(np.concatenate((table.x, xmid[inaccurate])))
+            table = cls(x, func(x))
+
+    def evaluate(self, x):
+        """Return the value and derivative of the spline at a single point.
+
+        :param float x: point at which to evaluate the spline
+        :return: value, derivative
+        """
+        if x <= self._xmin:
+            return self._ymin + self._dymin*(x - self._xmin), self._dymin
+        if x >= self._xmax:
+            return self._ymax + self._dymax*(x - self._xmax), self._dymax
+        i = bisect.bisect_right(self._breaks, x) - 1
+        c3, c2, c1, c0 = self._coeffs[i]
+        dx = x - self._breaks[i]
+        return ((c3*dx + c2)*dx + c1)*dx + c0, (3*c3*dx + 2*c2)*dx + c1
+
+    def __call__(self, x):
+        """Evaluate the spline at one or more points."""
+        x = np.asarray(x, dtype=float)
+        i = np.clip(np.searchsorted(self.x, x, side="right") - 1, 0, len(self.x) - 2)
+        c3, c2, c1, c0 = np.moveaxis(self._coeff_array[i], -1, 0)
+        dx = x - self.x[i]
+        values = ((c3*dx + c2)*dx + c1)*dx + c0
+        values = np.where(x <= self._xmin, self._ymin + self._dymin*(x - self._xmin), values)
+        return np.where(x >= self._xmax, self._ymax + self._dymax*(x - self._xmax), values)
+
+    def max_error(self, func, x=None, error="absolute"):
+        """Maximum difference between the spline and the original function,
+        by default evaluated at three points between each pair of sample points,
+        see :func:`get_check_points`.
+
+        :param callable func: the tabulated function
+        :param ndarray x: points at which to compare (optional)
+        :param str error: error measure, see :func:`table_error`
+        :return: maximum error
+        """
+        if x is None:
+            x = get_check_points(self.x)
+        y = np.asarray(func(x), dtype=float)
+        scale = max(np.max(np.abs(y)), np.max(np.abs(self.y)))
+        return np.max(table_error(self(x), y, error, scale))
+
+
+def table_error(approx, exact, error, scale=None):
+    """Error of a table at each point, with one of the measures in ERROR_MEASURES:
+
+    * absolute: ``|approx - exact|``
+    * relative: ``|approx - exact| / scale``, where scale is the largest absolute value of
+      the function (by default, of exact)
+    * mixed: ``|approx - exact| / max(1, |exact|)``, i.e. absolute where the function is
+      smaller than one, and relative to the local function value elsewhere. This measure
+      is suited to functions that diverge at the ends of the range.
+
+    Non-finite function values are an infinite error.
+
+    :param ndarray approx: values of the table
+    :param ndarray exact: values of the function
+    :param str error: error measure
+    :param float scale: scale of the relative error (optional)
+    :return: error at each point
+    """
+    exact = np.asarray(exact, dtype=float)
+    diff = np.abs(approx - exact)
+    if error == "relative":
+        diff = diff / (np.max(np.abs(exact)) if scale is None else scale)
+    elif error == "mixed":
+        diff = diff / np.maximum(1., np.abs(exact))
+    elif error != "absolute":
+        raise ValueError(f"Unknown error measure: {error}")
+    return np.where(np.isfinite(exact), diff, np.inf)
+
+
+def get_sample_points(xmin, xmax, npoints):
+    """Chebyshev-Lobatto points on [xmin, xmax]"""
+    s = np.linspace(0., 1., npoints)
+    return xmin + (xmax - xmin) * 0.5*(1 - np.cos(np.pi*s))
+
+
+def get_check_points(x):
+    """Points at a quarter, half and three quarters of each interval between the sample
+    points x, ordered by interval"""
+    return (x[:-1, None] + np.diff(x)[:, None]*np.array([0.25, 0.5, 0.75])).ravel()
+
+
+def get_cache_dir():
+    """Folder in which tables are stored. This is the folder set by the MPET_TABLE_CACHE
+    environment variable, or the table_cache folder in the current working directory."""
+    return os.environ.get(CACHE_DIR_ENV, os.path.join(os.getcwd(), "table_cache"))
+
+
+def get_cache_key(name, funcs, xmin, xmax, npoints, tol):
+    """Create a key that identifies a table. Rather than trying to find out which
+    parameters a function uses, the function is evaluated at a fixed set of points and
+    the results are part of the key.
+
+    :param str name: name of the tabulated function
+    :param list funcs: functions that are tabulated together
+    :param float xmin: lower end of the range
+    :param float xmax: upper end of the range
+    :param int npoints: number of sample points
+    :param tol: tolerance of the tables
+    :return: key (str)
+    """
+    probes = get_sample_points(xmin, xmax, NUM_PROBES)
+    digest = hashlib.sha1()
+    digest.update(repr((TABLE_VERSION, name, xmin, xmax, npoints, tol)).encode())
+    for func in funcs:
+        digest.update(np.ascontiguousarray(func(probes), dtype=float).tobytes())
+    return f"{name}_{digest.hexdigest()[:16]}"
+
+
+def tabulate(name, funcs, xmin, xmax, npoints, tol, use_cache=True, error="absolute",
+             verify_points=None):
+    """Tabulate one or more functions of the same variable, verify the tables against the
+    original functions and store them on disk.
+
+    :param str name: name of the tabulated function, used in file names and error messages
+    :param list funcs: vectorized functions to tabulate
+    :param float xmin: lower end of the range
+    :param float xmax: upper end of the range
+    :param int npoints: initial number of sample points, points are added where needed
+        to meet the tolerance
+    :param float tol: maximum allowed error of the tables
+    :param bool use_cache: whether to load/store tables from/to disk
+    :param str error: error measure of tol, see :func:`table_error`
+    :param ndarray verify_points: additional points at which the tolerance must be met,
+        see :meth:`SplineTable.from_function`
+
+    :return: list of :class:`SplineTable`, one per function
+    """
+    filename = None
+    if use_cache:
+        key = get_cache_key(name, funcs, xmin, xmax, npoints, (tol, error))
+        filename = os.path.join(get_cache_dir(), f"{key}.npz")
+        if os.path.isfile(filename):
+            with np.load(filename) as data:
+                return [SplineTable(data[f"x{i}"], data[f"y{i}"]) for i in range(len(funcs))]
+
+    tables = [SplineTable.from_function(func, xmin, xmax, npoints, tol, error=error,
+                                        verify_points=verify_points)
+              for func in funcs]
+    for i, (func, table) in enumerate(zip(funcs, tables)):
+        max_error = table.max_error(func, error=error)
+        if verify_points is not None:
+            max_error = max(max_error, table.max_error(func, verify_points, error=error))
+        if not max_error <= tol:
+            raise Exception(f"Table {i} of {name} has a maximum {error} error of "
+                            f"{max_error:.3g}, which exceeds the tolerance of {tol:.3g}. "
+                            f"Increase the number of table points or the tolerance, or "
+                            f"reduce the range.")
+
+    if filename is not None:
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        tmpfile = filename + ".tmp.npz"
+        arrays = {}
+        for i, table in enumerate(tables):
+            arrays[f"x{i}"] = table.x
+            arrays[f"y{i}"] = table.y
+        np.savez(tmpfile, **arrays)
+        os.replace(tmpfile, filename)
+    return tables
+
+
+#: Default range of filling fractions of muR tables
+MURFUNC_TABLE_RANGE = (1e-6, 1 - 1e-6)
+
+
+def tabulate_muRfunc(funcs):
+    """Tabulate the chemical potential (and activity, if defined) of a material as a
+    function of the local filling fraction.
+
+    Only materials for which muR depends on nothing but the local filling fraction can be
+    tabulated. This is verified before tabulating, as is the assumption that muR_ref is a
+    constant offset. The tables do not include muR_ref. The tolerance is a mixed
+    absolute/relative error (see :func:`table_error`), as many materials diverge at the
+    ends of the range. The range is given by :func:`get_muRfunc_table_range`.
+
+    :param muRfuncs funcs: :class:`mpet.props_am.muRfuncs` instance of the particle
+
+    :return: muR table, actR table (None if the material defines no activity)
+    """
+    name = funcs.get_trode_param("muRfunc")
+    npoints = funcs.get_trode_param("muRfunc_table_points")
+    tol = funcs.get_trode_param("muRfunc_table_tol")
+
+    if not muRfunc_is_local(funcs):
+        raise Exception(f"The chemical potential of {name} does not only depend on the local "
+                        "filling fraction, it cannot be tabulated")
+
+    actR = funcs.muRfunc(np.array([0.5]), 0.5, 0.)[1]
+    tabulated = [lambda x: funcs.muRfunc(x, 0.5, 0.)[0]]
+    if actR is not None:
+        tabulated.append(lambda x: funcs.muRfunc(x, 0.5, 0.)[1])
+    xmin, xmax = get_muRfunc_table_range(funcs, tabulated)
+    tables = tabulate(f"muR_{name}", tabulated, xmin, xmax, npoints, tol, error="mixed")
+    if actR is None:
+        tables.append(None)
+    return tables
+
+
+def get_muRfunc_table_range(funcs, tabulated, num=10001):
+    """Range of filling fractions of the muR tables of a material.
+
+    This is the muRfunc_table_range of the electrode if set. Otherwise, it is the
+    ``table_range`` attribute of the material function if the material defines one (e.g.
+    because its OCV fit has poles), or else MURFUNC_TABLE_RANGE. The default range is
+    reduced to the interval around y = 0.5 in which all tabulated functions are finite.
+
+    :param muRfuncs funcs: :class:`mpet.props_am.muRfuncs` instance of the particle
+    :param list tabulated: functions that are tabulated
+    :param int num: number of points at which the functions are checked
+
+    :return: xmin, xmax
+    """
+    name = funcs.get_trode_param("muRfunc")
+    table_range = funcs.get_trode_param("muRfunc_table_range")
+    if table_range is not None:
+        x = get_sample_points(table_range[0], table_range[1], num)
+        with np.errstate(invalid="ignore", divide="ignore", over="ignore"):
+            finite = all(np.all(np.isfinite(func(x))) for func in tabulated)
+        if not finite:
+            raise Exception(f"The chemical potential of {name} is not finite everywhere in "
+                            f"muRfunc_table_range {table_range}, reduce the range")
+        return tuple(table_range)
+
+    xmin, xmax = getattr(funcs.muRfunc, "table_range", MURFUNC_TABLE_RANGE)
+    x = get_sample_points(xmin, xmax, num)
+    with np.errstate(invalid="ignore", divide="ignore", over="ignore"):
+        finite = np.logical_and.reduce([np.isfinite(func(x)) for func in tabulated])
+    centre = np.searchsorted(x, 0.5)
+    if not finite[centre]:
+        raise Exception(f"The chemical potential of {name} is not finite at y = 0.5, set "
+                        "muRfunc_table_range to tabulate it")
+    # the last finite point before the first non-finite value on either side
+    lower = np.nonzero(~finite[:centre])[0]
+    upper = np.nonzero(~finite[centre:])[0]
+    if len(lower) > 0:
+        xmin = x[lower[-1] + 1]
+    if len(upper) > 0:
+        xmax = x[centre + upper[0] - 1]
+    return float(xmin), float(xmax)
+
+
+def muRfunc_is_local(funcs):
+    """Check whether the chemical potential (and activity) of a material depends on nothing but
+    the local filling fraction, with muR_ref as a constant offset. Such functions can be
+    evaluated for any number of points at once, independent of the particle they belong to.
+
+    :param muRfuncs funcs: :class:`mpet.props_am.muRfuncs` instance of the particle
+
+    :return: True if muR is local
+    """
+    y = np.array([0.1, 0.3, 0.45, 0.6, 0.9])
+    try:
+        muR, actR = funcs.muRfunc(y, 0.3, 0.)
+        muR_ref_shifted, actR_ref_shifted = funcs.muRfunc(y, 0.3, 1.)
+        muR_ybar, _ = funcs.muRfunc(y, 0.7, 0.)
+        muR_local = np.array([funcs.muRfunc(y[i:i+1], 0.3, 0.)[0][0] for i in range(len(y))])
+        return bool(np.allclose(muR_ybar, muR) and np.allclose(muR_local, muR)
+                    and np.allclose(muR_ref_shifted - 1., muR)
+                    and (actR is None or np.allclose(actR_ref_shifted, actR)))
+    except (TypeError, ValueError):
+        # e.g. materials with gradient terms operate on object arrays
+        return False
+
+
+#: Electrolyte properties that can be tabulated, in the order returned by an SMset
+ELYTE_PROPERTIES = ("D", "sigma", "thermFac", "tp0")
+
+#: Number of points of the uniform grid on which electrolyte tables are verified
+ELYTE_VERIFY_POINTS = 100001
+
+
+def tabulate_elyte(elyte_function, name, T, crange, npoints, tol):
+    """Tabulate the transport properties of a Stefan-Maxwell electrolyte property set
+    as a function of concentration at a fixed temperature.
+
+    :param callable elyte_function: SMset function, see :mod:`mpet.electrolyte`
+    :param str name: name of the SMset
+    :param float T: non-dimensional temperature
+    :param tuple crange: (min, max) non-dimensional concentration
+    :param int npoints: initial number of sample points
+    :param float tol: maximum allowed error of each table, relative to its largest value,
+        on the uniform grid of :func:`verify_elyte_tables`
+
+    :return: dict of :class:`SplineTable`, with the keys in ELYTE_PROPERTIES
+    """
+    funcs = [get_elyte_property(elyte_function, prop, T) for prop in ELYTE_PROPERTIES]
+    tables = tabulate(f"elyte_{name}_T{T:.6g}", funcs, crange[0], crange[1], npoints, tol,
+                      error="relative",
+                      verify_points=np.linspace(crange[0], crange[1], ELYTE_VERIFY_POINTS))
+    return dict(zip(ELYTE_PROPERTIES, tables))
+
+
+def get_elyte_property(elyte_function, prop, T):
+    """Return a vectorized function of concentration for a single electrolyte property
+    at temperature T"""
+    func = elyte_function()[ELYTE_PROPERTIES.index(prop)]
+
+    def property_at_T(c):
+        # some property sets return a constant, make sure the result is an array
+        return np.broadcast_to(np.asarray(func(c, T), dtype=float), np.shape(c))
+    return property_at_T
+
+
+def verify_elyte_tables(tables, elyte_function, T, tol=None, num=ELYTE_VERIFY_POINTS):
+    """Compare electrolyte property tables against the analytic functions on a dense,
+    uniform grid over the tabulated range.
+
+    :param dict tables: tables as returned by :func:`tabulate_elyte`
+    :param callable elyte_function: SMset function the tables were created from
+    :param float T: non-dimensional temperature
+    :param float tol: if given, an error is raised if a table exceeds this tolerance
+    :param int num: number of points to compare at
+
+    :return: dict with the maximum error of each property, relative to its largest value
+    """
+    errors = {}
+    for prop, table in tables.items():
+        x = np.linspace(table.x[0], table.x[-1], num)
+        errors[prop] = table.max_error(get_elyte_property(elyte_function, prop, T), x,
+                                       error="relative")
+        if tol is not None and not errors[prop] <= tol:
+            raise Exception(f"The {prop} table has a maximum relative error of "
+                            f"{errors[prop]:.3g}, which exceeds the tolerance of {tol:.3g}. "
+                            f"Increase the number of table points or the tolerance, or "
+                            f"reduce the range.")
+    return errors
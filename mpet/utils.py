@@ -1,13 +1,31 @@
 import subprocess as subp
 
 import os
+import re
 import sys
+import json
 import importlib
+import types
 import numpy as np
-import h5py
-import scipy.io as sio
 
-import daetools.pyDAE as dae
+
+class LazyModule(types.ModuleType):
+    """A module that is only imported when one of its attributes is first used.
+    Keeps heavy dependencies (daetools, matplotlib, h5py) out of the start-up of
+    scripts and code paths that do not need them."""
+    def __getattr__(self, attr):
+        return getattr(importlib.import_module(self.__name__), attr)
+
+
+def lazy_import(name):
+    """Module name, imported on first attribute access (see :class:`LazyModule`).
+    Use as ``h5py = lazy_import("h5py")`` instead of ``import h5py``."""
+    if name in sys.modules:
+        return sys.modules[name]
+    return LazyModule(name)
+
+
+h5py = lazy_import("h5py")
 
 
 def mean_linear(a):
@@ -62,12 +80,14 @@ def get_var_vec(var, N, dt=False):
 
 def get_asc_vec(var, Nvol, dt=False):
     """Get a numpy array for a variable spanning the anode, separator, and cathode."""
+    # the values can only be daetools variables if the daetools models were imported
+    dae = sys.modules.get("daetools.pyDAE")
     varout = {}
     for sectn in ["a", "s", "c"]:
         # If we have information within this battery section
         if sectn in var.keys():
             # If it's an array of dae variable objects
-            if isinstance(var[sectn], dae.pyCore.daeVariable):
+            if dae is not None and isinstance(var[sectn], dae.pyCore.daeVariable):
                 varout[sectn] = get_var_vec(var[sectn], Nvol[sectn], dt)
             # Otherwise, it's a parameter that varies with electrode section
             elif isinstance(var[sectn], np.ndarray):
@@ -110,13 +130,107 @@ def get_git_info(local_dir, shell=False):
     return branch_name, commit_hash, commit_diff
 
 
+# Suffix of the manifest file of segmented mat output
+SEGMENT_MANIFEST = "_segments.json"
+
+
+class SegmentedMatData():
+    """Read-only, dict-like view of mat file output that is stored in segments.
+    Continued simulations with the matSegments data reporter write each
+    simulation segment to a separate mat file. The manifest file lists the
+    segments in order. Variables are loaded from the segment files only when
+    requested and are stitched together along the time axis.
+    Takes in the path of the output data file without extension."""
+    def __init__(self, dataFile):
+        self.dataFile = dataFile
+        self.folder = os.path.dirname(dataFile)
+        self.manifest = read_segment_manifest(dataFile)
+        self.segments = self.manifest["segments"]
+        self._cache = {}
+        self._files = {}
+
+    def keys(self):
+        return self.manifest["keys"]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __contains__(self, key):
+        return key in self.manifest["keys"]
+
+    def _load(self, segment, key):
+        from mpet.io import MatFile
+        filename = os.path.join(self.folder, segment["file"])
+        if filename not in self._files:
+            self._files[filename] = MatFile(filename)
+        values = self._files[filename][key]
+        if key in self.manifest["series"]:
+            # 1D time series are stored as row vectors
+            values = values.reshape(1, -1)
+        return values
+
+    def __getitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        if key not in self._cache:
+            if key in self.manifest["static"]:
+                # time independent data is the same in all segments
+                values = self._load(self.segments[0], key)
+            else:
+                axis = 1 if key in self.manifest["series"] else 0
+                values = np.concatenate([self._load(segment, key)
+                                         for segment in self.segments], axis=axis)
+            self._cache[key] = values
+        return self._cache[key]
+
+    def close(self):
+        """Release the (memory-mapped) segment files."""
+        for matfile in self._files.values():
+            matfile.close()
+        self._files = {}
+        self._cache = {}
+
+    def final(self, key):
+        """Values of a variable in the last segment only."""
+        if key not in self:
+            raise KeyError(key)
+        return self._load(self.segments[-1], key)
+
+
+def read_segment_manifest(dataFile):
+    """Read the manifest of segmented mat file output, None if there is none."""
+    manifest_file = dataFile + SEGMENT_MANIFEST
+    if not os.path.isfile(manifest_file):
+        return None
+    with open(manifest_file, "r") as fi:
+        return json.load(fi)
+
+
+def write_segment_manifest(dataFile, manifest):
+    """Write the manifest of segmented mat file output.
+    The file is replaced atomically, so it always lists complete segments only."""
+    manifest_file = dataFile + SEGMENT_MANIFEST
+    with open(manifest_file + ".tmp", "w") as fo:
+        json.dump(manifest, fo, indent=1)
+    os.replace(manifest_file + ".tmp", manifest_file)
+
+
 def open_data_file(dataFile):
     """Load hdf5/mat file output.
-    Always defaults to .mat file, else opens .hdf5 file.
+    Segmented mat output (with a manifest) is opened first, then it
+    defaults to .mat file, else opens .hdf5 file.
+    Mat files are memory-mapped (see mpet.io.MatFile), so only the variables
+    that are used are read from disk.
     Takes in dataFile (path of file without .mat or .hdf5), returns data (output of array)"""
+    from mpet.io import MatFile
     data = []
-    if os.path.isfile(dataFile + ".mat"):
-        data = sio.loadmat(dataFile + ".mat")
+    if os.path.isfile(dataFile + SEGMENT_MANIFEST):
+        data = SegmentedMatData(dataFile)
+    elif os.path.isfile(dataFile + ".mat"):
+        data = MatFile(dataFile + ".mat")
     elif os.path.isfile(dataFile + ".hdf5"):
         data = h5py.File(dataFile + ".hdf5", 'r')
     else:
@@ -124,6 +238,112 @@ def open_data_file(dataFile):
     return data
 
 
+# Output key of a single particle field in the perParticle layout,
+# e.g. partTrodecvol0part1_cbar
+PARTICLE_KEY = re.compile(r"^(?P<pfx>(mpet\.)?)partTrode(?P<trode>\w)vol(?P<vInd>\d+)"
+                          r"part(?P<pInd>\d+)(?P<sStr>[._])(?P<field>\w+)$")
+
+
+def consolidate_particle_data(mdict, psd_num, time_axis=True):
+    """Convert the particle fields in mdict from the perParticle layout to
+    the consolidated layout, in place.
+    All particles of an electrode are concatenated along the last axis into
+    a single array per field, partTrode{l}_{field}. Particles are stored in
+    (volume, particle) order. Distributed fields (c, c1, c2, ...) take
+    psd_num[l][i,j] columns per particle, scalar fields (cbar, ...) take one.
+    Takes in mdict (output key -> values, with time as first axis if time_axis
+    is true) and psd_num (number of points per particle for each electrode).
+    Returns a dict with the (time independent) index tables:
+    partTrode{l}_index -- flat particle number of particle (i,j)
+    partTrode{l}_offsets -- first column of each particle in distributed fields
+    """
+    groups = {}
+    for key in list(mdict.keys()):
+        match = PARTICLE_KEY.match(key)
+        if match is None:
+            continue
+        ind = (int(match.group("vInd")), int(match.group("pInd")))
+        groups.setdefault((match.group("trode"), match.group("field")), {})[ind] = \
+            mdict.pop(key)
+    tables = {}
+    for (trode, field), parts in groups.items():
+        Nvol, Npart = np.shape(psd_num[trode])
+        values = []
+        for i in range(Nvol):
+            for j in range(Npart):
+                value = np.asarray(parts[i, j])
+                if time_axis:
+                    values.append(value.reshape(value.shape[0], -1))
+                else:
+                    values.append(value.reshape(-1))
+        mdict["partTrode{l}_{field}".format(l=trode, field=field)] = \
+            np.concatenate(values, axis=-1)
+        offsets = np.zeros(Nvol*Npart + 1, dtype=int)
+        offsets[1:] = np.cumsum(np.ravel(psd_num[trode]))
+        tables["partTrode{l}_offsets".format(l=trode)] = offsets
+        tables["partTrode{l}_index".format(l=trode)] = np.arange(
+            Nvol*Npart, dtype=int).reshape(Nvol, Npart)
+    return tables
+
+
+def get_particle_field(data, trode, vInd, pInd, field, squeeze=True, final=False,
+                       pfx="", sStr="_"):
+    """Gets the values of one field of a single particle, independent of the
+    particle data layout (perParticle or consolidated) of the output file.
+    Takes in data array, electrode, volume and particle index and the name of
+    the field (e.g. c, cbar, c1). If final is true, only the values at the last
+    time point are returned (as 1D array), otherwise the values at all time points.
+    Squeeze squeezes the output if true.
+    pfx and sStr are the prefix and separator used in the keys of the file."""
+    key = "{pfx}partTrode{l}vol{i}part{j}{sStr}{field}".format(
+        pfx=pfx, l=trode, i=vInd, j=pInd, sStr=sStr, field=field)
+    if key in data:
+        if final:
+            return get_final_values(data, key, pfx=pfx)
+        values = data[key]
+        return np.squeeze(values[...]) if squeeze else values[...]
+    # consolidated layout
+    base = "{pfx}partTrode{l}{sStr}".format(pfx=pfx, l=trode, sStr=sStr)
+    if base + field not in data:
+        raise KeyError(key)
+    offsets = np.ravel(data[base + "offsets"][...])
+    index = data[base + "index"][...]
+    k = int(index[vInd, pInd])
+    if final and hasattr(data, "final"):
+        # only read the last segment of segmented output
+        values = data.final(base + field)
+    else:
+        values = data[base + field]
+    if values.shape[-1] == offsets[-1]:
+        cols = slice(int(offsets[k]), int(offsets[k+1]))
+    else:
+        cols = slice(k, k+1)
+    if final:
+        return np.atleast_1d(np.squeeze(values[-1, cols]))
+    values = values[:, cols]
+    return np.squeeze(values) if squeeze else values
+
+
+def get_final_values(data, string, pfx=""):
+    """Gets the values of a variable at the last time point as 1D array.
+    For segmented output only the last segment is read."""
+    if hasattr(data, "final"):
+        values = data.final(string)
+        nt = data.segments[-1]["nt"]
+    else:
+        values = data[string]
+        nt = None
+    if values.ndim == 1:
+        return np.atleast_1d(values[-1])
+    if values.shape[0] == 1:
+        if nt is None:
+            nt = data[pfx + "phi_applied_times"].size
+        if nt != 1:
+            # time series stored as a row vector (mat files)
+            return np.atleast_1d(values[0, -1])
+    return np.atleast_1d(values[-1, ...])
+
+
 def get_dict_key(data, string, squeeze=True, final=False):
     """Gets the values in a 1D array, which is formatted slightly differently
     depending on whether it is a h5py file or a mat file
@@ -133,7 +353,17 @@ def get_dict_key(data, string, squeeze=True, final=False):
     Final overwrites squeeze--if final is true, then the array will always be squeezed.
     Squeeze squeezes into 1D array if is true, otherwise false"""
     # do not call both squeeze false and final true!!!
+    match = PARTICLE_KEY.match(string)
+    if match is not None and string not in data:
+        # particle data stored in the consolidated layout
+        values = get_particle_field(data, match.group("trode"), int(match.group("vInd")),
+                                    int(match.group("pInd")), match.group("field"),
+                                    squeeze=squeeze, final=final, pfx=match.group("pfx"),
+                                    sStr=match.group("sStr"))
+        return values.item() if final else values
     if final:  # only returns last value
+        if hasattr(data, "final"):
+            return data.final(string)[...,-1].item()
         return data[string][...,-1].item()
     elif squeeze:
         return np.squeeze(data[string][...])
@@ -169,9 +399,15 @@ def get_negative_sign_change_arrays(input_array):
     return neg_indices_start, neg_indices_end, pos_indices_start, pos_indices_end
 
 
+# Functions that were already resolved by import_function, keyed by
+# (absolute filename, function name, mpet module)
+_function_registry = {}
+
+
 def import_function(filename, function, mpet_module=None):
     """Load a function from a file that is not part of MPET, with a fallback to MPET internal
-    functions.
+    functions. Resolved functions are cached, so repeated calls with the same arguments
+    do not import anything.
 
     :param Config config: MPET configuration
     :param str filename: .py file containing the function to import. None to load from mpet_module
@@ -181,6 +417,14 @@ def import_function(filename, function, mpet_module=None):
 
     :return: A callable function
     """
+    if filename is not None:
+        filename = os.path.abspath(filename)
+    key = (filename, function, mpet_module)
+    try:
+        return _function_registry[key]
+    except KeyError:
+        pass
+
     if filename is None:
         # no filename set, load function from mpet itself
         module = importlib.import_module(mpet_module)
@@ -191,14 +435,17 @@ def import_function(filename, function, mpet_module=None):
         # sys.path is used to temporarily have only the folder containig the module we
         # need to import in the Python search path for imports
         # the following lines can be interpreted as "import <module_name>"
-        folder = os.path.dirname(os.path.abspath(filename))
+        folder = os.path.dirname(filename)
         module_name = os.path.splitext(os.path.basename(filename))[0]
         old_path = sys.path
         sys.path = [folder]
-        module = importlib.import_module(module_name)
-        sys.path = old_path
+        try:
+            module = importlib.import_module(module_name)
+        finally:
+            sys.path = old_path
 
     # import the function from the module
     callable_function = getattr(module, function)
+    _function_registry[key] = callable_function
 
     return callable_function
@@ -23,7 +23,7 @@ setuptools.setup(
         'mpet.electrode.diffusion',
         'mpet.electrode.materials',
         'mpet.electrode.reactions',
-        'mpet.electrolyte','mpet.config'
+        'mpet.electrolyte','mpet.config','mpet.backends'
     ],
     install_requires=open('requirements.txt').readlines(),
     extras_require={'test':['pytest','coverage', 'coveralls', 'flake8'],
@@ -32,7 +32,8 @@ setuptools.setup(
                     'cluster_jobs': ['dask-jobqueue', 'bokeh']},
     python_requires='>=3.6',
     scripts=['bin/mpetrun.py','bin/mpetplot.py','bin/run_jobs.py', 'bin/create_ensemble.py',
-             'bin/mpet_create_runjobs_dashboard.py', 'bin/mpet_plot_app.py'],
+             'bin/mpet_create_runjobs_dashboard.py', 'bin/mpet_plot_app.py',
+             'bin/mpetcache.py'],
     classifiers=[
         "Programming Language :: Python :: 3",
     ],
@@ -52,6 +52,16 @@ def pytest_collection_modifyitems(config, items):
                 item.add_marker(skip_analytic)
 
 
+def dirs_param(dir_b, dir_t):
+    """Reference and test directory of a test, skipped if the backend of the test run does
+    not support it (see tests/test_suite.py)"""
+    skipFile = osp.join(dir_t, "skipped.txt")
+    if osp.exists(skipFile):
+        with open(skipFile) as fi:
+            return pytest.param((dir_b, dir_t), marks=pytest.mark.skip(reason=fi.read().strip()))
+    return (dir_b, dir_t)
+
+
 def pytest_generate_tests(metafunc):
     if "Dirs" in metafunc.fixturenames:
         dir_t = metafunc.config.getoption("modDir")
@@ -64,15 +74,16 @@ def pytest_generate_tests(metafunc):
             except Exception:
                 pass
 
-            metafunc.parametrize("Dirs", [(osp.join(dir_b, dir),
-                                           osp.join(dir_t, dir)) for dir in directories])
+            metafunc.parametrize("Dirs", [dirs_param(osp.join(dir_b, dir),
+                                                     osp.join(dir_t, dir))
+                                          for dir in directories])
         else:
             # Sometimes the tests option is a list, other times it is
             # an array with one element (a string of tests).
             # This handles both.
             tests_str = " ".join(metafunc.config.getoption("tests"))
             tests_lst = tests_str.split()
-            metafunc.parametrize("Dirs", [(dir_b + "/" + test, dir_t + "/" + test)
+            metafunc.parametrize("Dirs", [dirs_param(dir_b + "/" + test, dir_t + "/" + test)
                                           for test in tests_lst])
     if "tol" in metafunc.fixturenames:
         metafunc.parametrize("tol", [float(metafunc.config.getoption("tolerance"))])
@@ -1,3 +1,4 @@
+import configparser
 import errno
 import os
 import os.path as osp
@@ -8,12 +9,27 @@ import matplotlib.pyplot as plt
 import numpy as np
 import scipy.io as sio
 
+import mpet.backends.numpy as numpy_backend
 import mpet.main
 from mpet.config.configuration import Config
 import tests.test_defs as defs
 
 
-def run_test_sims(runInfo, dirDict, pflag=True):
+#: file in the output directory of a test that the backend does not support, with the reason
+SKIP_FILE = "skipped.txt"
+
+
+def set_backend(configfile, backend):
+    """Set the simulation backend in a system config file."""
+    parser = configparser.ConfigParser()
+    parser.optionxform = str
+    parser.read(configfile)
+    parser["Sim Params"]["backend"] = backend
+    with open(configfile, "w") as fo:
+        parser.write(fo)
+
+
+def run_test_sims(runInfo, dirDict, pflag=True, backend=None):
     for testStr in runInfo:
         testDir = osp.join(dirDict["out"], testStr)
         os.makedirs(testDir)
@@ -27,6 +43,17 @@ def run_test_sims(runInfo, dirDict, pflag=True):
 
         # Run the simulation
         configfile = osp.join(testDir,'params_system.cfg')
+        if backend is not None:
+            set_backend(configfile, backend)
+        if backend == "numpy":
+            try:
+                numpy_backend.check_supported(Config(configfile))
+            except NotImplementedError as exception:
+                # Skipped by the comparison, not run with another backend
+                print(testStr + " skipped: " + str(exception))
+                with open(osp.join(testDir, SKIP_FILE), "w") as fo:
+                    fo.write(str(exception) + "\n")
+                continue
         mpet.main.main(configfile, keepArchive=False)
         shutil.move(dirDict["simOut"], testDir)
 
@@ -0,0 +1,39 @@
+"""Tests of the call times of bin/benchmark_lasolvers.py."""
+import importlib.util
+import os
+import types
+
+import pytest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope="module")
+def benchmark():
+    spec = importlib.util.spec_from_file_location(
+        "benchmark_lasolvers", os.path.join(ROOT_DIR, "bin", "benchmark_lasolvers.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class LASolver:
+    """Linear solver with the CallStats of a daetools linear solver."""
+    def __init__(self, **durations):
+        self.CallStats = {key: types.SimpleNamespace(Count=1, Duration=duration)
+                          for key, duration in durations.items()}
+
+
+def test_call_times(benchmark, capsys):
+    assert benchmark.call_times(LASolver(Setup=2., Solve=0.5, Other=1.), "SuperLU") \
+        == (2., 0.5)
+    assert capsys.readouterr().out == ""
+
+    # call statistics that are not reported are left out
+    assert benchmark.call_times(LASolver(Solve=0.5), "SuperLU") == (None, 0.5)
+    out = capsys.readouterr().out
+    assert "Warning" in out and "Setup" in out
+    assert benchmark.call_times(LASolver(), "SuperLU") == (None, None)
+    assert benchmark.call_times(object(), "SuperLU") == (None, None)
+    assert "CallStats" in capsys.readouterr().out
+    assert [benchmark.fmt(value) for value in (1., None)] == ["1.000", "-"]
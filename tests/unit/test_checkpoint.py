@@ -0,0 +1,263 @@
+"""Tests of the checkpoints of mpet.checkpoint and of resuming a simulation from them."""
+import configparser
+import glob
+import os
+import shutil
+import types
+
+import h5py
+import numpy as np
+import pytest
+
+import mpet.checkpoint as checkpoint
+import mpet.output_data as output_data
+import mpet.utils as utils
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+NT = 10
+# reporting stride of the strided variable
+STRIDE = 3
+
+
+def write_hdf5(filename):
+    """Output file as the hdf5Stream data reporter writes it, with a strided variable,
+    time-independent data and the solver statistics table. Returns the data."""
+    times = np.linspace(0., 0.9, NT)
+    rows = np.arange(0, NT, STRIDE)
+    data = {"phi_applied_times": times,
+            "phi_applied": np.sin(times),
+            "c_lyte_c": np.outer(times, [1., 2., 3.]),
+            "partTrodecvol0part0_c": np.outer(times[rows], [1., 2.]),
+            "partTrodecvol0part0_c_times": times[rows]}
+    # time-independent data with as many rows as time points
+    static = {"partTrodec_index": np.arange(NT), "psd_num": np.array([[2]])}
+    with h5py.File(filename, "w") as fo:
+        for key, value in data.items():
+            fo.create_dataset(key, data=value, maxshape=(None,) + value.shape[1:])
+        # the solver statistics are replaced by the resumed simulation
+        static["solver_stats"] = np.ones((NT, 3))
+        for key, value in static.items():
+            fo.create_dataset(key, data=value)
+    return data, static
+
+
+def test_truncate_hdf5(tmp_path):
+    filename = str(tmp_path / "output_data.hdf5")
+    data, static = write_hdf5(filename)
+    times = data["phi_applied_times"]
+    t_resume = times[5]
+    checkpoint.truncate_hdf5(filename, t_resume + 1e-14)
+    with h5py.File(filename, "r") as fi:
+        assert set(fi) == set(data) | set(static)
+        for key in ["phi_applied_times", "phi_applied", "c_lyte_c"]:
+            np.testing.assert_array_equal(fi[key][()], data[key][:6])
+        # the strided variable keeps its own time points up to the checkpoint
+        ptimes = data["partTrodecvol0part0_c_times"]
+        keep = ptimes <= t_resume
+        assert np.sum(keep) == 2
+        np.testing.assert_array_equal(fi["partTrodecvol0part0_c_times"][()], ptimes[keep])
+        np.testing.assert_array_equal(fi["partTrodecvol0part0_c"][()],
+                                      data["partTrodecvol0part0_c"][keep])
+        # time-independent data and the solver statistics are not truncated
+        for key, value in static.items():
+            np.testing.assert_array_equal(fi[key][()], value)
+
+    # truncating at a later time or again at the same time does not change the file
+    checkpoint.truncate_hdf5(filename, times[-1])
+    checkpoint.truncate_hdf5(filename, t_resume)
+    with h5py.File(filename, "r") as fi:
+        assert fi["phi_applied"].shape == (6,)
+        assert fi["partTrodecvol0part0_c"].shape == (2, 2)
+
+
+def test_shift_profile_unramped():
+    state = {"current": 0.5, "phi_applied": -0.2}
+    config = {"profileType": "CCsegments", "tramp": 0.,
+              "segments": [(1., 10.), (-1., 10.), (2., 10.)]}
+    checkpoint.shift_profile(config, 15., state)
+    assert config["currPrev"] == 0.5
+    assert config["phiPrev"] == -0.2
+    # the rest of the second segment and the whole third segment
+    assert config["segments"] == [(-1., 5.), (2., 10.)]
+
+    # a checkpoint at the end of a segment starts with the next one
+    config["segments"] = [(1., 10.), (-1., 10.)]
+    checkpoint.shift_profile(config, 10., state)
+    assert config["segments"] == [(-1., 10.)]
+
+    # after the last segment, the simulation continues in the last segment
+    config["segments"] = [(1., 10.), (-1., 10.)]
+    checkpoint.shift_profile(config, 25., state)
+    assert config["segments"] == [(-1., 10.)]
+
+
+def test_shift_profile_ramped():
+    state = {"current": np.array(0.5), "phi_applied": np.array(-0.2)}
+    tvec = np.array([0., 1., 10., 11., 20.])
+    setvec = np.array([0., 1., 1., -1., -1.])
+    config = {"profileType": "CVsegments", "tramp": 1., "segments_tvec": tvec,
+              "segments_setvec": setvec}
+    checkpoint.shift_profile(config, 10.5, state)
+    assert isinstance(config["currPrev"], float)
+    np.testing.assert_allclose(config["segments_tvec"], [0., 0.5, 9.5])
+    # the set point at the checkpoint is on the ramp between the segments
+    np.testing.assert_allclose(config["segments_setvec"], [0., -1., -1.])
+    # the shifted profile is the original profile from the checkpoint on
+    t = np.linspace(0., 9.5, 20)
+    np.testing.assert_allclose(np.interp(t, config["segments_tvec"], config["segments_setvec"]),
+                               np.interp(t + 10.5, tvec, setvec))
+
+    # other profiles are not changed
+    config = {"profileType": "CC", "currset": 1.}
+    checkpoint.shift_profile(config, 3., state)
+    assert config == {"profileType": "CC", "currset": 1., "currPrev": 0.5, "phiPrev": -0.2}
+
+
+def write_configs(folder, **options):
+    """Small simulation of configs/params_system.cfg with the given Sim Params."""
+    os.makedirs(folder)
+    for fname in glob.glob(os.path.join(ROOT_DIR, "configs", "*.cfg")):
+        shutil.copy(fname, folder)
+    configfile = os.path.join(folder, "params_system.cfg")
+    parser = configparser.ConfigParser()
+    parser.optionxform = str
+    parser.read(configfile)
+    options = dict({"randomSeed": "true", "tsteps": "40", "Nvol_c": "3", "Nvol_s": "2",
+                    "Nvol_a": "3", "Npart_c": "1", "Npart_a": "1"}, **options)
+    for option, value in options.items():
+        parser["Sim Params"][option] = value
+    with open(configfile, "w") as fo:
+        parser.write(fo)
+    return configfile
+
+
+def read_output(outdir):
+    data = utils.open_data_file(os.path.join(outdir, "output_data"))
+    output = {key: np.squeeze(data[key][()]) for key in data.keys()
+              if not key.startswith("__")}
+    if hasattr(data, "close"):
+        data.close()
+    return output
+
+
+@pytest.mark.parametrize("reporter", ["hdf5", "hdf5Stream", "matSegments"])
+def test_resume(tmp_path, monkeypatch, reporter):
+    """A simulation that is interrupted after a checkpoint and resumed has the output of
+    an uninterrupted simulation"""
+    pytest.importorskip("daetools")
+    import mpet.main
+    import mpet.solver_stats as solver_stats
+    from mpet.config import Config
+    monkeypatch.chdir(tmp_path)
+
+    fullDir = str(tmp_path / "full")
+    mpet.main.main(write_configs(str(tmp_path / "config_full"), dataReporter=reporter),
+                   outdir=fullDir)
+    full = read_output(fullDir)
+    t_total = full["phi_applied_times"][-1]*Config.from_dicts(fullDir)["t_ref"]
+
+    # a checkpoint after about a quarter of the simulation, interrupted at the next one
+    written = []
+    write_checkpoint = checkpoint.write_checkpoint
+
+    def interrupt(simulation, outdir):
+        if written:
+            raise KeyboardInterrupt
+        write_checkpoint(simulation, outdir)
+        written.append(simulation.CurrentTime)
+
+    monkeypatch.setattr(checkpoint, "write_checkpoint", interrupt)
+    resumedDir = str(tmp_path / "resumed")
+    configfile = write_configs(str(tmp_path / "config_resumed"), dataReporter=reporter,
+                               checkpointSimTime=str(0.25*t_total))
+    mpet.main.main(configfile, outdir=resumedDir)
+    assert len(written) == 1
+    # the checkpoint of the interrupted simulation is kept
+    assert checkpoint.checkpoint_dir(resumedDir) is not None
+    interrupted = read_output(resumedDir)
+    assert interrupted["phi_applied_times"][-1] < full["phi_applied_times"][-1]
+
+    monkeypatch.setattr(checkpoint, "write_checkpoint", write_checkpoint)
+    mpet.main.resume(resumedDir, keepArchive=False)
+    assert checkpoint.checkpoint_dir(resumedDir) is None
+    resumed = read_output(resumedDir)
+    assert set(resumed) == set(full)
+    if reporter == "matSegments":
+        # the resumed part is a new segment, and the solver statistics of both parts
+        # are stored in it
+        assert len(utils.read_segment_manifest(os.path.join(resumedDir, "output_data"))
+                   ["segments"]) == 2
+        assert "solver_stats" not in resumed
+        assert solver_stats.read_solver_stats(resumedDir) is not None
+    for key in full:
+        if key == "solver_stats":
+            # rows per reporting interval, plus the initialization of each run
+            continue
+        assert resumed[key].shape == full[key].shape, key
+        # the integrator restarts at the checkpoint, the criterion of tests/compare_tests.py
+        diff = np.abs(resumed[key] - full[key])
+        assert np.mean(diff) < 1e-4 or np.mean(diff) < 1e-4*np.mean(np.abs(full[key])), key
+
+
+def write_reported(writer, times, nt):
+    """Report the first nt time points of a simulation to a writer of mpet.output_data."""
+    values = {"phi_applied": np.sin(times), "phi_lyte_c": np.outer(times, [1., 2.]),
+              "c_lyte_c": np.outer(np.cos(times), [1., 2., 3.])}
+    writer.variables = [output_data.ReportedVariable("mpet." + key, value[:nt], times[:nt])
+                        for key, value in values.items()]
+    writer.report_stride = [("c_lyte_c", STRIDE)]
+
+
+@pytest.mark.parametrize("reporter", checkpoint.INCREMENTAL)
+def test_output_increments(tmp_path, reporter):
+    """Checkpoints that only append the output since the previous checkpoint have the
+    output of a checkpoint of all of it, which is reset to the time of a checkpoint"""
+    outdir = str(tmp_path / "out")
+    os.makedirs(outdir)
+    times = np.linspace(0., 1., 3*NT)
+    simulation = types.SimpleNamespace(dr=output_data.WRITERS[reporter](),
+                                       checkpointRows=0, resume=None)
+    # an earlier simulation in the directory, which is continued
+    write_reported(simulation.dr, times, NT)
+    simulation.dr.ConnectionString = os.path.join(outdir, "output_data")
+    simulation.dr.WriteDataToFile()
+    t_checkpoints = []
+    for nt in [4, 11, 11, 17, 25]:
+        write_reported(simulation.dr, times, nt)
+        checkpoint.write_output_increment(simulation, outdir)
+        # the times continue from the end time of the earlier simulation
+        t_checkpoints.append(times[NT - 1] + times[nt - 1])
+    assert simulation.checkpointRows == 25
+    datadir = os.path.join(outdir, checkpoint.DATA_DIR)
+    if reporter == "matSegments":
+        # the earlier simulation and one segment per checkpoint with new time points
+        assert len(utils.read_segment_manifest(os.path.join(datadir, "output_data"))
+                   ["segments"]) == 5
+
+    def check_output(nt):
+        full = str(tmp_path / "full{}".format(nt))
+        os.makedirs(full)
+        writer = output_data.WRITERS[reporter]()
+        write_reported(writer, times, NT)
+        writer.ConnectionString = os.path.join(full, "output_data")
+        writer.WriteDataToFile()
+        write_reported(writer, times, nt)
+        checkpoint.write_output(writer, writer.ConnectionString)
+        expected = read_output(full)
+        output = read_output(outdir)
+        assert set(output) == set(expected)
+        for key in expected:
+            np.testing.assert_allclose(output[key], expected[key], err_msg=key)
+
+    shutil.copytree(datadir, str(tmp_path / "data"))
+    # the output of the latest checkpoint
+    checkpoint.restore_output(None, outdir, {"dataReporter": reporter}, t_checkpoints[-1])
+    check_output(25)
+    # and of an earlier one, if the later one was not completed
+    shutil.rmtree(datadir)
+    shutil.copytree(str(tmp_path / "data"), datadir)
+    checkpoint.restore_output(None, outdir, {"dataReporter": reporter}, t_checkpoints[1])
+    check_output(11)
+    checkpoint.remove_checkpoints(outdir)
+    assert not os.path.exists(datadir)
@@ -0,0 +1,131 @@
+"""Tests of the DAE system size and the cost model of mpet.cost."""
+import configparser
+import glob
+import os
+import shutil
+
+import numpy as np
+import pytest
+
+import mpet.cost as cost
+from mpet.config import Config
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def write_configs(folder, **options):
+    """configs/params_system.cfg (ACR cathode, CHR anode) with a fixed random seed and
+    the given Sim Params."""
+    os.makedirs(folder)
+    for fname in glob.glob(os.path.join(ROOT_DIR, "configs", "*.cfg")):
+        shutil.copy(fname, folder)
+    configfile = os.path.join(folder, "params_system.cfg")
+    parser = configparser.ConfigParser()
+    parser.optionxform = str
+    parser.read(configfile)
+    options = dict({"randomSeed": "true"}, **options)
+    for option, value in options.items():
+        parser["Sim Params"][option] = str(value)
+    with open(configfile, "w") as fo:
+        parser.write(fo)
+    return configfile
+
+
+@pytest.mark.parametrize("options", [{}, {"Nvol_c": 4, "Npart_a": 3},
+                                     {"profileType": "CCsegments", "tramp": 0}])
+def test_dae_size(tmp_path, options):
+    config = Config(write_configs(str(tmp_path / "config"), **options))
+    size = cost.dae_size(config)
+    Nvol, Npart = config["Nvol"], config["Npart"]
+    assert size["Nvol"] == dict(Nvol)
+    assert size["Npart"] == dict(Npart)
+    nparts = {trode: Nvol[trode]*Npart[trode] for trode in config["trodes"]}
+    for trode in config["trodes"]:
+        assert size["psd_total"][trode] == np.sum(config["psd_num"][trode])
+        assert size["interface_vars"][trode] == 0
+        assert size["cell_vars"][trode] == 6*Nvol[trode] + 2*nparts[trode] + 1
+    # ACR: c and Rxn per point, cbar, dcbardt and three ports per particle
+    assert size["particle_vars"]["c"] == 2*size["psd_total"]["c"] + 5*nparts["c"]
+    # CHR: c per point, cbar, dcbardt, Rxn and three ports per particle
+    assert size["particle_vars"]["a"] == size["psd_total"]["a"] + 6*nparts["a"]
+    # current, voltages, end condition, operating conditions, electrolyte ghost points,
+    # separator and the segment set points and end times
+    nseg = 2*len(config["segments"]) if config["profileType"] == "CCsegments" else 0
+    expected = 4 + 4 + 2 + 2*Nvol["s"] + nseg + sum(
+        size[key][trode] for key in ["particle_vars", "interface_vars", "cell_vars"]
+        for trode in config["trodes"])
+    assert size["total"] == expected
+
+
+def test_cost_features(tmp_path):
+    config = Config(write_configs(str(tmp_path / "cc"), tsteps=50, capFrac=0.8))
+    features = cost.cost_features(config)
+    assert features["nvar"] == cost.dae_size(config)["total"]
+    assert features["steps"] == 50
+    # tend is capFrac/currset for CC
+    assert features["throughput"] == pytest.approx(0.8)
+    config = Config(write_configs(str(tmp_path / "segments"), profileType="CCsegments"))
+    assert cost.throughput(config) == pytest.approx(
+        sum(abs(setpoint)*duration for setpoint, duration in config["segments"]))
+
+
+def runtime_law(features):
+    return 1e-3*features["nvar"]**1.2*features["steps"]**0.5
+
+
+def memory_law(features):
+    return 1e8 + 1e4*features["nvar"] + 16*features["nvar"]*features["steps"]
+
+
+def test_fit(tmp_path):
+    """The coefficients of synthetic runs that follow the model are recovered"""
+    history = tmp_path / "history"
+    for Nvol_c in [2, 4, 6]:
+        for tsteps in [50, 100, 200]:
+            configfile = write_configs(str(tmp_path / f"config_{Nvol_c}_{tsteps}"),
+                                       Nvol_c=Nvol_c, tsteps=tsteps)
+            run = str(history / f"run_{Nvol_c}_{tsteps}")
+            os.makedirs(run)
+            config = Config(configfile)
+            config.write(run)
+            features = cost.cost_features(config)
+            with open(os.path.join(run, "run_info.txt"), "w") as fo:
+                print("mpet version:\n0.0.0\n", file=fo)
+                print("\nPeak memory:", repr(memory_law(features)/1e6), "MB", file=fo)
+                print("\nTotal run time:", repr(runtime_law(features)), "s", file=fo)
+    # an unfinished run is ignored
+    os.makedirs(str(history / "unfinished"))
+    config.write(str(history / "unfinished"))
+    with open(str(history / "unfinished" / "run_info.txt"), "w") as fo:
+        print("mpet version:\n0.0.0", file=fo)
+
+    model = cost.CostModel.fit([str(history)])
+    assert model.nruns == 9
+    # the throughput is the same in all runs and not used
+    np.testing.assert_allclose(model.runtime_coef, [1e-3, 1.2, 0.5, 0.], rtol=1e-6, atol=1e-9)
+    np.testing.assert_allclose(model.memory_coef, [1e8, 1e4, 16.], rtol=1e-6)
+
+    config = Config(write_configs(str(tmp_path / "new"), Nvol_c=5, tsteps=150))
+    runtime, memory = model.predict(config)
+    features = cost.cost_features(config)
+    assert runtime == pytest.approx(runtime_law(features))
+    assert memory == pytest.approx(memory_law(features))
+
+    # save and load, models saved without the operating conditions still load
+    filename = str(tmp_path / "model.json")
+    model.save(filename)
+    loaded = cost.CostModel.load(filename)
+    assert loaded.predict(config) == pytest.approx((runtime, memory))
+    old = cost.CostModel(runtime_coef=(0.05, 1.), memory_coef=(3e8, 2e4))
+    nvar = features["nvar"]
+    assert old.predict(config) == pytest.approx((0.05*nvar, 3e8 + 2e4*nvar))
+
+
+def test_fit_too_few_runs(tmp_path):
+    assert cost.fit_linear([], []) is None
+    # a single run or runs with the same features keep the defaults
+    assert cost.fit_linear([[1., 2.]], [3.]) is None
+    assert cost.fit_linear([[1., 2.], [1., 2.]], [3., 4.]) is None
+    model = cost.CostModel.fit([str(tmp_path)])
+    assert model.nruns == 0
+    assert model.runtime_coef == cost.CostModel().runtime_coef
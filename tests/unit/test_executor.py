@@ -0,0 +1,65 @@
+"""Tests of the local parallel runs of mpet.executor."""
+import csv
+import os
+
+import pytest
+
+import mpet.executor as executor
+
+
+@pytest.fixture
+def eight_cpus(monkeypatch):
+    monkeypatch.setattr(executor, "available_cpus", lambda: list(range(8)))
+
+
+@pytest.mark.skipif(not hasattr(os, "sched_setaffinity"), reason="no CPU pinning")
+def test_cpu_slots(eight_cpus):
+    slots = executor.cpu_slots(3, 2)
+    assert slots == [[0, 1], [2, 3], [4, 5]]
+    assert executor.cpu_slots(4, 2) == [[0, 1], [2, 3], [4, 5], [6, 7]]
+    # the slots do not overlap
+    slots = executor.cpu_slots(8, 1)
+    assert sorted(cpu for slot in slots for cpu in slot) == list(range(8))
+
+
+def test_cpu_slots_unpinned(eight_cpus):
+    # more threads than CPUs
+    assert executor.cpu_slots(3, 3) == [None]*3
+    assert executor.cpu_slots(2, 2, pin=False) == [None]*2
+
+
+def test_job_outdirs():
+    paramfiles = ["a/params_system.cfg", "b/params_system.cfg", "c/other.cfg"]
+    outdirs = executor.job_outdirs(paramfiles, "out")
+    assert outdirs == [os.path.join("out", "sim_output", "0000_params_system"),
+                       os.path.join("out", "sim_output", "0001_params_system"),
+                       os.path.join("out", "sim_output", "0002_other")]
+    # identical config names get separate directories
+    assert len(set(outdirs)) == len(outdirs)
+
+
+def test_write_summary(tmp_path):
+    results = [{"config": "a.cfg", "outdir": "out/0000_a", "status": "done", "time": 1.5,
+                "cpus": "0 1", "error": ""},
+               {"config": "b.cfg", "outdir": "out/0001_b", "status": "failed",
+                "time": float("nan"), "cpus": "", "error": "ValueError: bad, value"}]
+    filename = str(tmp_path / "folder" / "summary.csv")
+    executor.write_summary(results, filename)
+    with open(filename, newline="") as fi:
+        rows = list(csv.DictReader(fi))
+    assert list(rows[0]) == executor.SUMMARY_COLUMNS
+    assert [row["status"] for row in rows] == ["done", "failed"]
+    assert rows[0]["time"] == "1.5"
+    assert rows[1]["error"] == "ValueError: bad, value"
+
+
+def test_run_local_failures(tmp_path):
+    """Every job runs in its own process and failing jobs are recorded in the summary"""
+    paramfiles = [str(tmp_path / f"missing_{i}.cfg") for i in range(3)]
+    results = executor.run_local(paramfiles, str(tmp_path / "out"), jobs=2, pin=False)
+    assert [result["config"] for result in results] == paramfiles
+    # the error of mpet.main.main is reported by the job process
+    assert all(result["status"] == "failed" and "Missing config file" in result["error"]
+               for result in results)
+    with open(str(tmp_path / "out" / "summary.csv"), newline="") as fi:
+        assert len(list(csv.DictReader(fi))) == 3
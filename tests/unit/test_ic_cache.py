@@ -0,0 +1,74 @@
+"""Tests of the config hash and the cache of initial values of mpet.ic_cache."""
+import configparser
+import glob
+import os
+import shutil
+import subprocess
+import sys
+
+import numpy as np
+
+import mpet.ic_cache as ic_cache
+from mpet.config import Config
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def write_configs(folder, **changes):
+    """Copy configs/ to folder with a fixed random seed and changed system parameters,
+    given as section=(option, value)."""
+    os.makedirs(folder)
+    for fname in glob.glob(os.path.join(ROOT_DIR, "configs", "*.cfg")):
+        shutil.copy(fname, folder)
+    configfile = os.path.join(folder, "params_system.cfg")
+    parser = configparser.ConfigParser()
+    parser.optionxform = str
+    parser.read(configfile)
+    # the particle size distribution is random otherwise
+    parser["Sim Params"]["randomSeed"] = "true"
+    for section, (option, value) in changes.items():
+        parser[section.replace("_", " ")][option] = value
+    with open(configfile, "w") as fo:
+        parser.write(fo)
+    return configfile
+
+
+def test_config_hash(tmp_path):
+    configfile = write_configs(str(tmp_path / "base"))
+    reference = ic_cache.config_hash(Config(configfile))
+    assert reference == ic_cache.config_hash(Config(configfile))
+
+    # stable across processes, with another hash seed for str
+    code = ("import sys; import mpet.ic_cache as ic_cache; from mpet.config import Config; "
+            "print(ic_cache.config_hash(Config(sys.argv[1])))")
+    env = dict(os.environ, PYTHONHASHSEED="123",
+               PYTHONPATH=os.pathsep.join(filter(None, [ROOT_DIR, os.environ.get("PYTHONPATH")])))
+    output = subprocess.run([sys.executable, "-c", code, configfile], env=env, check=True,
+                            stdout=subprocess.PIPE, universal_newlines=True).stdout
+    assert output.strip() == reference
+
+    # the operating conditions do not change the model
+    crate = write_configs(str(tmp_path / "crate"), Sim_Params=("Crate", "3"))
+    assert ic_cache.config_hash(Config(crate)) == reference
+    # model parameters do
+    rser = write_configs(str(tmp_path / "rser"), Sim_Params=("Rser", "0.1"))
+    assert ic_cache.config_hash(Config(rser)) != reference
+    nvol = write_configs(str(tmp_path / "nvol"), Sim_Params=("Nvol_c", "4"))
+    assert ic_cache.config_hash(Config(nvol)) != reference
+
+
+def test_initial_state(tmp_path):
+    config = Config(write_configs(str(tmp_path / "config")))
+    cachedir = str(tmp_path / "ic_cache")
+    assert ic_cache.load_initial_state(config, cachedir) is None
+    values = {"phi_applied": -0.1, "phi_bulk_c": np.linspace(0., 1., 4)}
+    ic_cache.save_initial_state(config, cachedir, values)
+    assert os.listdir(cachedir) == [os.path.basename(ic_cache.cache_file(config, cachedir))]
+    loaded = ic_cache.load_initial_state(config, cachedir)
+    assert set(loaded) == set(values)
+    for key, value in values.items():
+        np.testing.assert_array_equal(loaded[key], value)
+    # a partially written file is ignored
+    with open(ic_cache.cache_file(config, cachedir), "wb") as fo:
+        fo.write(b"PK\x03\x04")
+    assert ic_cache.load_initial_state(config, cachedir) is None
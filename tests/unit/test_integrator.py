@@ -0,0 +1,131 @@
+"""Tests of the mass matrix BDF integrator and finite difference Jacobians of
+mpet.backends.integrator."""
+import numpy as np
+import pytest
+import scipy.sparse as sprs
+
+from mpet.backends.integrator import BDF, FiniteDifferenceJacobian, color_columns
+
+
+def random_pattern(n, density, seed):
+    rng = np.random.default_rng(seed)
+    pattern = sprs.random(n, n, density=density, random_state=rng, format="csc")
+    pattern = pattern + sprs.eye(n, format="csc")
+    pattern.data[:] = 1.
+    return sprs.csc_matrix(pattern)
+
+
+@pytest.mark.parametrize("n, density", [(1, 1.), (30, 0.05), (50, 0.2), (20, 1.)])
+def test_color_columns(n, density):
+    pattern = random_pattern(n, density, seed=n)
+    groups, ngroups = color_columns(pattern)
+    assert groups.shape == (n,)
+    assert set(groups) == set(range(ngroups))
+    # no two columns of a group have a nonzero in the same row
+    dense = pattern.toarray() != 0
+    for group in range(ngroups):
+        assert np.all(np.sum(dense[:, groups == group], axis=1) <= 1)
+    # a dense pattern needs a group per column, a diagonal one a single group
+    if density == 1.:
+        assert ngroups == n
+    assert color_columns(sprs.eye(n, format="csc"))[1] == 1
+
+
+def test_finite_difference_jacobian():
+    n = 40
+    pattern = random_pattern(n, 0.1, seed=1)
+    A = sprs.csr_matrix(pattern.multiply(np.random.default_rng(2).random((n, n))))
+
+    def fun(t, y):
+        return A @ np.sin(y) + t*y**3
+
+    def jac(t, y):
+        return A.toarray()*np.cos(y) + np.diag(3*t*y**2)
+
+    y = np.linspace(-2., 3., n)
+    t = 0.7
+    J = FiniteDifferenceJacobian(pattern)(fun, t, y, fun(t, y))
+    assert sprs.issparse(J)
+    np.testing.assert_allclose(J.toarray(), jac(t, y), rtol=1e-6, atol=1e-6)
+
+    # rows left out of the pattern (e.g. known analytically) are not evaluated
+    partial = sprs.csr_matrix(pattern)[:n//2]
+    partial = sprs.vstack((partial, sprs.csr_matrix((n - n//2, n))))
+    J = FiniteDifferenceJacobian(partial)(fun, t, y, fun(t, y)).toarray()
+    np.testing.assert_allclose(J[:n//2], jac(t, y)[:n//2], rtol=1e-6, atol=1e-6)
+    assert not np.any(J[n//2:])
+
+
+def dae():
+    """Index-1 DAE y0' = -y0 + y1, 0 = y1 - sin(t) with y0(0) = 1, which has a constant
+    Jacobian and the solution y0 = (sin(t) - cos(t))/2 + 3/2 exp(-t), y1 = sin(t)"""
+    def fun(t, y):
+        return np.array([-y[0] + y[1], y[1] - np.sin(t)])
+
+    def jac(t, y, f):
+        return sprs.csc_matrix(np.array([[-1., 1.], [0., 1.]]))
+
+    def exact(t):
+        return np.array([0.5*(np.sin(t) - np.cos(t)) + 1.5*np.exp(-t), np.sin(t)])
+
+    mass = sprs.csc_matrix(np.diag([1., 0.]))
+    # consistent initial values and derivatives
+    return fun, jac, mass, exact, exact(0.), np.array([-1., 1.])
+
+
+def integrate(rtol, t_end=5.):
+    fun, jac, mass, exact, y0, ydot0 = dae()
+    solver = BDF(fun, jac, mass, 0., y0, ydot0, rtol, rtol*1e-2)
+    orders = set()
+    errors = []
+    while solver.t < t_end:
+        assert solver.step(t_end)
+        orders.add(solver.order)
+        errors.append(np.max(np.abs(solver.y - exact(solver.t))))
+        # the dense output interpolates within the last step
+        t_mid = 0.5*(solver.t_old + solver.t)
+        np.testing.assert_allclose(solver.dense(t_mid), exact(t_mid), rtol=100*rtol,
+                                   atol=rtol)
+    assert solver.t == t_end
+    return max(errors), orders, solver.nsteps
+
+
+def test_bdf_dae():
+    error, orders, nsteps = integrate(1e-8)
+    # the algebraic variable follows the differential one and the error is of the order
+    # of the tolerance
+    assert error < 1e-7
+    # the variable order method uses the higher orders on a smooth solution
+    assert max(orders) >= 4
+
+
+def test_bdf_convergence():
+    """The global error decreases with the tolerance, with more steps"""
+    results = [integrate(rtol) for rtol in [1e-4, 1e-6, 1e-8]]
+    errors = [result[0] for result in results]
+    steps = [result[2] for result in results]
+    assert errors[0] > errors[1] > errors[2]
+    assert steps[0] < steps[1] < steps[2]
+    # tolerance proportionality: two orders of magnitude of the tolerance give at
+    # least one order of magnitude in the error
+    assert errors[1] < 0.1*errors[0]
+    assert errors[2] < 0.1*errors[1]
+
+
+def test_bdf_order():
+    """With a constant step size at order 1 (backward Euler), the error is first order in
+    the step size"""
+    fun, jac, mass, exact, y0, ydot0 = dae()
+    errors = []
+    for n in [50, 100, 200]:
+        # tolerances that accept every step
+        solver = BDF(fun, jac, mass, 0., y0, ydot0, 1e3, 1e3, first_step=1./n)
+        for _ in range(n):
+            # the step size and order are only changed after order + 1 equal steps
+            solver.n_equal_steps = 0
+            assert solver.step(1.)
+        assert solver.order == 1
+        assert solver.t == pytest.approx(1.)
+        errors.append(np.max(np.abs(solver.y - exact(solver.t))))
+    rates = np.log2(np.array(errors[:-1])/np.array(errors[1:]))
+    np.testing.assert_allclose(rates, 1., atol=0.05)
@@ -0,0 +1,244 @@
+"""Tests of the lazy output reader mpet.io against scipy.io.loadmat and h5py."""
+import json
+import os
+import shutil
+import struct
+
+import h5py
+import numpy as np
+import pytest
+import scipy.io as sio
+
+import mpet.utils as utils
+from mpet.config import Config
+from mpet.io import MatFile, SimResult
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+NT = 9
+# reporting stride of the particle concentrations
+STRIDE = 4
+PSD_NUM = np.array([[3], [5]])
+
+
+@pytest.fixture(scope="module")
+def config_dir(tmp_path_factory):
+    """Folder with the config dicts of configs/params_system.cfg"""
+    folder = tmp_path_factory.mktemp("config")
+    Config(os.path.join(ROOT_DIR, "configs", "params_system.cfg")).write(str(folder))
+    return folder
+
+
+def make_output(layout="perParticle", t_offset=0., seed=0):
+    """Output data as the data reporters store it: phi_applied_times, time series,
+    electrolyte and particle data, with a reporting stride for the particle
+    concentrations"""
+    rng = np.random.default_rng(seed)
+    times = t_offset + np.linspace(0., 1., NT)
+    mdict = {"phi_applied": rng.random(NT), "current": rng.random(NT),
+             "c_lyte_c": rng.random((NT, 2))}
+    for vInd, N in enumerate(PSD_NUM[:, 0]):
+        name = "partTrodecvol{}part0_".format(vInd)
+        mdict[name + "c"] = rng.random((NT, N))
+        mdict[name + "cbar"] = rng.random(NT)
+    static = {}
+    if layout == "consolidated":
+        static = utils.consolidate_particle_data(mdict, {"c": PSD_NUM})
+    rows = np.append(np.arange(0, NT, STRIDE), NT - 1)
+    for key in list(mdict):
+        if key.endswith("_c") and key.startswith("partTrode"):
+            mdict[key] = mdict[key][rows]
+            mdict[key + "_times"] = times[rows]
+    mdict["phi_applied_times"] = times
+    mdict.update(static)
+    return mdict
+
+
+def write_mat(filename, mdict):
+    sio.savemat(filename, mdict, appendmat=False, format='5', long_field_names=False,
+                do_compression=False, oned_as='row')
+
+
+def write_output(folder, config_dir, fmt, layout):
+    outdir = os.path.join(folder, "{}_{}".format(fmt, layout))
+    shutil.copytree(str(config_dir), outdir)
+    mdict = make_output(layout)
+    if fmt == "mat":
+        write_mat(os.path.join(outdir, "output_data.mat"), mdict)
+    else:
+        with h5py.File(os.path.join(outdir, "output_data.hdf5"), "w") as fo:
+            for key, value in mdict.items():
+                fo.create_dataset(key, data=value)
+    return outdir
+
+
+def read_reference(outdir, fmt):
+    """All variables with time as the first axis, read with loadmat or h5py"""
+    if fmt == "mat":
+        data = sio.loadmat(os.path.join(outdir, "output_data.mat"))
+        return {key: np.squeeze(value) for key, value in data.items()
+                if not key.startswith("__")}
+    with h5py.File(os.path.join(outdir, "output_data.hdf5"), "r") as fi:
+        return {key: np.squeeze(fi[key][()]) for key in fi}
+
+
+def expected_particle(ref, trode, vInd, pInd, field):
+    key = "partTrode{}vol{}part{}_{}".format(trode, vInd, pInd, field)
+    if key in ref:
+        return ref[key], ref.get(key + "_times", ref["phi_applied_times"])
+    base = "partTrode{}_".format(trode)
+    k = int(np.reshape(ref[base + "index"], PSD_NUM.shape)[vInd, pInd])
+    offsets = np.ravel(ref[base + "offsets"])
+    values = np.atleast_2d(ref[base + field].T).T
+    if values.shape[1] == offsets[-1]:
+        values = values[:, offsets[k]:offsets[k+1]]
+    else:
+        values = values[:, k]
+    return np.squeeze(values), ref.get(base + field + "_times", ref["phi_applied_times"])
+
+
+def test_matfile_matches_loadmat(tmp_path):
+    mdict = make_output()
+    # data types and shapes that are not memory-mapped are loaded with loadmat
+    mdict["name"] = "test"
+    mdict["ints"] = np.arange(4, dtype=np.int32).reshape(2, 2)
+    mdict["empty"] = np.zeros((0, 3))
+    filename = str(tmp_path / "data.mat")
+    write_mat(filename, mdict)
+    ref = sio.loadmat(filename)
+    matfile = MatFile(filename)
+    assert set(matfile.keys()) == {key for key in ref if not key.startswith("__")}
+    for key in matfile:
+        assert matfile[key].shape == ref[key].shape, key
+        if ref[key].dtype.kind in "fiu":
+            np.testing.assert_array_equal(matfile[key], ref[key])
+        else:
+            assert matfile[key] == ref[key]
+    # copy-on-write: the file is never modified
+    matfile["phi_applied"][0, 0] = -1.
+    np.testing.assert_array_equal(sio.loadmat(filename)["phi_applied"], ref["phi_applied"])
+    matfile.close()
+
+
+def mat_element(mtype, data):
+    """Data element of a MAT-file, padded to 8 bytes"""
+    return struct.pack('<II', mtype, len(data)) + data + bytes(-len(data) % 8)
+
+
+def write_mat_stored_as(filename, mdict):
+    """Write double arrays to a MAT-file, each stored with the given data type as
+    MATLAB stores integer-valued doubles. mdict maps names to (values, mat data type)"""
+    with open(filename, "wb") as fo:
+        fo.write(b"MATLAB 5.0 MAT-file".ljust(116) + bytes(8) + struct.pack('<H', 0x0100)
+                 + b"IM")
+        for name, (values, mtype) in mdict.items():
+            values = np.asarray(values)
+            # mxDOUBLE_CLASS array flags, dimensions, name and the real part
+            matrix = (mat_element(6, struct.pack('<II', 6, 0))
+                      + mat_element(5, np.array(values.shape, dtype='<i4').tobytes())
+                      + mat_element(1, name.encode('latin1'))
+                      + mat_element(mtype, values.tobytes(order='F')))
+            fo.write(mat_element(14, matrix))
+
+
+def test_matfile_storage_dtype(tmp_path):
+    """Integer-valued doubles that are stored with a smaller data type are read as doubles"""
+    filename = str(tmp_path / "stored.mat")
+    mdict = {"int8_values": (np.array([[-3, 0, 5]], dtype='i1'), 1),
+             "uint8_values": (np.arange(6, dtype='u1').reshape(2, 3), 2),
+             "int16_values": (np.array([[-300], [2], [1000]], dtype='<i2'), 3),
+             "double_values": (np.array([[0.5, 1.5]], dtype='<f8'), 9)}
+    write_mat_stored_as(filename, mdict)
+    ref = sio.loadmat(filename, mat_dtype=True)
+    matfile = MatFile(filename)
+    for key, (values, _) in mdict.items():
+        assert ref[key].dtype == np.float64
+        assert matfile[key].dtype == ref[key].dtype, key
+        assert matfile[key].shape == ref[key].shape, key
+        np.testing.assert_array_equal(matfile[key], ref[key])
+        np.testing.assert_array_equal(matfile[key], values)
+    # the doubles stored as doubles are still memory-mapped
+    assert isinstance(matfile["double_values"], np.memmap)
+    matfile.close()
+
+
+@pytest.mark.parametrize("fmt", ["mat", "hdf5"])
+@pytest.mark.parametrize("layout", ["perParticle", "consolidated"])
+def test_simresult(tmp_path, config_dir, fmt, layout):
+    outdir = write_output(str(tmp_path), config_dir, fmt, layout)
+    ref = read_reference(outdir, fmt)
+    t_ref = Config.from_dicts(outdir)["t_ref"]
+    with SimResult(outdir) as result:
+        assert result.format == fmt
+        assert set(result.keys()) == set(ref.keys())
+        np.testing.assert_allclose(result.times(), ref["phi_applied_times"]*t_ref)
+        for key in ref:
+            np.testing.assert_array_equal(result.get(key), ref[key])
+
+        times = ref["phi_applied_times"]*t_ref
+        t_start, t_end = times[2], times[6]
+        window = (times >= t_start) & (times <= t_end)
+        np.testing.assert_array_equal(result.get("c_lyte_c", t_start, t_end),
+                                      ref["c_lyte_c"][window])
+        np.testing.assert_array_equal(result.get("c_lyte_c", tslice=slice(1, 3), cols=1),
+                                      ref["c_lyte_c"][1:3, 1])
+
+        for field in ["c", "cbar"]:
+            for vInd in range(len(PSD_NUM)):
+                values, ptimes = expected_particle(ref, "c", vInd, 0, field)
+                np.testing.assert_array_equal(result.get_particle("c", vInd, 0, field),
+                                              values)
+                # strided variables are selected by their own times
+                pwindow = (ptimes*t_ref >= t_start) & (ptimes*t_ref <= t_end)
+                np.testing.assert_array_equal(
+                    result.get_particle("c", vInd, 0, field, t_start, t_end),
+                    np.squeeze(values[pwindow]))
+                particles = result.get_particles("c", field, [vInd], [0], t_start, t_end)
+                np.testing.assert_array_equal(particles[vInd, 0], np.squeeze(values[pwindow]))
+
+
+def test_simresult_segments(tmp_path, config_dir):
+    outdir = str(tmp_path / "segments")
+    shutil.copytree(str(config_dir), outdir)
+    manifest = {"keys": [], "series": [], "static": [], "segments": []}
+    parts = []
+    for seg in range(3):
+        mdict = make_output(t_offset=1.*seg, seed=seg)
+        filename = "output_data.mat" if seg == 0 else "output_data_seg{:04d}.mat".format(seg)
+        write_mat(os.path.join(outdir, filename), mdict)
+        for key, value in mdict.items():
+            if key not in manifest["keys"]:
+                manifest["keys"].append(key)
+            if np.ndim(value) == 1 and key not in manifest["series"]:
+                manifest["series"].append(key)
+        manifest["segments"].append({"file": filename,
+                                     "t_start": float(mdict["phi_applied_times"][0]),
+                                     "t_end": float(mdict["phi_applied_times"][-1]),
+                                     "nt": NT})
+        parts.append(sio.loadmat(os.path.join(outdir, filename)))
+    with open(os.path.join(outdir, "output_data" + utils.SEGMENT_MANIFEST), "w") as fo:
+        json.dump(manifest, fo)
+    ref = {key: np.concatenate([np.atleast_2d(np.squeeze(part[key]).T).T for part in parts])
+           for key in manifest["keys"]}
+    ref = {key: np.squeeze(value) for key, value in ref.items()}
+
+    t_ref = Config.from_dicts(outdir)["t_ref"]
+    result = SimResult(outdir)
+    assert result.format == "matSegments"
+    for key in manifest["keys"]:
+        np.testing.assert_array_equal(result.get(key), ref[key])
+    # a window within the second and third segment
+    times = ref["phi_applied_times"]*t_ref
+    t_start, t_end = times[NT + 2], times[2*NT + 4]
+    window = (times >= t_start) & (times <= t_end)
+    np.testing.assert_array_equal(result.get("c_lyte_c", t_start, t_end),
+                                  ref["c_lyte_c"][window])
+    ptimes = ref["partTrodecvol1part0_c_times"]*t_ref
+    pwindow = (ptimes >= t_start) & (ptimes <= t_end)
+    np.testing.assert_array_equal(
+        result.get_particles("c", "c", [1], [0], t_start, t_end)[1, 0],
+        np.squeeze(ref["partTrodecvol1part0_c"][pwindow]))
+    result.close()
+    # the memory maps of all segments are released
+    assert all(not segment._loaded for segment in result._segments)
+    assert not result.data._files
@@ -0,0 +1,60 @@
+"""Tests of the particle templates in mpet.model_funcs."""
+import gc
+import os
+
+import numpy as np
+
+import mpet.model_funcs as model_funcs
+from mpet.config import Config
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def load_config():
+    return Config(os.path.join(ROOT_DIR, "configs", "params_system.cfg"))
+
+
+def test_template_per_config():
+    config = load_config()
+    params = config.get_particle_params("c", (0, 0))
+    template = model_funcs.get_particle_template(config, params)
+    # particles of the same config with an identical key share the template
+    assert model_funcs.get_particle_template(
+        config, config.get_particle_params("c", (0, 0))) is template
+    # other configs never do
+    other = load_config()
+    assert model_funcs.get_particle_template(
+        other, other.get_particle_params("c", (0, 0))) is not template
+    # the cache is released with the config
+    num_configs = len(model_funcs._particle_templates)
+    assert config in model_funcs._particle_templates
+    del config, other
+    gc.collect()
+    assert len(model_funcs._particle_templates) == num_configs - 2
+
+
+def test_template_absolute_paths(tmp_path, monkeypatch):
+    config = load_config()
+    params = config.get_particle_params("c", (0, 0))
+    template = model_funcs.get_particle_template(config, params)
+    for key in model_funcs._particle_templates[config]:
+        rxnType_filename, Dfunc_filename = key[4], key[6]
+        for filename in [rxnType_filename, Dfunc_filename]:
+            assert filename is None or os.path.isabs(filename)
+    # a change of the working directory does not change the key
+    monkeypatch.chdir(tmp_path)
+    assert model_funcs.get_particle_template(config, params) is template
+
+
+def test_mass_matvec():
+    config = load_config()
+    params = config.get_particle_params("c", (0, 0))
+    template = model_funcs.ParticleTemplate("diffn", "sphere", 5, params.rxnType,
+                                            params.rxnType_filename, params.Dfunc,
+                                            params.Dfunc_filename)
+    vec = np.linspace(0.1, 0.5, 5)
+    np.testing.assert_allclose(template.mass_matvec(vec), template.Mmat.dot(vec))
+    # object arrays, e.g. of daetools expressions, are multiplied element by element
+    out = template.mass_matvec(vec.astype(object))
+    assert out.dtype == object
+    np.testing.assert_allclose(out.astype(float), template.Mmat.dot(vec))
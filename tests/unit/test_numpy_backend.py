@@ -0,0 +1,76 @@
+"""Tests of the numpy simulation backend against the reference outputs of the test suite."""
+import configparser
+import os
+import shutil
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+import scipy.io as sio
+
+import mpet.backends.numpy as numpy_backend
+import mpet.main
+from mpet.config import Config
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+REF_DIR = os.path.join(ROOT_DIR, "tests", "ref_outputs")
+
+#: tolerance of tests/compare_tests.py
+TOL = 1e-4
+
+#: reference tests run with the numpy backend: ACR (test001), CHR (test002), noise
+#: (test004), homog and diffn particles, dilute and SM electrolytes, with and without
+#: anode, and the CV, CP and segments profiles
+SUPPORTED_TESTS = ["test001", "test002", "test004", "test005", "test006", "test008",
+                   "test012", "test014", "test018", "test019", "test023", "test024"]
+
+
+def copy_configs(test, folder, backend):
+    """Copy the configs of a reference test to folder, with the given backend"""
+    for fname in os.listdir(os.path.join(REF_DIR, test)):
+        if fname.endswith(".cfg"):
+            shutil.copy(os.path.join(REF_DIR, test, fname), folder)
+    configfile = os.path.join(folder, "params_system.cfg")
+    parser = configparser.ConfigParser()
+    parser.optionxform = str
+    parser.read(configfile)
+    parser["Sim Params"]["backend"] = backend
+    with open(configfile, "w") as fo:
+        parser.write(fo)
+    return configfile
+
+
+@pytest.mark.parametrize("test", SUPPORTED_TESTS)
+def test_reference_outputs(tmp_path, monkeypatch, test):
+    monkeypatch.chdir(tmp_path)
+    configfile = copy_configs(test, str(tmp_path), "numpy")
+    mpet.main.main(configfile, keepArchive=False)
+
+    new = sio.loadmat(str(tmp_path / "sim_output" / "output_data.mat"))
+    ref = sio.loadmat(os.path.join(REF_DIR, test, "sim_output", "output_data.mat"))
+    keys = [key for key in set(ref) & set(new) if not key.startswith("__")]
+    assert "phi_applied" in keys
+    for key in keys:
+        diff = np.abs(new[key] - ref[key])
+        # the criterion of tests/compare_tests.py
+        assert np.mean(diff) < TOL or np.mean(diff) < TOL*np.mean(np.abs(ref[key])), key
+
+
+@pytest.mark.parametrize("test", ["test009", "test013", "test025", "test028"])
+def test_unsupported(tmp_path, test):
+    """Configs the backend does not support are rejected before the simulation starts"""
+    config = Config(copy_configs(test, str(tmp_path), "numpy"))
+    with pytest.raises(NotImplementedError, match="use backend = daetools"):
+        numpy_backend.check_supported(config)
+
+
+def test_without_daetools():
+    """The backend and the modules it uses do not import daetools"""
+    code = ("import sys; import mpet.backends.numpy; "
+            "print(sorted(m for m in sys.modules if m.startswith('daetools')))")
+    env = dict(os.environ,
+               PYTHONPATH=os.pathsep.join(filter(None, [ROOT_DIR, os.environ.get("PYTHONPATH")])))
+    output = subprocess.run([sys.executable, "-c", code], env=env, check=True,
+                            stdout=subprocess.PIPE, universal_newlines=True).stdout
+    assert output.strip() == "[]"
@@ -0,0 +1,66 @@
+"""Tests of the output writers of mpet.output_data."""
+import os
+
+import numpy as np
+import pytest
+
+import mpet.output_data as output_data
+import mpet.utils as utils
+
+NT = 11
+# reporting stride of the strided variable
+STRIDE = 3
+
+
+def test_stride_rows():
+    np.testing.assert_array_equal(output_data.get_stride_rows(8, 3), [0, 3, 6, 7])
+    np.testing.assert_array_equal(output_data.get_stride_rows(7, 3), [0, 3, 6])
+    np.testing.assert_array_equal(output_data.get_stride_rows(8, 3, last=False), [0, 3, 6])
+    # the phase of continued output follows the time points written before
+    np.testing.assert_array_equal(output_data.get_stride_rows(8, 3, offset=4), [2, 5, 7])
+    np.testing.assert_array_equal(output_data.get_stride_rows(2, 3, offset=4, last=False),
+                                  [])
+    assert len(output_data.get_stride_rows(0, 3)) == 0
+
+
+def write(folder, dataReporter, times, values, skip_first=False, final_output=True):
+    writer = output_data.WRITERS[dataReporter]()
+    writer.report_stride = [("c_lyte_c", STRIDE)]
+    writer.skip_first = skip_first
+    writer.final_output = final_output
+    writer.variables = [output_data.ReportedVariable("mpet.phi_applied", values[:, 0], times),
+                        output_data.ReportedVariable("mpet.c_lyte_c", values, times)]
+    writer.ConnectionString = os.path.join(folder, "output_data")
+    writer.WriteDataToFile()
+
+
+def read(folder):
+    data = utils.open_data_file(os.path.join(folder, "output_data"))
+    output = {key: np.squeeze(data[key][()]) for key in data.keys()
+              if not key.startswith("__")}
+    if hasattr(data, "close"):
+        data.close()
+    return output
+
+
+@pytest.mark.parametrize("dataReporter", ["mat", "hdf5", "hdf5Fast", "matSegments"])
+@pytest.mark.parametrize("k", [4, 6])
+def test_resumed_strides(tmp_path, dataReporter, k):
+    """The output of a checkpoint at time point k followed by the resumed simulation has
+    the time points of an uninterrupted simulation"""
+    times = np.linspace(0., 1., NT)
+    values = np.outer(np.arange(NT), [1., 2.])
+    os.makedirs(str(tmp_path / "full"))
+    write(str(tmp_path / "full"), dataReporter, times, values)
+    full = read(str(tmp_path / "full"))
+    np.testing.assert_array_equal(full["c_lyte_c_times"], times[[0, 3, 6, 9, 10]])
+
+    resumed = str(tmp_path / "resumed")
+    os.makedirs(resumed)
+    write(resumed, dataReporter, times[:k + 1], values[:k + 1], final_output=False)
+    # the resumed simulation starts at the checkpoint time, which is reported again
+    write(resumed, dataReporter, times[k:] - times[k], values[k:], skip_first=True)
+    output = read(resumed)
+    assert set(output) == set(full)
+    for key, value in full.items():
+        np.testing.assert_allclose(output[key], value, err_msg=key)
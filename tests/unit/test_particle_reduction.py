@@ -0,0 +1,177 @@
+"""Tests of the particle reduction in mpet.config.particle_reduction and its use in Config."""
+import configparser
+import json
+import os
+import re
+import shutil
+
+import numpy as np
+import pytest
+
+from mpet.config import Config, particle_reduction
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def make_particles(Npart=40, seed=0):
+    """Size, contact fraction, conductance and volume fraction of random particles"""
+    rng = np.random.default_rng(seed)
+    size = rng.lognormal(np.log(100e-9), 0.3, Npart)
+    gamma_contact = rng.uniform(0.5, 1., Npart)
+    G = rng.lognormal(np.log(1e-14), 0.5, Npart)
+    weights = size**3 / np.sum(size**3)
+    return size, gamma_contact, G, weights
+
+
+@pytest.mark.parametrize("method", ["binning", "kmeans"])
+@pytest.mark.parametrize("K", [1, 3, 7, 40])
+def test_group_particles(method, K):
+    size, gamma_contact, G, weights = make_particles()
+    labels = particle_reduction.group_particles(method, size, gamma_contact, G, weights, K)
+    # every particle is in exactly one of the K groups, and no group is empty
+    assert labels.shape == size.shape
+    counts = np.bincount(labels, minlength=K)
+    assert len(counts) == K
+    assert np.all(counts > 0)
+    assert counts.sum() == len(size)
+    # the groups conserve the total volume
+    group_weights = np.array([weights[labels == k].sum() for k in range(K)])
+    assert np.isclose(group_weights.sum(), weights.sum())
+    # groups are numbered by increasing mean size
+    mean_size = [np.average(size[labels == k], weights=weights[labels == k]) for k in range(K)]
+    assert np.all(np.diff(mean_size) >= 0)
+    if method == "binning":
+        # nearly equal number of particles per bin, without overlap in size
+        assert counts.max() - counts.min() <= 1
+        for k in range(K - 1):
+            assert size[labels == k].max() <= size[labels == k + 1].min()
+    # deterministic, and independent of the state of the random number generator
+    np.random.seed(1)
+    state = np.random.get_state()[1].copy()
+    again = particle_reduction.group_particles(method, size, gamma_contact, G, weights, K)
+    np.testing.assert_array_equal(again, labels)
+    np.testing.assert_array_equal(np.random.get_state()[1], state)
+
+
+def test_kmeans_clusters():
+    # three well separated clusters of particles are found exactly
+    rng = np.random.default_rng(2)
+    centres = np.array([[-5., 0.], [0., 5.], [5., 0.]])
+    truth = np.repeat(np.arange(3), 10)
+    features = centres[truth] + 0.1*rng.standard_normal((30, 2))
+    labels = particle_reduction.kmeans_particles(features, np.ones(30), 3)
+    for k in range(3):
+        assert len(np.unique(labels[truth == k])) == 1
+    assert len(np.unique(labels)) == 3
+
+
+def test_fill_empty_groups():
+    # more groups than distinct particles
+    features = np.zeros((4, 2))
+    labels = particle_reduction.kmeans_particles(features, np.ones(4), 4)
+    np.testing.assert_array_equal(np.sort(labels), np.arange(4))
+
+
+def test_standardize():
+    features = np.column_stack((np.arange(5.), np.full(5, 3.)))
+    scaled = particle_reduction.standardize(features)
+    assert np.isclose(scaled[:, 0].mean(), 0.) and np.isclose(scaled[:, 0].std(), 1.)
+    np.testing.assert_array_equal(scaled[:, 1], 0.)
+
+
+def write_config(folder, **values):
+    """Copy configs/params_system.cfg and its electrode configs to folder, with the
+    given values replaced"""
+    with open(os.path.join(ROOT_DIR, "configs", "params_system.cfg")) as fi:
+        text = fi.read()
+    for key, value in values.items():
+        text, count = re.subn(rf"^{key} = .*$", f"{key} = {value}", text, flags=re.M)
+        assert count == 1, key
+    for name in ["params_LFP.cfg", "params_graphite_1param.cfg"]:
+        shutil.copy(os.path.join(ROOT_DIR, "configs", name), folder)
+    filename = os.path.join(folder, "params_system.cfg")
+    with open(filename, "w") as fo:
+        fo.write(text)
+    return filename
+
+
+@pytest.mark.parametrize("method", ["binning", "kmeans"])
+def test_config_reduction(tmp_path, method):
+    values = {"Npart_c": 20, "stddev_c": "30e-9", "randomSeed": "true", "seed": 3}
+    full = Config(write_config(str(tmp_path), **values))
+    assert full.particle_reduction_summary() == []
+    filename = write_config(str(tmp_path), particleReduction=method, Nrep_c=4, Nrep_a=2,
+                            **values)
+    config = Config(filename)
+
+    # the anode has Nrep >= Npart and is not reduced
+    assert config["Npart"]["a"] == full["Npart"]["a"]
+    assert "a" not in config["psd_reduction"]
+    np.testing.assert_array_equal(config["psd_len"]["a"], full["psd_len"]["a"])
+
+    assert config["Npart"]["c"] == 4
+    assert config["c", "indvPart"]["N"].shape == (config["Nvol"]["c"], 4)
+    labels = config["psd_reduction"]["c"]["labels"]
+    assert labels.shape == full["psd_len"]["c"].shape
+    # the representatives carry the volume of their group, and the total volume is
+    # conserved in each electrode volume
+    full_frac = full["psd_vol_FracVol"]["c"]
+    rep_frac = config["psd_vol_FracVol"]["c"]
+    for k in range(4):
+        np.testing.assert_allclose(rep_frac[:, k],
+                                   np.sum(np.where(labels == k, full_frac, 0.), axis=1))
+    np.testing.assert_allclose(rep_frac.sum(axis=1), full_frac.sum(axis=1))
+    assert config["psd_reduction"]["c"]["grid_points"] \
+        < config["psd_reduction"]["c"]["grid_points_full"]
+
+    # deterministic
+    again = Config(filename)
+    np.testing.assert_array_equal(again["psd_reduction"]["c"]["labels"], labels)
+    np.testing.assert_array_equal(again["psd_len"]["c"], config["psd_len"]["c"])
+
+    summary = config.particle_reduction_summary()
+    assert len(summary) == 1
+    assert summary[0].startswith(f"Particle reduction ({method}), electrode c: 200 -> 40")
+
+
+def test_config_reduction_silent(tmp_path, capsys):
+    # the summary is printed by mpet.main, not when the config is loaded
+    Config(write_config(str(tmp_path), particleReduction="kmeans", Npart_c=10, Nrep_c=3))
+    assert capsys.readouterr().out == ""
+
+
+def test_compare_reduction(tmp_path, monkeypatch):
+    """The full and the reduced simulation are run and their difference is reported"""
+    import mpet.main
+    monkeypatch.chdir(tmp_path)
+    test = os.path.join(ROOT_DIR, "tests", "ref_outputs", "test008")
+    shutil.copy(os.path.join(test, "params_c.cfg"), str(tmp_path))
+    parser = configparser.ConfigParser()
+    parser.optionxform = str
+    parser.read(os.path.join(test, "params_system.cfg"))
+    parser["Sim Params"]["backend"] = "numpy"
+    parser["Sim Params"]["Npart_c"] = "6"
+    parser["Particles"]["particleReduction"] = "kmeans"
+    parser["Particles"]["Nrep_c"] = "2"
+    configfile = str(tmp_path / "params_system.cfg")
+    with open(configfile, "w") as fo:
+        parser.write(fo)
+
+    outdir = str(tmp_path / "comparison")
+    difference = mpet.main.compare_particle_reduction(configfile, outdir)
+    assert Config.from_dicts(os.path.join(outdir, "full"))["Npart"]["c"] == 6
+    assert Config.from_dicts(os.path.join(outdir, "reduced"))["Npart"]["c"] == 2
+    with open(os.path.join(outdir, "reduction_comparison.json")) as fi:
+        assert json.load(fi) == difference
+    assert difference["limtrode"] == "c"
+    # a few particles of similar size give nearly the same response
+    assert 0 < difference["max_voltage_difference"] < 0.05
+    assert difference["mean_voltage_difference"] <= difference["max_voltage_difference"]
+    assert abs(difference["capacity_difference"]) < 0.05
+    # the temporary config without reduction is removed
+    assert sorted(os.listdir(str(tmp_path))) == ["comparison", "params_c.cfg",
+                                                 "params_system.cfg"]
+
+    # a config without reduction
+    with pytest.raises(ValueError):
+        mpet.main.compare_particle_reduction(os.path.join(test, "params_system.cfg"))
@@ -0,0 +1,87 @@
+"""Tests of storing simulation results in the result cache of mpet.result_cache."""
+import configparser
+import glob
+import os
+import shutil
+
+import mpet.backends.numpy as numpy_backend
+import mpet.main
+import mpet.result_cache as result_cache
+from mpet.config import Config
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def write_configs(folder, store):
+    """Configs of test005 of the test suite with the numpy backend, stored in the result
+    cache store."""
+    os.makedirs(folder)
+    for fname in glob.glob(os.path.join(ROOT_DIR, "tests", "ref_outputs", "test005", "*.cfg")):
+        shutil.copy(fname, folder)
+    configfile = os.path.join(folder, "params_system.cfg")
+    parser = configparser.ConfigParser()
+    parser.optionxform = str
+    parser.read(configfile)
+    parser["Sim Params"]["backend"] = "numpy"
+    parser["Sim Params"]["resultCache"] = store
+    with open(configfile, "w") as fo:
+        parser.write(fo)
+    return configfile
+
+
+def test_store_completed_only(tmp_path, monkeypatch):
+    store = str(tmp_path / "store")
+    configfile = write_configs(str(tmp_path / "config"), store)
+    key = result_cache.result_hash(Config(configfile))
+    integrate = numpy_backend.integrate
+
+    def failed(model, y0):
+        times, states, _ = integrate(model, y0)
+        return times, states, False
+
+    # the output of a failed run is kept, but not stored
+    monkeypatch.setattr(numpy_backend, "integrate", failed)
+    outdir = mpet.main.main(configfile, outdir=str(tmp_path / "failed"))
+    assert glob.glob(os.path.join(outdir, "output_data.*"))
+    assert result_cache.lookup(store, key) is None
+
+    # a complete run is stored and reused
+    monkeypatch.setattr(numpy_backend, "integrate", integrate)
+    mpet.main.main(configfile, outdir=str(tmp_path / "complete"))
+    entry = result_cache.lookup(store, key)
+    assert entry is not None
+    outdir = mpet.main.main(configfile, outdir=str(tmp_path / "cached"))
+    assert not os.path.islink(outdir)
+    assert set(os.listdir(outdir)) == set(os.listdir(entry)) - {result_cache.INFO_FILE}
+
+
+def read_files(folder):
+    files = {}
+    for root, _, fnames in os.walk(folder):
+        for fname in fnames:
+            with open(os.path.join(root, fname), "rb") as fi:
+                files[os.path.relpath(os.path.join(root, fname), folder)] = fi.read()
+    return files
+
+
+def test_cached_runs_move_output(tmp_path, monkeypatch):
+    """Jobs that move their output to sim_output (keepArchive=False) do not move or
+    change the stored result"""
+    monkeypatch.chdir(tmp_path)
+    store = str(tmp_path / "store")
+    configfile = write_configs(str(tmp_path / "config"), store)
+    mpet.main.main(configfile, keepArchive=False)
+    entry = result_cache.lookup(store, result_cache.result_hash(Config(configfile)))
+    stored = read_files(entry)
+    output = read_files(str(tmp_path / "sim_output"))
+    for _ in range(2):
+        # the result is reused, and the next job replaces sim_output
+        mpet.main.main(configfile, keepArchive=False)
+        simOutput = str(tmp_path / "sim_output")
+        assert os.path.isdir(simOutput) and not os.path.islink(simOutput)
+        assert read_files(simOutput).keys() == output.keys()
+    assert os.listdir(str(tmp_path / "history")) == []
+    stored.pop(result_cache.INFO_FILE)
+    files = read_files(entry)
+    files.pop(result_cache.INFO_FILE)
+    assert files == stored
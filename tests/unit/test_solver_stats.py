@@ -0,0 +1,186 @@
+"""Tests of the solver statistics of mpet.solver_stats."""
+import json
+import os
+
+import h5py
+import numpy as np
+import pytest
+import scipy.io as sio
+
+import mpet.output_data as output_data
+import mpet.solver_stats as solver_stats
+import mpet.utils as utils
+
+
+class FakeSolver:
+    """Solver with the IntegratorStats of a daeIDAS solver."""
+    def __init__(self, **stats):
+        self.IntegratorStats = dict(stats)
+
+    def advance(self, **increments):
+        for key, increment in increments.items():
+            self.IntegratorStats[key] += increment
+
+
+def integrator_stats(**changes):
+    stats = {key: 0. for key in solver_stats.COUNTERS.values()}
+    stats.update(LastStep=0., LastOrder=1.)
+    stats.update(changes)
+    return stats
+
+
+def test_record(capsys):
+    daesolver = FakeSolver(**integrator_stats(NumSteps=3., NumEquationEvals=10.))
+    stats = solver_stats.SolverStats(daesolver, tScale=2.)
+    daesolver.advance(NumSteps=5., NumEquationEvals=12., NumLinSolvSetups=2.,
+                      NumJacobianEvals=1.)
+    daesolver.IntegratorStats.update(LastStep=0.1, LastOrder=3.)
+    stats.record(1., phase=solver_stats.PHASE_INIT)
+    daesolver.advance(NumSteps=4., NumEquationEvals=6., NumLinSolvSetups=1.)
+    stats.record(3.)
+    # IDAS reinitialized at a discontinuity, its counters restart from zero
+    daesolver.IntegratorStats.update(integrator_stats(NumSteps=2., NumEquationEvals=3.))
+    stats.record(4.)
+
+    table = stats.table()
+    assert table.shape == (3, len(solver_stats.COLUMNS))
+    columns = {column: table[:, i] for i, column in enumerate(solver_stats.COLUMNS)}
+    np.testing.assert_array_equal(columns["phase"], [0, 1, 1])
+    np.testing.assert_array_equal(columns["t_start"], [0., 2., 6.])
+    np.testing.assert_array_equal(columns["t_end"], [2., 6., 8.])
+    np.testing.assert_array_equal(columns["steps"], [5., 4., 2.])
+    np.testing.assert_array_equal(columns["residual_evals"], [12., 6., 3.])
+    # linear solver setups are counted separately from the Jacobian evaluations
+    np.testing.assert_array_equal(columns["linear_setups"], [2., 1., 0.])
+    np.testing.assert_array_equal(columns["jacobian_evals"], [1., 0., 0.])
+    np.testing.assert_array_equal(columns["step_size"], [0.1, 0.1, 0.])
+    np.testing.assert_array_equal(columns["order"], [3., 3., 1.])
+    assert stats.summary()["steps"] == 11.
+    assert "Warning" not in capsys.readouterr().out
+
+
+def test_record_missing_keys(capsys):
+    # iterative solvers only report the linear iterations
+    stats = integrator_stats()
+    for key in ["NumLinIters", "NumJacobianEvals", "NumLinSolvSetups"]:
+        del stats[key]
+    daesolver = FakeSolver(**stats)
+    collector = solver_stats.SolverStats(daesolver)
+    daesolver.advance(NumSteps=2.)
+    collector.record(1.)
+    collector.record(2.)
+    # one warning for the missing keys that every solver reports
+    out = capsys.readouterr().out
+    assert out.count("Warning") == 1
+    assert "NumLinSolvSetups" in out and "NumLinIters" not in out
+    table = collector.table()
+    np.testing.assert_array_equal(table[:, solver_stats.COLUMNS.index("steps")], [2., 0.])
+    for column in ["linear_setups", "jacobian_evals", "linear_iters"]:
+        assert np.all(np.isnan(table[:, solver_stats.COLUMNS.index(column)]))
+
+    # a solver without IntegratorStats
+    collector = solver_stats.SolverStats(object())
+    collector.record(1.)
+    assert "NumSteps" in capsys.readouterr().out
+    assert np.isnan(collector.table()[0, solver_stats.COLUMNS.index("steps")])
+
+
+def make_table(nrows=4):
+    return np.arange(nrows*len(solver_stats.COLUMNS), dtype=float).reshape(nrows, -1)
+
+
+def check_table(stats, table):
+    assert list(stats) == solver_stats.COLUMNS
+    for i, column in enumerate(solver_stats.COLUMNS):
+        np.testing.assert_array_equal(stats[column], table[:, i])
+
+
+@pytest.mark.parametrize("dataReporter", ["hdf5", "mat", "matSegments"])
+def test_write_read(tmp_path, dataReporter):
+    outdir = str(tmp_path)
+    dataFile = os.path.join(outdir, "output_data")
+    data = {"phi_applied": np.linspace(0., 1., 5)}
+    if dataReporter == "hdf5":
+        with h5py.File(dataFile + ".hdf5", "w") as fo:
+            fo.create_dataset("phi_applied", data=data["phi_applied"])
+    elif dataReporter == "mat":
+        sio.savemat(dataFile + ".mat", data)
+    else:
+        files = ["output_data.mat", "output_data_seg0001.mat"]
+        for filename in files:
+            sio.savemat(os.path.join(outdir, filename), data)
+        manifest = {"keys": ["phi_applied"], "series": ["phi_applied"], "static": [],
+                    "segments": [{"file": filename, "t_start": 0., "t_end": 1., "nt": 5}
+                                 for filename in files]}
+        with open(dataFile + utils.SEGMENT_MANIFEST, "w") as fo:
+            json.dump(manifest, fo)
+    assert solver_stats.read_solver_stats(outdir) is None
+
+    table = make_table()
+    solver_stats.write_solver_stats(outdir, dataReporter, table)
+    check_table(solver_stats.read_solver_stats(outdir), table)
+    if dataReporter == "matSegments":
+        # the table is stored in the latest segment
+        names = [name for name, _, _ in sio.whosmat(os.path.join(outdir, files[-1]))]
+        assert "solver_stats" in names
+        assert "solver_stats" not in [name for name, _, _ in sio.whosmat(dataFile + ".mat")]
+    else:
+        # the output of the data reporter is kept
+        reader = utils.open_data_file(dataFile)
+        np.testing.assert_array_equal(np.squeeze(reader["phi_applied"][()]),
+                                      data["phi_applied"])
+        if hasattr(reader, "close"):
+            reader.close()
+
+    if dataReporter == "hdf5":
+        # the table of an earlier run is replaced
+        table = make_table(2)
+        solver_stats.write_solver_stats(outdir, dataReporter, table)
+        check_table(solver_stats.read_solver_stats(outdir), table)
+
+
+def test_read_old_table(tmp_path):
+    """Tables without the columns that were added later are read with NaN columns"""
+    old = make_table()[:, :13]
+    with h5py.File(str(tmp_path / "output_data.hdf5"), "w") as fo:
+        fo.create_dataset("solver_stats", data=old)
+    stats = solver_stats.read_solver_stats(str(tmp_path))
+    np.testing.assert_array_equal(stats["order"], old[:, -1])
+    assert np.all(np.isnan(stats["linear_setups"]))
+    # and continued by the rows of a resumed run
+    collector = solver_stats.SolverStats(FakeSolver(**integrator_stats()), previous=old)
+    collector.record(1.)
+    assert collector.table().shape == (5, len(solver_stats.COLUMNS))
+
+
+def write_run(outdir, dataReporter, times, table):
+    """Output of a run as its data reporter writes it, followed by the solver statistics
+    of all runs in the directory so far."""
+    writer = output_data.WRITERS[dataReporter]()
+    writer.variables = [
+        output_data.ReportedVariable("mpet.phi_applied", np.sin(times), times),
+        output_data.ReportedVariable("mpet.c_lyte_c", np.outer(times, [1., 2.]), times)]
+    writer.ConnectionString = os.path.join(outdir, "output_data")
+    writer.WriteDataToFile()
+    solver_stats.write_solver_stats(outdir, dataReporter, table)
+
+
+@pytest.mark.parametrize("first", ["mat", "matSegments"])
+def test_continued_segments(tmp_path, first):
+    """The table of continued runs in segments is not a variable of the segments"""
+    outdir = str(tmp_path)
+    times = np.linspace(0., 1., 5)
+    table = make_table(6)
+    # each run adds two rows to the table of the earlier runs
+    write_run(outdir, first, times, table[:2])
+    write_run(outdir, "matSegments", times, table[:4])
+    write_run(outdir, "matSegments", times, table)
+
+    data = utils.open_data_file(os.path.join(outdir, "output_data"))
+    assert isinstance(data, utils.SegmentedMatData)
+    assert len(data.segments) == 3
+    assert not any(key.startswith("solver_stats") for key in data.keys())
+    assert data["phi_applied"].size == 3*len(times)
+    assert data["c_lyte_c"].shape == (3*len(times), 2)
+    data.close()
+    check_table(solver_stats.read_solver_stats(outdir), table)
@@ -0,0 +1,96 @@
+"""Tests of the parameter sweeps of mpet.sweep against separate simulations."""
+import configparser
+import glob
+import os
+import shutil
+
+import numpy as np
+import pytest
+
+pytest.importorskip("daetools")
+
+import mpet.main  # noqa: E402
+import mpet.utils as utils  # noqa: E402
+from mpet.sweep import run_sweep  # noqa: E402
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+#: tolerance of tests/compare_tests.py
+TOL = 1e-4
+
+#: Sim Params and the two sweep points of each profile type
+CASES = {
+    "CC": ({"profileType": "CC", "tend": "1.2e3"},
+           [{"Crate": 1}, {"Crate": 2}]),
+    "CV": ({"profileType": "CV", "tend": "30"},
+           [{"Vset": 3.3}, {"Vset": 3.35}]),
+    "CCsegments": ({"profileType": "CCsegments", "tramp": "0"},
+                   [{"segments": [(1., 10.), (-0.5, 10.)]},
+                    {"segments": [(2., 5.), (-1., 10.)]}]),
+}
+
+
+def write_configs(folder, options):
+    """Small simulation of configs/params_system.cfg with the given Sim Params."""
+    os.makedirs(folder)
+    for fname in glob.glob(os.path.join(ROOT_DIR, "configs", "*.cfg")):
+        shutil.copy(fname, folder)
+    configfile = os.path.join(folder, "params_system.cfg")
+    parser = configparser.ConfigParser()
+    parser.optionxform = str
+    parser.read(configfile)
+    options = dict({"randomSeed": "true", "tsteps": "20", "dataReporter": "mat",
+                    "Nvol_c": "3", "Nvol_s": "2", "Nvol_a": "3", "Npart_c": "1",
+                    "Npart_a": "1"}, **options)
+    for option, value in options.items():
+        parser["Sim Params"][option] = str(value)
+    with open(configfile, "w") as fo:
+        parser.write(fo)
+    return configfile
+
+
+def read_output(outdir):
+    data = utils.open_data_file(os.path.join(outdir, "output_data"))
+    result = {key: np.squeeze(data[key][()]) for key in data.keys()
+              if not key.startswith("__")}
+    if hasattr(data, "close"):
+        data.close()
+    return result
+
+
+@pytest.mark.parametrize("evaluationMode", ["computeStack", "evaluationTree"])
+@pytest.mark.parametrize("case", list(CASES))
+def test_sweep(tmp_path, monkeypatch, case, evaluationMode):
+    """Every sweep point has the output of a separate simulation of its operating
+    conditions, i.e. the conditions assigned after Initialize take effect"""
+    monkeypatch.chdir(tmp_path)
+    options, points = CASES[case]
+    options = dict(options, evaluationMode=evaluationMode)
+    pointdirs = run_sweep(write_configs(str(tmp_path / "config"), options), points,
+                          outdir=str(tmp_path / "sweep"))
+    assert len(pointdirs) == len(points)
+
+    outputs = []
+    for i, (point, pointdir) in enumerate(zip(points, pointdirs)):
+        configfile = write_configs(str(tmp_path / f"config_{i}"), dict(options, **point))
+        refdir = str(tmp_path / f"ref_{i}")
+        mpet.main.main(configfile, outdir=refdir)
+        ref = read_output(refdir)
+        new = read_output(pointdir)
+        outputs.append(new)
+        # the solver statistics are only stored by separate simulations
+        keys = (set(new) & set(ref)) - {"solver_stats"}
+        assert {"phi_applied", "current", "c_lyte_c"} <= keys
+        for key in keys:
+            assert new[key].shape == ref[key].shape, key
+            diff = np.abs(new[key] - ref[key])
+            assert np.mean(diff) < TOL or np.mean(diff) < TOL*np.mean(np.abs(ref[key])), key
+    # the points differ, so the second point did not repeat the first one
+    assert not np.allclose(outputs[0]["current"], outputs[1]["current"])
+
+
+def test_sweep_outdir_exists(tmp_path):
+    configfile = write_configs(str(tmp_path / "config"), CASES["CC"][0])
+    os.makedirs(str(tmp_path / "sweep"))
+    with pytest.raises(FileExistsError):
+        run_sweep(configfile, CASES["CC"][1], outdir=str(tmp_path / "sweep"))
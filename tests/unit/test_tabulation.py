@@ -0,0 +1,156 @@
+"""Tests of the spline tables in mpet.tabulation."""
+import importlib
+import os
+
+import numpy as np
+import pytest
+
+import mpet.props_am as props_am
+import mpet.tabulation as tabulation
+from mpet.config import Config
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+MATERIALS = sorted(os.path.splitext(fname)[0] for fname in
+                   os.listdir(os.path.join(ROOT_DIR, "mpet", "electrode", "materials"))
+                   if fname.endswith(".py") and not fname.startswith("_"))
+
+#: materials with a chemical potential that does not only depend on the local filling
+#: fraction: 2-variable and ACR materials, and testRS_ss, which calls reg_sln with an
+#: extra argument
+NOT_LOCAL = {"LTO", "LiC6", "LiC6_1param", "LiFePO4", "testRS", "testRS_ps", "testRS_ss"}
+
+
+@pytest.fixture(scope="module")
+def config():
+    return Config(os.path.join(ROOT_DIR, "configs", "params_system.cfg"))
+
+
+@pytest.fixture(autouse=True)
+def table_cache(tmp_path, monkeypatch):
+    monkeypatch.setenv(tabulation.CACHE_DIR_ENV, str(tmp_path / "table_cache"))
+
+
+def material_funcs(config, material, **values):
+    config["c", "muRfunc"] = material
+    for key, value in {"muRfunc_table_range": None, **values}.items():
+        config["c", key] = value
+    return props_am.muRfuncs(config, "c")
+
+
+def test_table_error():
+    exact = np.array([0.5, -2., 100., np.nan])
+    approx = exact + np.array([1e-3, 1e-3, 1e-3, 0.])
+    np.testing.assert_allclose(tabulation.table_error(approx, exact, "absolute")[:3], 1e-3)
+    np.testing.assert_allclose(tabulation.table_error(approx, exact, "relative", 100.)[:3],
+                               1e-5)
+    np.testing.assert_allclose(tabulation.table_error(approx, exact, "mixed")[:3],
+                               [1e-3, 5e-4, 1e-5])
+    # non-finite function values are never accurate
+    for error in tabulation.ERROR_MEASURES:
+        assert tabulation.table_error(approx, exact, error, 1.)[3] == np.inf
+    with pytest.raises(ValueError):
+        tabulation.table_error(approx, exact, "other")
+
+
+def test_spline_table():
+    func = np.sin
+    table = tabulation.SplineTable.from_function(func, 0., 3., 101, tol=1e-7)
+    x = np.linspace(0., 3., 10001)
+    assert np.max(np.abs(table(x) - func(x))) < 2e-7
+    assert table.max_error(func) <= 1e-7
+    # scalar evaluation with derivative, and linear extrapolation
+    value, deriv = table.evaluate(1.)
+    assert value == pytest.approx(np.sin(1.), abs=1e-7)
+    assert deriv == pytest.approx(np.cos(1.), abs=1e-5)
+    value, deriv = table.evaluate(4.)
+    assert value == pytest.approx(table(3.) + deriv)
+    np.testing.assert_allclose(table(np.array([4.])), value)
+
+
+@pytest.mark.parametrize("material", MATERIALS)
+def test_muRfunc_tables(config, material):
+    """Tabulate every material with the default table settings, and compare the tables with
+    the material function on a dense grid"""
+    funcs = material_funcs(config, material)
+    if material in NOT_LOCAL:
+        assert not tabulation.muRfunc_is_local(funcs)
+        return
+    assert tabulation.muRfunc_is_local(funcs)
+    muR_table, actR_table = tabulation.tabulate_muRfunc(funcs)
+    tol = config["c", "muRfunc_table_tol"]
+    x = np.linspace(muR_table.x[0], muR_table.x[-1], 100001)
+    muR, actR = funcs.muRfunc(x, 0.5, 0.)
+    assert np.max(tabulation.table_error(muR_table(x), muR, "mixed")) < 2*tol
+    if actR is None:
+        assert actR_table is None
+    else:
+        assert np.max(tabulation.table_error(actR_table(x), actR, "mixed")) < 2*tol
+    # the default range covers nearly all filling fractions, except where the material
+    # defines its own range
+    xmin, xmax = getattr(funcs.muRfunc, "table_range", tabulation.MURFUNC_TABLE_RANGE)
+    assert muR_table.x[0] == pytest.approx(xmin)
+    assert muR_table.x[-1] == pytest.approx(xmax, abs=2e-3)
+
+
+def test_muRfunc_table_range(config):
+    # reduced to where the material is finite
+    funcs = material_funcs(config, "LiMn2O4_ss")
+    table = tabulation.tabulate_muRfunc(funcs)[0]
+    assert 0.998 < table.x[-1] < 0.998432
+    # defined by the material
+    funcs = material_funcs(config, "LiCoO2_LIONSIMBA")
+    assert tabulation.tabulate_muRfunc(funcs)[0].x[0] == 0.43
+    # set in the config
+    funcs = material_funcs(config, "LiMn2O4_ss2", muRfunc_table_range=(0.1, 0.9))
+    table = tabulation.tabulate_muRfunc(funcs)[0]
+    assert (table.x[0], table.x[-1]) == (0.1, 0.9)
+    funcs = material_funcs(config, "LiMn2O4_ss", muRfunc_table_range=(0.1, 0.9999))
+    with pytest.raises(Exception, match="not finite"):
+        tabulation.tabulate_muRfunc(funcs)
+
+
+def test_muRfunc_table_cache(config, tmp_path):
+    funcs = material_funcs(config, "NCA_ss1")
+    table = tabulation.tabulate_muRfunc(funcs)[0]
+    files = os.listdir(str(tmp_path / "table_cache"))
+    assert len(files) == 1
+    cached = tabulation.tabulate_muRfunc(funcs)[0]
+    np.testing.assert_array_equal(cached.x, table.x)
+    np.testing.assert_array_equal(cached.y, table.y)
+    # another tolerance is another table
+    funcs = material_funcs(config, "NCA_ss1", muRfunc_table_tol=1e-4)
+    assert len(tabulation.tabulate_muRfunc(funcs)[0].x) < len(table.x)
+    assert len(os.listdir(str(tmp_path / "table_cache"))) == 2
+
+
+#: Stefan-Maxwell property sets, solid_elyte has constant properties of one argument
+SMSETS = sorted(os.path.splitext(fname)[0] for fname in
+                os.listdir(os.path.join(ROOT_DIR, "mpet", "electrolyte"))
+                if fname.endswith(".py") and fname not in ["__init__.py", "solid_elyte.py"])
+
+
+@pytest.mark.parametrize("SMset", SMSETS)
+def test_elyte_tables(config, SMset):
+    """Tabulate every property set with the default table settings, and compare the tables
+    with the SMset functions at the simulation temperature"""
+    elyte_function = importlib.import_module(f"mpet.electrolyte.{SMset}").__dict__[SMset]
+    T = config["T"]
+    crange = config["elyteTable_range"]
+    tol = config["elyteTable_tol"]
+    tables = tabulation.tabulate_elyte(elyte_function, SMset, T, crange,
+                                       config["elyteTable_points"], tol)
+    errors = tabulation.verify_elyte_tables(tables, elyte_function, T, tol)
+    assert all(error <= tol for error in errors.values())
+
+    c = np.linspace(crange[0], crange[1], 20001)
+    for prop, func in zip(tabulation.ELYTE_PROPERTIES, elyte_function()):
+        exact = np.broadcast_to(func(c, T), c.shape)
+        scale = np.max(np.abs(exact))
+        assert np.max(np.abs(tables[prop](c) - exact)) <= tol*scale, prop
+
+    # tables that do not meet the tolerance are rejected
+    if max(errors.values()) > 0:
+        with pytest.raises(Exception, match="exceeds the tolerance"):
+            tabulation.verify_elyte_tables(tables, elyte_function, T,
+                                           0.5*max(errors.values()))